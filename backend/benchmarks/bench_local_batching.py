@@ -0,0 +1,80 @@
+"""Throughput of batched vs sequential decoding with the local inference provider.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_local_batching --requests 16 --batch-size 8
+    python -m benchmarks.bench_local_batching --model sshleifer/tiny-gpt2
+
+Without --model a randomly initialised GPT-2 sized by --layers/--hidden is
+used, so the benchmark runs offline. Prompts are random token IDs of
+--prompt-tokens length and every request decodes exactly --new-tokens.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, GPT2Config, GPT2LMHeadModel
+
+from services.local_inference import DynamicBatcher
+
+
+def build_model(args):
+    if args.model:
+        return AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32)
+    torch.manual_seed(0)
+    config = GPT2Config(n_layer=args.layers, n_embd=args.hidden, n_head=max(1, args.hidden // 64), vocab_size=32000, n_positions=1024)
+    return GPT2LMHeadModel(config)
+
+
+async def run(batcher: DynamicBatcher, prompts, new_tokens: int) -> float:
+    started = time.perf_counter()
+
+    async def one(prompt_ids):
+        request = batcher.submit(prompt_ids, new_tokens, temperature=0.0)
+        while True:
+            item = await request.output.get()
+            if not isinstance(item, str):
+                return item
+
+    results = await asyncio.gather(*(one(p) for p in prompts))
+    elapsed = time.perf_counter() - started
+    assert all(r.completion_tokens == new_tokens for r in results), "every request should decode the full budget"
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="Hugging Face model to load instead of a random GPT-2")
+    parser.add_argument("--layers", type=int, default=6)
+    parser.add_argument("--hidden", type=int, default=512)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--wait-ms", type=float, default=15.0)
+    parser.add_argument("--prompt-tokens", type=int, default=64)
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    model = build_model(args)
+    # Keep the EOS token out of reach so all rows run for the same number of steps
+    model.config.eos_token_id = None
+    rng = random.Random(0)
+    prompts = [[rng.randrange(100, 30000) for _ in range(args.prompt_tokens)] for _ in range(args.requests)]
+    total_tokens = args.requests * args.new_tokens
+
+    for label, batch_size in (("sequential", 1), ("batched", args.batch_size)):
+        batcher = DynamicBatcher("benchmark", max_batch_size=batch_size, max_wait_ms=args.wait_ms,
+                                 max_new_tokens=args.new_tokens, num_threads=args.threads, model=model)
+        batcher.start()
+        asyncio.run(run(batcher, prompts[:2], 4))  # warm up kernels and allocator
+        batcher.stats.update(batches=0, requests=0, tokens=0, max_batch=0)
+        elapsed = asyncio.run(run(batcher, prompts, args.new_tokens))
+        batcher.stop()
+        print(f"{label:>10}: batch<={batch_size:<3} {elapsed:7.2f}s  {total_tokens / elapsed:8.1f} tokens/s  "
+              f"({batcher.stats['batches']} batches, largest {batcher.stats['max_batch']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Latency of travel fact store lookups and template answers.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_travel_facts --routes 20000
+    python -m benchmarks.bench_travel_facts --source travel_facts.csv
+
+Without --source, synthetic facts are generated for --routes random
+origin/destination/purpose combinations so the benchmark runs without data.
+The compiled file is written to a temporary directory.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from services.travel_facts import PURPOSES, TravelFact, TravelFactStore
+from utils.countries import COUNTRY_NAMES
+
+
+def synthetic_facts(routes: int, rng: random.Random):
+    codes = sorted(COUNTRY_NAMES)
+    for _ in range(routes):
+        origin, destination = rng.sample(codes, 2)
+        yield TravelFact(
+            origin, destination, rng.choice(PURPOSES), rng.choice(["Visa not required", "eVisa", "Visa on arrival"]),
+            rng.choice([30, 90, 180]), rng.choice([3, 6]), rng.choice([1, 2]),
+            rng.sample(["Yellow fever", "Polio", "Hepatitis A"], rng.randrange(0, 3)),
+            ["Return ticket", "Proof of accommodation"], source="benchmark", updated="2025-01-01"
+        )
+
+
+def timed(label: str, fn, items, repeat: int) -> None:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    per_call = (time.perf_counter() - started) / (repeat * len(items))
+    print(f"{label:>10}: {per_call * 1e6:8.2f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=None, help="CSV or JSON facts to compile instead of synthetic ones")
+    parser.add_argument("--routes", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    store = TravelFactStore(os.path.join(directory, "facts.bin"), args.source)
+    started = time.perf_counter()
+    if args.source:
+        count = store.reload()
+    else:
+        count = store.build(synthetic_facts(args.routes, rng), store.path)
+        store.load()
+    print(f"compiled {count} facts into {os.path.getsize(store.path) / 1024:.0f} KiB in {time.perf_counter() - started:.2f}s")
+
+    codes = sorted(COUNTRY_NAMES)
+    routes = [(rng.choice(codes), rng.choice(codes), rng.choice(PURPOSES)) for _ in range(1000)]
+    questions = [
+        f"Do {COUNTRY_NAMES[o]} citizens need a visa to visit {COUNTRY_NAMES[d]}?" for o, d, _ in routes[:200]
+    ] + [
+        f"What vaccinations do I need for {COUNTRY_NAMES[d]} from {COUNTRY_NAMES[o]}?" for o, d, _ in routes[200:400]
+    ]
+    timed("lookup", lambda route: store.lookup(*route), routes, args.repeat)
+    timed("answer", store.answer, questions, args.repeat)
+    answered = sum(store.answer(q) is not None for q in questions)
+    print(f"{answered}/{len(questions)} questions answered from the store")
+
+
+if __name__ == "__main__":
+    main()
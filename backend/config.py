@@ -7,13 +7,158 @@ class Config:
         
         # Ollama configuration
         self.OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+        self.DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "llama3.1")
+        # Models kept loaded at all times, e.g. "llama3.1,mistral"
+        self.OLLAMA_HOT_MODELS = [m.strip() for m in os.getenv("OLLAMA_HOT_MODELS", "").split(",") if m.strip()]
+        self.OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        # RAM available for resident models; 0 uses 75% of physical memory
+        self.OLLAMA_MEMORY_BUDGET_GB = float(os.getenv("OLLAMA_MEMORY_BUDGET_GB", "0"))
+        
+        # Provider used by /api/v1/ask; mirrors SystemSettings.default_provider
+        # ("openai", "anthropic", "ollama" or "huggingface")
+        self.DEFAULT_PROVIDER = os.getenv("DEFAULT_PROVIDER", "openai")
+
+        # In-process CPU inference (ModelProvider.HUGGINGFACE)
+        self.HF_MODEL = os.getenv("HF_MODEL", "Qwen/Qwen2.5-0.5B-Instruct")
+        self.HF_MAX_BATCH_SIZE = int(os.getenv("HF_MAX_BATCH_SIZE", "8"))
+        self.HF_BATCH_WAIT_MS = float(os.getenv("HF_BATCH_WAIT_MS", "15"))
+        self.HF_MAX_NEW_TOKENS = int(os.getenv("HF_MAX_NEW_TOKENS", "512"))
+        self.HF_NUM_THREADS = int(os.getenv("HF_NUM_THREADS", "0")) or None
+        # Other models requests may name (loaded on first use); HF_MODEL is always allowed
+        self.HF_ALLOWED_MODELS = [m.strip() for m in os.getenv("HF_ALLOWED_MODELS", "").split(",") if m.strip()]
         
         # Cloud API keys
         self.OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
         self.ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+        self.OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+        self.ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-5-haiku-latest")
+        
+        # Background provider health probes; unpinned requests fail over to PROVIDER_FALLBACKS
+        self.PROVIDER_FALLBACKS = [p.strip() for p in os.getenv("PROVIDER_FALLBACKS", "").split(",") if p.strip()]
+        self.PROVIDER_PROBE_INTERVAL = float(os.getenv("PROVIDER_PROBE_INTERVAL", "15"))
+        self.PROVIDER_PROBE_TIMEOUT = float(os.getenv("PROVIDER_PROBE_TIMEOUT", "5"))
+        
+        # Pooled HTTP connections per provider client
+        self.PROVIDER_MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", "100"))
+        self.PROVIDER_MAX_KEEPALIVE = int(os.getenv("PROVIDER_MAX_KEEPALIVE", "20"))
+        
+        # Bring-your-own-key client pools (one small pool per tenant and key)
+        self.BYOK_MAX_POOLS = int(os.getenv("BYOK_MAX_POOLS", "64"))
+        self.BYOK_IDLE_TIMEOUT = float(os.getenv("BYOK_IDLE_TIMEOUT", "300"))
+        self.BYOK_MAX_CONNECTIONS = int(os.getenv("BYOK_MAX_CONNECTIONS", "10"))
+        self.BYOK_MAX_KEEPALIVE = int(os.getenv("BYOK_MAX_KEEPALIVE", "5"))
+        
+        # Adaptive pacing and retries for cloud providers
+        self.PACER_INITIAL_CONCURRENCY = int(os.getenv("PACER_INITIAL_CONCURRENCY", "8"))
+        self.PACER_MAX_CONCURRENCY = int(os.getenv("PACER_MAX_CONCURRENCY", "64"))
+        self.PACER_MAX_WAIT = float(os.getenv("PACER_MAX_WAIT", "30"))
+        self.PACER_MAX_ENTRIES = int(os.getenv("PACER_MAX_ENTRIES", "256"))  # per provider/model/BYOK key
+        self.RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+        self.RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+        self.RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "1"))
+        
+        # Token counting and cost accounting
+        self.TOKENIZER_DIR = os.getenv("TOKENIZER_DIR")  # pre-downloaded tokenizer.json files
+        self.TOKENIZER_DOWNLOAD = os.getenv("TOKENIZER_DOWNLOAD", "True").lower() == "true"
+        self.MODEL_PRICES_FILE = os.getenv("MODEL_PRICES_FILE")
+        self.COST_FLUSH_INTERVAL = float(os.getenv("COST_FLUSH_INTERVAL", "30"))
+        self.USAGE_MERGE_INTERVAL = float(os.getenv("USAGE_MERGE_INTERVAL", "10"))
+        
+        # Attachment uploads and text extraction
+        self.ATTACHMENT_DIR = os.getenv("ATTACHMENT_DIR", "attachments")
+        self.ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(20 * 1024 * 1024)))
+        self.ATTACHMENT_MAX_FILES = int(os.getenv("ATTACHMENT_MAX_FILES", "5"))
+        self.ATTACHMENT_WORKERS = int(os.getenv("ATTACHMENT_WORKERS", "2"))  # extraction processes per worker
+        self.ATTACHMENT_EXTRACT_TIMEOUT = float(os.getenv("ATTACHMENT_EXTRACT_TIMEOUT", "60"))
+        self.ATTACHMENT_MAX_CHARS = int(os.getenv("ATTACHMENT_MAX_CHARS", "200000"))
+        self.ATTACHMENT_CACHE_SIZE = int(os.getenv("ATTACHMENT_CACHE_SIZE", "64"))
+        self.ATTACHMENT_CONTEXT_TOKENS = int(os.getenv("ATTACHMENT_CONTEXT_TOKENS", "1500"))
+        
+        # Travel requirement facts answered without an LLM call (compiled from TRAVEL_FACTS_SOURCE CSV/JSON)
+        self.TRAVEL_FACTS_PATH = os.getenv("TRAVEL_FACTS_PATH", "travel_facts.bin")
+        self.TRAVEL_FACTS_SOURCE = os.getenv("TRAVEL_FACTS_SOURCE")
+        self.TRAVEL_FACTS_ANSWERS = os.getenv("TRAVEL_FACTS_ANSWERS", "True").lower() == "true"
+        self.TRAVEL_FACTS_CHECK_INTERVAL = float(os.getenv("TRAVEL_FACTS_CHECK_INTERVAL", "30"))
+        
+        # Chat history recording and full-text search
+        self.HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "True").lower() == "true"
+        self.HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "2"))
+        self.HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "500"))
+        self.HISTORY_SEARCH_TIMEOUT_MS = int(os.getenv("HISTORY_SEARCH_TIMEOUT_MS", "2000"))
+        self.HISTORY_COUNT_LIMIT = int(os.getenv("HISTORY_COUNT_LIMIT", "1000"))  # matches counted past the current page
+        
+        # Bulk exports (GET /export/{dataset} and python -m services.export)
+        self.EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))  # rows per cursor batch and response chunk
+        self.EXPORT_ROW_GROUP_SIZE = int(os.getenv("EXPORT_ROW_GROUP_SIZE", "50000"))  # Parquet rows held before a row group is written
+        
+        # Weight quantization jobs (POST /models/optimize)
+        self.OPTIMIZATION_DIR = os.getenv("OPTIMIZATION_DIR", "optimized_models")
+        self.OPTIMIZATION_WORKERS = int(os.getenv("OPTIMIZATION_WORKERS", "2"))  # tensors quantized in parallel
+        self.OPTIMIZATION_CHUNK_ELEMENTS = int(os.getenv("OPTIMIZATION_CHUNK_ELEMENTS", str(1 << 22)))  # weights per worker step
+        self.OPTIMIZATION_EVALUATE = os.getenv("OPTIMIZATION_EVALUATE", "True").lower() == "true"
+        self.OPTIMIZATION_DOWNLOAD = os.getenv("OPTIMIZATION_DOWNLOAD", "False").lower() == "true"
+        # Directories local models may be optimized from (default: MODEL_STORE_DIR and TRAINING_DIR)
+        self.OPTIMIZATION_MODEL_ROOTS = [m.strip() for m in os.getenv("OPTIMIZATION_MODEL_ROOTS", "").split(",") if m.strip()]
+        
+        # Content-addressed model version store
+        self.MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR", "model_store")
+        # Mirrors SystemSettings.retention_policies["model_versions"]
+        self.MODEL_VERSION_RETENTION_DAYS = int(os.getenv("MODEL_VERSION_RETENTION_DAYS", "90"))
+        self.MODEL_STORE_GC_INTERVAL = float(os.getenv("MODEL_STORE_GC_INTERVAL", "3600"))  # 0 disables background GC
+        self.MODEL_STORE_GC_GRACE = float(os.getenv("MODEL_STORE_GC_GRACE", "3600"))  # unreferenced blobs younger than this are kept
+        
+        # Tenant settings / user preferences cache
+        self.TENANT_CACHE_TTL = float(os.getenv("TENANT_CACHE_TTL", "300"))
+        self.TENANT_CACHE_NEGATIVE_TTL = float(os.getenv("TENANT_CACHE_NEGATIVE_TTL", "30"))  # for ids with no document
+        self.TENANT_CACHE_STALE = float(os.getenv("TENANT_CACHE_STALE", "60"))  # served past the TTL while refreshing
+        self.TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "10000"))
+        self.TENANT_CACHE_WATCH = os.getenv("TENANT_CACHE_WATCH", "True").lower() == "true"  # change streams / polling
+        self.TENANT_CACHE_POLL_INTERVAL = float(os.getenv("TENANT_CACHE_POLL_INTERVAL", "15"))  # without a replica set
+        
+        # On-demand profiling (/api/v1/admin/profile); nothing is sampled or traced unless requested
+        self.PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "False").lower() == "true"
+        self.PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+        self.LOOP_LAG_MONITOR = os.getenv("LOOP_LAG_MONITOR", "False").lower() == "true"  # start with the worker
+        self.LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))  # log stacks of longer stalls
+        
+        # Multi-model comparison (POST /api/v1/compare)
+        self.COMPARE_MAX_MODELS = int(os.getenv("COMPARE_MAX_MODELS", "4"))
+        
+        # Evaluation harness (POST /api/v1/models/evaluate)
+        self.EVAL_DATASET_DIR = os.getenv("EVAL_DATASET_DIR", "eval_datasets")  # <dataset>.jsonl / .csv
+        self.EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "8"))  # provider calls in flight per run
+        self.EVAL_BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", "64"))
+        self.EVAL_SCORING_WORKERS = int(os.getenv("EVAL_SCORING_WORKERS", "2"))
+        self.EVAL_REGRESSION_THRESHOLD = float(os.getenv("EVAL_REGRESSION_THRESHOLD", "0.1"))  # per-item score change reported
+        
+        # LoRA fine-tuning jobs (POST /api/v1/models/train)
+        self.TRAINING_DIR = os.getenv("TRAINING_DIR", "training_runs")  # checkpoints and adapters, one directory per job
+        self.TRAINING_DATASET_DIR = os.getenv("TRAINING_DATASET_DIR", "training_datasets")  # JSONL datasets jobs may read
+        self.TRAINING_THREADS = int(os.getenv("TRAINING_THREADS", "0"))  # torch threads per job; 0 = all cores
+        self.TRAINING_ACTIVATION_MEMORY_MB = float(os.getenv("TRAINING_ACTIVATION_MEMORY_MB", "2048"))  # sizes the micro-batch
+        self.TRAINING_CHECKPOINT_STEPS = int(os.getenv("TRAINING_CHECKPOINT_STEPS", "50"))
+        self.TRAINING_MAX_RESTARTS = int(os.getenv("TRAINING_MAX_RESTARTS", "2"))
+        self.TRAINING_PREFETCH_BATCHES = int(os.getenv("TRAINING_PREFETCH_BATCHES", "4"))
+        self.TRAINING_DOWNLOAD = os.getenv("TRAINING_DOWNLOAD", "false").lower() == "true"  # else only cached models
+        
+        # Background system diagnostics sampler
+        self.DIAGNOSTICS_SAMPLE_INTERVAL = float(os.getenv("DIAGNOSTICS_SAMPLE_INTERVAL", "5"))
+        self.DIAGNOSTICS_HISTORY = int(os.getenv("DIAGNOSTICS_HISTORY", "720"))  # samples kept (1h at 5s)
+        self.DIAGNOSTICS_DISK_PATH = os.getenv("DIAGNOSTICS_DISK_PATH", "/")
         
         # Security
         self.JWT_SECRET = os.getenv("JWT_SECRET", "neuralnexus_secret_key")
+        self.AUTH_ENABLED = os.getenv("AUTH_ENABLED", "False").lower() == "true"  # require a bearer token on /api/v1
+        self.JWT_KEYS = os.getenv("JWT_KEYS", "")  # extra signing keys for rotation: "kid=secret,kid2=secret2"
+        self.JWT_KEYS_FILE = os.getenv("JWT_KEYS_FILE") or None  # JSON {"kid": "secret"}, re-read when it changes
+        self.JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID", "default")  # key used to issue tokens
+        self.JWT_ALGORITHMS = [a.strip() for a in os.getenv("JWT_ALGORITHMS", "HS256").split(",") if a.strip()]
+        self.JWT_ISSUER = os.getenv("JWT_ISSUER") or None
+        self.JWT_AUDIENCE = os.getenv("JWT_AUDIENCE") or None
+        self.JWT_TENANT_CLAIM = os.getenv("JWT_TENANT_CLAIM", "tenant_id")
+        self.JWT_LEEWAY = int(os.getenv("JWT_LEEWAY", "30"))  # seconds of clock skew tolerated
+        self.AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))  # verified tokens kept per worker
+        self.AUTH_ADMIN_SCOPE = os.getenv("AUTH_ADMIN_SCOPE", "admin")  # scope/role required by operator and /api/v1/admin routes
         
         # Database
         self.MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
@@ -22,4 +167,29 @@ class Config:
         self.DEBUG = os.getenv("DEBUG", "True").lower() == "true"
         self.PORT = int(os.getenv("PORT", "8000"))
 
+        # Response length policy: learn per-class budgets from stored chat history at startup
+        self.LENGTH_POLICY_SEED_HISTORY = os.getenv("LENGTH_POLICY_SEED_HISTORY", "False").lower() == "true"
+
+        # Logging
+        self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+        self.LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+        self.LOG_HEALTH_SAMPLE_RATE = float(os.getenv("LOG_HEALTH_SAMPLE_RATE", "0.01"))
+        self.LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+        # Mirrors SystemSettings.security["sensitive_data_masking"]
+        self.SENSITIVE_DATA_MASKING = os.getenv("SENSITIVE_DATA_MASKING", "True").lower() == "true"
+
+        # Tracing
+        self.TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")  # "none", "jsonl" or "otlp"
+        self.TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH", "traces.jsonl")
+        self.TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318")
+        self.TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+
+        # Serving
+        self.HOST = os.getenv("HOST", "0.0.0.0")
+        self.WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+        self.STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")  # "memory" (single worker) or "mongo"
+        self.WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "60"))
+        self.SHUTDOWN_READY_GRACE = float(os.getenv("SHUTDOWN_READY_GRACE", "5"))
+        self.SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+
 config = Config()
\ No newline at end of file
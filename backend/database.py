@@ -15,6 +15,16 @@ class Database:
     def initialize(self):
         """Initialize MongoDB connection"""
         self.client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+
+    async def ping(self):
+        """Round-trip to the server to confirm the connection pool is usable"""
+        await self.db.command("ping")
+
+    def close(self):
+        """Close the MongoDB connection pool"""
+        if self.client is not None:
+            self.client.close()
+            self.client = None
     
     @property
     def db(self):
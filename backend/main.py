@@ -1,19 +1,138 @@
-from fastapi import FastAPI, status
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import Depends, FastAPI, Query, status
 from fastapi.middleware.cors import CORSMiddleware
-from routers import qna
+from fastapi.responses import JSONResponse
+from config import config
+from models import ModelProvider, SystemDiagnostics
+from database import db
+from routers import attachments, auth, evaluation, export, history, model_versions, optimization, profiling, qna, training, travel_facts, usage
+from services import llm
+from services.attachments import attachment_store
+from services.auth import DEFAULT_SECRET, token_verifier
+from services.chat_history import chat_history
+from services.evaluation import evaluation_runner
+from services.model_optimization import model_optimizer
+from services.model_store import model_store
+from services.provider_health import provider_health
+from services.tenant_config import tenant_config
+from services.training import training_executor
+from services.travel_facts import travel_facts as travel_fact_store
+from services.providers import default_model_for
+from utils.lifecycle import InFlightMiddleware, lifecycle
+from utils.logging_utils import setup_logging
+from utils.model_residency import residency
+from utils.profiling import loop_monitor
+from utils.request_context import RequestContextMiddleware
+from utils.response_policy import response_policy, seed_policy_from_history
+from utils.state import shared_state
+from utils.system_sampler import system_sampler
+from utils.token_accounting import cost_ledger, token_counter
+from utils.tracing import TracingMiddleware, setup_tracing, tracer
+from utils.usage_stats import usage_stats
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: records are queued on the request path and written by a background thread
+setup_logging(
+    level=config.LOG_LEVEL,
+    fmt=config.LOG_FORMAT,
+    mask=config.SENSITIVE_DATA_MASKING,
+    health_sample_rate=config.LOG_HEALTH_SAMPLE_RATE,
+    debug_sample_rate=config.LOG_DEBUG_SAMPLE_RATE
+)
 logger = logging.getLogger(__name__)
 
+# Spans are exported in batches from a background thread
+setup_tracing(
+    exporter=config.TRACE_EXPORTER,
+    jsonl_path=config.TRACE_JSONL_PATH,
+    otlp_endpoint=config.TRACE_OTLP_ENDPOINT,
+    sample_rate=config.TRACE_SAMPLE_RATE
+)
+
+async def _warm_provider_pools():
+    await llm.warm_up()
+
+async def _seed_response_policy():
+    await seed_policy_from_history(response_policy, db.db)
+
+async def _preload_tokenizers():
+    # Tokenizer files load from disk or the hub; keep that off the event loop
+    model = default_model_for(config.DEFAULT_PROVIDER)
+    await asyncio.get_running_loop().run_in_executor(None, token_counter.preload, [model])
+
+async def _open_travel_facts():
+    # Compiling from TRAVEL_FACTS_SOURCE parses CSV/JSON; mapping an existing file is cheap
+    await asyncio.get_running_loop().run_in_executor(None, travel_fact_store.open)
+
+async def _close_provider_pools():
+    await llm.close_clients()
+
+async def _close_database():
+    await shared_state.close()
+    db.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build per-worker clients, pre-warm them, and drain in-flight work on shutdown"""
+    if config.AUTH_ENABLED and config.JWT_SECRET == DEFAULT_SECRET and "default" in token_verifier.key_ids:
+        # The default secret is public; anyone could mint tokens for any tenant
+        raise RuntimeError("AUTH_ENABLED requires JWT_SECRET to be set (or emptied in favour of JWT_KEYS)")
+    db.initialize()
+    shared_state.initialize(config.STATE_BACKEND, db.db if config.STATE_BACKEND == "mongo" else None)
+    if config.STATE_BACKEND == "mongo":
+        lifecycle.on_warmup("shared_state", shared_state.backend.ping, required=True)
+    lifecycle.on_warmup("provider_pools", _warm_provider_pools)
+    if config.OLLAMA_HOT_MODELS:
+        lifecycle.on_warmup("ollama_residency", residency.preload)
+    if config.LENGTH_POLICY_SEED_HISTORY:
+        lifecycle.on_warmup("response_policy", _seed_response_policy)
+    lifecycle.on_warmup("tokenizers", _preload_tokenizers)
+    lifecycle.on_warmup("travel_facts", _open_travel_facts)
+    lifecycle.on_warmup("chat_history_indexes", chat_history.ensure_indexes)
+    lifecycle.on_warmup("eval_indexes", evaluation_runner.ensure_indexes)
+    lifecycle.on_shutdown("database", _close_database)
+    lifecycle.on_shutdown("cost_ledger", cost_ledger.stop)
+    lifecycle.on_shutdown("chat_history", chat_history.stop)
+    lifecycle.on_shutdown("usage_stats", usage_stats.stop)
+    lifecycle.on_shutdown("provider_health", provider_health.stop)
+    lifecycle.on_shutdown("provider_pools", _close_provider_pools)
+    lifecycle.on_shutdown("ollama_residency", residency.close)
+    lifecycle.on_shutdown("system_sampler", system_sampler.stop)
+    lifecycle.on_shutdown("attachment_extraction", attachment_store.close)
+    lifecycle.on_shutdown("model_optimization", model_optimizer.close)
+    lifecycle.on_shutdown("evaluation", evaluation_runner.close)
+    lifecycle.on_shutdown("training", training_executor.close)
+    lifecycle.on_shutdown("model_store_gc", model_store.stop)
+    lifecycle.on_shutdown("tenant_config", tenant_config.stop)
+    lifecycle.on_shutdown("loop_monitor", loop_monitor.stop)
+    if config.LOOP_LAG_MONITOR:
+        loop_monitor.start()
+    system_sampler.start()
+    cost_ledger.start(db.db)
+    chat_history.start(db.db)
+    evaluation_runner.start(db.db)
+    model_store.start()
+    tenant_config.start(db.db)
+    training_executor.start()
+    usage_stats.start(shared_state.usage)
+    await lifecycle.startup(config.WARMUP_TIMEOUT)
+    provider_health.start()
+    logger.info("Worker ready")
+    yield
+    await lifecycle.shutdown(config.SHUTDOWN_DRAIN_TIMEOUT)
+    tracer.shutdown()
+
 app = FastAPI(
     title="PAWA Q&A AI",
     description="An advanced interactive Q&A system with LLM integration, optimized for travel queries.",
     version="1.1.0",
     docs_url="/docs",
     redoc_url="/redoc",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    lifespan=lifespan
 )
 
 # Enable CORS with detailed configuration
@@ -22,15 +141,96 @@ app.add_middleware(
     allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
-    expose_headers=["X-Process-Time"]
+    allow_headers=["Content-Type", "Authorization", "X-Requested-With", "X-Request-ID", "X-Tenant-ID", "traceparent"],
+    expose_headers=["X-Process-Time", "X-Request-ID", "Server-Timing"]
 )
 
+# Record per-stage spans for each request (runs inside the request context below)
+app.add_middleware(TracingMiddleware)
+
+# Bind X-Request-ID / X-Tenant-ID to the request context for log attribution
+app.add_middleware(RequestContextMiddleware)
+
+# Track in-flight requests so shutdown can drain them
+app.add_middleware(InFlightMiddleware)
+
+# Every /api/v1 route authenticates (when AUTH_ENABLED); verified tokens are cached until they expire
+api_auth = [Depends(auth.authenticate)]
+# Operator routes act on server paths and shared state, so they also need AUTH_ADMIN_SCOPE
+admin_auth = [Depends(auth.require_admin)]
+
 # Include the Q&A router
-app.include_router(qna.router, prefix="/api/v1", tags=["Q&A"])
+app.include_router(auth.router, prefix="/api/v1", tags=["Auth"])
+app.include_router(qna.router, prefix="/api/v1", tags=["Q&A"], dependencies=api_auth)
+app.include_router(usage.router, prefix="/api/v1", tags=["Usage"], dependencies=api_auth)
+app.include_router(attachments.router, prefix="/api/v1", tags=["Attachments"], dependencies=api_auth)
+app.include_router(travel_facts.router, prefix="/api/v1", tags=["Travel Facts"], dependencies=api_auth)
+app.include_router(history.router, prefix="/api/v1", tags=["History"], dependencies=api_auth)
+app.include_router(export.router, prefix="/api/v1", tags=["Export"], dependencies=api_auth)
+app.include_router(optimization.router, prefix="/api/v1", tags=["Optimization"], dependencies=admin_auth)
+app.include_router(evaluation.router, prefix="/api/v1", tags=["Evaluation"], dependencies=api_auth)
+app.include_router(training.router, prefix="/api/v1", tags=["Training"], dependencies=api_auth)
+app.include_router(model_versions.router, prefix="/api/v1", tags=["Model Versions"], dependencies=admin_auth)
+app.include_router(profiling.router, prefix="/api/v1", tags=["Profiling"], dependencies=admin_auth)
 
-# Health check endpoint
+# Health check endpoint (liveness: the process is up and serving; provider state comes from the background prober)
 @app.get("/health", status_code=status.HTTP_200_OK)
 async def health_check():
-    logger.info("Health check requested")
-    return {"status": "healthy", "version": app.version}
\ No newline at end of file
+    logger.debug("Health check requested", extra={"sample": "health"})
+    return {"status": "healthy", "version": app.version, "providers": provider_health.status()}
+
+# Cached per-provider probe results (latency, last error); never waits on a probe
+@app.get("/providers/status", status_code=status.HTTP_200_OK)
+async def providers_status():
+    logger.debug("Provider status requested", extra={"sample": "health"})
+    return provider_health.snapshot()
+
+# Operator views of per-worker caches (key ids and hit statistics are not for every caller)
+@app.get("/api/v1/tenants/cache", status_code=status.HTTP_200_OK, tags=["Tenants"], dependencies=admin_auth)
+async def tenant_cache_status():
+    """Hit ratio and invalidation mode of this worker's tenant settings cache"""
+    return tenant_config.snapshot()
+
+@app.get("/api/v1/auth/cache", status_code=status.HTTP_200_OK, tags=["Auth"], dependencies=admin_auth)
+async def auth_cache_status():
+    """Verified-token cache size and hit ratio for this worker"""
+    return token_verifier.snapshot()
+
+# Readiness endpoint (warmup finished and not draining)
+@app.get("/ready")
+async def readiness_check():
+    logger.debug("Readiness check requested", extra={"sample": "health"})
+    body = {
+        "status": "ready" if lifecycle.ready else ("draining" if lifecycle.draining else "starting"),
+        "in_flight": lifecycle.in_flight,
+        "warmup_errors": lifecycle.warmup_errors
+    }
+    if not lifecycle.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+    return body
+
+# System diagnostics from the background sampler; no /proc reads happen on this path
+@app.get("/diagnostics", response_model=SystemDiagnostics)
+async def diagnostics():
+    logger.debug("Diagnostics requested", extra={"sample": "health"})
+    providers = provider_health.status()
+    performance = system_sampler.performance()
+    for provider, entry in provider_health.health.items():
+        if entry.latency_ms is not None:
+            performance[f"{provider.value}_probe_latency_ms"] = entry.latency_ms
+    stale = system_sampler.sampled_at is None or system_sampler.sampled_at < time.time() - 3 * system_sampler.interval
+    return SystemDiagnostics(
+        status="degraded" if stale or not all(providers.values()) else "healthy",
+        resources=system_sampler.resources,
+        providers=providers,
+        models={ModelProvider.OLLAMA: list(residency.catalog.values())} if residency.catalog else {},
+        performance=performance,
+        version=app.version,
+        environment="dev" if config.DEBUG else "prod"
+    )
+
+# Recent samples as one array per metric, oldest first
+@app.get("/diagnostics/history")
+async def diagnostics_history(seconds: Optional[float] = Query(None, gt=0)):
+    logger.debug("Diagnostics history requested", extra={"sample": "health"})
+    return {"interval": system_sampler.interval, "samples": system_sampler.history(seconds)}
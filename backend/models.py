@@ -47,10 +47,10 @@ class QueryRequest(BaseModel):
     api_key: Optional[str] = None  # For cloud providers
     model_version: Optional[str] = None  # For versioned models
     system_prompt: Optional[str] = None  # Override default system prompt
-    attachments: Optional[List[str]] = None  # File attachments
-    user_id: Optional[str] = str(uuid.uuid4())  # Default user ID
+    attachments: Optional[List[str]] = None  # Attachment ids from POST /api/v1/attachments
+    user_id: Optional[str] = Field(default_factory=lambda: str(uuid.uuid4()))  # Default user ID
     tenant_id: Optional[str] = None  # For multi-tenant support
-    request_id: Optional[str] = str(uuid.uuid4())  # For request tracing
+    request_id: Optional[str] = Field(default_factory=lambda: str(uuid.uuid4()))  # For request tracing
 
 class QueryResponse(BaseModel):
     """Response model for LLM queries"""
@@ -60,11 +60,23 @@ class QueryResponse(BaseModel):
     tokens_used: int
     processing_time: float  # In seconds
     request_id: str
-    timestamp: str = datetime.datetime.utcnow().isoformat()
+    timestamp: str = Field(default_factory=lambda: datetime.datetime.utcnow().isoformat())
     context_used: Optional[List[Dict]] = None  # For RAG systems
     warning: Optional[str] = None  # For deprecation warnings
     metadata: Optional[Dict[str, Any]] = None  # For provider-specific metadata
 
+class AttachmentInfo(BaseModel):
+    """Stored attachment; `id` is the SHA-256 of its content and goes in QueryRequest.attachments"""
+    id: str
+    filename: str
+    content_type: str
+    size_bytes: int
+    chars: int = 0  # Extracted text length
+    metadata: Dict[str, Any] = {}  # e.g., {"pages": 3} or {"width": 1200, "height": 800}
+    error: Optional[str] = None  # Set when no text could be extracted
+    deduplicated: bool = False  # Same content was already stored
+    uploaded_at: str = Field(default_factory=lambda: datetime.datetime.utcnow().isoformat())
+
 # Model Management Models
 class ModelInfo(BaseModel):
     """Core model metadata"""
@@ -233,7 +245,9 @@ class ModelUsageStats(BaseModel):
     success_rate: float = 1.0
     error_rates: Dict[str, float] = {}
     last_used: Optional[str] = None
-    active_users: int = 0
+    active_users: int = 0  # Approximate distinct users over the last 24 hours
+    active_users_by_window: Dict[str, int] = {}  # e.g., {"1h": 12, "24h": 240, "7d": 1200}
+    latency_ms: Dict[str, float] = {}  # Recent p50/p95/p99
 
 class ModelPerformanceMetrics(BaseModel):
     """Model performance metrics"""
@@ -280,15 +294,21 @@ class SystemSettings(BaseModel):
 # Model Training & Fine-tuning
 class ModelTrainingConfig(BaseModel):
     """Configuration for model training"""
-    model_name: str
-    dataset: str  # Dataset identifier
+    model_name: str  # Hugging Face model id or local path of a causal LM
+    dataset: str  # "chat_history" or a JSONL file of question/answer rows in TRAINING_DATASET_DIR
     epochs: int = Field(default=3, ge=1)
-    batch_size: int = Field(default=8, ge=1)
+    batch_size: int = Field(default=8, ge=1)  # Effective batch; reached by gradient accumulation
     learning_rate: float = 0.001
     validation_data: Optional[str] = None
-    output_dir: str = f"/models/{uuid.uuid4()}"
+    output_dir: str = f"/models/{uuid.uuid4()}"  # Must be under TRAINING_DIR; defaults to TRAINING_DIR/<training_id>
     use_gpu: bool = True
-    mixed_precision: bool = True
+    mixed_precision: bool = True  # bf16 autocast where the CPU supports it
+    training_id: str = Field(default_factory=lambda: str(uuid.uuid4()), pattern=r"^[A-Za-z0-9_-]{1,64}$")
+    max_seq_length: int = Field(default=512, ge=16)
+    lora_rank: int = Field(default=8, ge=1)
+    lora_alpha: float = Field(default=16.0, gt=0)
+    lora_dropout: float = Field(default=0.05, ge=0, lt=1)
+    target_modules: Optional[List[str]] = None  # Defaults to the attention projections
 
 class ModelTrainingStatus(BaseModel):
     """Training status response"""
@@ -318,6 +338,15 @@ class ModelVersion(BaseModel):
     description: Optional[str] = None
     changelog: Optional[str] = None
     migration_plan: Optional[Dict] = None
+    current: bool = False  # the version the model's `current` pointer references
+
+class ModelVersionCreateRequest(BaseModel):
+    """Request model for committing files as a new model version"""
+    source: str  # file or directory on the server
+    version: Optional[str] = None  # defaults to a prefix of the content hash
+    description: Optional[str] = None
+    changelog: Optional[str] = None
+    activate: bool = False
 
 # Multi-Tenancy
 class TenantInfo(BaseModel):
@@ -402,14 +431,14 @@ class ModelCapabilities(BaseModel):
 # System Monitoring
 class SystemResources(BaseModel):
     """System resource metrics"""
-    cpu_usage: float  # 0-100%
-    ram_usage: float  # In GB
-    disk_usage: float  # In GB
+    cpu_usage: float = 0.0  # 0-100%
+    ram_usage: float = 0.0  # In GB
+    disk_usage: float = 0.0  # In GB
     gpu_usage: Optional[float] = None  # In GB
     active_models: List[str] = []
     active_connections: int = 0
     uptime: str = "0d 0h 0m"
-    temperature: float = 45.0  # CPU/GPU temp
+    temperature: Optional[float] = None  # CPU temperature in C; None when no thermal sensor is readable
 
 class SystemDiagnostics(BaseModel):
     """Comprehensive system diagnostics"""
@@ -431,7 +460,9 @@ class ModelOptimizationRequest(BaseModel):
     preserve_accuracy: bool = True
     target_size: Optional[str] = None  # e.g., "4.7GB"
     output_format: str = "gguf"
-    request_id: str = str(uuid.uuid4())
+    quantization: Optional[str] = None  # "q8_0" (int8) or "q4_0" (4-bit); chosen from target_size when unset
+    # Names the saved job status file, so it is restricted to filename characters
+    request_id: str = Field(default_factory=lambda: str(uuid.uuid4()), pattern=r"^[A-Za-z0-9_-]{1,64}$")
 
 class ModelOptimizationResponse(BaseModel):
     """Response model for optimization operations"""
@@ -444,6 +475,9 @@ class ModelOptimizationResponse(BaseModel):
     processing_time: float
     warnings: List[str] = []
     request_id: str
+    progress: float = 0.0  # fraction of tensors processed
+    output_path: Optional[str] = None
+    metrics: Dict[str, float] = {}  # reconstruction error, perplexity and tokens/s before and after
 
 # Model Permissions
 class ModelPermissions(BaseModel):
@@ -560,8 +594,9 @@ class ModelEvaluationRequest(BaseModel):
     metrics: List[str] = ["accuracy", "speed", "cost"]
     dataset: str = "MMLU"
     provider: ModelProvider = ModelProvider.OLLAMA
-    parameters: Dict[str, Any] = {}
-    baseline: Optional[str] = None  # For comparison
+    parameters: Dict[str, Any] = {}  # temperature, max_tokens, system_prompt, prompt_template, scorers, primary_metric, limit
+    baseline: Optional[str] = None  # For comparison: a previous request_id, or a model name (its latest run)
+    request_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
 
 class ModelEvaluationResult(BaseModel):
     """Evaluation results for models"""
@@ -574,7 +609,9 @@ class ModelEvaluationResult(BaseModel):
     passed: bool = True
     metrics: Dict[str, float] = {}
     logs: List[str] = []
-    report: Dict[str, Any] = {}
+    report: Dict[str, Any] = {}  # diff against the baseline run
+    request_id: Optional[str] = None
+    status: str = "completed"  # "queued", "running", "completed", "failed", "cancelled"
 
 # Model Documentation
 class ModelDocumentationRequest(BaseModel):
@@ -714,7 +751,7 @@ class ModelImportResponse(BaseModel):
     provider: ModelProvider
     status: str
     message: str
-    model_info: ModelInfo = ModelInfo()
+    model_info: Optional[ModelInfo] = None
     warnings: List[str] = []
     request_id: str
 
@@ -725,10 +762,10 @@ class ModelInfo(ModelInfo):
     tags: List[str] = []
     capabilities: ModelCapabilities = ModelCapabilities()
     governance: ModelGovernanceRules = ModelGovernanceRules()
-    compatibility: ModelCompatibilityMatrix = ModelCompatibilityMatrix()
-    performance: ModelPerformanceMetrics = ModelPerformanceMetrics()
-    training: ModelTrainingStatus = ModelTrainingStatus()
-    documentation: ModelDocumentationResponse = ModelDocumentationResponse()
+    compatibility: Optional[ModelCompatibilityMatrix] = None
+    performance: Optional[ModelPerformanceMetrics] = None
+    training: Optional[ModelTrainingStatus] = None
+    documentation: Optional[ModelDocumentationResponse] = None
     recommendations: List[str] = []
     audit_trail: List[Dict[str, Any]] = []
 
@@ -832,7 +869,7 @@ class ModelCapabilities(ModelCapabilities):
     compression: bool = False
 
 # Enhanced Chat History with full metadata
-class ChatHistory(ChatHistory):
+class ChatHistory(BaseModel):
     """Enhanced ChatHistory with full metadata"""
     user_id: str
     query: str
@@ -853,6 +890,32 @@ class ChatHistory(ChatHistory):
     tags: List[str] = []
     attachments: List[str] = []
 
+class HistorySearchHit(BaseModel):
+    """One chat history match; *_highlight fields are HTML-escaped with <mark> around matched words"""
+    id: str
+    user_id: str
+    tenant_id: Optional[str] = None
+    session_id: Optional[str] = None
+    model: str
+    provider: Optional[str] = None
+    timestamp: str
+    status: Optional[str] = None
+    tags: List[str] = []
+    score: float
+    query: str
+    query_highlight: str
+    response_highlight: str
+
+class HistorySearchResponse(BaseModel):
+    """Ranked, paginated chat history search results"""
+    query: str
+    page: int
+    page_size: int
+    total: int
+    total_is_estimate: bool = False  # counting stopped at HISTORY_COUNT_LIMIT or timed out
+    has_more: bool
+    results: List[HistorySearchHit]
+
 # Model Comparison with full implementation
 class ModelComparison(ModelComparison):
     """Full implementation of model comparison"""
@@ -864,6 +927,47 @@ class ModelComparison(ModelComparison):
     baseline: str = "default"
     comparison_date: str = datetime.datetime.utcnow().isoformat()
 
+class ComparisonTarget(BaseModel):
+    """One model in a comparison"""
+    provider: ModelProvider
+    model_name: Optional[str] = None  # provider default when omitted
+    api_key: Optional[str] = None
+
+class ModelComparisonRequest(BaseModel):
+    """Send one question to several models at once; the first model is the baseline"""
+    question: str
+    models: List[ComparisonTarget] = Field(min_length=2)
+    temperature: float = 0.7
+    max_tokens: Optional[int] = None
+    system_prompt: Optional[str] = None
+    history: Optional[List[Dict[str, str]]] = None
+    stream: bool = True
+    user_id: Optional[str] = None
+    tenant_id: Optional[str] = None
+    request_id: Optional[str] = Field(default_factory=lambda: str(uuid.uuid4()))
+
+class ComparisonResult(BaseModel):
+    """One model's answer and timings"""
+    index: int
+    model: str
+    provider: ModelProvider
+    response: str = ""
+    error: Optional[str] = None
+    ttft_ms: Optional[float] = None  # time to first token
+    duration_ms: float = 0.0
+    completion_tokens: int = 0
+    tokens_per_second: float = 0.0  # completion tokens over the time after the first token
+    output_chars: int = 0
+    cost_usd: float = 0.0
+
+class ModelComparisonResponse(BaseModel):
+    """Per-model results plus each model compared against the baseline"""
+    request_id: str
+    question: str
+    wall_time_ms: float  # the slowest model, since all run concurrently
+    results: List[ComparisonResult]
+    comparisons: List[ModelComparison]
+
 # Model Documentation with full implementation
 class ModelDocumentationResponse(ModelDocumentationResponse):
     """Full implementation of model documentation response"""
@@ -0,0 +1,43 @@
+from fastapi import APIRouter, HTTPException, Request, status
+from typing import List
+from models import AttachmentInfo
+from services.attachments import AttachmentError, attachment_store
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+_UPLOAD_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}}
+                }
+            }
+        }
+    }
+}
+
+@router.post("/attachments", response_model=List[AttachmentInfo], status_code=status.HTTP_201_CREATED, openapi_extra=_UPLOAD_SCHEMA)
+async def upload_attachments(request: Request):
+    """Upload PDF, DOCX, text or image files; pass the returned ids in QueryRequest.attachments"""
+    try:
+        # Read from the raw stream: the body is written to disk as it arrives rather than buffered
+        attachments = await attachment_store.receive(request.headers, request.stream())
+    except AttachmentError as e:
+        logger.warning("Attachment upload rejected: %s", e)
+        raise HTTPException(status_code=e.status_code, detail={"error": "Invalid attachment", "message": str(e)})
+    for attachment in attachments:
+        logger.info("Stored attachment %s (%d bytes, %d chars extracted%s)", attachment.id[:12], attachment.size_bytes,
+                    attachment.chars, ", deduplicated" if attachment.deduplicated else "")
+    return attachments
+
+@router.get("/attachments/{attachment_id}", response_model=AttachmentInfo, status_code=status.HTTP_200_OK)
+async def get_attachment(attachment_id: str):
+    document = await attachment_store.document(attachment_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail={"error": "Not found", "message": f"Unknown attachment: {attachment_id}"})
+    return document.info()
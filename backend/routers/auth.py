@@ -0,0 +1,59 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from typing import Optional
+from config import config
+from services.auth import AuthError, Principal, token_verifier
+from utils.request_context import tenant_id_var, user_id_var
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+bearer = HTTPBearer(auto_error=False)
+
+async def authenticate(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer)) -> Optional[Principal]:
+    """Verify the bearer token and bind its user and tenant to the request (no-op unless AUTH_ENABLED)"""
+    if not config.AUTH_ENABLED:
+        return None
+    if credentials is None:
+        raise HTTPException(
+            status_code=401,
+            detail={"error": "Unauthorized", "message": "Missing bearer token"},
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    try:
+        principal = token_verifier.verify(credentials.credentials)
+    except AuthError as e:
+        logger.info("Rejected token: %s", e)
+        raise HTTPException(
+            status_code=e.status_code,
+            detail={"error": "Unauthorized", "message": str(e)},
+            headers={"WWW-Authenticate": 'Bearer error="invalid_token"'}
+        )
+    user_id_var.set(principal.user_id)
+    # The signed claim replaces any X-Tenant-ID header, which the client controls
+    tenant_id_var.set(principal.tenant_id)
+    return principal
+
+async def require_admin(principal: Optional[Principal] = Depends(authenticate)) -> Optional[Principal]:
+    """Admin routes need AUTH_ADMIN_SCOPE in the token's `scope` or `roles` claim"""
+    if principal is None:
+        return None
+    scope = principal.claims.get("scope") or ""
+    granted = set(scope.split() if isinstance(scope, str) else scope) | set(principal.claims.get("roles") or [])
+    if config.AUTH_ADMIN_SCOPE not in granted:
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "Forbidden", "message": f"Requires the {config.AUTH_ADMIN_SCOPE} scope"}
+        )
+    return principal
+
+@router.get("/auth/me", status_code=status.HTTP_200_OK)
+async def whoami(principal: Optional[Principal] = Depends(authenticate)):
+    if principal is None:
+        return {"authenticated": False}
+    return {
+        "authenticated": True,
+        "user_id": principal.user_id,
+        "tenant_id": principal.tenant_id,
+        "expires_at": principal.expires_at
+    }
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, status
+from models import ModelEvaluationRequest, ModelEvaluationResult
+from services.evaluation import EvaluationError, evaluation_runner
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+@router.post("/models/evaluate", response_model=ModelEvaluationResult, status_code=status.HTTP_202_ACCEPTED)
+async def evaluate_model(request: ModelEvaluationRequest):
+    """Start an evaluation over a JSONL/CSV dataset; poll GET /models/evaluate/{request_id}"""
+    try:
+        job = await evaluation_runner.submit(request)
+    except EvaluationError as e:
+        logger.warning("Evaluation request rejected: %s", e)
+        raise HTTPException(status_code=e.status_code, detail={"error": "Invalid evaluation", "message": str(e)})
+    logger.info("Evaluation %s queued for %s on %s", job.request_id, job.model_name, request.dataset)
+    return job
+
+@router.get("/models/evaluate/{request_id}", response_model=ModelEvaluationResult, status_code=status.HTTP_200_OK)
+async def get_evaluation(request_id: str):
+    job = evaluation_runner.status(request_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"error": "Not found", "message": f"Unknown evaluation: {request_id}"})
+    return job
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import datetime
+from database import db
+from services.export import DATASETS, FORMATS, ExportError, build_filter, check_format, stream_export
+from utils.request_context import get_tenant_id
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+@router.get("/export/{dataset}")
+async def export_dataset(
+    dataset: str,
+    format: str = Query(default="ndjson", description=" | ".join(FORMATS)),
+    gzip: bool = Query(default=False, description="gzip NDJSON/CSV on the fly; gzip-compressed pages for Parquet"),
+    since: Optional[datetime.datetime] = Query(default=None, description="UTC, inclusive"),
+    until: Optional[datetime.datetime] = Query(default=None, description="UTC, exclusive"),
+    after: Optional[str] = Query(default=None, description="Resume after this row id (the last `id` received)")
+):
+    """Stream the calling tenant's (X-Tenant-ID) chat history or usage costs in `_id` order"""
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail={"error": "Not found", "message": f"Unknown dataset: {dataset}; expected one of {', '.join(DATASETS)}"})
+    try:
+        spec = DATASETS[dataset]
+        query = build_filter(spec, get_tenant_id(), since=since, until=until, after=after)
+        # Fail on a bad format or missing Parquet dependencies before the response starts
+        encoder = check_format(format)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail={"error": "Invalid export", "message": str(e)})
+
+    filename = f"{dataset}{encoder.extension}{'.gz' if gzip and format != 'parquet' else ''}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-cache"}
+    logger.info("Exporting %s as %s for tenant %s", dataset, format, get_tenant_id())
+    return StreamingResponse(
+        stream_export(db.db, spec, query, format, gzip),
+        media_type="application/gzip" if gzip and format != "parquet" else encoder.media_type,
+        headers=headers
+    )
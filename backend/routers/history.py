@@ -0,0 +1,62 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from pymongo.errors import ExecutionTimeout, OperationFailure, PyMongoError
+from typing import Optional
+import datetime
+from config import config
+from models import HistorySearchResponse
+from services.chat_history import chat_history
+from utils.request_context import get_tenant_id, get_user_id
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def _own_user(user_id: Optional[str]) -> Optional[str]:
+    """With AUTH_ENABLED a caller only reads their own history; otherwise any user_id is taken as given"""
+    if not config.AUTH_ENABLED:
+        return user_id
+    if user_id is not None and user_id != get_user_id():
+        raise HTTPException(status_code=403, detail={"error": "Forbidden", "message": "Cannot read another user's history"})
+    return get_user_id()
+
+@router.get("/history/search", response_model=HistorySearchResponse, status_code=status.HTTP_200_OK)
+async def search_history(
+    q: str = Query(..., min_length=1, max_length=500, description='Words, "quoted phrases" and -excluded words'),
+    user_id: Optional[str] = Query(default=None),
+    model: Optional[str] = Query(default=None),
+    since: Optional[datetime.datetime] = Query(default=None),
+    until: Optional[datetime.datetime] = Query(default=None),
+    page: int = Query(default=1, ge=1, le=500),
+    page_size: int = Query(default=20, ge=1, le=100),
+    snippet_chars: int = Query(default=200, ge=40, le=2000)
+):
+    """Search the calling tenant's (X-Tenant-ID) chat history, best matches first"""
+    try:
+        return await chat_history.search(
+            q, tenant_id=get_tenant_id(), user_id=_own_user(user_id), model=model, since=since, until=until,
+            page=page, page_size=page_size, snippet_chars=snippet_chars
+        )
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail={"error": "Timeout", "message": "Search took too long; narrow the query or filters"})
+    except OperationFailure as e:
+        # Most often the text index has not been built yet
+        logger.error("History search failed: %s", e)
+        raise HTTPException(status_code=503, detail={"error": "Search unavailable", "message": str(e)})
+    except PyMongoError as e:
+        logger.error("History search failed: %s", e)
+        raise HTTPException(status_code=503, detail={"error": "Database error", "message": str(e)})
+
+@router.get("/history/{user_id}", status_code=status.HTTP_200_OK)
+async def list_history(
+    user_id: str,
+    page: int = Query(default=1, ge=1, le=500),
+    page_size: int = Query(default=20, ge=1, le=100)
+):
+    """A user's most recent exchanges, newest first"""
+    _own_user(user_id)
+    try:
+        records, has_more = await chat_history.recent(get_tenant_id(), user_id, page, page_size)
+    except PyMongoError as e:
+        logger.error("History listing failed: %s", e)
+        raise HTTPException(status_code=503, detail={"error": "Database error", "message": str(e)})
+    return {"user_id": user_id, "page": page, "page_size": page_size, "has_more": has_more, "history": records}
@@ -0,0 +1,110 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from typing import List, Optional
+import asyncio
+import datetime
+import functools
+from models import (
+    LifecycleStatus, ModelLifecycleRequest, ModelLifecycleResponse, ModelMigrationRequest, ModelMigrationResponse,
+    ModelVersion, ModelVersionCreateRequest
+)
+from services.model_store import ModelStoreError, model_store
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+async def _run(fn, *args, **kwargs):
+    """Store operations hash files and take a file lock; keep them off the event loop"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+    except ModelStoreError as e:
+        raise HTTPException(status_code=e.status_code, detail={"error": "Model version error", "message": str(e)})
+
+@router.post("/models/lifecycle", response_model=ModelLifecycleResponse, status_code=status.HTTP_200_OK)
+async def model_lifecycle(request: ModelLifecycleRequest):
+    """deprecate / retire a version (default: the live one), or migrate / rollback the live pointer"""
+    old_version = await _run(model_store.current, request.model_name)
+    new_version = old_version
+    if request.action in ("deprecate", "retire"):
+        version = request.target_version or old_version
+        if version is None:
+            raise HTTPException(status_code=404, detail={"error": "Not found", "message": f"{request.model_name} has no live version"})
+        target = LifecycleStatus.DEPRECATED if request.action == "deprecate" else LifecycleStatus.RETIRED
+        await _run(model_store.set_status, request.model_name, version, target, force=request.force)
+        message = f"{request.model_name}@{version} marked {target.value}"
+    elif request.action == "migrate":
+        if not request.target_version:
+            raise HTTPException(status_code=400, detail={"error": "Invalid input", "message": "migrate needs target_version"})
+        old_version, new_version = await _run(model_store.activate, request.model_name, request.target_version, force=request.force)
+        message = f"{request.model_name} now serves {new_version}"
+    elif request.action == "rollback":
+        old_version, new_version = await _run(model_store.rollback, request.model_name, request.target_version)
+        message = f"{request.model_name} rolled back to {new_version}"
+    else:
+        raise HTTPException(status_code=400, detail={"error": "Invalid input", "message": f"Unknown action: {request.action}"})
+    logger.info("Lifecycle %s on %s: %s -> %s", request.action, request.model_name, old_version, new_version)
+    return ModelLifecycleResponse(
+        model_name=request.model_name,
+        old_version=old_version,
+        new_version=new_version,
+        action=request.action,
+        status="completed",
+        message=message,
+        timestamp=datetime.datetime.utcnow().isoformat(),
+        # Every version stays in the store until garbage collected, so the previous one is the backup
+        backup_location=model_store.version_path(request.model_name, old_version) if old_version else None
+    )
+
+@router.post("/models/migrate", response_model=ModelMigrationResponse, status_code=status.HTTP_200_OK)
+async def migrate_model(request: ModelMigrationRequest):
+    """Switch the live version (verifying its files first if asked); `rollback` returns to the previous one"""
+    started_at = datetime.datetime.utcnow().isoformat()
+    if request.rollback:
+        old_version, new_version = await _run(model_store.rollback, request.model_name, request.target_version)
+    else:
+        old_version, new_version = await _run(
+            model_store.activate, request.model_name, request.target_version, verify=request.verify_integrity
+        )
+    return ModelMigrationResponse(
+        model_name=request.model_name,
+        old_version=old_version or "",
+        new_version=new_version,
+        status="completed",
+        message=f"{request.model_name} now serves {new_version}",
+        started_at=started_at,
+        completed_at=datetime.datetime.utcnow().isoformat(),
+        rollback_available=old_version is not None and old_version != new_version,
+        artifacts=[model_store.current_path(request.model_name)]
+    )
+
+@router.post("/models/versions/gc", status_code=status.HTTP_200_OK)
+async def collect_model_garbage(retention_days: Optional[int] = Query(default=None, ge=0)):
+    """Remove versions past the retention period and the blobs only they referenced"""
+    return await _run(model_store.collect_garbage, retention_days)
+
+@router.get("/models/{model_name:path}/versions", response_model=List[ModelVersion], status_code=status.HTTP_200_OK)
+async def list_versions(model_name: str):
+    return await _run(model_store.versions, model_name)
+
+@router.post("/models/{model_name:path}/versions", status_code=status.HTTP_201_CREATED)
+async def create_version(model_name: str, request: ModelVersionCreateRequest):
+    """Commit server-side files as a version; content already in the store is shared, not copied"""
+    version, stats = await _run(
+        model_store.commit, model_name, request.source, request.version, request.description, request.changelog,
+        request.activate
+    )
+    return {"version": version, "stored": stats}
+
+@router.post("/models/{model_name:path}/versions/{version}/activate", response_model=ModelLifecycleResponse,
+             status_code=status.HTTP_200_OK)
+async def activate_version(model_name: str, version: str, verify: bool = Query(default=False)):
+    old_version, new_version = await _run(model_store.activate, model_name, version, verify=verify)
+    return ModelLifecycleResponse(
+        model_name=model_name,
+        old_version=old_version,
+        new_version=new_version,
+        action="migrate",
+        status="completed",
+        message=f"{model_name} now serves {new_version}",
+        timestamp=datetime.datetime.utcnow().isoformat()
+    )
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, status
+from models import ModelOptimizationRequest, ModelOptimizationResponse
+from services.model_optimization import OptimizationError, model_optimizer
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+@router.post("/models/optimize", response_model=ModelOptimizationResponse, status_code=status.HTTP_202_ACCEPTED)
+async def optimize_model(request: ModelOptimizationRequest):
+    """Start quantizing a local or cached safetensors model; poll GET /models/optimize/{request_id}"""
+    try:
+        job = await model_optimizer.submit(request)
+    except OptimizationError as e:
+        logger.warning("Optimization request rejected: %s", e)
+        raise HTTPException(status_code=400, detail={"error": "Invalid optimization", "message": str(e)})
+    logger.info("Optimization %s queued for %s (%s, %s)", job.request_id, job.model_name, job.optimization_type, job.original_size)
+    return job
+
+@router.get("/models/optimize/{request_id}", response_model=ModelOptimizationResponse, status_code=status.HTTP_200_OK)
+async def get_optimization(request_id: str):
+    job = model_optimizer.status(request_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"error": "Not found", "message": f"Unknown optimization job: {request_id}"})
+    return job
@@ -0,0 +1,82 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from config import config
+from utils.profiling import ProfilerBusy, allocation_profiler, loop_monitor, stack_sampler
+import asyncio
+import threading
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def _check_enabled(seconds: float = 0.0) -> None:
+    if not config.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail={"error": "Not found", "message": "Profiling is disabled (PROFILING_ENABLED)"})
+    if seconds > config.PROFILING_MAX_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid input", "message": f"seconds must be at most {config.PROFILING_MAX_SECONDS:g}"}
+        )
+
+@router.post("/admin/profile/cpu", status_code=status.HTTP_200_OK)
+async def profile_cpu(
+    seconds: float = Query(default=10.0, gt=0),
+    interval_ms: float = Query(default=5.0, ge=1, le=1000),
+    format: str = Query(default="collapsed", pattern="^(collapsed|json)$"),
+    include_idle: bool = Query(default=False, description="Keep samples of threads blocked in waits"),
+    top: int = Query(default=30, ge=1, le=500)
+):
+    """Sample every thread's stack for `seconds`; `collapsed` output feeds flamegraph.pl or speedscope"""
+    _check_enabled(seconds)
+    loop = asyncio.get_running_loop()
+    logger.info("CPU profile started for %.1fs", seconds)
+    try:
+        result = await loop.run_in_executor(
+            None, stack_sampler.profile, seconds, interval_ms / 1000, include_idle, threading.get_ident()
+        )
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail={"error": "Conflict", "message": str(e)})
+    if format == "collapsed":
+        return PlainTextResponse(
+            stack_sampler.collapsed(result),
+            headers={"X-Profile-Samples": str(result["samples"]), "X-Profile-Duration": str(result["duration"])}
+        )
+    return {
+        "duration": result["duration"],
+        "samples": result["samples"],
+        "idle_samples": result["idle_samples"],
+        "top": stack_sampler.top_functions(result, top)
+    }
+
+@router.post("/admin/profile/memory", status_code=status.HTTP_200_OK)
+async def profile_memory(
+    seconds: float = Query(default=10.0, gt=0),
+    top: int = Query(default=25, ge=1, le=500),
+    group_by: str = Query(default="lineno", pattern="^(lineno|filename|traceback)$"),
+    frames: int = Query(default=10, ge=1, le=100, description="Stack depth recorded for group_by=traceback")
+):
+    """Trace allocations for `seconds` and return the sites whose live memory grew the most"""
+    _check_enabled(seconds)
+    try:
+        return await allocation_profiler.diff(seconds, top, group_by, frames)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail={"error": "Conflict", "message": str(e)})
+
+@router.get("/admin/profile/loop", status_code=status.HTTP_200_OK)
+async def loop_lag():
+    """Event-loop lag percentiles and the stacks of recent stalls"""
+    _check_enabled()
+    return loop_monitor.snapshot()
+
+@router.post("/admin/profile/loop", status_code=status.HTTP_200_OK)
+async def configure_loop_monitor(
+    enabled: bool = Query(...),
+    threshold_ms: Optional[float] = Query(default=None, ge=1)
+):
+    _check_enabled()
+    if enabled:
+        loop_monitor.start(threshold_ms / 1000 if threshold_ms is not None else None)
+    else:
+        await loop_monitor.stop()
+    return loop_monitor.snapshot()
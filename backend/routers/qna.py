@@ -1,34 +1,271 @@
-from fastapi import APIRouter, HTTPException, Header, status
+from fastapi import APIRouter, HTTPException, Header, Query, status
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from pymongo.errors import PyMongoError
+from models import ModelComparisonRequest, ModelComparisonResponse, ModelProvider, QueryRequest, QueryResponse, TenantInfo
 from schemas import Question, Answer
-from services.llm import get_llm_response
+from config import config
+from services.attachments import AttachmentError, attachment_store
+from services.chat_history import chat_history
+from services.comparison import run_comparison
+from services.llm import default_provider, generate_answer, get_llm_response, stream_answer
+from services.providers import ChatResult, ProviderError
+from services.tenant_config import tenant_config
+from utils.request_context import get_request_id, get_tenant_id, get_user_id
+from utils.tracing import get_current_trace, span
 from utils.validators import validate_question
+import datetime
+import json
 import time
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.post("/ask", response_model=Answer, status_code=status.HTTP_200_OK)
+async def _context_tenant() -> Optional[TenantInfo]:
+    """Settings of the context tenant (cached), None for requests without a tenant.
+
+    The tenant comes from the request context, never the body. With auth
+    on, a tenant that has no settings document is refused rather than
+    treated as unrestricted.
+    """
+    tenant_id = get_tenant_id()
+    try:
+        tenant = await tenant_config.tenant(tenant_id)
+    except PyMongoError as e:
+        logger.error("Could not load settings for tenant %s: %s", tenant_id, e)
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "Service unavailable", "message": "Tenant settings are temporarily unavailable"}
+        )
+    if tenant is None and tenant_id and config.AUTH_ENABLED:
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "Forbidden", "message": f"Tenant {tenant_id} is not configured"}
+        )
+    return tenant
+
+def _enforce_tenant_policy(tenant: Optional[TenantInfo], provider: ModelProvider, text: str) -> None:
+    if tenant is None:
+        return
+    if provider not in tenant.models_allowed:
+        raise HTTPException(
+            status_code=403,
+            detail={"error": "Forbidden", "message": f"Provider {provider.value} is not enabled for tenant {tenant.tenant_id}"}
+        )
+    if len(text) > tenant.model_governance.max_input_length:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid input", "message": f"Input exceeds {tenant.model_governance.max_input_length} characters"}
+        )
+
+async def _apply_tenant_policy(provider: ModelProvider, text: str) -> None:
+    """Enforce the context tenant's allowed providers and input limit"""
+    _enforce_tenant_policy(await _context_tenant(), provider, text)
+
+@router.post("/ask", response_model=Answer, response_model_exclude_none=True, status_code=status.HTTP_200_OK)
 async def ask_question(
     question: Question,
-    user_agent: str = Header(default=None, alias="User-Agent")
+    user_agent: str = Header(default=None, alias="User-Agent"),
+    diagnostics: bool = Query(default=False, description="Include per-stage timings in the response")
 ):
     start_time = time.time()
+    trace = get_current_trace()
+    if trace is not None:
+        # Routing, body parsing and schema validation happen before the handler runs
+        trace.add_span("request_validation", trace.root.start_ns)
     try:
-        logger.info(f"Received question: {question.text} from User-Agent: {user_agent}")
-        validate_question(question.text)
-        answer_text = get_llm_response(question.text)
+        logger.debug("Received question (%d chars) from User-Agent: %s", len(question.text), user_agent)
+        with span("validation"):
+            validate_question(question.text)
+            # Enforce the policy on the provider that will actually answer, failover included
+            tenant = await _context_tenant()
+            provider = default_provider(tenant.models_allowed if tenant is not None else None)
+            _enforce_tenant_policy(tenant, provider, question.text)
+        answer_text = await get_llm_response(question.text, provider)
         if not answer_text.strip():
             raise ValueError("LLM returned an empty response")
         response_time = time.time() - start_time
-        logger.info(f"Processed question in {response_time:.2f} seconds")
-        return {"answer": answer_text, "response_time": response_time}
+        logger.info("Processed question in %.2f seconds", response_time)
+        result = {"answer": answer_text, "response_time": response_time}
+        if trace is not None:
+            if diagnostics:
+                result["diagnostics"] = trace.diagnostics()
+            trace.mark("handler_end")
+        return result
     except ValueError as ve:
-        logger.warning(f"Validation error: {str(ve)}")
+        logger.warning("Validation error: %s", ve)
         raise HTTPException(status_code=400, detail={"error": "Invalid input", "message": str(ve)})
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Internal server error: {str(e)}")
+        logger.error("Internal server error: %s", e)
         raise HTTPException(
             status_code=500,
             detail={"error": "Server error", "message": f"Failed to process request: {str(e)}"}
-        )
\ No newline at end of file
+        )
+
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+def _record_history(query: QueryRequest, request_id: str, start_time: float, response: str = "",
+                    result: ChatResult = None, error: ProviderError = None) -> None:
+    """Queue a ChatHistory record for this exchange (written in batches by the history store)"""
+    if not config.HISTORY_ENABLED:
+        return
+    chat_history.record({
+        "user_id": query.user_id,
+        "query": query.question,
+        "response": response,
+        "model": result.model if result is not None else query.model_name,
+        "provider": (result.provider if result is not None else query.provider).value,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "tokens_used": result.tokens_used if result is not None else 0,
+        "status": "error" if error is not None else "success",
+        "error": str(error) if error is not None else None,
+        "duration": time.time() - start_time,
+        "input_length": len(query.question),
+        "output_length": len(response),
+        "tenant_id": get_tenant_id(),
+        # QueryRequest has no session concept; the request id lets a record be matched to its logs and traces
+        "session_id": request_id,
+        "tags": [],
+        "attachments": query.attachments or []
+    })
+
+@router.post("/query", response_model=QueryResponse, status_code=status.HTTP_200_OK)
+async def query_model(query: QueryRequest):
+    """Query any configured provider; set `stream` for server-sent events"""
+    start_time = time.time()
+    request_id = query.request_id if "request_id" in query.model_fields_set else (get_request_id() or query.request_id)
+    if get_user_id() is not None:
+        # Authenticated callers act as the token's user and tenant, whatever the body claims
+        query.user_id = get_user_id()
+        query.tenant_id = get_tenant_id()
+    try:
+        with span("validation"):
+            validate_question(query.question)
+    except ValueError as ve:
+        logger.warning("Validation error: %s", ve)
+        raise HTTPException(status_code=400, detail={"error": "Invalid input", "message": str(ve)})
+    await _apply_tenant_policy(query.provider, query.question)
+
+    model_name = query.model_name if query.model_name not in ("", "auto") else None
+    if model_name is None and query.provider == ModelProvider.OLLAMA and "user_id" in query.model_fields_set:
+        # default_model holds an Ollama tag, so it only applies to Ollama requests
+        try:
+            preferences = await tenant_config.user(query.user_id)
+        except PyMongoError as e:
+            # Preferences only pick a default model; answer with the provider default instead of failing
+            logger.warning("Could not load preferences for user %s, using the default model: %s", query.user_id, e)
+            preferences = None
+        model_name = preferences.default_model if preferences is not None else None
+
+    params = dict(
+        provider=query.provider,
+        model_name=model_name,
+        temperature=query.temperature,
+        max_tokens=query.max_tokens,
+        system_prompt=query.system_prompt,
+        history=query.history,
+        pinned=query.model_name not in ("", "auto"),
+        api_key=query.api_key,
+        # user_id defaults to a fresh UUID; only count callers that identify themselves
+        user_id=query.user_id if "user_id" in query.model_fields_set else None
+    )
+    if query.attachments:
+        try:
+            with span("attachments", count=len(query.attachments)):
+                params["context"] = await attachment_store.context_for(
+                    query.attachments, query.question, config.ATTACHMENT_CONTEXT_TOKENS, params["model_name"]
+                )
+        except AttachmentError as e:
+            raise HTTPException(status_code=e.status_code, detail={"error": "Invalid attachment", "message": str(e)})
+
+    if query.stream:
+        async def events():
+            deltas = []
+            try:
+                async for item in stream_answer(query.question, **params):
+                    if isinstance(item, ChatResult):
+                        _record_history(query, request_id, start_time, "".join(deltas).strip(), result=item)
+                        yield _sse({
+                            "done": True,
+                            "model": item.model,
+                            "provider": item.provider.value,
+                            "tokens_used": item.tokens_used,
+                            "processing_time": time.time() - start_time,
+                            "request_id": request_id,
+                            "metadata": item.metadata()
+                        })
+                    else:
+                        deltas.append(item)
+                        yield _sse({"delta": item})
+            except ProviderError as pe:
+                logger.error("%s API error during stream: %s", pe.provider.value, pe)
+                _record_history(query, request_id, start_time, "".join(deltas).strip(), error=pe)
+                yield _sse({"error": str(pe), "request_id": request_id})
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    try:
+        result = await generate_answer(query.question, **params)
+    except ProviderError as pe:
+        logger.error("%s API error: %s", pe.provider.value, pe)
+        _record_history(query, request_id, start_time, error=pe)
+        raise HTTPException(
+            status_code=502 if pe.retryable else 400,
+            detail={"error": "Provider error", "message": str(pe)}
+        )
+    _record_history(query, request_id, start_time, result.text.strip(), result=result)
+    return QueryResponse(
+        response=result.text.strip(),
+        model=result.model,
+        provider=result.provider,
+        tokens_used=result.tokens_used,
+        processing_time=time.time() - start_time,
+        request_id=request_id,
+        metadata=result.metadata()
+    )
+
+@router.post("/compare", response_model=ModelComparisonResponse, status_code=status.HTTP_200_OK)
+async def compare_models(request: ModelComparisonRequest):
+    """Ask every listed model the same question concurrently; with `stream`, deltas from all models share one SSE stream"""
+    if len(request.models) > config.COMPARE_MAX_MODELS:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid input", "message": f"At most {config.COMPARE_MAX_MODELS} models can be compared"}
+        )
+    request_id = request.request_id if "request_id" in request.model_fields_set else (get_request_id() or request.request_id)
+    try:
+        with span("validation"):
+            validate_question(request.question)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail={"error": "Invalid input", "message": str(ve)})
+    if get_user_id() is not None:
+        request.user_id = get_user_id()
+        request.tenant_id = get_tenant_id()
+    for target in request.models:
+        await _apply_tenant_policy(target.provider, request.question)
+
+    events = run_comparison(
+        request.question, request.models, temperature=request.temperature, max_tokens=request.max_tokens,
+        system_prompt=request.system_prompt, history=request.history, user_id=request.user_id
+    )
+
+    def summary(event: dict) -> ModelComparisonResponse:
+        return ModelComparisonResponse(request_id=request_id, question=request.question, **event)
+
+    if request.stream:
+        async def stream():
+            async for event in events:
+                if "results" in event:
+                    yield _sse({"done": True, "request_id": request_id, **summary(event).model_dump(mode="json", exclude={"question"})})
+                else:
+                    yield _sse(event)
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    async for event in events:
+        if "results" in event:
+            return summary(event)
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from models import ModelTrainingConfig, ModelTrainingStatus, TrainingResult
+from routers.auth import require_admin
+from services.training import TrainingError, training_executor
+from utils.request_context import get_tenant_id
+import json
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def _not_found(training_id: str) -> HTTPException:
+    return HTTPException(status_code=404, detail={"error": "Not found", "message": f"Unknown training job: {training_id}"})
+
+@router.post("/models/train", response_model=ModelTrainingStatus, status_code=status.HTTP_202_ACCEPTED,
+             dependencies=[Depends(require_admin)])
+async def train_model(request: ModelTrainingConfig):
+    """Queue a LoRA fine-tuning job; follow it with GET /models/train/{training_id}/events"""
+    try:
+        job = await training_executor.submit(request, tenant_id=get_tenant_id())
+    except TrainingError as e:
+        logger.warning("Training request rejected: %s", e)
+        raise HTTPException(status_code=e.status_code, detail={"error": "Invalid training job", "message": str(e)})
+    logger.info("Training %s queued for %s on %s", job.training_id, job.model_name, request.dataset)
+    return job
+
+@router.get("/models/train/{training_id}", response_model=ModelTrainingStatus, status_code=status.HTTP_200_OK)
+async def get_training(training_id: str):
+    job = training_executor.status(training_id, get_tenant_id())
+    if job is None:
+        raise _not_found(training_id)
+    return job
+
+@router.get("/models/train/{training_id}/events")
+async def training_events(training_id: str):
+    """Server-sent ModelTrainingStatus updates (progress, loss) until the job finishes"""
+    if training_executor.status(training_id, get_tenant_id()) is None:
+        raise _not_found(training_id)
+
+    async def events():
+        async for job in training_executor.watch(training_id, get_tenant_id()):
+            # Comment lines keep proxies from closing an idle stream between checkpoints
+            yield ": keepalive\n\n" if job is None else f"data: {json.dumps(job.model_dump(mode='json'))}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/models/train/{training_id}/result", response_model=TrainingResult, status_code=status.HTTP_200_OK)
+async def get_training_result(training_id: str):
+    result = training_executor.result(training_id, get_tenant_id())
+    if result is None:
+        raise _not_found(training_id)
+    return result
+
+@router.post("/models/train/{training_id}/cancel", response_model=ModelTrainingStatus, status_code=status.HTTP_200_OK,
+             dependencies=[Depends(require_admin)])
+async def cancel_training(training_id: str):
+    try:
+        job = await training_executor.cancel(training_id, get_tenant_id())
+    except TrainingError as e:
+        raise HTTPException(status_code=e.status_code, detail={"error": "Conflict", "message": str(e)})
+    if job is None:
+        raise _not_found(training_id)
+    return job
@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from typing import Optional
+from routers.auth import require_admin
+from services.travel_facts import PURPOSES, extract, resolve_country, travel_facts
+import asyncio
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+@router.get("/travel-facts", status_code=status.HTTP_200_OK)
+async def fact_store_status():
+    return travel_facts.stats()
+
+@router.get("/travel-facts/extract", status_code=status.HTTP_200_OK)
+async def extract_entities(question: str = Query(..., min_length=3)):
+    """What the entity extractor resolves from a question, and the template answer if there is one"""
+    query = extract(question)
+    return {
+        "origin": query.origin,
+        "destination": query.destination,
+        "purpose": query.purpose,
+        "topics": query.topics,
+        "answer": travel_facts.answer(question)
+    }
+
+@router.get("/travel-facts/{origin}/{destination}", status_code=status.HTTP_200_OK)
+async def lookup_fact(origin: str, destination: str, purpose: Optional[str] = Query(default=None)):
+    """Requirements for a route; countries may be ISO codes or names, origin may be "*" """
+    origin_code, destination_code = resolve_country(origin), resolve_country(destination)
+    if origin_code is None or destination_code is None:
+        raise HTTPException(status_code=400, detail={"error": "Invalid input", "message": "Unknown country"})
+    if purpose is not None and purpose not in PURPOSES:
+        raise HTTPException(status_code=400, detail={"error": "Invalid input", "message": f"purpose must be one of {', '.join(PURPOSES)}"})
+    fact = travel_facts.lookup(origin_code, destination_code, purpose)
+    if fact is None:
+        raise HTTPException(status_code=404, detail={"error": "Not found", "message": f"No facts for {origin_code} -> {destination_code}"})
+    return fact.to_dict()
+
+@router.post("/travel-facts/reload", status_code=status.HTTP_200_OK, dependencies=[Depends(require_admin)])
+async def reload_facts(request: Request):
+    """Rebuild the store from a CSV or JSON body, or from TRAVEL_FACTS_SOURCE when the body is empty"""
+    body = await request.body()
+    fmt = "json" if "json" in request.headers.get("content-type", "") else "csv"
+    try:
+        # Parsing and compiling happen off the event loop; lookups keep using the old mapping until the swap
+        count = await asyncio.get_running_loop().run_in_executor(None, travel_facts.reload, body or None, fmt if body else None)
+    except (ValueError, OSError) as e:
+        logger.warning("Travel fact reload failed: %s", e)
+        raise HTTPException(status_code=400, detail={"error": "Invalid input", "message": str(e)})
+    logger.info("Reloaded %d travel facts", count)
+    return travel_facts.stats()
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from typing import List, Optional
+from pydantic import BaseModel
+from config import config
+from models import ModelProvider, ModelUsageStats
+from utils.request_context import get_tenant_id
+from utils.token_accounting import cost_ledger, token_counter
+from utils.usage_stats import usage_stats
+import asyncio
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Below this many characters counting is cheaper than a thread hop
+_INLINE_COUNT_CHARS = 4096
+
+def _tenant(requested: Optional[str]) -> Optional[str]:
+    """The tenant whose usage may be read: the token's when AUTH_ENABLED, else whichever was asked for"""
+    if not config.AUTH_ENABLED:
+        return requested
+    # None would mean "every tenant"; a token without a tenant reads nothing instead
+    return get_tenant_id() or ""
+
+class TokenCountRequest(BaseModel):
+    """Strings to count before dispatch (quota checks, context budgeting)"""
+    texts: List[str]
+    model: Optional[str] = None
+
+@router.get("/usage/costs", status_code=status.HTTP_200_OK)
+async def get_costs(tenant_id: Optional[str] = Query(default=None)):
+    """Token and cost totals recorded by this worker, per tenant and model"""
+    return {"entries": cost_ledger.snapshot(_tenant(tenant_id))}
+
+@router.post("/usage/tokens", status_code=status.HTTP_200_OK)
+async def count_tokens(request: TokenCountRequest):
+    if sum(len(text) for text in request.texts) > _INLINE_COUNT_CHARS:
+        # Encoding a large batch takes milliseconds of CPU; keep it off the event loop
+        counts = await asyncio.get_running_loop().run_in_executor(None, token_counter.count_batch, request.texts, request.model)
+    else:
+        counts = token_counter.count_batch(request.texts, request.model)
+    return {"model": request.model, "counts": counts, "total": sum(counts)}
+
+@router.get("/usage/models", response_model=List[ModelUsageStats], status_code=status.HTTP_200_OK)
+async def list_model_usage(tenant_id: Optional[str] = Query(default=None)):
+    """Usage for every model, merged across workers every USAGE_MERGE_INTERVAL seconds"""
+    return usage_stats.all(_tenant(tenant_id))
+
+@router.get("/usage/models/{provider}/{model_name:path}", response_model=ModelUsageStats, status_code=status.HTTP_200_OK)
+async def get_model_usage(provider: ModelProvider, model_name: str, tenant_id: Optional[str] = Query(default=None)):
+    stats = usage_stats.get(model_name, provider.value, _tenant(tenant_id))
+    if stats is None:
+        raise HTTPException(status_code=404, detail={"error": "Not found", "message": f"No usage recorded for {model_name}"})
+    return stats
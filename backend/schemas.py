@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field, validator
+from typing import Any, Dict, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,4 +13,5 @@ class Question(BaseModel):
 
 class Answer(BaseModel):
     answer: str = Field(..., description="The LLM-generated answer")
-    response_time: float = Field(..., ge=0, description="Time taken to process the request in seconds")
\ No newline at end of file
+    response_time: float = Field(..., ge=0, description="Time taken to process the request in seconds")
+    diagnostics: Optional[Dict[str, Any]] = Field(None, description="Per-stage timings, returned when requested")
\ No newline at end of file
@@ -0,0 +1,40 @@
+import asyncio
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+from config import config
+from utils.lifecycle import lifecycle
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that reports not-ready before it stops accepting connections"""
+
+    def handle_exit(self, sig, frame):
+        if lifecycle.draining or self.should_exit:
+            # Second signal: stop waiting
+            super().handle_exit(sig, frame)
+            return
+        lifecycle.begin_drain()
+        # Keep serving while load balancers observe /ready returning 503
+        try:
+            asyncio.get_running_loop().call_later(config.SHUTDOWN_READY_GRACE, super().handle_exit, sig, frame)
+        except RuntimeError:
+            super().handle_exit(sig, frame)
+
+def main():
+    """Run the API with one or more worker processes (WEB_CONCURRENCY)"""
+    uvicorn_config = uvicorn.Config(
+        "main:app",
+        host=config.HOST,
+        port=config.PORT,
+        workers=config.WORKERS,
+        timeout_graceful_shutdown=int(config.SHUTDOWN_DRAIN_TIMEOUT),
+        proxy_headers=True
+    )
+    server = DrainingServer(config=uvicorn_config)
+    if uvicorn_config.workers > 1:
+        sock = uvicorn_config.bind_socket()
+        Multiprocess(uvicorn_config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+
+if __name__ == "__main__":
+    main()
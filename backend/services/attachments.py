@@ -0,0 +1,461 @@
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from config import config
+from models import AttachmentInfo
+from utils.document_extraction import SUPPORTED_TYPES, extract_text, sniff_content_type
+from utils.token_accounting import token_counter
+
+logger = logging.getLogger(__name__)
+
+CHUNK_CHARS = 1200
+MAX_FIELD_BYTES = 64 * 1024
+_ID_RE = re.compile(r"[0-9a-f]{64}")
+_WORD_RE = re.compile(r"\w{3,}")
+_STOPWORDS = frozenset(("the", "and", "for", "are", "with", "what", "how", "does", "this", "that", "can", "from", "have", "you", "your", "there", "when", "which", "need", "about", "into", "will"))
+
+
+class AttachmentError(ValueError):
+    """An upload the API should reject, with the HTTP status to reject it with"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Upload:
+    """One file part while it is being streamed to a temporary file"""
+
+    __slots__ = ("filename", "declared_type", "path", "file", "digest", "size", "head")
+
+    def __init__(self, filename: str, declared_type: str, directory: str):
+        self.filename = filename
+        self.declared_type = declared_type
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        self.file = os.fdopen(fd, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+
+
+class _Document:
+    """Extracted text of one stored attachment, split into excerpt-sized chunks on first use"""
+
+    __slots__ = ("id", "filename", "content_type", "size_bytes", "metadata", "error", "retry", "text", "_chunks",
+                 "_token_counts")
+
+    def __init__(self, id: str, filename: str, content_type: str, size_bytes: int, text: str = "",
+                 metadata: Optional[Dict[str, object]] = None, error: Optional[str] = None, retry: bool = False):
+        self.id = id
+        self.filename = filename
+        self.content_type = content_type
+        self.size_bytes = size_bytes
+        self.text = text
+        self.metadata = metadata or {}
+        self.error = error
+        # The error was transient (timeout, crashed worker, missing parser): extract again on next use
+        self.retry = retry
+        self._chunks: Optional[List[str]] = None
+        self._token_counts: Dict[str, List[int]] = {}
+
+    @property
+    def chunks(self) -> List[str]:
+        if self._chunks is None:
+            chunks, current = [], ""
+            for block in re.split(r"\n\s*\n", self.text):
+                block = block.strip()
+                while len(block) > CHUNK_CHARS:
+                    chunks.append(block[:CHUNK_CHARS])
+                    block = block[CHUNK_CHARS:]
+                if current and len(current) + len(block) + 2 > CHUNK_CHARS:
+                    chunks.append(current)
+                    current = ""
+                if block:
+                    current = f"{current}\n\n{block}" if current else block
+            if current:
+                chunks.append(current)
+            self._chunks = chunks
+        return self._chunks
+
+    def token_counts(self, model: Optional[str]) -> List[int]:
+        key = model or ""
+        if key not in self._token_counts:
+            self._token_counts[key] = token_counter.count_batch(self.chunks, model) if self.chunks else []
+        return self._token_counts[key]
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "size_bytes": self.size_bytes,
+            "metadata": self.metadata,
+            "error": self.error,
+            "retry": self.retry,
+        }
+
+    def info(self, filename: Optional[str] = None, deduplicated: bool = False) -> AttachmentInfo:
+        return AttachmentInfo(
+            id=self.id,
+            filename=filename or self.filename,
+            content_type=self.content_type,
+            size_bytes=self.size_bytes,
+            chars=len(self.text),
+            metadata=self.metadata,
+            error=self.error,
+            deduplicated=deduplicated
+        )
+
+
+class AttachmentStore:
+    """Content-addressed attachment storage with text extraction in a process pool.
+
+    Uploads are parsed from the request stream as they arrive and written
+    to a temporary file on a thread while being hashed, so a file is never
+    held in memory. The file is then stored under its SHA-256, which is also
+    its attachment id: uploading the same bytes again reuses the stored file
+    and its extracted text instead of parsing it a second time.
+
+    Extraction runs in a small spawned process pool so PDF and DOCX parsing
+    never blocks the event loop, and concurrent requests for the same file
+    share one extraction. Extracted text is written next to the file and the
+    most recently used documents are also kept in memory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 20 * 1024 * 1024, max_files: int = 5, workers: int = 2,
+                 max_chars: int = 200_000, cache_size: int = 64, extract_timeout: float = 60.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.workers = workers
+        self.max_chars = max_chars
+        self.cache_size = cache_size
+        self.extract_timeout = extract_timeout
+        self._cache: "OrderedDict[str, _Document]" = OrderedDict()
+        self._extracting: Dict[str, asyncio.Future] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _path(self, attachment_id: str, suffix: str = "") -> str:
+        return os.path.join(self.directory, attachment_id[:2], attachment_id + suffix)
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned workers do not inherit the server's threads, sockets or loaded models
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            # Bounds queued extractions as well as running ones
+            self._slots = asyncio.Semaphore(self.workers * 2)
+        return self._slots
+
+    async def receive(self, headers, stream) -> List[AttachmentInfo]:
+        """Stream every file part of a multipart body to disk, then store and extract each one"""
+        content_type, params = parse_options_header(headers.get("content-type"))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise AttachmentError("Expected a multipart/form-data body", 415)
+        os.makedirs(self.directory, exist_ok=True)
+
+        uploads: List[_Upload] = []
+        writes: List[tuple] = []
+        part: Dict[str, object] = {}
+
+        def on_part_begin():
+            part.clear()
+            part.update(headers={}, header_name=b"", header_value=b"", upload=None, field_bytes=0)
+
+        def on_header_field(data, start, end):
+            part["header_name"] += data[start:end]
+
+        def on_header_value(data, start, end):
+            part["header_value"] += data[start:end]
+
+        def on_header_end():
+            part["headers"][part["header_name"].lower()] = part["header_value"]
+            part["header_name"], part["header_value"] = b"", b""
+
+        def on_headers_finished():
+            _, options = parse_options_header(part["headers"].get(b"content-disposition"))
+            if b"filename" not in options:
+                return
+            if len(uploads) >= self.max_files:
+                raise AttachmentError(f"At most {self.max_files} files can be uploaded at once")
+            filename = os.path.basename(options[b"filename"].decode("utf-8", "replace"))
+            upload = _Upload(filename, part["headers"].get(b"content-type", b"").decode("latin-1"), self.directory)
+            uploads.append(upload)
+            part["upload"] = upload
+
+        def on_part_data(data, start, end):
+            upload = part["upload"]
+            if upload is None:
+                part["field_bytes"] += end - start
+                if part["field_bytes"] > MAX_FIELD_BYTES:
+                    raise AttachmentError("Form field too large")
+                return
+            upload.size += end - start
+            if upload.size > self.max_bytes:
+                raise AttachmentError(f"{upload.filename} exceeds the {self.max_bytes // (1024 * 1024)} MB limit", 413)
+            if len(upload.head) < 16:
+                upload.head += data[start:min(end, start + 16)]
+            writes.append((upload, data[start:end]))
+
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": on_part_begin,
+            "on_part_data": on_part_data,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+        })
+        loop = asyncio.get_running_loop()
+        try:
+            async for chunk in stream:
+                parser.write(chunk)
+                if writes:
+                    batch = writes[:]
+                    writes.clear()
+                    # Hashing and disk writes happen off the event loop, one batch per network chunk
+                    await loop.run_in_executor(None, _write_batch, batch)
+            parser.finalize()
+            for upload in uploads:
+                upload.file.close()
+        except BaseException:
+            for upload in uploads:
+                upload.file.close()
+                _remove(upload.path)
+            raise
+        if not uploads:
+            raise AttachmentError("No files in upload")
+
+        results = []
+        try:
+            for upload in uploads:
+                results.append(await self._store(upload))
+        finally:
+            for upload in uploads[len(results):]:
+                _remove(upload.path)
+        return results
+
+    async def _store(self, upload: _Upload) -> AttachmentInfo:
+        content_type = sniff_content_type(upload.head, upload.filename, upload.declared_type)
+        if content_type not in SUPPORTED_TYPES:
+            raise AttachmentError(f"{upload.filename}: unsupported file type {content_type}", 415)
+        attachment_id = upload.digest.hexdigest()
+        blob = self._path(attachment_id)
+        deduplicated = os.path.exists(blob)
+        if deduplicated:
+            _remove(upload.path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(upload.path, blob)
+        document = await self.document(attachment_id, _Document(attachment_id, upload.filename, content_type, upload.size))
+        return document.info(upload.filename, deduplicated)
+
+    def _remember(self, document: _Document) -> _Document:
+        self._cache[document.id] = document
+        self._cache.move_to_end(document.id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return document
+
+    def _load(self, attachment_id: str) -> Optional[_Document]:
+        """Previously extracted text from disk (runs on a thread)"""
+        try:
+            with open(self._path(attachment_id, ".json")) as f:
+                meta = json.load(f)
+            with open(self._path(attachment_id, ".txt"), encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, ValueError):
+            return None
+        return _Document(attachment_id, meta["filename"], meta["content_type"], meta["size_bytes"],
+                         text, meta.get("metadata"), meta.get("error"), meta.get("retry", False))
+
+    def _save(self, document: _Document) -> None:
+        """Persist extracted text for other workers and restarts (runs on a thread)"""
+        for suffix, content in ((".txt", document.text), (".json", json.dumps(document.to_dict()))):
+            path = self._path(document.id, suffix)
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(temp, path)
+
+    async def document(self, attachment_id: str, new: Optional[_Document] = None) -> Optional[_Document]:
+        """Extracted text for an attachment: memory, then disk, then a single shared extraction"""
+        if not _ID_RE.fullmatch(attachment_id):
+            return None
+        document = self._cache.get(attachment_id)
+        if document is not None:
+            self._cache.move_to_end(attachment_id)
+            return document
+        pending = self._extracting.get(attachment_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        loop = asyncio.get_running_loop()
+        future = self._extracting[attachment_id] = loop.create_future()
+        try:
+            document = await loop.run_in_executor(None, self._load, attachment_id)
+            if document is not None and document.retry:
+                # Only the metadata of a transient failure was saved; try the extraction again
+                new, document = new or document, None
+            if document is None and new is not None:
+                document = await self._extract(new)
+                # Parse failures are kept too, so a bad file is not parsed again on every request. Transient
+                # failures are saved (so other workers know the file) but flagged for retry, and not cached
+                await loop.run_in_executor(None, self._save, document)
+            if document is not None and not document.retry:
+                self._remember(document)
+            future.set_result(document)
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieve it so a failure nobody else was waiting for is not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._extracting[attachment_id]
+        return document
+
+    async def _extract(self, document: _Document) -> _Document:
+        """Run the extractor in the pool; `document.retry` marks failures that may succeed on retry"""
+        document.error, document.retry = None, False
+        async with self.slots:
+            pool = self.pool
+            try:
+                work = pool.submit(extract_text, self._path(document.id), document.content_type, self.max_chars)
+                document.text, document.metadata = await asyncio.wait_for(asyncio.wrap_future(work), self.extract_timeout)
+            except asyncio.TimeoutError:
+                document.error = f"extraction timed out after {self.extract_timeout:.0f}s"
+                document.retry = True
+                # The pool task cannot be cancelled and would keep its worker busy; replace the pool
+                self._recycle_pool(pool)
+            except BrokenProcessPool:
+                # A parser crashed its worker; start a fresh pool for the next upload
+                document.error = "extraction worker crashed"
+                document.retry = True
+                self._recycle_pool(pool)
+            except ImportError as e:
+                # Parser library missing on this host; installing it should make a retry succeed
+                document.error = f"{type(e).__name__}: {e}"[:300]
+                document.retry = True
+            except Exception as e:
+                document.error = f"{type(e).__name__}: {e}"[:300]
+        if document.error:
+            logger.warning("Could not extract text from %s (%s): %s", document.filename, document.id[:12], document.error)
+        return document
+
+    def _recycle_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Drop `pool` without waiting and kill its processes; the next extraction starts a new one"""
+        if self._pool is not pool:
+            return  # already replaced by a concurrent failure
+        self._pool = None
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    async def context_for(self, attachment_ids: Sequence[str], question: str, budget_tokens: int,
+                          model: Optional[str] = None) -> str:
+        """Excerpts of the attachments most relevant to `question`, within `budget_tokens` in total"""
+        documents = []
+        for attachment_id in dict.fromkeys(attachment_ids):
+            document = await self.document(attachment_id)
+            if document is None:
+                raise AttachmentError(f"Unknown attachment: {attachment_id}", 404)
+            if document.text:
+                documents.append(document)
+        terms = {t for t in _WORD_RE.findall(question.lower()) if t not in _STOPWORDS}
+        loop = asyncio.get_running_loop()
+        sections = []
+        remaining = budget_tokens
+        for position, document in enumerate(documents):
+            # Split what is left evenly, so budget a short document does not need goes to the next one
+            share = remaining // (len(documents) - position)
+            # Chunking and token counting cover up to ATTACHMENT_MAX_CHARS; keep them off the event loop
+            excerpt, used = await loop.run_in_executor(None, self._excerpt, document, terms, share, model)
+            remaining -= used
+            if excerpt:
+                sections.append(f"[Attachment: {document.filename}]\n{excerpt}")
+        return "\n\n".join(sections)
+
+    @staticmethod
+    def _excerpt(document: _Document, terms: set, budget: int, model: Optional[str]):
+        chunks, counts = document.chunks, document.token_counts(model)
+        if sum(counts) <= budget:
+            return "\n\n".join(chunks), sum(counts)
+        # Chunks sharing the most question terms first; the opening chunk breaks ties
+        ranked = sorted(range(len(chunks)), key=lambda i: (-sum(t in chunks[i].lower() for t in terms), i))
+        chosen, used = [], 0
+        for index in ranked:
+            if used + counts[index] <= budget:
+                chosen.append(index)
+                used += counts[index]
+        if not chosen and ranked and budget > 0:
+            # Every chunk is larger than the share: the best one cut to fit beats no context at all
+            best = ranked[0]
+            text = _truncate(chunks[best], counts[best], budget, model)
+            return text, token_counter.count(text, model) if text else 0
+        chosen.sort()
+        parts = []
+        for previous, index in zip([None] + chosen, chosen):
+            if previous is not None and index != previous + 1:
+                parts.append("...")
+            parts.append(chunks[index])
+        return "\n\n".join(parts), used
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+
+
+def _truncate(text: str, tokens: int, budget: int, model: Optional[str]) -> str:
+    """Leading part of `text` (cut at a word boundary) that fits `budget` tokens; `tokens` is the full count"""
+    end = len(text) * budget // max(tokens, 1)
+    while end > 0:
+        cut = text[:end]
+        if end < len(text) and " " in cut:
+            cut = cut[:cut.rindex(" ")]
+        cut = cut.rstrip()
+        if token_counter.count(cut, model) <= budget:
+            return cut
+        end = int(end * 0.9)
+    return ""
+
+
+def _write_batch(batch) -> None:
+    for upload, data in batch:
+        upload.digest.update(data)
+        upload.file.write(data)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+# Per-worker store; files and extracted text on disk are shared by every worker using ATTACHMENT_DIR
+attachment_store = AttachmentStore(
+    config.ATTACHMENT_DIR,
+    max_bytes=config.ATTACHMENT_MAX_BYTES,
+    max_files=config.ATTACHMENT_MAX_FILES,
+    workers=config.ATTACHMENT_WORKERS,
+    max_chars=config.ATTACHMENT_MAX_CHARS,
+    cache_size=config.ATTACHMENT_CACHE_SIZE,
+    extract_timeout=config.ATTACHMENT_EXTRACT_TIMEOUT
+)
@@ -0,0 +1,242 @@
+"""Bearer token verification with a cache of verified claims.
+
+Tokens are HS256 JWTs by default. Signing keys are identified by the `kid`
+header so they can be rotated: add the new key, switch the active key used
+for issuing, and drop the old one once its tokens have expired. Keys come
+from JWT_SECRET (kid "default"), JWT_KEYS ("kid=secret,...") and
+JWT_KEYS_FILE (a JSON object of kid -> key, re-read when it changes).
+
+Issue a token for testing or service accounts from the backend directory:
+
+    python -m services.auth --user alice --tenant acme --expires 3600
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from jose import ExpiredSignatureError, JWTError, jwt
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECRET = "neuralnexus_secret_key"
+
+
+class AuthError(ValueError):
+    """Token rejected; the message is safe to return to the client"""
+
+    status_code = 401
+
+
+class Principal(NamedTuple):
+    user_id: str
+    tenant_id: Optional[str]
+    expires_at: float
+    kid: Optional[str]
+    claims: Dict[str, Any]
+
+
+def parse_keys(spec: str) -> Dict[str, str]:
+    """Parse "kid=secret,kid2=secret2" (secrets may not contain commas)"""
+    keys = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kid, sep, secret = item.partition("=")
+        if not sep or not kid or not secret:
+            raise ValueError(f"Invalid JWT_KEYS entry: {kid or item!r}")
+        keys[kid.strip()] = secret.strip()
+    return keys
+
+
+class TokenVerifier:
+    """Verify bearer tokens, caching the claims of valid ones until they expire.
+
+    The cache is keyed by the SHA-256 of the token, so raw tokens are never
+    held in memory, and bounded to `cache_size` entries in LRU order. A hit
+    costs one hash and a dict lookup instead of a signature check. Entries
+    signed with a key that is later removed are dropped on the next reload.
+    """
+
+    def __init__(self, keys: Dict[str, str], active_kid: Optional[str] = None, algorithms: List[str] = None,
+                 issuer: Optional[str] = None, audience: Optional[str] = None, tenant_claim: str = "tenant_id",
+                 leeway: int = 30, cache_size: int = 10000, keys_file: Optional[str] = None, reload_interval: float = 30.0):
+        self.algorithms = algorithms or ["HS256"]
+        self.issuer = issuer
+        self.audience = audience
+        self.tenant_claim = tenant_claim
+        self.leeway = leeway
+        self.cache_size = cache_size
+        self.keys_file = keys_file
+        self.reload_interval = reload_interval
+        self._static_keys = dict(keys)
+        self._keys = dict(keys)
+        self.active_kid = active_kid
+        self._cache: "OrderedDict[bytes, Principal]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._file_mtime = None
+        self._next_reload = 0.0
+        self.stats = {"hits": 0, "misses": 0, "rejected": 0, "evictions": 0, "key_reloads": 0}
+        self._reload_keys()
+
+    @property
+    def key_ids(self) -> List[str]:
+        return sorted(self._keys)
+
+    def set_keys(self, keys: Dict[str, str], active_kid: Optional[str] = None) -> None:
+        """Replace the signing keys; cached tokens signed by a removed key are forgotten"""
+        with self._lock:
+            removed = {kid for kid in self._keys if kid not in keys or keys[kid] != self._keys[kid]}
+            self._keys = dict(keys)
+            if active_kid is not None:
+                self.active_kid = active_kid
+            if removed:
+                stale = [digest for digest, principal in self._cache.items() if principal.kid in removed]
+                for digest in stale:
+                    del self._cache[digest]
+                logger.info("Signing keys rotated: removed %s, dropped %d cached tokens", sorted(removed), len(stale))
+
+    def _reload_keys(self) -> None:
+        self._next_reload = time.monotonic() + self.reload_interval
+        if not self.keys_file:
+            return
+        try:
+            mtime = os.stat(self.keys_file).st_mtime_ns
+            if mtime == self._file_mtime:
+                return
+            with open(self.keys_file, "r", encoding="utf-8") as f:
+                file_keys = json.load(f)
+        except (OSError, ValueError) as e:
+            # Keep the previous keys: a half-written file must not lock everybody out
+            logger.error("Could not load JWT keys from %s: %s", self.keys_file, e)
+            return
+        self._file_mtime = mtime
+        self.stats["key_reloads"] += 1
+        self.set_keys({**self._static_keys, **{str(k): str(v) for k, v in file_keys.items()}})
+
+    def verify(self, token: str) -> Principal:
+        if time.monotonic() >= self._next_reload:
+            self._reload_keys()
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        principal = self._cache.get(digest)
+        if principal is not None:
+            if time.time() < principal.expires_at + self.leeway:
+                self.stats["hits"] += 1
+                with self._lock:
+                    if digest in self._cache:
+                        self._cache.move_to_end(digest)
+                return principal
+            with self._lock:
+                self._cache.pop(digest, None)
+        self.stats["misses"] += 1
+        try:
+            principal = self._decode(token)
+        except AuthError:
+            self.stats["rejected"] += 1
+            raise
+        with self._lock:
+            self._cache[digest] = principal
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.stats["evictions"] += 1
+        return principal
+
+    def _decode(self, token: str) -> Principal:
+        try:
+            header = jwt.get_unverified_header(token)
+        except JWTError:
+            raise AuthError("Malformed token")
+        kid = header.get("kid")
+        if kid is not None:
+            if kid not in self._keys:
+                raise AuthError("Token signed with an unknown key")
+            candidates = [(kid, self._keys[kid])]
+        else:
+            # Tokens issued before keys had ids: try the active key first
+            candidates = sorted(self._keys.items(), key=lambda item: item[0] != self.active_kid)
+        options = {"require_exp": True, "require_sub": True, "leeway": self.leeway, "verify_aud": self.audience is not None}
+        for candidate_kid, key in candidates:
+            try:
+                claims = jwt.decode(token, key, algorithms=self.algorithms, audience=self.audience, issuer=self.issuer,
+                                    options=options)
+            except ExpiredSignatureError:
+                raise AuthError("Token expired")
+            except JWTError as e:
+                if "signature" in str(e).lower() and len(candidates) > 1:
+                    continue
+                raise AuthError(f"Invalid token: {e}")
+            return Principal(
+                user_id=str(claims["sub"]),
+                tenant_id=claims.get(self.tenant_claim),
+                expires_at=float(claims["exp"]),
+                kid=candidate_kid,
+                claims=claims
+            )
+        raise AuthError("Invalid token: signature verification failed")
+
+    def issue(self, user_id: str, tenant_id: Optional[str] = None, expires_in: int = 3600, **claims) -> str:
+        """Sign a token with the active key"""
+        if self.active_kid not in self._keys:
+            raise ValueError(f"Active signing key {self.active_kid!r} is not configured")
+        now = int(time.time())
+        payload = {"sub": user_id, "iat": now, "exp": now + expires_in, **claims}
+        if tenant_id is not None:
+            payload[self.tenant_claim] = tenant_id
+        if self.issuer:
+            payload["iss"] = self.issuer
+        if self.audience:
+            payload["aud"] = self.audience
+        return jwt.encode(payload, self._keys[self.active_kid], algorithm=self.algorithms[0],
+                          headers={"kid": self.active_kid})
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "cached_tokens": len(self._cache),
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            "active_kid": self.active_kid,
+            "key_ids": self.key_ids,
+            **self.stats
+        }
+
+
+def _configured_keys() -> Dict[str, str]:
+    keys = {"default": config.JWT_SECRET} if config.JWT_SECRET else {}
+    keys.update(parse_keys(config.JWT_KEYS))
+    return keys
+
+
+# Per-worker verifier
+token_verifier = TokenVerifier(
+    _configured_keys(),
+    active_kid=config.JWT_ACTIVE_KID,
+    algorithms=config.JWT_ALGORITHMS,
+    issuer=config.JWT_ISSUER,
+    audience=config.JWT_AUDIENCE,
+    tenant_claim=config.JWT_TENANT_CLAIM,
+    leeway=config.JWT_LEEWAY,
+    cache_size=config.AUTH_CACHE_SIZE,
+    keys_file=config.JWT_KEYS_FILE
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", required=True, help="subject (user_id)")
+    parser.add_argument("--tenant", default=None)
+    parser.add_argument("--expires", type=int, default=3600, help="lifetime in seconds")
+    args = parser.parse_args()
+    print(token_verifier.issue(args.user, args.tenant, args.expires))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import asyncio
+import datetime
+import html
+import logging
+import re
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError, ExecutionTimeout
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Mongo $text syntax: "quoted phrases", -negated terms, bare terms
+_QUERY_TOKEN_RE = re.compile(r'-?"[^"]*"|\S+')
+_SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "ied", "es", "ed", "s")
+
+# Returned with each hit; query and response are needed for the highlights, the rest of the record is not
+_PROJECTION = {
+    "user_id": 1, "query": 1, "response": 1, "model": 1, "provider": 1, "timestamp": 1,
+    "tenant_id": 1, "session_id": 1, "tags": 1, "status": 1, "score": {"$meta": "textScore"}
+}
+
+
+def iso_utc(value: datetime.datetime) -> str:
+    """Format like stored timestamps, which are naive UTC (datetime.utcnow().isoformat())"""
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+
+def _stem(word: str) -> str:
+    """Crude suffix stripping, close enough to Mongo's stemmer to highlight the words it matched"""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def highlight_terms(search: str) -> List[str]:
+    """Stems of the positive terms and phrase words in a $text search string"""
+    stems = []
+    for token in _QUERY_TOKEN_RE.findall(search):
+        if token.startswith("-"):
+            continue
+        for word in _WORD_RE.findall(token.lower()):
+            stem = _stem(word)
+            if stem not in stems:
+                stems.append(stem)
+    return stems
+
+
+def snippet(text: str, stems: List[str], width: int = 200) -> str:
+    """HTML-escaped excerpt of about `width` characters around the densest run of matches, with <mark> tags"""
+    matches = [
+        (m.start(), m.end()) for m in _WORD_RE.finditer(text)
+        if any(m.group().lower().startswith(stem) if len(stem) >= 3 else m.group().lower() == stem for stem in stems)
+    ]
+    if not matches:
+        return html.escape(text[:width]) + ("…" if len(text) > width else "")
+
+    # Window starting at the match that has the most other matches within `width` characters
+    best, best_count, j = 0, 0, 0
+    for i, (start, _) in enumerate(matches):
+        while j < len(matches) and matches[j][1] <= start + width:
+            j += 1
+        if j - i > best_count:
+            best, best_count = i, j - i
+    start = max(0, matches[best][0] - width // 5)
+    if start > 0:
+        space = text.rfind(" ", 0, start)
+        start = space + 1 if space >= 0 and start - space < 20 else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.find(" ", end)
+        end = space if 0 <= space < end + 20 else end
+
+    parts = ["…"] if start > 0 else []
+    position = start
+    for match_start, match_end in matches:
+        if match_start < start or match_end > end:
+            continue
+        parts.append(html.escape(text[position:match_start]))
+        parts.append(f"<mark>{html.escape(text[match_start:match_end])}</mark>")
+        position = match_end
+    parts.append(html.escape(text[position:end]))
+    if end < len(text):
+        parts.append("…")
+    return "".join(parts)
+
+
+class ChatHistoryStore:
+    """Chat history records in MongoDB with full-text search.
+
+    `record` only appends to an in-memory buffer; a background task writes
+    the buffer with `insert_many` every `flush_interval` seconds (sooner once
+    `batch_size` records are waiting), so recording adds nothing to request
+    latency and records become searchable within one flush. Search runs on a
+    text index whose first key is `tenant_id`, so each query only scans one
+    tenant's postings; matches are ranked by text score, then recency.
+    """
+
+    def __init__(self, flush_interval: float = 2.0, batch_size: int = 500, max_pending: int = 20000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._database = None
+        self.dropped = 0
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Queue one ChatHistory record (as a dict) for the next flush"""
+        if len(self._pending) >= self.max_pending:
+            # Mongo has been unreachable for a while; keep the newest records
+            self._pending.popleft()
+            self.dropped += 1
+        entry.setdefault("tenant_id", None)
+        self._pending.append(entry)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Write buffered records; returns the number inserted"""
+        if not self._pending or self._database is None:
+            return 0
+        pending, self._pending = list(self._pending), deque()
+        try:
+            await self._database.chat_history.insert_many(pending, ordered=False)
+            return len(pending)
+        except BulkWriteError as e:
+            # Per-document errors (including duplicates from a retried batch) would fail again; drop those records
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                logger.warning("Chat history flush rejected %d records: %s", len(errors), errors[0].get("errmsg"))
+            return e.details.get("nInserted", 0)
+        except Exception as e:
+            # insert_many has set _id on each record, so any that did land are skipped as duplicates on retry
+            logger.warning("Chat history flush failed, keeping %d records for the next attempt: %s", len(pending), e)
+            self._pending.extendleft(reversed(pending[-self.max_pending:]))
+            while len(self._pending) > self.max_pending:
+                self._pending.popleft()
+                self.dropped += 1
+            return 0
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def ensure_indexes(self) -> None:
+        """Create the search and listing indexes (no-op when they already exist)"""
+        collection = self._database.chat_history
+        await collection.create_index(
+            [("tenant_id", 1), ("query", "text"), ("response", "text"), ("tags", "text")],
+            name="chat_history_search",
+            weights={"tags": 5, "query": 3, "response": 1},
+            default_language="english"
+        )
+        await collection.create_index(
+            [("tenant_id", 1), ("user_id", 1), ("timestamp", -1)], name="chat_history_recent"
+        )
+        # Exports walk one tenant's records in _id order so they can resume after the last id written
+        await collection.create_index([("tenant_id", 1), ("_id", 1)], name="chat_history_export")
+
+    @staticmethod
+    def _filter(tenant_id: Optional[str], user_id: Optional[str], model: Optional[str],
+                since: Optional[datetime.datetime], until: Optional[datetime.datetime]) -> Dict[str, Any]:
+        # The text index is prefixed by tenant_id, which therefore needs an equality match
+        query: Dict[str, Any] = {"tenant_id": tenant_id}
+        if user_id:
+            query["user_id"] = user_id
+        if model:
+            query["model"] = model
+        if since or until:
+            # Timestamps are stored as ISO-8601 strings, which sort chronologically
+            query["timestamp"] = {}
+            if since:
+                query["timestamp"]["$gte"] = iso_utc(since)
+            if until:
+                query["timestamp"]["$lt"] = iso_utc(until)
+        return query
+
+    async def search(self, text: str, tenant_id: Optional[str] = None, user_id: Optional[str] = None,
+                     model: Optional[str] = None, since: Optional[datetime.datetime] = None,
+                     until: Optional[datetime.datetime] = None, page: int = 1, page_size: int = 20,
+                     snippet_chars: int = 200) -> Dict[str, Any]:
+        """Ranked page of records matching `text` (Mongo $text syntax: "phrases" and -exclusions)"""
+        collection = self._database.chat_history
+        query = self._filter(tenant_id, user_id, model, since, until)
+        query["$text"] = {"$search": text}
+        skip = (page - 1) * page_size
+        cursor = (
+            collection.find(query, _PROJECTION)
+            .sort([("score", {"$meta": "textScore"}), ("timestamp", -1)])
+            .skip(skip)
+            .limit(page_size + 1)
+            .max_time_ms(config.HISTORY_SEARCH_TIMEOUT_MS)
+        )
+        # Counting every match of a common word is the slow part; cap it and let the page query run alongside
+        count = asyncio.ensure_future(collection.count_documents(
+            query, limit=skip + config.HISTORY_COUNT_LIMIT, maxTimeMS=config.HISTORY_SEARCH_TIMEOUT_MS
+        ))
+        try:
+            documents = await cursor.to_list(length=page_size + 1)
+        except BaseException:
+            count.cancel()
+            raise
+        has_more = len(documents) > page_size
+        documents = documents[:page_size]
+        try:
+            total = await count
+            estimated = total >= skip + config.HISTORY_COUNT_LIMIT
+        except ExecutionTimeout:
+            total, estimated = skip + len(documents), True
+        stems = highlight_terms(text)
+        hits = [self._hit(document, stems, snippet_chars) for document in documents]
+        return {
+            "query": text,
+            "page": page,
+            "page_size": page_size,
+            "total": total,
+            "total_is_estimate": estimated,
+            "has_more": has_more,
+            "results": hits
+        }
+
+    @staticmethod
+    def _hit(document: Dict[str, Any], stems: List[str], snippet_chars: int) -> Dict[str, Any]:
+        query, response = document.get("query", ""), document.get("response", "")
+        return {
+            "id": str(document["_id"]),
+            "user_id": document.get("user_id"),
+            "tenant_id": document.get("tenant_id"),
+            "session_id": document.get("session_id"),
+            "model": document.get("model"),
+            "provider": document.get("provider"),
+            "timestamp": document.get("timestamp"),
+            "status": document.get("status"),
+            "tags": document.get("tags") or [],
+            "score": round(document.get("score", 0.0), 4),
+            "query": query,
+            "query_highlight": snippet(query, stems, snippet_chars),
+            "response_highlight": snippet(response, stems, snippet_chars)
+        }
+
+    async def recent(self, tenant_id: Optional[str], user_id: str, page: int = 1,
+                     page_size: int = 20) -> Tuple[List[Dict[str, Any]], bool]:
+        """A user's newest records first; returns (records, has_more)"""
+        cursor = (
+            self._database.chat_history.find({"tenant_id": tenant_id, "user_id": user_id})
+            .sort("timestamp", -1)
+            .skip((page - 1) * page_size)
+            .limit(page_size + 1)
+            .max_time_ms(config.HISTORY_SEARCH_TIMEOUT_MS)
+        )
+        documents = await cursor.to_list(length=page_size + 1)
+        for document in documents:
+            document["id"] = str(document.pop("_id"))
+        return documents[:page_size], len(documents) > page_size
+
+    def start(self, database) -> None:
+        self._database = database
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# Per-worker write buffer
+chat_history = ChatHistoryStore(config.HISTORY_FLUSH_INTERVAL, config.HISTORY_BATCH_SIZE)
@@ -0,0 +1,142 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from models import (
+    ComparisonResult, ComparisonTarget, ModelArchitecture, ModelComparison, ModelInfo, ModelType
+)
+from services.llm import stream_answer
+from services.providers import ChatResult, ProviderError, default_model_for
+
+logger = logging.getLogger(__name__)
+
+# Queued as (_FINISHED, index) by a model's task when it has finished (successfully or not)
+_FINISHED = object()
+
+
+async def _run_model(index: int, target: ComparisonTarget, question: str, params: Dict[str, Any],
+                     started: float, queue: asyncio.Queue, result: ComparisonResult) -> None:
+    deltas = []
+    first_token = None
+    try:
+        async for item in stream_answer(question, provider=target.provider, model_name=target.model_name,
+                                        api_key=target.api_key, pinned=True, use_facts=False, **params):
+            if isinstance(item, ChatResult):
+                result.model = item.model
+                result.completion_tokens = item.completion_tokens
+                result.cost_usd = round(item.cost, 6)
+                continue
+            if first_token is None:
+                first_token = time.perf_counter()
+                result.ttft_ms = round((first_token - started) * 1000, 1)
+            deltas.append(item)
+            await queue.put({"index": index, "model": result.model, "delta": item})
+    except ProviderError as e:
+        logger.warning("Comparison model %s/%s failed: %s", target.provider.value, result.model, e)
+        result.error = str(e)
+    except Exception as e:
+        logger.exception("Comparison model %s/%s crashed", target.provider.value, result.model)
+        result.error = f"Unexpected error: {e}"
+    finally:
+        finished = time.perf_counter()
+        result.response = "".join(deltas).strip()
+        result.output_chars = len(result.response)
+        result.duration_ms = round((finished - started) * 1000, 1)
+        if first_token is not None and result.completion_tokens and finished > first_token:
+            result.tokens_per_second = round(result.completion_tokens / (finished - first_token), 2)
+        await queue.put((_FINISHED, index))
+
+
+def _model_info(result: ComparisonResult) -> ModelInfo:
+    return ModelInfo(name=result.model, provider=result.provider, type=ModelType.TEXT,
+                     architecture=ModelArchitecture.TRANSFORMER)
+
+
+def _ratio(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return round(a / b, 3) if a and b else None
+
+
+def compare(baseline: ComparisonResult, other: ComparisonResult) -> ModelComparison:
+    """Pairwise metrics (`_a` = baseline, `_b` = other) and plain-language recommendations"""
+    metrics = {}
+    for name in ("ttft_ms", "duration_ms", "tokens_per_second", "completion_tokens", "output_chars", "cost_usd"):
+        for suffix, result in (("a", baseline), ("b", other)):
+            value = getattr(result, name)
+            if value is not None:
+                metrics[f"{name}_{suffix}"] = float(value)
+    ratios = {
+        # > 1 means the other model is better (faster / cheaper)
+        "ttft_speedup": _ratio(baseline.ttft_ms, other.ttft_ms),
+        "throughput_ratio": _ratio(other.tokens_per_second, baseline.tokens_per_second),
+        "cost_ratio": _ratio(other.cost_usd, baseline.cost_usd),
+        "length_ratio": _ratio(other.output_chars, baseline.output_chars)
+    }
+    metrics.update({name: value for name, value in ratios.items() if value is not None})
+
+    recommendations = []
+    both_ok = baseline.error is None and other.error is None
+    if not both_ok:
+        failed = [r.model for r in (baseline, other) if r.error is not None]
+        recommendations.append(f"{', '.join(failed)} failed; metrics are incomplete")
+    else:
+        if ratios["ttft_speedup"] and abs(ratios["ttft_speedup"] - 1) >= 0.2:
+            faster, factor = (other, ratios["ttft_speedup"]) if ratios["ttft_speedup"] > 1 else (baseline, 1 / ratios["ttft_speedup"])
+            recommendations.append(f"{faster.model} starts answering {factor:.1f}x sooner")
+        if ratios["throughput_ratio"] and abs(ratios["throughput_ratio"] - 1) >= 0.2:
+            faster, factor = (other, ratios["throughput_ratio"]) if ratios["throughput_ratio"] > 1 else (baseline, 1 / ratios["throughput_ratio"])
+            recommendations.append(f"{faster.model} generates {factor:.1f}x more tokens per second")
+        if baseline.cost_usd != other.cost_usd:
+            cheaper = min((baseline, other), key=lambda r: r.cost_usd)
+            recommendations.append(f"{cheaper.model} was cheaper for this question (${cheaper.cost_usd:.6f})")
+    return ModelComparison(
+        model_a=_model_info(baseline),
+        model_b=_model_info(other),
+        metrics=metrics,
+        recommendations=recommendations,
+        # A single question is one sample; only say how complete the measurement is
+        confidence=1.0 if both_ok else 0.0,
+        baseline=f"{baseline.provider.value}/{baseline.model}",
+        comparison_date=datetime.datetime.utcnow().isoformat()
+    )
+
+
+async def run_comparison(question: str, targets: List[ComparisonTarget], **params) -> AsyncIterator[Dict[str, Any]]:
+    """Stream every model concurrently, yielding deltas as they arrive from whichever model produced them.
+
+    Yields `{"index", "model", "delta"}` events, `{"index", "model", "done",
+    "result"}` as each model finishes, then one `{"results", "comparisons",
+    "wall_time_ms"}` summary once the slowest model has finished. Closing the
+    generator early (client disconnect) cancels the models still running.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    started = time.perf_counter()
+    results = [
+        ComparisonResult(index=index, model=target.model_name or default_model_for(target.provider), provider=target.provider)
+        for index, target in enumerate(targets)
+    ]
+    tasks = [
+        asyncio.ensure_future(_run_model(index, target, question, params, started, queue, results[index]))
+        for index, target in enumerate(targets)
+    ]
+    try:
+        pending = len(tasks)
+        while pending:
+            event = await queue.get()
+            if isinstance(event, tuple):
+                pending -= 1
+                result = results[event[1]]
+                yield {"index": result.index, "model": result.model, "done": True,
+                       "result": result.model_dump(mode="json", exclude={"response"})}
+                continue
+            yield event
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    yield {
+        "results": results,
+        "comparisons": [compare(results[0], other) for other in results[1:]],
+        "wall_time_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
@@ -0,0 +1,366 @@
+import asyncio
+import csv
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set
+
+from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from config import config
+from models import ModelEvaluationRequest, ModelEvaluationResult
+from services.llm import generate_answer
+from services.providers import ProviderError, default_model_for
+from utils.eval_metrics import SCORERS, score_batch
+
+logger = logging.getLogger(__name__)
+
+_LETTERS = "ABCDEFGHIJ"
+
+
+class EvaluationError(ValueError):
+    """Rejected evaluation request; the message is safe to return to the client"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class EvalItem(NamedTuple):
+    id: str
+    prompt: str
+    reference: str
+    choice: bool = False  # reference is an option letter
+
+
+def _item_from_record(record: Dict[str, Any], position: int) -> EvalItem:
+    """Accept {prompt|question|input, reference|answer|target|output}, with optional multiple-choice `choices`"""
+    prompt = record.get("prompt") or record.get("question") or record.get("input")
+    reference = next((record[k] for k in ("reference", "answer", "target", "output") if record.get(k) is not None), None)
+    if not prompt or reference is None:
+        raise EvaluationError(f"Dataset row {position} needs a prompt and a reference")
+    choices = record.get("choices")
+    if isinstance(choices, str):
+        choices = json.loads(choices)
+    if choices:
+        # MMLU-style rows: the answer is a choice index or letter, scored as the letter
+        prompt = "\n".join([prompt] + [f"{_LETTERS[i]}) {choice}" for i, choice in enumerate(choices)])
+        prompt += "\nAnswer with the letter of the correct option only."
+        if isinstance(reference, int) or str(reference).isdigit():
+            reference = _LETTERS[int(reference)]
+    return EvalItem(str(record.get("id", position)), str(prompt), str(reference), bool(choices))
+
+
+def iter_dataset(path: str) -> Iterator[EvalItem]:
+    """Read a JSONL or CSV dataset one row at a time"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            for position, record in enumerate(csv.DictReader(f)):
+                yield _item_from_record(record, position)
+            return
+        for position, line in enumerate(f):
+            if line.strip():
+                yield _item_from_record(json.loads(line), position)
+
+
+def resolve_dataset(dataset: str, dataset_dir: str) -> str:
+    """Dataset file under `dataset_dir`, by name ("capitals") or relative path; nothing outside it is readable"""
+    root = os.path.realpath(dataset_dir)
+    for extension in ("", ".jsonl", ".csv"):
+        path = os.path.realpath(os.path.join(root, dataset + extension))
+        if os.path.commonpath([root, path]) != root:
+            raise EvaluationError(f"Dataset {dataset!r} must be in {dataset_dir}")
+        if os.path.isfile(path):
+            return path
+    raise EvaluationError(f"Unknown dataset {dataset!r}: not in {dataset_dir} as .jsonl or .csv", 404)
+
+
+def generation_key(provider: str, model: str, prompt: str, params: Dict[str, Any]) -> str:
+    """Cache key for one generation: model, prompt hash and every parameter that changes the output"""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    payload = json.dumps([provider, model, prompt_hash, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+class EvaluationRunner:
+    """Run ModelEvaluationRequests against a JSONL/CSV dataset.
+
+    The dataset is read in batches. Each batch looks up its generations in
+    `eval_generations` with one query, generates only the misses (at most
+    `concurrency` provider calls in flight), then hands the texts to a
+    process pool for scoring while the next batch generates. Re-running an
+    evaluation after editing a prompt therefore only regenerates the items
+    whose prompt or parameters changed. Per-item scores are stored with the
+    run so later runs can be diffed against it as their `baseline`.
+    """
+
+    def __init__(self, dataset_dir: str = "eval_datasets", concurrency: int = 8, batch_size: int = 64,
+                 workers: int = 2, regression_threshold: float = 0.1):
+        self.dataset_dir = dataset_dir
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.workers = workers
+        self.regression_threshold = regression_threshold
+        self.jobs: Dict[str, ModelEvaluationResult] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._database = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def start(self, database) -> None:
+        self._database = database
+
+    async def ensure_indexes(self) -> None:
+        await self._database.eval_items.create_index([("run_id", 1), ("item_id", 1)], name="eval_items_run")
+        await self._database.eval_runs.create_index(
+            [("model_name", 1), ("dataset", 1), ("timestamp", DESCENDING)], name="eval_runs_latest"
+        )
+
+    async def submit(self, request: ModelEvaluationRequest) -> ModelEvaluationResult:
+        existing = self.jobs.get(request.request_id)
+        if existing is not None and existing.status in ("queued", "running"):
+            return existing
+        if self._database is None:
+            raise EvaluationError("Evaluation needs the database", 503)
+        path = resolve_dataset(request.dataset, self.dataset_dir)
+        unknown = set(request.parameters.get("scorers", SCORERS)) - set(SCORERS)
+        if unknown:
+            raise EvaluationError(f"Unknown scorers: {sorted(unknown)}; available: {list(SCORERS)}")
+        if request.parameters.get("primary_metric", "overlap_f1") not in request.parameters.get("scorers", SCORERS):
+            raise EvaluationError("primary_metric must be one of the scorers")
+        try:
+            (request.parameters.get("prompt_template") or "{prompt}").format(prompt="")
+        except (KeyError, IndexError, ValueError):
+            raise EvaluationError("prompt_template may only use the {prompt} placeholder")
+        job = self.jobs[request.request_id] = ModelEvaluationResult(
+            model_name=request.model_name or default_model_for(request.provider),
+            provider=request.provider,
+            evaluation_type=request.evaluation_type,
+            score=0.0,
+            status="queued",
+            request_id=request.request_id,
+            timestamp=datetime.datetime.utcnow().isoformat()
+        )
+        task = asyncio.ensure_future(self._run(job, request, path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def status(self, request_id: str) -> Optional[ModelEvaluationResult]:
+        return self.jobs.get(request_id)
+
+    async def _run(self, job: ModelEvaluationResult, request: ModelEvaluationRequest, path: str) -> None:
+        started = time.perf_counter()
+        job.status = "running"
+        parameters = request.parameters
+        scorers = list(parameters.get("scorers", SCORERS))
+        primary = parameters.get("primary_metric", "overlap_f1")
+        gen_params = {
+            "temperature": float(parameters.get("temperature", 0.0)),
+            "max_tokens": parameters.get("max_tokens"),
+            "system_prompt": parameters.get("system_prompt"),
+            # Always ask the model: a travel fact store answer would be scored (and cached) as the model's
+            "use_facts": False,
+        }
+        template = parameters.get("prompt_template") or "{prompt}"
+        limit = parameters.get("limit")
+        semaphore = asyncio.Semaphore(int(parameters.get("concurrency", self.concurrency)))
+        loop = asyncio.get_running_loop()
+        totals = {name: 0.0 for name in scorers}
+        stats = {"items": 0, "cached": 0, "generated": 0, "failed": 0, "cost_usd": 0.0, "cost_incurred_usd": 0.0,
+                 "completion_tokens": 0}
+        latencies, throughputs = [], []
+        scoring: List[asyncio.Future] = []
+
+        async def generate(item: EvalItem, prompt: str, key: str) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                began = time.perf_counter()
+                try:
+                    result = await generate_answer(prompt, provider=request.provider, model_name=job.model_name,
+                                                   pinned=True, **gen_params)
+                except ProviderError as e:
+                    job.logs.append(f"{item.id}: {e}")
+                    return None
+            elapsed = time.perf_counter() - began
+            return {
+                "_id": key, "model": result.model, "provider": request.provider.value, "text": result.text,
+                "latency_ms": round(elapsed * 1000, 1), "completion_tokens": result.completion_tokens,
+                "cost_usd": round(result.cost, 6), "created_at": datetime.datetime.utcnow().isoformat()
+            }
+
+        async def score(batch: List[EvalItem], keys: List[str], texts: List[Optional[str]]) -> None:
+            scores = await loop.run_in_executor(self.pool, score_batch, texts, [item.reference for item in batch], scorers,
+                                                [item.choice for item in batch])
+            rows = []
+            for i, item in enumerate(batch):
+                item_scores = {name: scores[name][i] for name in scorers}
+                for name in scorers:
+                    totals[name] += item_scores[name]
+                rows.append({"run_id": job.request_id, "item_id": item.id, "key": keys[i], "scores": item_scores})
+            await self._database.eval_items.insert_many(rows, ordered=False)
+
+        try:
+            reader = itertools.islice(iter_dataset(path), limit)
+            while True:
+                # The dataset is read off the event loop, one batch at a time
+                batch = await loop.run_in_executor(None, lambda: list(itertools.islice(reader, self.batch_size)))
+                if not batch:
+                    break
+                prompts = [template.format(prompt=item.prompt) for item in batch]
+                keys = [generation_key(request.provider.value, job.model_name, p, gen_params) for p in prompts]
+                cached = {doc["_id"]: doc async for doc in self._database.eval_generations.find({"_id": {"$in": keys}})}
+                # Items sharing a prompt within the batch share one generation
+                misses = {key: i for i, key in reversed(list(enumerate(keys))) if key not in cached}
+                fresh = await asyncio.gather(*(generate(batch[i], prompts[i], key) for key, i in misses.items()))
+                new_docs = [doc for doc in fresh if doc is not None]
+                if new_docs:
+                    try:
+                        await self._database.eval_generations.insert_many(new_docs, ordered=False)
+                    except BulkWriteError:
+                        pass  # another run cached the same generation first
+                    cached.update((doc["_id"], doc) for doc in new_docs)
+                    stats["cost_incurred_usd"] += sum(doc["cost_usd"] for doc in new_docs)
+
+                texts = []
+                for key in keys:
+                    doc = cached.get(key)
+                    if doc is None:
+                        stats["failed"] += 1
+                        texts.append(None)
+                        continue
+                    texts.append(doc["text"])
+                    latencies.append(doc["latency_ms"])
+                    if doc["completion_tokens"] and doc["latency_ms"]:
+                        throughputs.append(doc["completion_tokens"] / (doc["latency_ms"] / 1000))
+                    stats["cost_usd"] += doc["cost_usd"]
+                    stats["completion_tokens"] += doc["completion_tokens"]
+                stats["items"] += len(batch)
+                stats["generated"] += len(new_docs)
+                stats["cached"] += sum(key not in misses for key in keys)
+                scoring.append(asyncio.ensure_future(score(batch, keys, texts)))
+                # Keep generation at most a couple of batches ahead of scoring
+                pending = [f for f in scoring if not f.done()]
+                if len(pending) > self.workers * 2:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                job.details = dict(stats)
+            await asyncio.gather(*scoring)
+
+            count = stats["items"] or 1
+            job.metrics = {f"{name}": round(totals[name] / count, 4) for name in scorers}
+            job.metrics.update({
+                "latency_p50_ms": round(_percentile(latencies, 0.5), 1),
+                "latency_p95_ms": round(_percentile(latencies, 0.95), 1),
+                "tokens_per_second": round(sum(throughputs) / len(throughputs), 2) if throughputs else 0.0,
+                "cost_usd": round(stats["cost_usd"], 6),
+                "cost_incurred_usd": round(stats["cost_incurred_usd"], 6),
+                "error_rate": round(stats["failed"] / count, 4)
+            })
+            job.score = job.metrics.get(primary, 0.0)
+            job.details = {**stats, "dataset": path, "primary_metric": primary, "cache_hit_ratio": round(stats["cached"] / count, 4)}
+            if request.baseline:
+                job.report = await self._diff(job, request, primary, float(parameters.get("max_regression", 0.01)))
+            threshold = parameters.get("pass_threshold")
+            job.passed = (threshold is None or job.score >= float(threshold)) and not job.report.get("regressed", False)
+            job.status = "completed"
+            await self._database.eval_runs.insert_one({
+                "_id": job.request_id, "model_name": job.model_name, "provider": request.provider.value,
+                "dataset": request.dataset, "timestamp": job.timestamp, "score": job.score,
+                "metrics": job.metrics, "details": job.details, "parameters": parameters
+            })
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except (PyMongoError, OSError, ValueError, RuntimeError) as e:
+            logger.error("Evaluation %s failed: %s", job.request_id, e)
+            job.status = "failed"
+            job.logs.append(str(e))
+        finally:
+            for future in scoring:
+                future.cancel()
+            job.details["processing_time"] = round(time.perf_counter() - started, 3)
+            logger.info("Evaluation %s %s: %s=%.4f over %d items (%d cached)", job.request_id, job.status, primary,
+                        job.score, stats["items"], stats["cached"])
+
+    async def _find_baseline(self, baseline: str, dataset: str) -> Optional[Dict[str, Any]]:
+        """`baseline` is a run id, or a model name whose latest run on the same dataset is used"""
+        run = await self._database.eval_runs.find_one({"_id": baseline})
+        if run is None:
+            run = await self._database.eval_runs.find_one(
+                {"model_name": baseline, "dataset": dataset}, sort=[("timestamp", DESCENDING)]
+            )
+        return run
+
+    async def _diff(self, job: ModelEvaluationResult, request: ModelEvaluationRequest, primary: str,
+                    max_regression: float) -> Dict[str, Any]:
+        run = await self._find_baseline(request.baseline, request.dataset)
+        if run is None:
+            job.logs.append(f"Baseline {request.baseline!r} not found; no diff computed")
+            return {"baseline": request.baseline, "found": False}
+        base_scores = {
+            doc["item_id"]: (doc["scores"].get(primary), doc["key"])
+            async for doc in self._database.eval_items.find({"run_id": run["_id"]}, {"item_id": 1, "scores": 1, "key": 1})
+        }
+        improved, regressed, changed, compared = [], [], 0, 0
+        async for doc in self._database.eval_items.find({"run_id": job.request_id}, {"item_id": 1, "scores": 1, "key": 1}):
+            base = base_scores.get(doc["item_id"])
+            if base is None or base[0] is None:
+                continue
+            compared += 1
+            changed += doc["key"] != base[1]
+            delta = doc["scores"].get(primary, 0.0) - base[0]
+            if delta >= self.regression_threshold:
+                improved.append((delta, doc["item_id"]))
+            elif delta <= -self.regression_threshold:
+                regressed.append((delta, doc["item_id"]))
+        metric_deltas = {
+            name: round(value - run["metrics"][name], 4)
+            for name, value in job.metrics.items() if isinstance(run["metrics"].get(name), (int, float))
+        }
+        return {
+            "baseline": run["_id"],
+            "baseline_model": run["model_name"],
+            "found": True,
+            "metric_deltas": metric_deltas,
+            "items_compared": compared,
+            "items_regenerated": changed,
+            "improved": len(improved),
+            "regressed_items": len(regressed),
+            # Worst regressions first, so they can be inspected in eval_items
+            "top_regressions": [{"item_id": item, "delta": round(delta, 4)} for delta, item in sorted(regressed)[:20]],
+            "top_improvements": [{"item_id": item, "delta": round(delta, 4)} for delta, item in sorted(improved, reverse=True)[:20]],
+            "regressed": metric_deltas.get(primary, 0.0) < -max_regression
+        }
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+
+
+# Per-worker runner; generations are cached in MongoDB and shared by every worker
+evaluation_runner = EvaluationRunner(
+    dataset_dir=config.EVAL_DATASET_DIR,
+    concurrency=config.EVAL_CONCURRENCY,
+    batch_size=config.EVAL_BATCH_SIZE,
+    workers=config.EVAL_SCORING_WORKERS,
+    regression_threshold=config.EVAL_REGRESSION_THRESHOLD
+)
@@ -0,0 +1,423 @@
+"""Streaming exports of chat history and usage costs.
+
+Rows are read from a MongoDB cursor in `_id` order and encoded batch by
+batch, so memory stays flat whatever the export size. Every row carries its
+`id`; pass the last one received as `after` to resume an interrupted export.
+
+Command line (from the backend directory):
+
+    python -m services.export history --tenant acme --since 2025-01-01 -o acme.ndjson.gz --gzip
+    python -m services.export costs --format csv -o costs.csv
+    python -m services.export history --format parquet -o acme_history/
+
+The CLI writes a checkpoint next to the output (`<output>.checkpoint`) and
+picks up from it when run again with the same arguments. Parquet output is a
+directory of part files, one per `--rows-per-file` rows.
+"""
+import asyncio
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import zlib
+from typing import Any, AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from config import config
+from services.chat_history import iso_utc
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("ndjson", "csv", "parquet")
+
+
+class ExportError(ValueError):
+    """Bad export parameters, or a format whose dependencies are missing"""
+
+
+class Dataset(NamedTuple):
+    collection: str
+    time_field: str
+    columns: Tuple[Tuple[str, str], ...]  # (name, "str" | "int" | "float" | "list")
+    day_granularity: bool = False  # time_field holds "YYYY-MM-DD" rather than a full timestamp
+
+
+DATASETS = {
+    "history": Dataset("chat_history", "timestamp", (
+        ("id", "str"), ("tenant_id", "str"), ("user_id", "str"), ("session_id", "str"), ("timestamp", "str"),
+        ("model", "str"), ("provider", "str"), ("status", "str"), ("error", "str"), ("query", "str"),
+        ("response", "str"), ("tokens_used", "int"), ("duration", "float"), ("input_length", "int"),
+        ("output_length", "int"), ("feedback", "int"), ("tags", "list"), ("attachments", "list")
+    )),
+    "costs": Dataset("usage_costs", "day", (
+        ("id", "str"), ("tenant_id", "str"), ("day", "str"), ("provider", "str"), ("model", "str"),
+        ("requests", "int"), ("prompt_tokens", "int"), ("completion_tokens", "int"), ("cost", "float"),
+        ("updated_at", "str")
+    ), day_granularity=True),
+}
+
+
+def build_filter(dataset: Dataset, tenant_id: Optional[str], all_tenants: bool = False,
+                 since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+                 after: Optional[str] = None) -> Dict[str, Any]:
+    query: Dict[str, Any] = {} if all_tenants else {"tenant_id": tenant_id}
+    if since or until:
+        bounds = query[dataset.time_field] = {}
+        for operator, value in (("$gte", since), ("$lt", until)):
+            if value is not None:
+                bounds[operator] = iso_utc(value)[:10] if dataset.day_granularity else iso_utc(value)
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except (InvalidId, TypeError):
+            raise ExportError(f"Invalid resume id: {after}")
+    return query
+
+
+async def iter_rows(database, dataset: Dataset, query: Dict[str, Any],
+                    batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yield batches of flat rows in _id order; only one cursor batch is held at a time"""
+    cursor = database[dataset.collection].find(query).sort("_id", 1).batch_size(batch_size)
+    batch: List[Dict[str, Any]] = []
+    async for document in cursor:
+        row = {"id": str(document["_id"])}
+        for name, kind in dataset.columns[1:]:
+            value = document.get(name)
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            elif kind == "list":
+                value = list(value or [])
+            row[name] = value
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class NDJSONEncoder:
+    media_type = "application/x-ndjson"
+    extension = ".ndjson"
+
+    def __init__(self, dataset: Dataset, **_):
+        self.dataset = dataset
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class CSVEncoder:
+    media_type = "text/csv"
+    extension = ".csv"
+
+    def __init__(self, dataset: Dataset, **_):
+        self.dataset = dataset
+        self.names = [name for name, _ in dataset.columns]
+        self.lists = {name for name, kind in dataset.columns if kind == "list"}
+
+    def header(self) -> bytes:
+        return self.encode_values([self.names])
+
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        return self.encode_values(
+            [";".join(map(str, row[name])) if name in self.lists else row[name] for name in self.names] for row in rows
+        )
+
+    @staticmethod
+    def encode_values(values: Iterable[List[Any]]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(values)
+        return buffer.getvalue().encode("utf-8")
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file object whose contents are handed off and released after every row group"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class ParquetEncoder:
+    """Row groups of at most `row_group_size` rows, built with pandas and written by pyarrow"""
+
+    media_type = "application/vnd.apache.parquet"
+    extension = ".parquet"
+
+    _TYPES = {"str": "string", "int": "int64", "float": "float64"}
+
+    def __init__(self, dataset: Dataset, row_group_size: int = 50000, compression: str = "snappy"):
+        pd, pa, pq = self.modules()
+        self._pd, self._pa = pd, pa
+        self.dataset = dataset
+        self.names = [name for name, _ in dataset.columns]
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([
+            (name, pa.list_(pa.string()) if kind == "list" else getattr(pa, self._TYPES[kind])())
+            for name, kind in dataset.columns
+        ])
+        self._pending: List[Dict[str, Any]] = []
+        self._sink = _DrainableSink()
+        self._writer = pq.ParquetWriter(self._sink, self.schema, compression=compression)
+
+    @staticmethod
+    def modules():
+        """pandas, pyarrow and pyarrow.parquet, or ExportError when they are not installed"""
+        try:
+            import pandas as pd
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ExportError("Parquet export requires pandas and pyarrow")
+        return pd, pa, pq
+
+    def header(self) -> bytes:
+        return self._sink.drain()
+
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        self._pending.extend(rows)
+        while len(self._pending) >= self.row_group_size:
+            self._write_group(self._pending[:self.row_group_size])
+            del self._pending[:self.row_group_size]
+        return self._sink.drain()
+
+    def _write_group(self, rows: List[Dict[str, Any]]) -> None:
+        frame = self._pd.DataFrame.from_records(rows, columns=self.names)
+        self._writer.write_table(self._pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+
+    def finish(self) -> bytes:
+        if self._pending:
+            self._write_group(self._pending)
+            self._pending = []
+        self._writer.close()
+        return self._sink.drain()
+
+
+ENCODERS = {"ndjson": NDJSONEncoder, "csv": CSVEncoder, "parquet": ParquetEncoder}
+
+
+def check_format(fmt: str):
+    """Encoder class for `fmt`, without creating one (a ParquetEncoder opens a writer)"""
+    if fmt not in ENCODERS:
+        raise ExportError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    if fmt == "parquet":
+        ParquetEncoder.modules()
+    return ENCODERS[fmt]
+
+
+def encoder_for(fmt: str, dataset: Dataset, compress: bool = False):
+    check_format(fmt)
+    if fmt == "parquet":
+        # Parquet pages are compressed internally; wrapping the file in gzip would make it unreadable
+        return ParquetEncoder(dataset, config.EXPORT_ROW_GROUP_SIZE, "gzip" if compress else "snappy")
+    return ENCODERS[fmt](dataset)
+
+
+async def stream_export(database, dataset: Dataset, query: Dict[str, Any], fmt: str,
+                        compress: bool = False) -> AsyncIterator[bytes]:
+    """Encoded (and optionally gzipped) chunks of an export, one per cursor batch.
+
+    Encoding and compression run in the default executor: a Parquet row group
+    or a large gzipped batch takes long enough to stall other requests.
+    """
+    encoder = encoder_for(fmt, dataset, compress)
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress and fmt != "parquet" else None
+    loop = asyncio.get_running_loop()
+
+    def emit(step, *args) -> bytes:
+        data = step(*args)
+        return gzip.compress(data) if gzip is not None and data else data
+
+    chunk = await loop.run_in_executor(None, emit, encoder.header)
+    if chunk:
+        yield chunk
+    rows = 0
+    async for batch in iter_rows(database, dataset, query, config.EXPORT_BATCH_SIZE):
+        rows += len(batch)
+        chunk = await loop.run_in_executor(None, emit, encoder.encode, batch)
+        if chunk:
+            yield chunk
+    tail = await loop.run_in_executor(None, emit, encoder.finish)
+    tail += gzip.flush() if gzip is not None else b""
+    if tail:
+        yield tail
+    logger.info("Exported %d %s rows as %s", rows, dataset.collection, fmt)
+
+
+def _load_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_checkpoint(path: str, state: Dict[str, Any]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+async def export_to_file(database, dataset: Dataset, output: str, fmt: str, compress: bool = False,
+                         tenant_id: Optional[str] = None, all_tenants: bool = False,
+                         since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+                         checkpoint_rows: int = 50000, rows_per_file: int = 1000000) -> int:
+    """Export to `output`, checkpointing every `checkpoint_rows` rows; returns the total rows written.
+
+    NDJSON/CSV checkpoints record the output size after a complete gzip
+    member (or plain line), so a resumed run truncates any partial tail and
+    appends. Parquet files only become readable once closed, so Parquet
+    output is a directory of part files and the checkpoint advances per part.
+    """
+    checkpoint_path = output.rstrip("/") + ".checkpoint"
+    state = _load_checkpoint(checkpoint_path)
+    if state.get("done"):
+        logger.info("%s is already complete; delete %s to export again", output, checkpoint_path)
+        return state["rows"]
+    after, rows = state.get("after"), state.get("rows", 0)
+    query = build_filter(dataset, tenant_id, all_tenants, since, until, after)
+    if after:
+        logger.info("Resuming export after %s (%d rows already written)", after, rows)
+
+    if fmt == "parquet":
+        os.makedirs(output, exist_ok=True)
+        part = state.get("part", 0)
+        encoder, f, part_rows, last_id = None, None, 0, after
+        async for batch in iter_rows(database, dataset, query, config.EXPORT_BATCH_SIZE):
+            if encoder is None:
+                encoder = encoder_for(fmt, dataset, compress)
+                f = open(os.path.join(output, f"part-{part:05d}.parquet.tmp"), "wb")
+                f.write(encoder.header())
+            f.write(encoder.encode(batch))
+            part_rows += len(batch)
+            last_id = batch[-1]["id"]
+            if part_rows >= rows_per_file:
+                rows, part = _close_part(encoder, f, output, part, rows + part_rows, last_id, checkpoint_path)
+                encoder, part_rows = None, 0
+        if encoder is not None:
+            rows, part = _close_part(encoder, f, output, part, rows + part_rows, last_id, checkpoint_path)
+        _save_checkpoint(checkpoint_path, {"after": last_id, "rows": rows, "part": part, "done": True})
+        return rows
+
+    offset = state.get("offset", 0)
+    mode = "r+b" if offset and os.path.exists(output) else "wb"
+    with open(output, mode) as f:
+        if mode == "r+b":
+            f.truncate(offset)
+            f.seek(offset)
+        encoder = encoder_for(fmt, dataset, compress)
+        gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+        def write(data: bytes) -> None:
+            if data:
+                f.write(gzip.compress(data) if gzip is not None else data)
+
+        if not offset:
+            write(encoder.header())
+        since_checkpoint = 0
+        async for batch in iter_rows(database, dataset, query, config.EXPORT_BATCH_SIZE):
+            write(encoder.encode(batch))
+            rows += len(batch)
+            since_checkpoint += len(batch)
+            if since_checkpoint >= checkpoint_rows:
+                if gzip is not None:
+                    # End the gzip member so the file is valid up to this offset; readers concatenate members
+                    f.write(gzip.flush())
+                    gzip = zlib.compressobj(6, zlib.DEFLATED, 31)
+                f.flush()
+                os.fsync(f.fileno())
+                _save_checkpoint(checkpoint_path, {"after": batch[-1]["id"], "rows": rows, "offset": f.tell()})
+                since_checkpoint = 0
+        write(encoder.finish())
+        if gzip is not None:
+            f.write(gzip.flush())
+    _save_checkpoint(checkpoint_path, {"rows": rows, "done": True})
+    return rows
+
+
+def _close_part(encoder: ParquetEncoder, f, output: str, part: int, rows: int, last_id: str,
+                      checkpoint_path: str) -> Tuple[int, int]:
+    f.write(encoder.finish())
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(f.name, f.name[:-len(".tmp")])
+    _save_checkpoint(checkpoint_path, {"after": last_id, "rows": rows, "part": part + 1})
+    return rows, part + 1
+
+
+async def _run_cli(args) -> int:
+    from database import db
+
+    db.initialize()
+    try:
+        return await export_to_file(
+            db.db, DATASETS[args.dataset], args.output, args.format, args.gzip, args.tenant, args.all_tenants,
+            args.since, args.until, args.checkpoint_rows, args.rows_per_file
+        )
+    finally:
+        db.close()
+
+
+def main():
+    import argparse
+
+    def date(value: str) -> datetime.datetime:
+        return datetime.datetime.fromisoformat(value)
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="gzip NDJSON/CSV output; gzip-compressed pages for Parquet")
+    tenants = parser.add_mutually_exclusive_group()
+    tenants.add_argument("--tenant", default=None, help="tenant id (omit for records without one)")
+    tenants.add_argument("--all-tenants", action="store_true")
+    parser.add_argument("--since", type=date, default=None, help="ISO date or datetime (UTC), inclusive")
+    parser.add_argument("--until", type=date, default=None, help="ISO date or datetime (UTC), exclusive")
+    parser.add_argument("--checkpoint-rows", type=int, default=50000)
+    parser.add_argument("--rows-per-file", type=int, default=1000000, help="Parquet rows per part file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        rows = asyncio.run(_run_cli(args))
+    except ExportError as e:
+        parser.error(str(e))
+    print(f"{rows} rows in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
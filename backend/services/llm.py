@@ -1,49 +1,327 @@
-from openai import OpenAI, OpenAIError
 from dotenv import load_dotenv
-import os
+import asyncio
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import time
+from typing import AsyncIterator, Collection, Dict, List, Optional, Union
+from config import config
+from models import ModelProvider
+from services.pacing import RateLimited, backoff_delay, pacers, retry_budget
+from services.providers import ChatResult, KeyedAdapterPool, ProviderAdapter, ProviderError, StreamItem, close_adapters, default_model_for, get_adapter, lease_adapter
+from services.provider_health import provider_health
+from services.travel_facts import travel_facts
+from utils.model_residency import residency
+from utils.prompt_engineering import PromptTemplates
+from utils.request_context import get_tenant_id
+from utils.response_policy import LengthDecision, response_policy
+from utils.token_accounting import cost_ledger, token_counter
+from utils.usage_stats import usage_stats
+from utils.tracing import span
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def default_provider(allowed: Optional[Collection[ModelProvider]] = None) -> ModelProvider:
+    """The default provider unless the prober has seen it go down; fallbacks are limited to `allowed`"""
+    fallbacks = [ModelProvider(p) for p in config.PROVIDER_FALLBACKS]
+    if allowed is not None:
+        fallbacks = [p for p in fallbacks if p in allowed]
+    return provider_health.choose(ModelProvider(config.DEFAULT_PROVIDER), fallbacks)
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    retry=retry_if_exception_type(OpenAIError)
-)
-def get_llm_response(question: str) -> str:
-    if not os.getenv("OPENAI_API_KEY"):
+def _resolve(provider: Optional[Union[ModelProvider, str]], model_name: Optional[str], pinned: bool):
+    if provider is None:
+        provider = default_provider()
+    provider = ModelProvider(provider)
+    model = model_name or default_model_for(provider)
+    if provider == ModelProvider.OLLAMA:
+        # Unpinned Ollama requests go to whichever suitable model is already loaded
+        model = residency.resolve(model, pinned=pinned and bool(model_name))
+    return provider, model
+
+def _build_messages(
+    question: str,
+    decision: LengthDecision,
+    system_prompt: Optional[str] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+    context: Optional[str] = None
+) -> List[Dict[str, str]]:
+    messages = [{"role": "system", "content": system_prompt or decision.system_prompt}]
+    messages.extend(history or [])
+    if context:
+        question = f"Use the reference material below where relevant.\n\n{context}\n\nQuestion: {question}"
+    messages.append({"role": "user", "content": question})
+    return messages
+
+def _continuation_messages(messages: List[Dict[str, str]], partial: str, system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
+    """Ask for the rest of a cut-off answer as a fresh turn.
+
+    Chat APIs treat a trailing assistant message as finished history, not a
+    prefill, so the model is asked explicitly to carry on. The short-answer
+    system prompt would pull it back to a brief reply, so it is swapped for
+    the detailed one unless the caller chose the prompt.
+    """
+    system = system_prompt or PromptTemplates.travel_detailed_prompt()
+    return [{"role": "system", "content": system}, *messages[1:],
+            {"role": "assistant", "content": partial},
+            {"role": "user", "content": PromptTemplates.continuation_prompt()}]
+
+def _estimate_tokens(adapter: ProviderAdapter, messages: List[Dict[str, str]], model: str, max_tokens: Optional[int]) -> int:
+    # Providers count max_tokens against the token rate limit up front
+    return adapter.count_tokens("\n".join(m["content"] for m in messages), model) + (max_tokens or 0)
+
+def _account(result: ChatResult, messages: List[Dict[str, str]], calibrate: bool = True) -> None:
+    """Fill in usage the provider did not report, learn from usage it did, and charge the tenant"""
+    if result.prompt_tokens:
+        if calibrate:
+            prompt_text = "\n".join(m["content"] for m in messages)
+            token_counter.calibrate(result.model, prompt_text, result.prompt_tokens - 4 * len(messages))
+    else:
+        result.prompt_tokens = token_counter.count_messages(messages, result.model)
+    if not result.completion_tokens and result.text:
+        result.completion_tokens = token_counter.count(result.text, result.model)
+    result.cost = cost_ledger.record(get_tenant_id(), result.provider.value, result.model,
+                                     result.prompt_tokens, result.completion_tokens)
+
+async def _retry_or_raise(error: ProviderError, attempt: int, model: str) -> None:
+    """Sleep before another attempt, or re-raise when the error is fatal or retries are exhausted"""
+    if not error.retryable or attempt >= config.RETRY_MAX_ATTEMPTS:
+        raise error
+    if not retry_budget.try_spend():
+        logger.warning("Retry budget exhausted; not retrying %s/%s", error.provider.value, model)
+        raise error
+    delay = backoff_delay(attempt, error.headers)
+    logger.warning("%s/%s failed (%s), retrying in %.2fs", error.provider.value, model, error.status_code or "network", delay)
+    await asyncio.sleep(delay)
+
+def _key_id(provider: ModelProvider, api_key: Optional[str]) -> Optional[str]:
+    """Fingerprint of a caller's own key, so its quota is paced apart from the shared key's"""
+    if not api_key or provider not in KeyedAdapterPool.BYOK_PROVIDERS:
+        return None
+    return KeyedAdapterPool.fingerprint(api_key, get_tenant_id())
+
+async def _paced_chat(adapter: ProviderAdapter, model: str, messages: List[Dict[str, str]], temperature: float,
+                      max_tokens: Optional[int], stop: Optional[List[str]] = None, key_id: Optional[str] = None) -> ChatResult:
+    """One logical completion: paced dispatch plus budgeted retries of retryable errors"""
+    pacer = pacers.get(adapter.provider, model, key_id)
+    estimate = _estimate_tokens(adapter, messages, model, max_tokens)
+    retry_budget.record_request()
+    attempt = 0
+    while True:
+        # Time spent waiting for a concurrency slot or quota (zero when the provider is not paced)
+        slot = None
+        with span("queueing"):
+            if pacer is not None:
+                try:
+                    slot = await pacer.acquire(estimate)
+                except RateLimited as e:
+                    raise ProviderError(adapter.provider, str(e), 429, retryable=False)
+        try:
+            result = await adapter.chat(messages, model, temperature, max_tokens, stop)
+            if slot is not None:
+                slot.release(result.headers)
+            return result
+        except ProviderError as e:
+            if slot is not None:
+                slot.release(e.headers, e.status_code, success=False)
+            attempt += 1
+            await _retry_or_raise(e, attempt, model)
+        finally:
+            # No-op when already released above
+            if slot is not None:
+                slot.release(success=False)
+
+async def _paced_stream(adapter: ProviderAdapter, model: str, messages: List[Dict[str, str]], temperature: float,
+                        max_tokens: Optional[int], stop: Optional[List[str]] = None,
+                        key_id: Optional[str] = None) -> AsyncIterator[StreamItem]:
+    """Paced streaming; retries only happen before the first delta reaches the caller"""
+    pacer = pacers.get(adapter.provider, model, key_id)
+    estimate = _estimate_tokens(adapter, messages, model, max_tokens)
+    retry_budget.record_request()
+    attempt = 0
+    while True:
+        # Time spent waiting for a concurrency slot or quota (zero when the provider is not paced)
+        slot = None
+        with span("queueing"):
+            if pacer is not None:
+                try:
+                    slot = await pacer.acquire(estimate)
+                except RateLimited as e:
+                    raise ProviderError(adapter.provider, str(e), 429, retryable=False)
+        started = False
+        try:
+            async for item in adapter.stream(messages, model, temperature, max_tokens, stop):
+                if isinstance(item, ChatResult):
+                    if slot is not None:
+                        slot.release(item.headers)
+                else:
+                    started = True
+                yield item
+            return
+        except ProviderError as e:
+            if slot is not None:
+                slot.release(e.headers, e.status_code, success=False)
+            if started:
+                raise
+            attempt += 1
+            await _retry_or_raise(e, attempt, model)
+        finally:
+            # No-op when already released above
+            if slot is not None:
+                slot.release(success=False)
+
+async def _generate(adapter, question, provider, model, temperature, max_tokens, system_prompt, history, context=None,
+                    key_id=None) -> ChatResult:
+    logger.debug("Sending question to %s/%s (%d chars)", provider.value, model, len(question))
+    with span("prompt_assembly"):
+        decision = response_policy.decide(question)
+        messages = _build_messages(question, decision, system_prompt, history, context)
+        budget = max_tokens or decision.max_tokens
+    with span("upstream", provider=provider.value, model=model, question_class=decision.question_class.value, max_tokens=budget):
+        result = await _paced_chat(adapter, model, messages, temperature, budget, decision.stop, key_id)
+    truncated = result.truncated
+    continued = truncated and max_tokens is None and budget < response_policy.continuation_budget()
+    if continued:
+        # The short budget was wrong for this question: let the model finish rather than cut it off
+        with span("upstream_continuation", provider=provider.value, model=model):
+            continuation = await _paced_chat(
+                adapter, model, _continuation_messages(messages, result.text, system_prompt),
+                temperature, response_policy.continuation_budget(), key_id=key_id
+            )
+        result.text += continuation.text
+        result.prompt_tokens += continuation.prompt_tokens
+        result.completion_tokens += continuation.completion_tokens
+        result.finish_reason = continuation.finish_reason
+    # After a continuation the usage covers two prompts, so it says nothing about this one
+    _account(result, messages, calibrate=not continued)
+    response_policy.observe(decision.question_class, result.completion_tokens, truncated)
+    logger.debug("LLM response received (%d chars, class %s)", len(result.text), decision.question_class.value)
+    return result
+
+def _from_facts(question: str, provider: ModelProvider, history, system_prompt, context,
+                use_facts: bool = True) -> Optional[ChatResult]:
+    """Answer a plain requirements lookup from the travel fact store, skipping the model"""
+    if not use_facts or not config.TRAVEL_FACTS_ANSWERS or history or system_prompt or context:
+        return None
+    with span("travel_facts"):
+        text = travel_facts.answer(question)
+    if text is None:
+        return None
+    result = ChatResult(text, "travel-facts", provider, finish_reason="stop")
+    result.source = "travel_facts"
+    return result
+
+def _with_grounding(question: str, context: Optional[str], use_facts: bool = True) -> Optional[str]:
+    """Add known facts about the route in the question to the prompt context"""
+    facts = travel_facts.grounding(question) if use_facts else None
+    if facts is None:
+        return context
+    return f"{facts}\n\n{context}" if context else facts
+
+def _record_usage(provider: ModelProvider, model: str, user_id: Optional[str], started: float,
+                  result: Optional[ChatResult] = None, error: Optional[ProviderError] = None) -> None:
+    if error is None:
+        provider_health.observe(provider, True)
+    elif error.retryable and (error.status_code is None or error.status_code >= 500):
+        # Outages, not rate limits or bad requests, say something about provider health
+        provider_health.observe(provider, False, str(error)[:300])
+    usage_stats.record(
+        model, provider.value, get_tenant_id(), user_id, (time.perf_counter() - started) * 1000,
+        tokens=result.tokens_used if result is not None else 0,
+        error=str(error.status_code or "connection") if error is not None else None
+    )
+
+async def generate_answer(
+    question: str,
+    provider: Optional[Union[ModelProvider, str]] = None,
+    model_name: Optional[str] = None,
+    temperature: float = 0.7,
+    max_tokens: Optional[int] = None,
+    system_prompt: Optional[str] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+    pinned: bool = True,
+    api_key: Optional[str] = None,
+    user_id: Optional[str] = None,
+    context: Optional[str] = None,
+    use_facts: bool = True
+) -> ChatResult:
+    """Answer a question through the provider adapter layer with the response-length policy applied.
+
+    `use_facts=False` always asks the model, without travel fact answers or
+    grounding: evaluations and comparisons measure the model, not the fact store.
+    """
+    provider, model = _resolve(provider, model_name, pinned)
+    answered = _from_facts(question, provider, history, system_prompt, context, use_facts)
+    if answered is not None:
+        return answered
+    context = _with_grounding(question, context, use_facts)
+    started = time.perf_counter()
+    try:
+        async with lease_adapter(provider, api_key) as adapter:
+            result = await _generate(adapter, question, provider, model, temperature, max_tokens, system_prompt, history,
+                                     context, _key_id(provider, api_key))
+    except ProviderError as e:
+        _record_usage(provider, model, user_id, started, error=e)
+        raise
+    _record_usage(provider, model, user_id, started, result)
+    return result
+
+async def stream_answer(
+    question: str,
+    provider: Optional[Union[ModelProvider, str]] = None,
+    model_name: Optional[str] = None,
+    temperature: float = 0.7,
+    max_tokens: Optional[int] = None,
+    system_prompt: Optional[str] = None,
+    history: Optional[List[Dict[str, str]]] = None,
+    pinned: bool = True,
+    api_key: Optional[str] = None,
+    user_id: Optional[str] = None,
+    context: Optional[str] = None,
+    use_facts: bool = True
+) -> AsyncIterator[StreamItem]:
+    """Stream text deltas for a question, ending with the ChatResult carrying usage"""
+    provider, model = _resolve(provider, model_name, pinned)
+    answered = _from_facts(question, provider, history, system_prompt, context, use_facts)
+    if answered is not None:
+        yield answered.text
+        yield answered
+        return
+    decision = response_policy.decide(question)
+    messages = _build_messages(question, decision, system_prompt, history, _with_grounding(question, context, use_facts))
+    started = time.perf_counter()
+    try:
+        async with lease_adapter(provider, api_key) as adapter:
+            async for item in _paced_stream(adapter, model, messages, temperature, max_tokens or decision.max_tokens,
+                                            decision.stop, _key_id(provider, api_key)):
+                if isinstance(item, ChatResult):
+                    _account(item, messages)
+                    response_policy.observe(decision.question_class, item.completion_tokens, item.truncated)
+                    _record_usage(provider, model, user_id, started, item)
+                yield item
+    except ProviderError as e:
+        _record_usage(provider, model, user_id, started, error=e)
+        raise
+
+async def get_llm_response(question: str, provider: Optional[ModelProvider] = None) -> str:
+    """Answer with `provider` (default: `default_provider()`) and its default model"""
+    provider = provider or default_provider()
+    if provider == ModelProvider.OPENAI and not config.OPENAI_API_KEY:
         logger.error("OpenAI API key not found in environment variables")
         raise ValueError("API key configuration missing")
-    
+
     try:
-        logger.info(f"Sending question to LLM: {question}")
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an expert travel assistant. Provide detailed, accurate, and well-structured answers "
-                        "using markdown formatting with headings (##), subheadings (###), and bullet points (-). "
-                        "Focus on clarity and completeness."
-                    )
-                },
-                {"role": "user", "content": question}
-            ],
-            temperature=0.7,
-            max_tokens=1500,
-            timeout=30
-        )
-        answer = response.choices[0].message.content.strip()
-        logger.info("LLM response received successfully")
-        return answer
-    except OpenAIError as oe:
-        logger.error(f"OpenAI API error: {str(oe)}")
-        raise Exception(f"Failed to communicate with LLM: {str(oe)}")
+        result = await generate_answer(question, provider=provider, pinned=False)
+        return result.text.strip()
+    except ProviderError as pe:
+        logger.error("%s API error: %s", pe.provider.value, pe)
+        raise Exception(f"Failed to communicate with LLM: {str(pe)}")
     except Exception as e:
-        logger.error(f"Unexpected error in LLM service: {str(e)}")
-        raise Exception(f"LLM processing error: {str(e)}")
\ No newline at end of file
+        logger.error("Unexpected error in LLM service: %s", e)
+        raise Exception(f"LLM processing error: {str(e)}")
+
+async def warm_up() -> None:
+    """Open pooled connections to the default provider before the worker reports ready"""
+    await get_adapter(config.DEFAULT_PROVIDER).warm_up()
+
+async def close_clients() -> None:
+    """Close every provider connection pool held by this worker"""
+    await close_adapters()
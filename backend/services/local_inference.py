@@ -0,0 +1,337 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+except ImportError:  # optional: only needed when ModelProvider.HUGGINGFACE is used
+    torch = None
+
+
+class _Done:
+    """End-of-stream marker carrying usage for one request"""
+
+    def __init__(self, prompt_tokens: int, completion_tokens: int, finish_reason: str, error: Optional[BaseException] = None):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.finish_reason = finish_reason
+        self.error = error
+
+
+class GenerationRequest:
+    """One prompt waiting for, or taking part in, a batched decode"""
+
+    def __init__(self, prompt_ids: List[int], max_new_tokens: int, temperature: float, loop: asyncio.AbstractEventLoop):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.loop = loop
+        self.output: asyncio.Queue = asyncio.Queue()
+        self.generated: List[int] = []
+        self.text_sent = 0
+        self.enqueued_at = time.perf_counter()
+        self.cancelled = False
+
+    def emit(self, item) -> None:
+        """Hand a text delta or _Done marker to the waiting coroutine (called from the decode thread)"""
+        self.loop.call_soon_threadsafe(self.output.put_nowait, item)
+
+
+class DynamicBatcher:
+    """Runs a causal LM on a dedicated thread, merging concurrent requests into batches.
+
+    Requests that arrive within `max_wait_ms` of the first queued one (up to
+    `max_batch_size`) are left-padded into a single batch. The batch is
+    prefilled once and then decoded step by step, reusing the KV cache so
+    each step only processes the newest token of every row. Rows that finish
+    are dropped from the cache so the remaining ones decode faster.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 15.0,
+        max_new_tokens: int = 256,
+        num_threads: Optional[int] = None,
+        model=None,
+        tokenizer=None
+    ):
+        if torch is None:
+            raise RuntimeError("Local inference requires torch and transformers to be installed")
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_new_tokens = max_new_tokens
+        self.num_threads = num_threads
+        self.model = model
+        self.tokenizer = tokenizer
+        self._queue: "queue.Queue[Optional[GenerationRequest]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"batches": 0, "requests": 0, "tokens": 0, "max_batch": 0}
+
+    def load(self) -> None:
+        """Load weights and tokenizer once for this worker"""
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        if self.model is None:
+            if self.tokenizer is None:
+                self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.model = AutoModelForCausalLM.from_pretrained(self.model_name, torch_dtype=torch.float32)
+        self.model.eval()
+        if self.tokenizer is not None and self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+    def start(self) -> None:
+        if self._thread is None:
+            self.load()
+            self._thread = threading.Thread(target=self._run, name=f"local-llm-{self.model_name}", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    @property
+    def eos_token_id(self) -> Optional[int]:
+        if self.tokenizer is not None:
+            return self.tokenizer.eos_token_id
+        return getattr(self.model.config, "eos_token_id", None)
+
+    @property
+    def pad_token_id(self) -> int:
+        if self.tokenizer is not None and self.tokenizer.pad_token_id is not None:
+            return self.tokenizer.pad_token_id
+        return self.eos_token_id or 0
+
+    def build_prompt(self, messages: List[Dict[str, str]]) -> List[int]:
+        """Tokenize chat messages with the model's chat template when it has one"""
+        if getattr(self.tokenizer, "chat_template", None):
+            return self.tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+        text = "".join(f"{m['role'].capitalize()}: {m['content']}\n" for m in messages) + "Assistant:"
+        return self.tokenizer.encode(text)
+
+    def submit(self, prompt_ids: List[int], max_new_tokens: Optional[int] = None, temperature: float = 0.7) -> GenerationRequest:
+        """Queue token IDs for generation; must be called from the event loop"""
+        self.start()
+        request = GenerationRequest(
+            prompt_ids,
+            min(max_new_tokens or self.max_new_tokens, self.max_new_tokens),
+            temperature,
+            asyncio.get_running_loop()
+        )
+        self._queue.put(request)
+        return request
+
+    async def stream(self, messages: List[Dict[str, str]], max_new_tokens: Optional[int] = None, temperature: float = 0.7) -> AsyncIterator[str]:
+        """Yield text deltas as they are decoded"""
+        request = self.submit(self.build_prompt(messages), max_new_tokens, temperature)
+        try:
+            while True:
+                item = await request.output.get()
+                if isinstance(item, _Done):
+                    if item.error is not None:
+                        raise item.error
+                    return
+                yield item
+        finally:
+            request.cancelled = True
+
+    async def generate(self, messages: List[Dict[str, str]], max_new_tokens: Optional[int] = None, temperature: float = 0.7) -> Tuple[str, _Done]:
+        """Return the full completion and its usage"""
+        request = self.submit(self.build_prompt(messages), max_new_tokens, temperature)
+        parts = []
+        try:
+            while True:
+                item = await request.output.get()
+                if isinstance(item, _Done):
+                    if item.error is not None:
+                        raise item.error
+                    return "".join(parts), item
+                parts.append(item)
+        finally:
+            request.cancelled = True
+
+    def _collect_batch(self, first: GenerationRequest) -> List[GenerationRequest]:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self) -> None:
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [r for r in self._collect_batch(first) if not r.cancelled]
+            if not batch:
+                continue
+            try:
+                with torch.inference_mode():
+                    self._decode(batch)
+            except Exception as e:
+                logger.error("Local generation failed for batch of %d: %s", len(batch), e)
+                for request in batch:
+                    request.emit(_Done(len(request.prompt_ids), len(request.generated), "error", e))
+
+    def _emit_text(self, request: GenerationRequest) -> None:
+        if self.tokenizer is None:
+            return
+        # Decode the whole suffix so multi-token characters are emitted once complete
+        text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+        if len(text) > request.text_sent and not text.endswith("�"):
+            request.emit(text[request.text_sent:])
+            request.text_sent = len(text)
+
+    def _sample(self, logits, requests: List[GenerationRequest]):
+        temperatures = torch.tensor([max(r.temperature, 0.0) for r in requests], dtype=logits.dtype).unsqueeze(1)
+        greedy = logits.argmax(dim=-1)
+        if bool((temperatures == 0).all()):
+            return greedy
+        probs = torch.softmax(logits / temperatures.clamp(min=1e-5), dim=-1)
+        sampled = torch.multinomial(probs, num_samples=1).squeeze(1)
+        return torch.where(temperatures.squeeze(1) == 0, greedy, sampled)
+
+    def _decode(self, batch: List[GenerationRequest]) -> None:
+        self.stats["batches"] += 1
+        self.stats["requests"] += len(batch)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        pad_id, eos_id = self.pad_token_id, self.eos_token_id
+
+        # Left-pad so the last column of every row is its newest token
+        width = max(len(r.prompt_ids) for r in batch)
+        input_ids = torch.full((len(batch), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+        for row, request in enumerate(batch):
+            input_ids[row, width - len(request.prompt_ids):] = torch.tensor(request.prompt_ids, dtype=torch.long)
+            attention_mask[row, width - len(request.prompt_ids):] = 1
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        out = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids, use_cache=True)
+        past = out.past_key_values
+        logits = out.logits[:, -1, :]
+        active = list(batch)
+        next_positions = position_ids[:, -1] + 1
+
+        for step in range(max(r.max_new_tokens for r in batch)):
+            tokens = self._sample(logits, active)
+            keep = []
+            for row, request in enumerate(active):
+                token = int(tokens[row])
+                finished = request.cancelled
+                reason = "cancelled"
+                if not finished and eos_id is not None and token == eos_id:
+                    finished, reason = True, "stop"
+                if not finished:
+                    request.generated.append(token)
+                    self._emit_text(request)
+                    if len(request.generated) >= request.max_new_tokens:
+                        finished, reason = True, "length"
+                if finished:
+                    self.stats["tokens"] += len(request.generated)
+                    request.emit(_Done(len(request.prompt_ids), len(request.generated), reason))
+                else:
+                    keep.append(row)
+            if not keep:
+                return
+
+            if len(keep) < len(active):
+                index = torch.tensor(keep, dtype=torch.long)
+                tokens, attention_mask, next_positions = tokens[index], attention_mask[index], next_positions[index]
+                if hasattr(past, "batch_select_indices"):
+                    past.batch_select_indices(index)
+                else:
+                    past = tuple((k[index], v[index]) for k, v in past)
+                active = [active[row] for row in keep]
+
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(active), 1))], dim=1)
+            out = self.model(
+                input_ids=tokens.unsqueeze(1),
+                attention_mask=attention_mask,
+                position_ids=next_positions.unsqueeze(1),
+                past_key_values=past,
+                use_cache=True
+            )
+            past = out.past_key_values
+            logits = out.logits[:, -1, :]
+            next_positions = next_positions + 1
+
+
+class UnknownModel(LookupError):
+    """The requested model is neither loaded nor in the allow-list"""
+
+
+class LocalInferenceProvider:
+    """Per-worker registry of loaded local models (ModelProvider.HUGGINGFACE)"""
+
+    def __init__(self, max_batch_size: int = 8, max_wait_ms: float = 15.0, max_new_tokens: int = 512, num_threads: Optional[int] = None,
+                 allowed_models: Optional[Sequence[str]] = None):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_new_tokens = max_new_tokens
+        self.num_threads = num_threads
+        # Model names come from requests; anything else could pull arbitrary weights from the hub
+        self.allowed_models = set(allowed_models or ())
+        self.batchers: Dict[str, DynamicBatcher] = {}
+        self._lock = threading.Lock()
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    def _load(self, model_name: str) -> DynamicBatcher:
+        """Load and start `model_name` once (blocking)"""
+        with self._lock:
+            batcher = self.batchers.get(model_name)
+            if batcher is None:
+                batcher = DynamicBatcher(
+                    model_name,
+                    max_batch_size=self.max_batch_size,
+                    max_wait_ms=self.max_wait_ms,
+                    max_new_tokens=self.max_new_tokens,
+                    num_threads=self.num_threads
+                )
+                batcher.start()
+                self.batchers[model_name] = batcher
+        return batcher
+
+    async def get(self, model_name: str) -> DynamicBatcher:
+        """Return the batcher for an allowed model, loading it on a thread on first use"""
+        batcher = self.batchers.get(model_name)
+        if batcher is not None:
+            return batcher
+        if model_name not in self.allowed_models:
+            raise UnknownModel(model_name)
+        loading = self._loading.get(model_name)
+        if loading is None:
+            loading = self._loading[model_name] = asyncio.get_running_loop().run_in_executor(None, self._load, model_name)
+            loading.add_done_callback(lambda _: self._loading.pop(model_name, None))
+        # Shielded: one caller going away must not abandon the load for the others
+        return await asyncio.shield(loading)
+
+    def preload(self, model_name: str) -> None:
+        """Load and start a model before the worker reports ready (blocking)"""
+        self._load(model_name)
+
+    def close(self) -> None:
+        for batcher in self.batchers.values():
+            batcher.stop()
+        self.batchers.clear()
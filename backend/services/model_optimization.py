@@ -0,0 +1,327 @@
+import asyncio
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import config
+from models import ModelOptimizationRequest, ModelOptimizationResponse
+from utils.quantization import (
+    BLOCK_BYTES, DTYPES, QUANT_TYPES, evaluate as evaluate_checkpoint, plan_tensor, quantize_tensor, quantized_nbytes,
+    read_header, tensor_entries, write_checkpoint
+)
+
+logger = logging.getLogger(__name__)
+
+_SIZE_RE = re.compile(r"^\s*([\d.]+)\s*([KMGT]?)i?B?\s*$", re.IGNORECASE)
+# Weight formats that are never copied into the optimized directory
+_WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth", ".gguf", ".h5", ".msgpack", ".onnx")
+
+
+class OptimizationError(ValueError):
+    """The request cannot be served (unknown model, unsupported optimization or format)"""
+
+
+def parse_size(value: str) -> int:
+    """"4.7GB" / "500MB" / "2G" -> bytes"""
+    match = _SIZE_RE.match(value)
+    if not match:
+        raise OptimizationError(f"Cannot parse target_size {value!r}; use a value like '4.7GB' or '500MB'")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** "BKMGT".index(unit.upper() or "B"))
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.2f}{unit}"
+        size /= 1024
+
+
+class ModelOptimizer:
+    """Quantizes safetensors checkpoints to q8_0/q4_0 blocks in the background.
+
+    Each job maps the checkpoint and sends one tensor at a time to a spawned
+    process pool; workers read their tensor through the memory map and write
+    packed blocks to a part file, so peak memory is a few chunks per worker
+    rather than the model size. The parts are then concatenated into
+    safetensors files next to the model's config and tokenizer. Jobs run one
+    at a time and report progress through `status`.
+
+    Job status is also written to `<output_dir>/.jobs/<request_id>.json`, so
+    any worker can answer a status poll. Local models must live under one of
+    `model_roots`; anything else is looked up as a hub id.
+    """
+
+    def __init__(self, output_dir: str, workers: int = 2, chunk_elements: int = 1 << 22, evaluate: bool = True,
+                 allow_download: bool = False, model_roots: Iterable[str] = ()):
+        self.output_dir = output_dir
+        self.model_roots = [os.path.realpath(root) for root in model_roots]
+        self.workers = workers
+        self.chunk_elements = chunk_elements
+        self.evaluate = evaluate
+        self.allow_download = allow_download
+        self.jobs: Dict[str, ModelOptimizationResponse] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned workers do not inherit the server's threads, sockets or loaded models
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _allowed(self, path: str) -> bool:
+        path = os.path.realpath(path)
+        return any(path != root and os.path.commonpath([root, path]) == root for root in self.model_roots)
+
+    def resolve(self, model_name: str) -> Tuple[str, List[str]]:
+        """Model directory and its safetensors files, from a local path or the Hugging Face cache"""
+        if os.path.exists(model_name) and not self._allowed(model_name):
+            raise OptimizationError(f"Local models must be under {', '.join(self.model_roots) or 'a configured model root'}")
+        if os.path.isfile(model_name) and model_name.endswith(".safetensors"):
+            return os.path.dirname(os.path.abspath(model_name)), [os.path.abspath(model_name)]
+        directory = model_name if os.path.isdir(model_name) else None
+        if directory is None:
+            try:
+                from huggingface_hub import snapshot_download
+                directory = snapshot_download(
+                    model_name, allow_patterns=["*.safetensors", "*.json", "*.txt", "*.model", "*.tiktoken"],
+                    local_files_only=not self.allow_download
+                )
+            except Exception as e:
+                raise OptimizationError(f"Model {model_name!r} is not a local path or a cached hub model: {e}")
+        files = sorted(glob.glob(os.path.join(directory, "*.safetensors")))
+        if not files:
+            raise OptimizationError(f"No .safetensors weights found for {model_name!r}")
+        return directory, files
+
+    def plan(self, request: ModelOptimizationRequest, files: List[str]) -> Tuple[str, int, List[str]]:
+        """Pick the quantization type; returns (qtype, estimated size, warnings)"""
+        warnings = []
+        if request.optimization_type not in ("auto", "quantize"):
+            raise OptimizationError(f"optimization_type {request.optimization_type!r} is not supported; use 'quantize'")
+        if request.output_format not in ("gguf", "safetensors"):
+            raise OptimizationError(f"output_format {request.output_format!r} is not supported")
+        if request.output_format == "gguf":
+            warnings.append("Wrote GGML-layout q8_0/q4_0 blocks in safetensors; GGUF needs llama.cpp's converter for the model metadata")
+        if request.quantization is not None and request.quantization not in QUANT_TYPES:
+            raise OptimizationError(f"quantization must be one of {', '.join(QUANT_TYPES)}")
+
+        def estimate(qtype: str) -> int:
+            total = 0
+            for path in files:
+                header, data_start = read_header(path)
+                total += data_start
+                for name, info in tensor_entries(header):
+                    begin, end = info["data_offsets"]
+                    planned = plan_tensor(name, info, qtype, request.preserve_accuracy)
+                    if planned is None:
+                        total += end - begin
+                    else:
+                        total += quantized_nbytes((end - begin) // DTYPES[info["dtype"]][1], planned)
+            return total
+
+        if request.quantization is not None:
+            return request.quantization, estimate(request.quantization), warnings
+        if request.target_size is None:
+            # 8-bit is close to lossless; 4-bit is opted into with target_size or quantization
+            qtype = "q8_0" if request.preserve_accuracy else "q4_0"
+            return qtype, estimate(qtype), warnings
+        target = parse_size(request.target_size)
+        for qtype in ("q8_0", "q4_0"):
+            size = estimate(qtype)
+            if size <= target:
+                return qtype, size, warnings
+        warnings.append(f"Smallest supported format ({format_size(size)}) is larger than target_size {request.target_size}")
+        return "q4_0", size, warnings
+
+    def _prepare(self, request: ModelOptimizationRequest):
+        directory, files = self.resolve(request.model_name)
+        return (directory, files) + self.plan(request, files)
+
+    async def submit(self, request: ModelOptimizationRequest) -> ModelOptimizationResponse:
+        """Validate the request and start a background job; raises OptimizationError"""
+        existing = self.status(request.request_id)
+        if existing is not None and existing.status in ("queued", "running", "evaluating"):
+            return existing
+        # Resolving may read the hub cache and planning reads every checkpoint header
+        directory, files, qtype, estimated, warnings = await asyncio.get_running_loop().run_in_executor(
+            None, self._prepare, request
+        )
+        job = self.jobs[request.request_id] = ModelOptimizationResponse(
+            model_name=request.model_name,
+            optimization_type=f"quantize:{qtype}",
+            original_size=format_size(sum(os.path.getsize(path) for path in files)),
+            optimized_size=f"~{format_size(estimated)}",
+            status="queued",
+            processing_time=0.0,
+            warnings=warnings,
+            request_id=request.request_id
+        )
+        await self._save(job)
+        task = asyncio.ensure_future(self._run(job, directory, files, qtype, request.preserve_accuracy))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def status(self, request_id: str) -> Optional[ModelOptimizationResponse]:
+        """The job from this worker, or as last saved by the worker running it"""
+        job = self.jobs.get(request_id)
+        if job is not None:
+            return job
+        try:
+            with open(self._status_path(request_id), "r", encoding="utf-8") as f:
+                return ModelOptimizationResponse.model_validate_json(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _status_path(self, request_id: str) -> str:
+        return os.path.join(self.output_dir, ".jobs", f"{request_id}.json")
+
+    def _persist(self, job: ModelOptimizationResponse) -> None:
+        path = self._status_path(job.request_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(job.model_dump_json())
+        os.replace(path + ".tmp", path)
+
+    async def _save(self, job: ModelOptimizationResponse) -> None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._persist, job)
+        except OSError as e:
+            logger.warning("Could not save optimization job %s: %s", job.request_id, e)
+
+    async def _run(self, job: ModelOptimizationResponse, directory: str, files: List[str], qtype: str,
+                   preserve_accuracy: bool) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            started = time.perf_counter()
+            job.status = "running"
+            await self._save(job)
+            output = os.path.join(self.output_dir, f"{os.path.basename(directory.rstrip('/'))}-{qtype}-{job.request_id[:8]}")
+            try:
+                job.metrics.update(await self._quantize(job, directory, files, qtype, preserve_accuracy, output))
+                job.output_path = output
+                job.optimized_size = format_size(sum(os.path.getsize(p) for p in glob.glob(os.path.join(output, "*"))))
+                if self.evaluate and os.path.exists(os.path.join(directory, "config.json")):
+                    job.status = "evaluating"
+                    await self._save(job)
+                    try:
+                        metrics = await asyncio.wrap_future(self.pool.submit(evaluate_checkpoint, directory, output))
+                        job.metrics.update({k: round(v, 4) for k, v in metrics.items()})
+                    except Exception as e:
+                        job.warnings.append(f"Perplexity/latency comparison skipped: {type(e).__name__}: {e}"[:300])
+                job.status = "completed"
+                logger.info("Quantized %s to %s: %s -> %s in %.1fs", job.model_name, qtype, job.original_size,
+                            job.optimized_size, time.perf_counter() - started)
+            except asyncio.CancelledError:
+                job.status = "cancelled"
+                shutil.rmtree(output, ignore_errors=True)
+                raise
+            except Exception as e:
+                logger.error("Optimization of %s failed: %s", job.model_name, e)
+                job.status = "failed"
+                job.warnings.append(f"{type(e).__name__}: {e}"[:300])
+                shutil.rmtree(output, ignore_errors=True)
+            finally:
+                job.processing_time = time.perf_counter() - started
+                await asyncio.shield(self._save(job))
+
+    async def _quantize(self, job: ModelOptimizationResponse, directory: str, files: List[str], qtype: str,
+                        preserve_accuracy: bool, output: str) -> Dict[str, float]:
+        parts_dir = os.path.join(output, ".parts")
+        os.makedirs(parts_dir, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        plans = []
+        for path in files:
+            header, data_start = read_header(path)
+            for index, (name, info) in enumerate(tensor_entries(header)):
+                part = os.path.join(parts_dir, f"{os.path.basename(path)}.{index}")
+                plans.append((path, data_start, name, info, plan_tensor(name, info, qtype, preserve_accuracy), part))
+        # Largest tensors first so a big one does not start last and leave the other workers idle
+        order = sorted(range(len(plans)), key=lambda i: -(plans[i][3]["data_offsets"][1] - plans[i][3]["data_offsets"][0]))
+        stats: Dict[int, dict] = {}
+        done = 0
+        # Saved progress moves in steps of about 2%
+        save_every = max(1, len(plans) // 50)
+
+        async def run(index: int) -> None:
+            nonlocal done
+            path, data_start, _, info, planned, part = plans[index]
+            stats[index] = await asyncio.wrap_future(
+                self.pool.submit(quantize_tensor, path, data_start, info, planned, part, self.chunk_elements)
+            )
+            done += 1
+            job.progress = round(done / len(plans), 4)
+            if done % save_every == 0:
+                await self._save(job)
+
+        # Only `workers` tensors are mapped at once, which is what bounds peak memory
+        slots = asyncio.Semaphore(self.workers)
+
+        async def bounded(index: int) -> None:
+            async with slots:
+                await run(index)
+
+        await asyncio.gather(*(bounded(i) for i in order))
+
+        for path in files:
+            tensors, quantized = [], {}
+            for index, (source, _, name, info, planned, part) in enumerate(plans):
+                if source != path:
+                    continue
+                if planned is None:
+                    tensors.append((name, info, part))
+                else:
+                    block_bytes = BLOCK_BYTES[planned]
+                    tensors.append((name, {"dtype": "U8", "shape": [stats[index]["nbytes"] // block_bytes, block_bytes]}, part))
+                    quantized[name] = {"qtype": planned, "dtype": info["dtype"], "shape": info["shape"]}
+            metadata = {"format": "pt", "quantization": qtype, "quantized_tensors": json.dumps(quantized)}
+            await loop.run_in_executor(None, write_checkpoint, os.path.join(output, os.path.basename(path)), tensors, metadata)
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        await loop.run_in_executor(None, _copy_sidecars, directory, output)
+
+        quantized_stats = [s for s in stats.values() if s["qtype"] is not None]
+        sq_norm = sum(s["sq_norm"] for s in quantized_stats)
+        return {
+            "tensors": float(len(plans)),
+            "quantized_tensors": float(len(quantized_stats)),
+            "relative_rmse": round((sum(s["sq_error"] for s in quantized_stats) / sq_norm) ** 0.5, 6) if sq_norm else 0.0,
+            "max_abs_error": round(max((s["max_error"] for s in quantized_stats), default=0.0), 6),
+            "worker_seconds": round(sum(s["seconds"] for s in stats.values()), 3)
+        }
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+
+
+def _copy_sidecars(directory: str, output: str) -> None:
+    """Copy config, tokenizer and index files so the output directory loads on its own"""
+    for path in glob.glob(os.path.join(directory, "*")):
+        if os.path.isfile(path) and not path.endswith(_WEIGHT_SUFFIXES):
+            shutil.copy2(path, output)
+
+
+# Per-worker job runner
+model_optimizer = ModelOptimizer(
+    config.OPTIMIZATION_DIR,
+    workers=config.OPTIMIZATION_WORKERS,
+    chunk_elements=config.OPTIMIZATION_CHUNK_ELEMENTS,
+    evaluate=config.OPTIMIZATION_EVALUATE,
+    allow_download=config.OPTIMIZATION_DOWNLOAD,
+    model_roots=config.OPTIMIZATION_MODEL_ROOTS or [config.MODEL_STORE_DIR, config.TRAINING_DIR]
+)
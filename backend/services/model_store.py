@@ -0,0 +1,472 @@
+import asyncio
+import contextlib
+import datetime
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import config
+from models import LifecycleStatus, ModelVersion
+
+logger = logging.getLogger(__name__)
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._:-]*(/[A-Za-z0-9][A-Za-z0-9._:-]*)?$")
+_VERSION_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+_FICLONE = 0x40049409  # linux/fs.h: share extents with another file (btrfs, XFS, overlay on those)
+_HASH_CHUNK = 4 << 20
+
+
+class ModelStoreError(ValueError):
+    """A version operation that cannot be carried out; `status_code` is the HTTP status to report"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(_HASH_CHUNK)
+            if not data:
+                return digest.hexdigest()
+            digest.update(data)
+
+
+def _clone(src: str, dst: str) -> None:
+    """Copy-on-write clone when the filesystem supports it, otherwise a regular copy"""
+    with open(src, "rb") as source, open(dst, "wb") as target:
+        try:
+            fcntl.ioctl(target.fileno(), _FICLONE, source.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+def _link(blob: str, dst: str) -> str:
+    """Materialize a blob at `dst`; returns how ("hardlink", "reflink/copy")"""
+    try:
+        os.link(blob, dst)
+        return "hardlink"
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    _clone(blob, dst)
+    return "reflink/copy"
+
+
+def _write_json(path: str, data: Any) -> None:
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _read_json(path: str, default: Any = None) -> Any:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TB"
+    return f"{size:.0f}{unit}" if unit == "B" else f"{size:.2f}{unit}"
+
+
+class ModelVersionStore:
+    """Versioned model artifacts stored once per unique file content.
+
+    Files are kept as read-only blobs named by their SHA-256, so a layer or
+    tokenizer shared by several versions is stored once. A version is a
+    manifest (relative path -> blob) plus a directory of hardlinks to the
+    blobs (reflinks or copies when hardlinks are not possible), which makes
+    committing a version whose files are mostly unchanged nearly free. The
+    live version of a model is a `current` symlink that is replaced with
+    `os.replace`, so activating or rolling back is one atomic rename and
+    readers always see a complete version. Blobs no manifest references are
+    removed by `collect_garbage` once retired versions age past the
+    retention period.
+
+    Layout under `root`:
+        blobs/ab/<sha256>
+        manifests/<model>/<version>.json
+        versions/<model>/<version>/...
+        models/<model>/current -> ../../versions/<model>/<version>
+        models/<model>/history.json
+    """
+
+    def __init__(self, root: str, retention_days: int = 90, gc_interval: float = 3600.0, gc_grace: float = 3600.0):
+        self.root = root
+        self.retention_days = retention_days
+        self.gc_interval = gc_interval
+        self.gc_grace = gc_grace
+        self._thread_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # Paths
+    @staticmethod
+    def _key(model_name: str) -> str:
+        if not _NAME_RE.match(model_name) or ".." in model_name:
+            raise ModelStoreError(f"Invalid model name: {model_name!r}")
+        # Hub ids contain a slash; use the hub cache's convention instead of nesting
+        return model_name.replace("/", "--")
+
+    @staticmethod
+    def _check_version(version: str) -> str:
+        if not _VERSION_RE.match(version):
+            raise ModelStoreError(f"Invalid version: {version!r}")
+        return version
+
+    def _blob(self, sha: str) -> str:
+        return os.path.join(self.root, "blobs", sha[:2], sha)
+
+    def _manifest_path(self, key: str, version: str) -> str:
+        return os.path.join(self.root, "manifests", key, f"{version}.json")
+
+    def _version_dir(self, key: str, version: str) -> str:
+        return os.path.join(self.root, "versions", key, version)
+
+    def _pointer(self, key: str) -> str:
+        return os.path.join(self.root, "models", key, "current")
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Serialize mutations across threads and across worker processes sharing the store"""
+        os.makedirs(self.root, exist_ok=True)
+        with self._thread_lock, open(os.path.join(self.root, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # Reads
+    def current(self, model_name: str) -> Optional[str]:
+        try:
+            return os.path.basename(os.readlink(self._pointer(self._key(model_name))))
+        except FileNotFoundError:
+            return None
+
+    def version_path(self, model_name: str, version: str) -> str:
+        return self._version_dir(self._key(model_name), self._check_version(version))
+
+    def current_path(self, model_name: str) -> Optional[str]:
+        """Directory of the live version; open files through it so a swap never mixes versions"""
+        version = self.current(model_name)
+        return self.version_path(model_name, version) if version else None
+
+    def manifest(self, model_name: str, version: str) -> Dict[str, Any]:
+        manifest = _read_json(self._manifest_path(self._key(model_name), self._check_version(version)))
+        if manifest is None:
+            raise ModelStoreError(f"Unknown version {version!r} of {model_name}", 404)
+        return manifest
+
+    def versions(self, model_name: str) -> List[ModelVersion]:
+        key = self._key(model_name)
+        current = self.current(model_name)
+        directory = os.path.join(self.root, "manifests", key)
+        manifests = []
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            if name.endswith(".json"):
+                manifest = _read_json(os.path.join(directory, name))
+                if manifest is not None:
+                    manifests.append(manifest)
+        manifests.sort(key=lambda m: m["created_at"], reverse=True)
+        return [self._describe(manifest, current) for manifest in manifests]
+
+    @staticmethod
+    def _describe(manifest: Dict[str, Any], current: Optional[str]) -> ModelVersion:
+        return ModelVersion(
+            model_name=manifest["model_name"],
+            version=manifest["version"],
+            size=_format_size(manifest["size"]),
+            hash=manifest["hash"],
+            modified=manifest.get("updated_at", manifest["created_at"]),
+            status=manifest["status"],
+            description=manifest.get("description"),
+            changelog=manifest.get("changelog"),
+            migration_plan=manifest.get("migration_plan"),
+            current=manifest["version"] == current
+        )
+
+    # Writes
+    def commit(self, model_name: str, source: str, version: Optional[str] = None, description: Optional[str] = None,
+               changelog: Optional[str] = None, activate: bool = False) -> Tuple[ModelVersion, Dict[str, int]]:
+        """Store the files under `source` (a file or directory) as a new version of `model_name`.
+
+        Files are hashed in parallel first; only content the store does not
+        already have is copied in (as a reflink where supported). The version
+        id defaults to a prefix of the manifest hash, so committing identical
+        content twice returns the existing version.
+        """
+        key = self._key(model_name)
+        if os.path.isfile(source):
+            files = {os.path.basename(source): source}
+        elif os.path.isdir(source):
+            files = {}
+            for directory, _, names in os.walk(source):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    if os.path.isfile(path) and not os.path.islink(path):
+                        files[os.path.relpath(path, source)] = path
+        else:
+            raise ModelStoreError(f"Source not found: {source}", 404)
+        if not files:
+            raise ModelStoreError(f"No files under {source}")
+
+        # hashlib releases the GIL on large updates, so threads hash files in parallel
+        with ThreadPoolExecutor(max_workers=min(4, len(files))) as hashing:
+            digests = dict(zip(files, hashing.map(_sha256, files.values())))
+        entries = {
+            relative: {"sha256": digests[relative], "size": os.path.getsize(path)}
+            for relative, path in sorted(files.items())
+        }
+        manifest_hash = hashlib.sha256(json.dumps(entries, sort_keys=True).encode()).hexdigest()
+        version = self._check_version(version or manifest_hash[:12])
+
+        stats = {"files": len(entries), "new_blobs": 0, "new_bytes": 0, "reused_bytes": 0}
+        with self._locked():
+            existing = _read_json(self._manifest_path(key, version))
+            if existing is not None:
+                if existing["hash"] != manifest_hash:
+                    raise ModelStoreError(f"Version {version!r} of {model_name} already exists with different content", 409)
+            else:
+                for relative, entry in entries.items():
+                    blob = self._blob(entry["sha256"])
+                    if os.path.exists(blob):
+                        stats["reused_bytes"] += entry["size"]
+                        # Touch it so a concurrent collection treats the blob as recently used
+                        os.utime(blob)
+                        continue
+                    os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    tmp = f"{blob}.{uuid.uuid4().hex[:8]}.tmp"
+                    _clone(files[relative], tmp)
+                    os.chmod(tmp, 0o444)
+                    os.replace(tmp, blob)
+                    stats["new_blobs"] += 1
+                    stats["new_bytes"] += entry["size"]
+                self._materialize(key, version, entries)
+                existing = {
+                    "model_name": model_name,
+                    "version": version,
+                    "hash": manifest_hash,
+                    "size": sum(entry["size"] for entry in entries.values()),
+                    "files": entries,
+                    "status": LifecycleStatus.ACTIVE.value,
+                    "description": description,
+                    "changelog": changelog,
+                    "parent": self.current(model_name),
+                    "created_at": _now(),
+                    "superseded_at": None
+                }
+                os.makedirs(os.path.dirname(self._manifest_path(key, version)), exist_ok=True)
+                _write_json(self._manifest_path(key, version), existing)
+                logger.info("Committed %s@%s: %d files, %s new, %s shared", model_name, version, len(entries),
+                            _format_size(stats["new_bytes"]), _format_size(stats["reused_bytes"]))
+            if activate:
+                self._swap(model_name, key, version)
+        return self._describe(existing, self.current(model_name)), stats
+
+    def _materialize(self, key: str, version: str, entries: Dict[str, Dict[str, Any]]) -> None:
+        target = self._version_dir(key, version)
+        # Left behind by a commit that failed before writing its manifest
+        shutil.rmtree(target, ignore_errors=True)
+        staging = f"{target}.{uuid.uuid4().hex[:8]}.tmp"
+        methods = set()
+        for relative, entry in entries.items():
+            path = os.path.join(staging, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            methods.add(_link(self._blob(entry["sha256"]), path))
+        os.rename(staging, target)
+        if "reflink/copy" in methods:
+            logger.info("Version directory %s is on another filesystem from its blobs; files were cloned or copied", target)
+
+    def _swap(self, model_name: str, key: str, version: str) -> Optional[str]:
+        """Point `current` at `version` with one atomic rename; returns the previous version"""
+        previous = self.current(model_name)
+        if previous == version:
+            return previous
+        pointer = self._pointer(key)
+        os.makedirs(os.path.dirname(pointer), exist_ok=True)
+        tmp = f"{pointer}.{uuid.uuid4().hex[:8]}.tmp"
+        os.symlink(os.path.join("..", "..", "versions", key, version), tmp)
+        os.replace(tmp, pointer)
+        now = _now()
+        if previous is not None:
+            manifest = _read_json(self._manifest_path(key, previous))
+            if manifest is not None:
+                manifest["superseded_at"] = now
+                _write_json(self._manifest_path(key, previous), manifest)
+        history_path = os.path.join(os.path.dirname(pointer), "history.json")
+        history = _read_json(history_path, [])
+        history.append({"version": version, "activated_at": now})
+        _write_json(history_path, history[-100:])
+        logger.info("Activated %s@%s (was %s)", model_name, version, previous)
+        return previous
+
+    def activate(self, model_name: str, version: str, verify: bool = False, force: bool = False) -> Tuple[Optional[str], str]:
+        """Make `version` live; returns (previous, new)"""
+        key = self._key(model_name)
+        with self._locked():
+            manifest = self.manifest(model_name, version)
+            if manifest["status"] == LifecycleStatus.RETIRED.value and not force:
+                raise ModelStoreError(f"{model_name}@{version} is retired; pass force to activate it", 409)
+            if verify:
+                problems = self._verify(key, manifest)
+                if problems:
+                    raise ModelStoreError(f"{model_name}@{version} failed verification: {'; '.join(problems[:5])}", 409)
+            previous = self._swap(model_name, key, version)
+        return previous, version
+
+    def rollback(self, model_name: str, target: Optional[str] = None) -> Tuple[Optional[str], str]:
+        """Activate `target`, or the most recently live version before the current one"""
+        key = self._key(model_name)
+        if target is None:
+            current = self.current(model_name)
+            history = _read_json(os.path.join(os.path.dirname(self._pointer(key)), "history.json"), [])
+            for entry in reversed(history):
+                version = entry["version"]
+                if version != current and os.path.exists(self._manifest_path(key, version)) \
+                        and self.manifest(model_name, version)["status"] != LifecycleStatus.RETIRED.value:
+                    target = version
+                    break
+            if target is None:
+                raise ModelStoreError(f"No earlier version of {model_name} to roll back to", 409)
+        return self.activate(model_name, target)
+
+    def set_status(self, model_name: str, version: str, status: LifecycleStatus, force: bool = False) -> Dict[str, Any]:
+        key = self._key(model_name)
+        with self._locked():
+            manifest = self.manifest(model_name, version)
+            if status == LifecycleStatus.RETIRED and version == self.current(model_name) and not force:
+                raise ModelStoreError(f"{model_name}@{version} is live; activate another version first or pass force", 409)
+            manifest["status"] = status.value
+            manifest["updated_at"] = _now()
+            _write_json(self._manifest_path(key, version), manifest)
+        return manifest
+
+    def _verify(self, key: str, manifest: Dict[str, Any]) -> List[str]:
+        problems = []
+        directory = self._version_dir(key, manifest["version"])
+        for relative, entry in manifest["files"].items():
+            path = os.path.join(directory, relative)
+            if not os.path.exists(path):
+                problems.append(f"{relative} is missing")
+            elif _sha256(path) != entry["sha256"]:
+                problems.append(f"{relative} does not match {entry['sha256'][:12]}")
+        return problems
+
+    def verify(self, model_name: str, version: str) -> List[str]:
+        """Re-hash a version's files; returns the problems found"""
+        return self._verify(self._key(model_name), self.manifest(model_name, version))
+
+    def collect_garbage(self, retention_days: Optional[int] = None) -> Dict[str, int]:
+        """Drop old non-live versions, then delete blobs no remaining manifest references.
+
+        A version is kept while it is live, while it is the most recent
+        rollback target, or until `retention_days` after it was last live
+        (or created, if it never was). Unreferenced blobs younger than the
+        grace period are kept so a commit in progress is never raced.
+        """
+        retention = self.retention_days if retention_days is None else retention_days
+        cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=retention)).isoformat()
+        result = {"versions_removed": 0, "blobs_removed": 0, "bytes_freed": 0}
+        manifests_root = os.path.join(self.root, "manifests")
+        with self._locked():
+            referenced = set()
+            for key in os.listdir(manifests_root) if os.path.isdir(manifests_root) else []:
+                try:
+                    current = os.path.basename(os.readlink(self._pointer(key)))
+                except FileNotFoundError:
+                    current = None
+                manifests = [
+                    _read_json(os.path.join(manifests_root, key, name))
+                    for name in os.listdir(os.path.join(manifests_root, key)) if name.endswith(".json")
+                ]
+                manifests = [m for m in manifests if m is not None]
+                superseded = sorted((m for m in manifests if m.get("superseded_at")), key=lambda m: m["superseded_at"])
+                rollback_target = superseded[-1]["version"] if superseded else None
+                for manifest in manifests:
+                    version = manifest["version"]
+                    last_used = manifest.get("superseded_at") or manifest["created_at"]
+                    if version in (current, rollback_target) or last_used >= cutoff:
+                        referenced.update(entry["sha256"] for entry in manifest["files"].values())
+                        continue
+                    os.unlink(self._manifest_path(key, version))
+                    shutil.rmtree(self._version_dir(key, version), ignore_errors=True)
+                    result["versions_removed"] += 1
+                    logger.info("Removed %s@%s (last live %s)", manifest["model_name"], version, last_used)
+
+            blobs_root = os.path.join(self.root, "blobs")
+            grace_cutoff = time.time() - self.gc_grace
+            for directory, _, names in os.walk(blobs_root):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    if name in referenced:
+                        continue
+                    stat = os.stat(path)
+                    if stat.st_mtime > grace_cutoff:
+                        continue
+                    os.unlink(path)
+                    result["blobs_removed"] += 1
+                    result["bytes_freed"] += stat.st_size
+        if result["versions_removed"] or result["blobs_removed"]:
+            logger.info("Model store GC removed %d versions and %d blobs (%s)", result["versions_removed"],
+                        result["blobs_removed"], _format_size(result["bytes_freed"]))
+        return result
+
+    async def _collect_periodically(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.gc_interval)
+            try:
+                await loop.run_in_executor(None, self.collect_garbage)
+            except Exception as e:
+                logger.warning("Model store garbage collection failed: %s", e)
+
+    def start(self) -> None:
+        if self._task is None and self.gc_interval > 0:
+            self._task = asyncio.ensure_future(self._collect_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Per-worker handle; the store itself is shared on disk and locked with flock
+model_store = ModelVersionStore(
+    config.MODEL_STORE_DIR,
+    retention_days=config.MODEL_VERSION_RETENTION_DAYS,
+    gc_interval=config.MODEL_STORE_GC_INTERVAL,
+    gc_grace=config.MODEL_STORE_GC_GRACE
+)
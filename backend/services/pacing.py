@@ -0,0 +1,350 @@
+import asyncio
+import email.utils
+import logging
+import random
+import re
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, Mapping, Optional, Tuple
+
+from config import config
+from models import ModelProvider
+
+logger = logging.getLogger(__name__)
+
+# Cloud providers publish their remaining quota on every response
+PACED_PROVIDERS = (ModelProvider.OPENAI, ModelProvider.ANTHROPIC)
+
+# Status codes that mean "slow down" rather than "this request is broken"
+OVERLOAD_STATUSES = (429, 503, 529)
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}T")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Seconds from OpenAI-style reset values such as "20ms", "1s" or "6m0s" """
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _UNITS[unit] for amount, unit in parts)
+
+
+def _reset_in(value: Optional[str]) -> Optional[float]:
+    """Seconds until a reset given as a duration (OpenAI) or RFC 3339 timestamp (Anthropic)"""
+    if not value:
+        return None
+    if not _TIMESTAMP.match(value):
+        return parse_duration(value)
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+    except ValueError:
+        return None
+
+
+def retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Server-requested wait in seconds from retry-after-ms or Retry-After"""
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def _int_header(headers: Mapping[str, str], *names: str) -> Optional[int]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return int(float(value))
+            except ValueError:
+                continue
+    return None
+
+
+class RateLimitState:
+    """Remaining request/token quota as last reported by the provider"""
+
+    __slots__ = ("requests", "tokens", "requests_reset_at", "tokens_reset_at")
+
+    def __init__(self):
+        self.requests: Optional[int] = None
+        self.tokens: Optional[int] = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        now = time.monotonic()
+        requests = _int_header(headers, "x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining")
+        tokens = _int_header(headers, "x-ratelimit-remaining-tokens", "anthropic-ratelimit-tokens-remaining")
+        if requests is not None:
+            self.requests = requests
+            reset = _reset_in(headers.get("x-ratelimit-reset-requests") or headers.get("anthropic-ratelimit-requests-reset"))
+            self.requests_reset_at = now + (reset if reset is not None else 1.0)
+        if tokens is not None:
+            self.tokens = tokens
+            reset = _reset_in(headers.get("x-ratelimit-reset-tokens") or headers.get("anthropic-ratelimit-tokens-reset"))
+            self.tokens_reset_at = now + (reset if reset is not None else 1.0)
+
+    def wait_for(self, tokens: int, now: float) -> float:
+        """Seconds until a request of `tokens` fits the known quota (0 when it fits now)"""
+        if self.requests is not None and now >= self.requests_reset_at:
+            self.requests = None
+        if self.tokens is not None and now >= self.tokens_reset_at:
+            self.tokens = None
+        wait = 0.0
+        if self.requests is not None and self.requests <= 0:
+            wait = self.requests_reset_at - now
+        if self.tokens is not None and self.tokens < tokens:
+            wait = max(wait, self.tokens_reset_at - now)
+        return wait
+
+    def consume(self, tokens: int) -> None:
+        # Spend from the local estimate until the next response corrects it
+        if self.requests is not None:
+            self.requests -= 1
+        if self.tokens is not None:
+            self.tokens -= tokens
+
+
+class RateLimited(Exception):
+    """Known quota will not free up within the pacer's maximum wait"""
+
+    def __init__(self, wait: float):
+        super().__init__(f"Rate limited for another {wait:.1f}s")
+        self.wait = wait
+
+
+class PacerSlot:
+    """One acquired slot; releasing it again (e.g. from a `finally`) is a no-op"""
+
+    __slots__ = ("pacer", "released")
+
+    def __init__(self, pacer: "ProviderPacer"):
+        self.pacer = pacer
+        self.released = False
+
+    def release(self, headers: Optional[Mapping[str, str]] = None, status_code: Optional[int] = None,
+                success: bool = True) -> None:
+        if self.released:
+            return
+        self.released = True
+        self.pacer.release(headers, status_code, success)
+
+
+class ProviderPacer:
+    """Paces dispatch to one provider/model.
+
+    Concurrency follows AIMD: every success raises the limit by 1/limit
+    (about one slot per round trip) and an overload response halves it, at
+    most once per `decrease_interval` so a burst of 429s from requests that
+    were already in flight counts as one signal. Dispatch also waits out
+    Retry-After and any quota the provider's rate-limit headers report as
+    exhausted.
+    """
+
+    def __init__(self, name: str, initial_concurrency: float = 8, max_concurrency: int = 64,
+                 min_concurrency: int = 1, max_wait: float = 30.0, decrease_interval: float = 1.0):
+        self.name = name
+        self.limit = float(initial_concurrency)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_wait = max_wait
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self.quota = RateLimitState()
+        self.blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.stats = {"dispatched": 0, "throttled": 0, "overloads": 0}
+
+    def _delay(self, tokens: int) -> float:
+        now = time.monotonic()
+        return max(self.blocked_until - now, self.quota.wait_for(tokens, now), 0.0)
+
+    async def acquire(self, tokens: int = 0) -> PacerSlot:
+        """Wait for a concurrency slot and enough known quota for `tokens`; release the returned slot once done"""
+        waited = 0.0
+        while True:
+            delay = self._delay(tokens)
+            if delay > 0:
+                if waited + delay > self.max_wait:
+                    raise RateLimited(delay)
+                self.stats["throttled"] += 1
+                await asyncio.sleep(delay)
+                waited += delay
+                continue
+            if self.in_flight < max(int(self.limit), self.min_concurrency):
+                break
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    self._wake()  # pass the wakeup on to the next waiter
+                raise
+        self.in_flight += 1
+        self.stats["dispatched"] += 1
+        self.quota.consume(tokens)
+        return PacerSlot(self)
+
+    def release(self, headers: Optional[Mapping[str, str]] = None, status_code: Optional[int] = None,
+                success: bool = True) -> None:
+        """Return a slot, learning from the response headers and outcome (prefer PacerSlot.release)"""
+        self.in_flight -= 1
+        try:
+            if headers:
+                self.quota.update(headers)
+            now = time.monotonic()
+            if status_code in OVERLOAD_STATUSES:
+                self.stats["overloads"] += 1
+                wait = retry_after(headers)
+                if wait:
+                    self.blocked_until = max(self.blocked_until, now + wait)
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self._last_decrease = now
+                    logger.info("Pacer %s overloaded (%s); concurrency limit now %.1f", self.name, status_code, self.limit)
+            elif success:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+        finally:
+            # Whatever the headers held, the freed slot must reach the next waiter
+            self._wake()
+
+    def _wake(self) -> None:
+        free = max(int(self.limit), self.min_concurrency) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "remaining_requests": self.quota.requests,
+            "remaining_tokens": self.quota.tokens,
+            "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 3),
+            **self.stats,
+        }
+
+
+class RetryBudget:
+    """Worker-wide cap on retries so they never multiply load during an outage.
+
+    Each first attempt deposits `ratio` tokens and each retry spends one, so
+    retries stay under roughly `ratio` of traffic; `min_per_second` keeps a
+    trickle of retries available when traffic is low.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, capacity: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.balance = capacity
+        self._refilled_at = time.monotonic()
+        self.stats = {"retries": 0, "denied": 0}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.balance = min(self.capacity, self.balance + (now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+
+    def record_request(self) -> None:
+        self._refill()
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self.balance >= 1:
+            self.balance -= 1
+            self.stats["retries"] += 1
+            return True
+        self.stats["denied"] += 1
+        return False
+
+
+def backoff_delay(attempt: int, headers: Optional[Mapping[str, str]] = None,
+                  base: float = 0.5, cap: float = 8.0) -> float:
+    """Retry-After when the provider gave one, otherwise full-jitter exponential backoff"""
+    wait = retry_after(headers)
+    if wait is not None:
+        return wait
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class PacerRegistry:
+    """Per-worker pacers keyed by provider, model and API key.
+
+    A bring-your-own-key request has its own quota, so it gets its own pacer
+    (keyed by the KeyedAdapterPool fingerprint): one tenant's 429s never
+    throttle the shared key or other tenants, and the reverse. The registry
+    is an LRU of at most `max_pacers`; only idle pacers are evicted.
+    """
+
+    def __init__(self, max_pacers: int = 256):
+        self.max_pacers = max_pacers
+        self._pacers: "OrderedDict[Tuple[ModelProvider, str, Optional[str]], ProviderPacer]" = OrderedDict()
+
+    def get(self, provider: ModelProvider, model: str, key_id: Optional[str] = None) -> Optional[ProviderPacer]:
+        if provider not in PACED_PROVIDERS:
+            return None
+        key = (provider, model, key_id)
+        pacer = self._pacers.get(key)
+        if pacer is None:
+            # Make room first, so the pacer being handed out is never the one evicted
+            self._evict(self.max_pacers - 1)
+            name = f"{provider.value}/{model}" + (f"@{key_id[:12]}" if key_id else "")
+            pacer = self._pacers[key] = ProviderPacer(
+                name,
+                initial_concurrency=config.PACER_INITIAL_CONCURRENCY,
+                max_concurrency=config.PACER_MAX_CONCURRENCY,
+                max_wait=config.PACER_MAX_WAIT
+            )
+        else:
+            self._pacers.move_to_end(key)
+        return pacer
+
+    def _evict(self, keep: int) -> None:
+        """Drop idle pacers, oldest first, until at most `keep` remain (busy ones may exceed it)"""
+        excess = len(self._pacers) - keep
+        for key in list(self._pacers):
+            if excess <= 0:
+                break
+            pacer = self._pacers[key]
+            # A pacer with requests in flight or queued is still learning; drop idle ones first
+            if pacer.in_flight == 0 and not pacer._waiters and pacer.blocked_until <= time.monotonic():
+                del self._pacers[key]
+                excess -= 1
+
+    def __len__(self) -> int:
+        return len(self._pacers)
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        return {pacer.name: pacer.snapshot() for pacer in self._pacers.values()}
+
+
+pacers = PacerRegistry(max_pacers=config.PACER_MAX_ENTRIES)
+retry_budget = RetryBudget(ratio=config.RETRY_BUDGET_RATIO, min_per_second=config.RETRY_BUDGET_MIN_PER_SECOND)
@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+from config import config
+from models import ModelProvider
+from services.providers import ProviderError, get_adapter
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderHealth:
+    """Last known state of one provider"""
+
+    __slots__ = ("provider", "healthy", "latency_ms", "checked_at", "last_success", "last_error", "consecutive_failures")
+
+    def __init__(self, provider: ModelProvider):
+        self.provider = provider
+        self.healthy: Optional[bool] = None  # None until the first probe finishes
+        self.latency_ms: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.last_success: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+
+    def to_dict(self) -> Dict[str, object]:
+        def iso(ts):
+            return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(tzinfo=None).isoformat() if ts else None
+        return {
+            "healthy": self.healthy,
+            "latency_ms": self.latency_ms,
+            "checked_at": iso(self.checked_at),
+            "last_success": iso(self.last_success),
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class ProviderHealthProber:
+    """Probes each configured provider in the background and serves the results from memory.
+
+    Every provider has its own loop that sleeps `interval` ± `jitter` between
+    probes so workers do not probe in lockstep. Request handlers only read
+    the cached snapshot and never wait on a probe. Outcomes of real traffic
+    are fed back through `observe`, so an outage is noticed before the next
+    probe and a recovery is noticed as soon as a request succeeds.
+    """
+
+    def __init__(self, providers: Sequence[ModelProvider], interval: float = 15.0, jitter: float = 0.2,
+                 timeout: float = 5.0, failure_threshold: int = 2):
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.health: Dict[ModelProvider, ProviderHealth] = {p: ProviderHealth(p) for p in providers}
+        self._status: Dict[ModelProvider, bool] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def _update(self, entry: ProviderHealth, ok: bool, error: Optional[str] = None, latency_ms: Optional[float] = None) -> None:
+        now = time.time()
+        entry.checked_at = now
+        if latency_ms is not None:
+            entry.latency_ms = round(latency_ms, 1)
+        if ok:
+            entry.healthy = True
+            entry.last_success = now
+            entry.consecutive_failures = 0
+        else:
+            entry.consecutive_failures += 1
+            entry.last_error = error
+            # One failed probe can be a blip; mark down only after repeated failures
+            if entry.healthy is None or entry.consecutive_failures >= self.failure_threshold:
+                if entry.healthy:
+                    logger.warning("Provider %s marked unhealthy: %s", entry.provider.value, error)
+                entry.healthy = False
+        self._status[entry.provider] = bool(entry.healthy)
+
+    async def probe(self, provider: ModelProvider) -> ProviderHealth:
+        """Run one probe now and record the result"""
+        entry = self.health[provider]
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(get_adapter(provider).probe(), self.timeout)
+            self._update(entry, True, latency_ms=(time.perf_counter() - started) * 1000)
+        except asyncio.TimeoutError:
+            self._update(entry, False, f"probe timed out after {self.timeout:.0f}s")
+        except ProviderError as e:
+            self._update(entry, False, str(e)[:300], (time.perf_counter() - started) * 1000)
+        except Exception as e:
+            self._update(entry, False, f"{type(e).__name__}: {e}"[:300])
+        return entry
+
+    async def _loop(self, provider: ModelProvider) -> None:
+        while True:
+            await self.probe(provider)
+            # Jitter keeps probes from different workers from lining up
+            await asyncio.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def observe(self, provider: Union[ModelProvider, str], ok: bool, error: Optional[str] = None) -> None:
+        """Passive signal from a real request"""
+        entry = self.health.get(ModelProvider(provider))
+        if entry is not None:
+            self._update(entry, ok, error)
+
+    def is_healthy(self, provider: Union[ModelProvider, str]) -> bool:
+        """Cached health; providers that have not been probed yet are assumed healthy"""
+        return self._status.get(ModelProvider(provider), True)
+
+    def status(self) -> Dict[ModelProvider, bool]:
+        """Per-provider booleans for ModelListResponse.provider_status and SystemDiagnostics.providers"""
+        return dict(self._status)
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        return {provider.value: entry.to_dict() for provider, entry in self.health.items()}
+
+    def choose(self, preferred: ModelProvider, fallbacks: Sequence[ModelProvider] = ()) -> ModelProvider:
+        """The preferred provider if it is healthy, otherwise the first healthy fallback"""
+        if self.is_healthy(preferred):
+            return preferred
+        for candidate in fallbacks:
+            if candidate != preferred and candidate in self.health and self.is_healthy(candidate):
+                logger.info("Routing around unhealthy %s to %s", preferred.value, candidate.value)
+                return candidate
+        return preferred
+
+    def start(self) -> None:
+        """Start one background probe loop per provider; the first probes run immediately"""
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._loop(p)) for p in self.health]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def _configured_providers() -> List[ModelProvider]:
+    providers = [ModelProvider(config.DEFAULT_PROVIDER)]
+    if config.OPENAI_API_KEY:
+        providers.append(ModelProvider.OPENAI)
+    if config.ANTHROPIC_API_KEY:
+        providers.append(ModelProvider.ANTHROPIC)
+    if config.OLLAMA_HOT_MODELS:
+        providers.append(ModelProvider.OLLAMA)
+    providers.extend(ModelProvider(p) for p in config.PROVIDER_FALLBACKS)
+    return list(dict.fromkeys(providers))
+
+
+# Per-worker prober
+provider_health = ProviderHealthProber(
+    _configured_providers(),
+    interval=config.PROVIDER_PROBE_INTERVAL,
+    timeout=config.PROVIDER_PROBE_TIMEOUT
+)
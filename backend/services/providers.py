@@ -0,0 +1,573 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Set, Tuple, Union
+
+import anthropic
+import httpx
+import openai
+
+from config import config
+from models import ModelProvider
+from services.local_inference import LocalInferenceProvider, UnknownModel
+from utils.model_residency import ModelUnavailable, residency
+from utils.request_context import get_tenant_id
+from utils.token_accounting import token_counter
+
+logger = logging.getLogger(__name__)
+
+Messages = List[Dict[str, str]]
+
+
+class ProviderError(Exception):
+    """A provider call failed; `retryable` tells callers whether trying again can help"""
+
+    def __init__(self, provider: ModelProvider, message: str, status_code: Optional[int] = None, retryable: bool = False,
+                 headers: Optional[Mapping[str, str]] = None):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+        self.retryable = retryable
+        self.headers = headers
+
+
+class ChatResult:
+    """Provider-independent completion with normalized usage"""
+
+    __slots__ = ("text", "model", "provider", "prompt_tokens", "completion_tokens", "finish_reason", "headers", "cost", "source")
+
+    def __init__(self, text: str, model: str, provider: ModelProvider, prompt_tokens: int = 0,
+                 completion_tokens: int = 0, finish_reason: Optional[str] = None,
+                 headers: Optional[Mapping[str, str]] = None):
+        self.text = text
+        self.model = model
+        self.provider = provider
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.finish_reason = finish_reason
+        # Response headers, kept so the pacer can read rate-limit state
+        self.headers = headers
+        self.cost = 0.0
+        # Set when the answer did not come from the model (e.g. "travel_facts")
+        self.source: Optional[str] = None
+
+    @property
+    def tokens_used(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def truncated(self) -> bool:
+        return self.finish_reason in ("length", "max_tokens")
+
+    def metadata(self) -> Dict[str, Any]:
+        """Usage details for QueryResponse.metadata"""
+        metadata = {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "finish_reason": self.finish_reason,
+            "cost_usd": round(self.cost, 6),
+        }
+        if self.source:
+            metadata["source"] = self.source
+        return metadata
+
+
+StreamItem = Union[str, ChatResult]
+
+
+def _pooled_http_client(timeout: float = 60.0, max_connections: Optional[int] = None,
+                        max_keepalive: Optional[int] = None) -> httpx.AsyncClient:
+    """Long-lived keep-alive HTTP client shared by every request to one provider"""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=5.0),
+        limits=httpx.Limits(
+            max_connections=max_connections or config.PROVIDER_MAX_CONNECTIONS,
+            max_keepalive_connections=max_keepalive or config.PROVIDER_MAX_KEEPALIVE,
+            keepalive_expiry=60.0
+        )
+    )
+
+
+class ProviderAdapter(ABC):
+    """Common async interface over every model provider.
+
+    `stream` yields text deltas followed by exactly one ChatResult carrying
+    the complete text and usage.
+    """
+
+    provider: ModelProvider
+
+    @abstractmethod
+    async def chat(self, messages: Messages, model: str, temperature: float = 0.7,
+                   max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> ChatResult:
+        ...
+
+    @abstractmethod
+    def stream(self, messages: Messages, model: str, temperature: float = 0.7,
+               max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> AsyncIterator[StreamItem]:
+        ...
+
+    def count_tokens(self, text: str, model: Optional[str] = None) -> int:
+        """Token count with the model's tokenizer when one is available, otherwise an estimate"""
+        return token_counter.count(text, model)
+
+    @abstractmethod
+    async def probe(self) -> None:
+        """Cheapest call that proves the provider is usable; raises ProviderError otherwise"""
+
+    async def health(self) -> bool:
+        try:
+            await self.probe()
+            return True
+        except ProviderError:
+            return False
+
+    async def warm_up(self) -> None:
+        """Open pooled connections before the worker reports ready"""
+        await self.health()
+
+    async def close(self) -> None:
+        pass
+
+
+class OpenAIAdapter(ProviderAdapter):
+    provider = ModelProvider.OPENAI
+
+    def __init__(self, api_key: Optional[str] = None, max_connections: Optional[int] = None,
+                 max_keepalive: Optional[int] = None):
+        self.api_key = api_key or config.OPENAI_API_KEY
+        self.http_client = _pooled_http_client(max_connections=max_connections, max_keepalive=max_keepalive)
+        self.client = openai.AsyncOpenAI(api_key=self.api_key or "missing", http_client=self.http_client, max_retries=0)
+
+    def _error(self, e: Exception) -> ProviderError:
+        if isinstance(e, openai.APIStatusError):
+            # A 429 for an exhausted billing quota will not clear by waiting
+            retryable = (e.status_code in (408, 409, 429) or e.status_code >= 500) and e.code != "insufficient_quota"
+            return ProviderError(self.provider, str(e), e.status_code, retryable=retryable, headers=e.response.headers)
+        if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+            return ProviderError(self.provider, str(e), retryable=True)
+        return ProviderError(self.provider, str(e))
+
+    def _require_key(self) -> None:
+        if not self.api_key:
+            raise ProviderError(self.provider, "OpenAI API key not configured")
+
+    async def chat(self, messages, model, temperature=0.7, max_tokens=None, stop=None) -> ChatResult:
+        self._require_key()
+        try:
+            raw = await self.client.chat.completions.with_raw_response.create(
+                model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, stop=stop
+            )
+            response = raw.parse()
+        except openai.OpenAIError as e:
+            raise self._error(e) from e
+        choice = response.choices[0]
+        usage = response.usage
+        return ChatResult(
+            choice.message.content or "", response.model or model, self.provider,
+            usage.prompt_tokens if usage else 0, usage.completion_tokens if usage else 0, choice.finish_reason,
+            raw.headers
+        )
+
+    async def stream(self, messages, model, temperature=0.7, max_tokens=None, stop=None):
+        self._require_key()
+        parts, finish_reason, usage = [], None, None
+        try:
+            raw = await self.client.chat.completions.with_raw_response.create(
+                model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, stop=stop,
+                stream=True, stream_options={"include_usage": True}
+            )
+            async for chunk in raw.parse():
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        parts.append(choice.delta.content)
+                        yield choice.delta.content
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+        except openai.OpenAIError as e:
+            raise self._error(e) from e
+        yield ChatResult("".join(parts), model, self.provider,
+                         usage.prompt_tokens if usage else 0, usage.completion_tokens if usage else 0, finish_reason,
+                         raw.headers)
+
+    async def probe(self) -> None:
+        self._require_key()
+        try:
+            await self.client.with_options(timeout=10).models.retrieve(config.OPENAI_MODEL)
+        except openai.OpenAIError as e:
+            raise self._error(e) from e
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class AnthropicAdapter(ProviderAdapter):
+    provider = ModelProvider.ANTHROPIC
+
+    def __init__(self, api_key: Optional[str] = None, max_connections: Optional[int] = None,
+                 max_keepalive: Optional[int] = None):
+        self.api_key = api_key or config.ANTHROPIC_API_KEY
+        self.http_client = _pooled_http_client(max_connections=max_connections, max_keepalive=max_keepalive)
+        self.client = anthropic.AsyncAnthropic(api_key=self.api_key or "missing", http_client=self.http_client, max_retries=0)
+
+    def _error(self, e: Exception) -> ProviderError:
+        if isinstance(e, anthropic.APIStatusError):
+            # 529 is Anthropic's "overloaded"
+            return ProviderError(self.provider, str(e), e.status_code, retryable=e.status_code in (408, 409, 429) or e.status_code >= 500,
+                                 headers=e.response.headers)
+        if isinstance(e, (anthropic.APIConnectionError, anthropic.APITimeoutError)):
+            return ProviderError(self.provider, str(e), retryable=True)
+        return ProviderError(self.provider, str(e))
+
+    @staticmethod
+    def _split(messages: Messages):
+        """Anthropic takes the system prompt separately from the conversation"""
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        conversation = [m for m in messages if m["role"] != "system"]
+        return system, conversation
+
+    def _params(self, messages, model, temperature, max_tokens, stop) -> Dict[str, Any]:
+        if not self.api_key:
+            raise ProviderError(self.provider, "Anthropic API key not configured")
+        system, conversation = self._split(messages)
+        params = {"model": model, "messages": conversation, "temperature": temperature, "max_tokens": max_tokens or 1024}
+        if system:
+            params["system"] = system
+        if stop:
+            params["stop_sequences"] = stop
+        return params
+
+    async def chat(self, messages, model, temperature=0.7, max_tokens=None, stop=None) -> ChatResult:
+        params = self._params(messages, model, temperature, max_tokens, stop)
+        try:
+            raw = await self.client.messages.with_raw_response.create(**params)
+            response = raw.parse()
+        except anthropic.AnthropicError as e:
+            raise self._error(e) from e
+        text = "".join(block.text for block in response.content if block.type == "text")
+        return ChatResult(text, response.model, self.provider, response.usage.input_tokens,
+                          response.usage.output_tokens, response.stop_reason, raw.headers)
+
+    async def stream(self, messages, model, temperature=0.7, max_tokens=None, stop=None):
+        params = self._params(messages, model, temperature, max_tokens, stop)
+        parts, prompt_tokens, completion_tokens, finish_reason = [], 0, 0, None
+        try:
+            raw = await self.client.messages.with_raw_response.create(stream=True, **params)
+            async for event in raw.parse():
+                if event.type == "message_start":
+                    prompt_tokens = event.message.usage.input_tokens
+                elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                    parts.append(event.delta.text)
+                    yield event.delta.text
+                elif event.type == "message_delta":
+                    completion_tokens = event.usage.output_tokens
+                    finish_reason = event.delta.stop_reason
+        except anthropic.AnthropicError as e:
+            raise self._error(e) from e
+        yield ChatResult("".join(parts), model, self.provider, prompt_tokens, completion_tokens, finish_reason, raw.headers)
+
+    async def probe(self) -> None:
+        if not self.api_key:
+            raise ProviderError(self.provider, "Anthropic API key not configured")
+        try:
+            await self.client.with_options(timeout=10).models.list(limit=1)
+        except anthropic.AnthropicError as e:
+            raise self._error(e) from e
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class OllamaAdapter(ProviderAdapter):
+    """Ollama chat API; shares the residency manager's pooled client and keeps models resident"""
+
+    provider = ModelProvider.OLLAMA
+
+    def _payload(self, messages, model, temperature, max_tokens, stop, stream: bool) -> Dict[str, Any]:
+        options: Dict[str, Any] = {"temperature": temperature}
+        if max_tokens:
+            options["num_predict"] = max_tokens
+        if stop:
+            options["stop"] = stop
+        return {"model": model, "messages": messages, "options": options, "stream": stream,
+                "keep_alive": residency.keep_alive_for(model)}
+
+    @staticmethod
+    def _finish_reason(body: Dict[str, Any]) -> Optional[str]:
+        return body.get("done_reason") or ("stop" if body.get("done") else None)
+
+    def _error(self, e: Exception) -> ProviderError:
+        if isinstance(e, ModelUnavailable):
+            return ProviderError(self.provider, str(e), 503, retryable=True)
+        if isinstance(e, httpx.HTTPStatusError):
+            status = e.response.status_code
+            return ProviderError(self.provider, e.response.text, status, retryable=status >= 500)
+        return ProviderError(self.provider, str(e), retryable=isinstance(e, httpx.TransportError))
+
+    async def chat(self, messages, model, temperature=0.7, max_tokens=None, stop=None) -> ChatResult:
+        try:
+            async with residency.use(model):
+                response = await residency.client.post("/api/chat", json=self._payload(messages, model, temperature, max_tokens, stop, False))
+                response.raise_for_status()
+        except (httpx.HTTPError, ModelUnavailable) as e:
+            raise self._error(e) from e
+        body = response.json()
+        return ChatResult(body.get("message", {}).get("content", ""), model, self.provider,
+                          body.get("prompt_eval_count", 0), body.get("eval_count", 0), self._finish_reason(body))
+
+    async def stream(self, messages, model, temperature=0.7, max_tokens=None, stop=None):
+        parts, body = [], {}
+        try:
+            async with residency.use(model):
+                payload = self._payload(messages, model, temperature, max_tokens, stop, True)
+                async with residency.client.stream("POST", "/api/chat", json=payload) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        body = json.loads(line)
+                        delta = body.get("message", {}).get("content", "")
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+        except (httpx.HTTPError, ModelUnavailable) as e:
+            raise self._error(e) from e
+        yield ChatResult("".join(parts), model, self.provider, body.get("prompt_eval_count", 0),
+                         body.get("eval_count", 0), self._finish_reason(body))
+
+    async def probe(self) -> None:
+        try:
+            response = await residency.client.get("/api/version", timeout=5.0)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise self._error(e) from e
+
+    async def close(self) -> None:
+        await residency.close()
+
+
+class HuggingFaceAdapter(ProviderAdapter):
+    """In-process models served by the dynamic batcher"""
+
+    provider = ModelProvider.HUGGINGFACE
+
+    def __init__(self):
+        self.local = LocalInferenceProvider(
+            max_batch_size=config.HF_MAX_BATCH_SIZE,
+            max_wait_ms=config.HF_BATCH_WAIT_MS,
+            max_new_tokens=config.HF_MAX_NEW_TOKENS,
+            num_threads=config.HF_NUM_THREADS,
+            allowed_models=[config.HF_MODEL, *config.HF_ALLOWED_MODELS]
+        )
+
+    async def _batcher(self, model: str):
+        try:
+            return await self.local.get(model)
+        except UnknownModel:
+            raise ProviderError(self.provider, f"Model {model} is not available for local inference", 400)
+        except Exception as e:
+            raise ProviderError(self.provider, f"Loading {model} failed: {e}") from e
+
+    async def chat(self, messages, model, temperature=0.7, max_tokens=None, stop=None) -> ChatResult:
+        batcher = await self._batcher(model)
+        try:
+            text, usage = await batcher.generate(messages, max_tokens, temperature)
+        except Exception as e:
+            raise ProviderError(self.provider, str(e)) from e
+        return ChatResult(text, model, self.provider, usage.prompt_tokens, usage.completion_tokens, usage.finish_reason)
+
+    async def stream(self, messages, model, temperature=0.7, max_tokens=None, stop=None):
+        batcher = await self._batcher(model)
+        request = batcher.submit(batcher.build_prompt(messages), max_tokens, temperature)
+        parts = []
+        try:
+            while True:
+                item = await request.output.get()
+                if isinstance(item, str):
+                    parts.append(item)
+                    yield item
+                    continue
+                if item.error is not None:
+                    raise ProviderError(self.provider, str(item.error))
+                yield ChatResult("".join(parts), model, self.provider, item.prompt_tokens, item.completion_tokens, item.finish_reason)
+                return
+        finally:
+            request.cancelled = True
+
+    def count_tokens(self, text: str, model: Optional[str] = None) -> int:
+        batcher = self.local.batchers.get(model or config.HF_MODEL)
+        if batcher is not None and batcher.tokenizer is not None:
+            return len(batcher.tokenizer.encode(text))
+        return super().count_tokens(text, model)
+
+    async def probe(self) -> None:
+        if config.HF_MODEL not in self.local.batchers:
+            raise ProviderError(self.provider, f"{config.HF_MODEL} is not loaded")
+
+    async def warm_up(self) -> None:
+        # Loading weights is blocking; keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.local.preload, config.HF_MODEL)
+
+    async def close(self) -> None:
+        self.local.close()
+
+
+_ADAPTER_CLASSES = {
+    ModelProvider.OPENAI: OpenAIAdapter,
+    ModelProvider.ANTHROPIC: AnthropicAdapter,
+    ModelProvider.OLLAMA: OllamaAdapter,
+    ModelProvider.HUGGINGFACE: HuggingFaceAdapter,
+}
+_adapters: Dict[ModelProvider, ProviderAdapter] = {}
+
+
+def get_adapter(provider: Union[ModelProvider, str]) -> ProviderAdapter:
+    """Return this worker's adapter for `provider`, creating it on first use"""
+    provider = ModelProvider(provider)
+    adapter = _adapters.get(provider)
+    if adapter is None:
+        adapter_class = _ADAPTER_CLASSES.get(provider)
+        if adapter_class is None:
+            raise ProviderError(provider, f"Provider {provider.value} is not supported")
+        adapter = _adapters[provider] = adapter_class()
+    return adapter
+
+
+def default_model_for(provider: Union[ModelProvider, str]) -> str:
+    """Model used when a request does not name one"""
+    return {
+        ModelProvider.OPENAI: config.OPENAI_MODEL,
+        ModelProvider.ANTHROPIC: config.ANTHROPIC_MODEL,
+        ModelProvider.OLLAMA: config.DEFAULT_MODEL,
+        ModelProvider.HUGGINGFACE: config.HF_MODEL,
+    }.get(ModelProvider(provider), config.DEFAULT_MODEL)
+
+
+class _KeyedEntry:
+    __slots__ = ("adapter", "last_used", "leases", "retired")
+
+    def __init__(self, adapter: ProviderAdapter):
+        self.adapter = adapter
+        self.last_used = time.monotonic()
+        self.leases = 0
+        self.retired = False
+
+
+class KeyedAdapterPool:
+    """Per-worker LRU of adapters for bring-your-own-key requests.
+
+    Entries are keyed by provider and a SHA-256 fingerprint of tenant and key,
+    so raw keys are never used as lookup keys or logged and two tenants never
+    share connections. Each entry owns a small connection pool; entries idle
+    longer than `idle_timeout` or pushed out by `max_pools` are retired and
+    closed once their last in-flight request releases them.
+    """
+
+    BYOK_PROVIDERS = (ModelProvider.OPENAI, ModelProvider.ANTHROPIC)
+
+    def __init__(self, max_pools: int, idle_timeout: float, max_connections: int, max_keepalive: int):
+        self.max_pools = max_pools
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self._entries: "OrderedDict[Tuple[ModelProvider, str], _KeyedEntry]" = OrderedDict()
+        self._closing: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def fingerprint(api_key: str, tenant_id: Optional[str] = None) -> str:
+        return hashlib.sha256(f"{tenant_id or ''}\0{api_key}".encode()).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _retire(self, key: Tuple[ModelProvider, str]) -> None:
+        entry = self._entries.pop(key)
+        entry.retired = True
+        if entry.leases == 0:
+            self._close_later(entry.adapter)
+
+    @staticmethod
+    async def _close_quietly(adapter: ProviderAdapter) -> None:
+        try:
+            await adapter.close()
+        except Exception as e:
+            logger.warning("Closing %s client pool failed: %s", adapter.provider.value, e)
+
+    def _close_later(self, adapter: ProviderAdapter) -> None:
+        task = asyncio.ensure_future(self._close_quietly(adapter))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def sweep(self) -> None:
+        """Retire pools that have been idle longer than `idle_timeout`"""
+        cutoff = time.monotonic() - self.idle_timeout
+        for key, entry in list(self._entries.items()):
+            if entry.leases == 0 and entry.last_used < cutoff:
+                self._retire(key)
+
+    @asynccontextmanager
+    async def lease(self, provider: ModelProvider, api_key: str, tenant_id: Optional[str] = None):
+        """Borrow the adapter for this tenant's key, creating its pool on first use"""
+        if provider not in self.BYOK_PROVIDERS:
+            raise ProviderError(provider, f"Provider {provider.value} does not accept API keys")
+        self.sweep()
+        key = (provider, self.fingerprint(api_key, tenant_id))
+        entry = self._entries.get(key)
+        if entry is None:
+            adapter = _ADAPTER_CLASSES[provider](api_key, self.max_connections, self.max_keepalive)
+            entry = self._entries[key] = _KeyedEntry(adapter)
+            logger.debug("Opened %s client pool for key %s", provider.value, key[1][:12])
+        self._entries.move_to_end(key)
+        entry.leases += 1
+        while len(self._entries) > self.max_pools:
+            self._retire(next(iter(self._entries)))
+        try:
+            yield entry.adapter
+        finally:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            if entry.retired and entry.leases == 0:
+                self._close_later(entry.adapter)
+
+    async def close(self) -> None:
+        for key in list(self._entries):
+            self._retire(key)
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+
+byok_pool = KeyedAdapterPool(
+    max_pools=config.BYOK_MAX_POOLS,
+    idle_timeout=config.BYOK_IDLE_TIMEOUT,
+    max_connections=config.BYOK_MAX_CONNECTIONS,
+    max_keepalive=config.BYOK_MAX_KEEPALIVE
+)
+
+
+@asynccontextmanager
+async def lease_adapter(provider: Union[ModelProvider, str], api_key: Optional[str] = None,
+                        tenant_id: Optional[str] = None):
+    """Adapter for a request: the caller's own key gets its own pool, otherwise the shared one"""
+    provider = ModelProvider(provider)
+    if api_key and provider in KeyedAdapterPool.BYOK_PROVIDERS:
+        async with byok_pool.lease(provider, api_key, tenant_id or get_tenant_id()) as adapter:
+            yield adapter
+    else:
+        yield get_adapter(provider)
+
+
+async def close_adapters() -> None:
+    await byok_pool.close()
+    for adapter in list(_adapters.values()):
+        try:
+            await adapter.close()
+        except Exception as e:
+            logger.warning("Closing %s adapter failed: %s", adapter.provider.value, e)
+    _adapters.clear()
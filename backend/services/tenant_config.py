@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+from pymongo.errors import OperationFailure, PyMongoError
+
+from config import config
+from models import TenantInfo, UserPreferences
+
+logger = logging.getLogger(__name__)
+
+# kind -> (collection, id field, model)
+_KINDS = {
+    "tenant": ("tenants", "tenant_id", TenantInfo),
+    "user": ("user_preferences", "user_id", UserPreferences),
+}
+# Server errors meaning change streams are unavailable (standalone server, or not permitted)
+_NO_CHANGE_STREAMS = {40573, 136, 13, 8000}
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "stale_until")
+
+    def __init__(self, value: Optional[BaseModel], ttl: float, stale: float):
+        now = time.monotonic()
+        # Jitter spreads the expiry of entries loaded together (e.g. after a restart)
+        self.expires_at = now + ttl * random.uniform(0.9, 1.0)
+        self.stale_until = self.expires_at + stale
+        self.value = value
+
+
+class TenantConfigCache:
+    """Read-through cache of tenant settings and user preferences.
+
+    A fresh entry is returned without awaiting anything, so requests from a
+    hot tenant cost no database round trips. Misses for the same key share
+    one load; tenants or users with no document are cached too (for a shorter
+    `negative_ttl`) so unknown ids do not reach MongoDB on every request.
+    After `ttl` an entry is still served for up to `stale` seconds while one
+    background load refreshes it.
+
+    Changes are pushed by a MongoDB change stream on both collections, which
+    overwrites or evicts the affected entry as soon as the write commits. On
+    a standalone server, where change streams are unavailable, the cached
+    ids are re-read in bulk every `poll_interval` seconds instead.
+    """
+
+    def __init__(self, ttl: float = 300.0, negative_ttl: float = 30.0, stale: float = 60.0, max_entries: int = 10000,
+                 poll_interval: float = 15.0):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale = stale
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._database = None
+        self.mode = "off"
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "loads": 0, "load_errors": 0, "invalidations": 0}
+
+    async def tenant(self, tenant_id: Optional[str]) -> Optional[TenantInfo]:
+        return await self._get("tenant", tenant_id) if tenant_id else None
+
+    async def user(self, user_id: Optional[str]) -> Optional[UserPreferences]:
+        return await self._get("user", user_id) if user_id else None
+
+    async def _get(self, kind: str, key_id: str) -> Optional[BaseModel]:
+        key = (kind, key_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            now = time.monotonic()
+            if now < entry.expires_at:
+                self.stats["hits"] += 1
+                self._entries.move_to_end(key)
+                return entry.value
+            if now < entry.stale_until:
+                self.stats["stale_hits"] += 1
+                if key not in self._loading:
+                    self._start_load(key)
+                return entry.value
+        self.stats["misses"] += 1
+        if self._database is None:
+            return None
+        pending = self._loading.get(key) or self._start_load(key)
+        return await asyncio.shield(pending)
+
+    def _start_load(self, key: Tuple[str, str]) -> asyncio.Future:
+        future = self._loading[key] = asyncio.ensure_future(self._load(key))
+
+        def done(f: asyncio.Future) -> None:
+            if self._loading.get(key) is f:
+                del self._loading[key]
+            # Background refreshes have no awaiter; retrieve the error so it is not reported as unhandled
+            if not f.cancelled() and f.exception() is not None:
+                logger.debug("Loading %s %s failed: %s", key[0], key[1], f.exception())
+
+        future.add_done_callback(done)
+        return future
+
+    async def _load(self, key: Tuple[str, str]) -> Optional[BaseModel]:
+        kind, key_id = key
+        collection, field, _ = _KINDS[kind]
+        self.stats["loads"] += 1
+        try:
+            document = await self._database[collection].find_one({field: key_id}, {"_id": 0})
+        except PyMongoError as e:
+            self.stats["load_errors"] += 1
+            stale = self._entries.get(key)
+            if stale is not None:
+                logger.warning("Could not refresh %s %s, serving the cached copy: %s", kind, key_id, e)
+                return stale.value
+            raise
+        return self._store(key, document)
+
+    def _store(self, key: Tuple[str, str], document: Optional[Dict[str, Any]]) -> Optional[BaseModel]:
+        kind, key_id = key
+        value = None
+        if document is not None:
+            document.pop("_id", None)
+            try:
+                value = _KINDS[kind][2].model_validate(document)
+            except ValidationError as e:
+                # Cache the miss so a malformed document is not re-read on every request
+                logger.warning("Ignoring invalid %s document %s: %s", kind, key_id, e.errors()[:3])
+        self._entries[key] = _Entry(value, self.ttl if value is not None else self.negative_ttl, self.stale)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, kind: Optional[str] = None, key_id: Optional[str] = None) -> int:
+        """Drop one entry, every entry of a kind, or everything; returns the number dropped"""
+        if kind is not None and key_id is not None:
+            dropped = 1 if self._entries.pop((kind, key_id), None) is not None else 0
+        else:
+            keys = [key for key in self._entries if kind is None or key[0] == kind]
+            for key in keys:
+                del self._entries[key]
+            dropped = len(keys)
+        self.stats["invalidations"] += dropped
+        return dropped
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["stale_hits"] + self.stats["misses"]
+        return {
+            "mode": self.mode,
+            "entries": len(self._entries),
+            "hit_ratio": round((self.stats["hits"] + self.stats["stale_hits"]) / lookups, 4) if lookups else None,
+            **self.stats
+        }
+
+    async def _watch(self, kind: str) -> None:
+        """Apply change events to the cache; falls back to polling when change streams are unavailable"""
+        collection, field, _ = _KINDS[kind]
+        resume_token = None
+        delay = 1.0
+        while True:
+            try:
+                async with self._database[collection].watch(
+                    [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}],
+                    full_document="updateLookup",
+                    resume_after=resume_token
+                ) as stream:
+                    self.mode = "change_stream"
+                    delay = 1.0
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._apply(kind, field, change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in _NO_CHANGE_STREAMS:
+                    logger.info("Change streams unavailable for %s (%s); polling every %.0fs", collection, e, self.poll_interval)
+                    await self._poll(kind)
+                    return
+                logger.warning("Change stream on %s failed, reconnecting: %s", collection, e)
+                resume_token = None
+            except PyMongoError as e:
+                logger.warning("Change stream on %s interrupted, resuming: %s", collection, e)
+            # Entries may have missed events while disconnected; let them expire normally but not linger stale
+            for key, entry in self._entries.items():
+                if key[0] == kind:
+                    entry.stale_until = entry.expires_at
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def _apply(self, kind: str, field: str, change: Dict[str, Any]) -> None:
+        document = change.get("fullDocument")
+        if document is not None and field in document:
+            key = (kind, document[field])
+            # Only refresh ids this worker has cached; others are loaded on first use
+            if key in self._entries:
+                self._store(key, document)
+                self.stats["invalidations"] += 1
+            return
+        # Deletes only carry _id, so the affected entry cannot be identified: drop the kind
+        self.invalidate(kind)
+
+    async def _poll(self, kind: str) -> None:
+        collection, field, _ = _KINDS[kind]
+        self.mode = "polling"
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            ids = [key_id for (entry_kind, key_id) in list(self._entries) if entry_kind == kind]
+            for start in range(0, len(ids), 1000):
+                batch = ids[start:start + 1000]
+                try:
+                    documents = {
+                        document[field]: document
+                        async for document in self._database[collection].find({field: {"$in": batch}}, {"_id": 0})
+                    }
+                except PyMongoError as e:
+                    logger.warning("Polling %s failed: %s", collection, e)
+                    break
+                for key_id in batch:
+                    if (kind, key_id) in self._entries:
+                        self._store((kind, key_id), documents.get(key_id))
+
+    def start(self, database) -> None:
+        self._database = database
+        if not self._tasks and config.TENANT_CACHE_WATCH:
+            self._tasks = [asyncio.ensure_future(self._watch(kind)) for kind in _KINDS]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tasks = []
+        self.mode = "off"
+
+
+# Per-worker cache
+tenant_config = TenantConfigCache(
+    ttl=config.TENANT_CACHE_TTL,
+    negative_ttl=config.TENANT_CACHE_NEGATIVE_TTL,
+    stale=config.TENANT_CACHE_STALE,
+    max_entries=config.TENANT_CACHE_SIZE,
+    poll_interval=config.TENANT_CACHE_POLL_INTERVAL
+)
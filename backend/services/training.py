@@ -0,0 +1,692 @@
+import asyncio
+import datetime
+import fcntl
+import glob
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+
+from config import config
+from models import ModelProvider, ModelTrainingConfig, ModelTrainingStatus, TrainingResult
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TEMPLATE = "### Question:\n{question}\n\n### Answer:\n"
+_TERMINAL = ("complete", "failed", "cancelled")
+
+
+class TrainingError(ValueError):
+    """Rejected training request; the message is safe to return to the client"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# ---------------------------------------------------------------------------
+# Worker process side. Everything below runs in a spawned process per job, so
+# torch and transformers are imported there and never in the server.
+# ---------------------------------------------------------------------------
+
+class _MongoSource:
+    """Successful chat history exchanges in _id order; the cursor is the last _id consumed"""
+
+    def __init__(self, uri: str, tenant_id: Optional[str]):
+        from pymongo import MongoClient
+
+        self.collection = MongoClient(uri).neuralnexus.chat_history
+        # Same tenant scoping as the export; (tenant_id, _id) is served by the chat_history_export index
+        self.query = {"tenant_id": tenant_id, "status": "success", "response": {"$nin": ["", None]}}
+
+    def count(self) -> int:
+        return self.collection.count_documents(self.query)
+
+    def iterate(self, after=None) -> Iterator[Tuple[str, str, Any]]:
+        query = dict(self.query, _id={"$gt": after}) if after is not None else self.query
+        for document in self.collection.find(query, {"query": 1, "response": 1}).sort("_id", 1).batch_size(256):
+            yield document["query"], document["response"], document["_id"]
+
+
+class _FileSource:
+    """JSONL rows with question/prompt and answer/response; the cursor is the line number"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def count(self) -> int:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return sum(1 for line in f if line.strip())
+
+    def iterate(self, after=None) -> Iterator[Tuple[str, str, Any]]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f):
+                if (after is not None and number <= after) or not line.strip():
+                    continue
+                row = json.loads(line)
+                yield row.get("question") or row.get("prompt"), row.get("answer") or row.get("response"), number
+
+
+def _open_source(dataset: str, spec: Dict[str, Any]):
+    if dataset == "chat_history":
+        # Resolved here rather than stored in job.json: the URI may carry credentials
+        return _MongoSource(config.MONGODB_URI, spec["tenant_id"])
+    return _FileSource(dataset)
+
+
+def _prefetch(source, after, tokenizer, micro_batch: int, max_length: int, depth: int):
+    """Tokenize and collate micro-batches on a background thread, `depth` batches ahead of training"""
+    import torch
+
+    batches: "queue.Queue" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def encode(question: str, answer: str) -> Tuple[List[int], List[int]]:
+        prompt = tokenizer(PROMPT_TEMPLATE.format(question=question), add_special_tokens=True)["input_ids"]
+        completion = tokenizer(answer, add_special_tokens=False)["input_ids"] + [tokenizer.eos_token_id]
+        ids = (prompt + completion)[:max_length]
+        # Loss only on the answer: the model should learn to reply, not to ask
+        labels = ([-100] * len(prompt) + completion)[:max_length]
+        return ids, labels
+
+    def collate(rows):
+        width = max(len(ids) for ids, _ in rows)
+        input_ids = torch.full((len(rows), width), tokenizer.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(rows), width), -100, dtype=torch.long)
+        attention = torch.zeros((len(rows), width), dtype=torch.long)
+        for i, (ids, row_labels) in enumerate(rows):
+            input_ids[i, :len(ids)] = torch.tensor(ids)
+            labels[i, :len(row_labels)] = torch.tensor(row_labels)
+            attention[i, :len(ids)] = 1
+        return {"input_ids": input_ids, "attention_mask": attention, "labels": labels}
+
+    def produce():
+        try:
+            rows, cursor = [], after
+            for question, answer, cursor in source.iterate(after):
+                if stop.is_set():
+                    return
+                if not question or not answer:
+                    continue
+                rows.append(encode(question, answer))
+                if len(rows) == micro_batch:
+                    batches.put((collate(rows), cursor, len(rows)))
+                    rows = []
+            if rows:
+                batches.put((collate(rows), cursor, len(rows)))
+            batches.put(None)
+        except Exception as e:
+            batches.put(e)
+
+    thread = threading.Thread(target=produce, name="training-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def plan_micro_batch(model_config, batch_size: int, max_length: int, budget_mb: float, dtype_bytes: int) -> Tuple[int, int]:
+    """Largest micro-batch whose activations fit the budget, and the accumulation steps to reach batch_size.
+
+    Activation memory per sequence is estimated as s*h*L*(34 + 5*a*s/h) bytes
+    for 16-bit activations (Korthikanti et al.), scaled for the dtype used.
+    """
+    hidden = getattr(model_config, "hidden_size", None) or getattr(model_config, "n_embd", 768)
+    layers = getattr(model_config, "num_hidden_layers", None) or getattr(model_config, "n_layer", 12)
+    heads = getattr(model_config, "num_attention_heads", None) or getattr(model_config, "n_head", 12)
+    per_sequence = max_length * hidden * layers * (34 + 5 * heads * max_length / hidden) * dtype_bytes / 2
+    micro = max(1, min(batch_size, int(budget_mb * 1024 * 1024 // per_sequence)))
+    accumulation = math.ceil(batch_size / micro)
+    # Even out the micro-batches so the effective batch is as close to batch_size as possible
+    return math.ceil(batch_size / accumulation), accumulation
+
+
+def _bf16_supported() -> bool:
+    import torch
+
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def _save_checkpoint(path: str, model, optimizer, scheduler, state: Dict[str, Any]) -> None:
+    import torch
+    from utils import lora
+
+    temporary = path + ".tmp"
+    torch.save({
+        "adapter": lora.adapter_state(model),
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict(),
+        "state": state,
+        "rng": torch.get_rng_state()
+    }, temporary)
+    # Atomic: a crash mid-write leaves the previous checkpoint intact
+    os.replace(temporary, path)
+
+
+def _train_worker(spec: Dict[str, Any], events) -> None:
+    """Entry point of the training process; reports through `events` (a multiprocessing queue)"""
+    def emit(kind: str, **payload):
+        events.put({"type": kind, **payload})
+
+    try:
+        _train(spec, emit)
+    except Exception as e:
+        emit("error", message=f"{type(e).__name__}: {e}", fatal=isinstance(e, (TrainingError, OSError, KeyError, ValueError)))
+        raise
+
+
+def _train(spec: Dict[str, Any], emit) -> None:
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from utils import lora
+
+    torch.set_num_threads(spec["threads"])
+    torch.set_num_interop_threads(1)
+    torch.manual_seed(spec["seed"])
+    device = "cuda" if spec["use_gpu"] and torch.cuda.is_available() else "cpu"
+    output_dir = spec["output_dir"]
+    checkpoint_path = os.path.join(output_dir, "checkpoint.pt")
+    local_only = not spec["allow_download"]
+
+    tokenizer = AutoTokenizer.from_pretrained(spec["model_name"], local_files_only=local_only)
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(spec["model_name"], torch_dtype=torch.float32, local_files_only=local_only)
+    wrapped = lora.inject(model, spec["lora_rank"], spec["lora_alpha"], spec["lora_dropout"], spec["target_modules"])
+    model.to(device)
+    trainable = [p for p in model.parameters() if p.requires_grad]
+
+    use_bf16 = spec["mixed_precision"] and (device == "cuda" or _bf16_supported())
+    if spec["mixed_precision"] and not use_bf16:
+        emit("log", message="mixed_precision ignored: this CPU has no bf16 support, training in float32")
+    micro, accumulation = plan_micro_batch(model.config, spec["batch_size"], spec["max_seq_length"],
+                                           spec["memory_mb"], 2 if use_bf16 else 4)
+
+    source = _open_source(spec["dataset"], spec)
+    examples = source.count()
+    if examples == 0:
+        raise TrainingError(f"Dataset {spec['dataset']!r} has no training examples")
+    validation = _open_source(spec["validation_data"], spec) if spec["validation_data"] else None
+    steps_per_epoch = math.ceil(examples / (micro * accumulation))
+    total_steps = steps_per_epoch * spec["epochs"]
+    warmup = max(1, total_steps // 20)
+    optimizer = torch.optim.AdamW(trainable, lr=spec["learning_rate"], weight_decay=0.0)
+    scheduler = torch.optim.lr_scheduler.LambdaLR(
+        optimizer, lambda step: min(1.0, (step + 1) / warmup) * max(0.0, (total_steps - step) / max(1, total_steps - warmup))
+    )
+
+    state = {"epoch": 0, "step": 0, "cursor": None, "examples_seen": 0}
+    if os.path.exists(checkpoint_path):
+        saved = torch.load(checkpoint_path, map_location=device, weights_only=False)
+        lora.load_adapter_state(model, saved["adapter"])
+        optimizer.load_state_dict(saved["optimizer"])
+        scheduler.load_state_dict(saved["scheduler"])
+        torch.set_rng_state(saved["rng"])
+        state = saved["state"]
+        emit("log", message=f"Resumed from step {state['step']} (epoch {state['epoch'] + 1})")
+    emit("start", total_steps=total_steps, examples=examples, micro_batch=micro, accumulation=accumulation,
+         device=device, bf16=use_bf16, adapted_modules=len(wrapped), trainable_parameters=sum(p.numel() for p in trainable))
+
+    def forward_loss(batch) -> torch.Tensor:
+        batch = {key: value.to(device) for key, value in batch.items()}
+        with torch.autocast(device_type=device, dtype=torch.bfloat16, enabled=use_bf16):
+            return model(**batch).loss
+
+    def optimizer_step() -> float:
+        norm = torch.nn.utils.clip_grad_norm_(trainable, 1.0)
+        optimizer.step()
+        scheduler.step()
+        optimizer.zero_grad(set_to_none=True)
+        return float(norm)
+
+    model.train()
+    started = time.perf_counter()
+    tokens_since = 0
+    for epoch in range(state["epoch"], spec["epochs"]):
+        pending, pending_loss = 0, 0.0
+        batches = _prefetch(source, state["cursor"], tokenizer, micro, spec["max_seq_length"], spec["prefetch"])
+        for batch, cursor, rows in batches:
+            loss = forward_loss(batch)
+            (loss / accumulation).backward()
+            pending += 1
+            pending_loss += float(loss)
+            tokens_since += int(batch["attention_mask"].sum())
+            state["examples_seen"] += rows
+            if pending < accumulation:
+                continue
+            grad_norm = optimizer_step()
+            state["step"] += 1
+            state["cursor"] = cursor
+            elapsed = time.perf_counter() - started
+            emit("progress", step=state["step"], total_steps=total_steps, epoch=epoch + 1,
+                 loss=pending_loss / pending, learning_rate=scheduler.get_last_lr()[0], grad_norm=grad_norm,
+                 tokens_per_second=tokens_since / elapsed if elapsed else 0.0)
+            pending, pending_loss = 0, 0.0
+            if state["step"] % spec["checkpoint_steps"] == 0:
+                _save_checkpoint(checkpoint_path, model, optimizer, scheduler, state)
+                emit("checkpoint", step=state["step"])
+        if pending:
+            # The epoch ended part-way through an accumulation window; use what there is
+            optimizer_step()
+            state["step"] += 1
+        metrics = {}
+        if validation is not None:
+            metrics["val_loss"] = _validation_loss(model, validation, tokenizer, spec, forward_loss)
+        state.update(epoch=epoch + 1, cursor=None)
+        _save_checkpoint(checkpoint_path, model, optimizer, scheduler, state)
+        emit("epoch", epoch=epoch + 1, step=state["step"], **metrics)
+
+    artifacts = lora.save_adapter(model, os.path.join(output_dir, "adapter"), spec["model_name"], wrapped,
+                                  spec["lora_rank"], spec["lora_alpha"], spec["lora_dropout"])
+    emit("done", artifacts=artifacts, step=state["step"], train_seconds=time.perf_counter() - started)
+    # The optimizer state is only needed to resume; the adapter is the deliverable
+    os.remove(checkpoint_path)
+
+
+def _validation_loss(model, source, tokenizer, spec, forward_loss, limit: int = 256) -> float:
+    import torch
+
+    model.eval()
+    total, count = 0.0, 0
+    with torch.no_grad():
+        for batch, _, rows in _prefetch(source, None, tokenizer, 8, spec["max_seq_length"], 2):
+            total += float(forward_loss(batch)) * rows
+            count += rows
+            if count >= limit:
+                break
+    model.train()
+    return total / count if count else float("nan")
+
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+class TrainingExecutor:
+    """Run LoRA fine-tuning jobs in separate processes, one at a time.
+
+    Each job gets a spawned process limited to `threads` torch threads, so a
+    training run cannot starve the event loop of this worker. The process
+    streams examples from MongoDB (or a JSONL file), checkpoints every
+    `checkpoint_steps` optimizer steps, and reports progress over a queue
+    that updates the job's ModelTrainingStatus. If the process dies it is
+    restarted from the last checkpoint, up to `max_restarts` times; jobs
+    interrupted by a server restart resume the same way on startup.
+
+    With several uvicorn workers, flocks under `output_dir` decide which
+    worker owns (and resumes) each job and keep one job training at a time
+    on the machine. Other workers answer status requests from the job.json
+    the owner keeps up to date.
+    """
+
+    def __init__(self, output_dir: str, threads: int = 0, memory_mb: float = 2048, checkpoint_steps: int = 50,
+                 max_restarts: int = 2, prefetch: int = 4, allow_download: bool = False,
+                 dataset_dir: str = "training_datasets"):
+        self.output_dir = output_dir
+        self.dataset_dir = dataset_dir
+        self.threads = threads or os.cpu_count() or 1
+        self.memory_mb = memory_mb
+        self.checkpoint_steps = checkpoint_steps
+        self.max_restarts = max_restarts
+        self.prefetch = prefetch
+        self.allow_download = allow_download
+        self.jobs: Dict[str, ModelTrainingStatus] = {}
+        self.results: Dict[str, TrainingResult] = {}
+        self._specs: Dict[str, Dict[str, Any]] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._processes: Dict[str, multiprocessing.Process] = {}
+        self._job_locks: Dict[str, Any] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _dataset(self, value: str, field: str) -> str:
+        """"chat_history", or a JSONL file confined to `dataset_dir`"""
+        if value == "chat_history":
+            return value
+        root = os.path.realpath(self.dataset_dir)
+        path = os.path.realpath(os.path.join(root, value))
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            raise TrainingError(f"{field} must be 'chat_history' or a JSONL file in {self.dataset_dir}")
+        return path
+
+    def _spec(self, request: ModelTrainingConfig, tenant_id: Optional[str]) -> Dict[str, Any]:
+        dataset = self._dataset(request.dataset, "dataset")
+        validation_data = self._dataset(request.validation_data, "validation_data") if request.validation_data else None
+        root = os.path.realpath(self.output_dir)
+        output_dir = os.path.realpath(os.path.join(
+            root, request.output_dir if "output_dir" in request.model_fields_set else request.training_id
+        ))
+        if output_dir == root or os.path.commonpath([root, output_dir]) != root:
+            raise TrainingError(f"output_dir must be a directory under {self.output_dir}")
+        return {
+            "training_id": request.training_id,
+            "model_name": request.model_name,
+            "dataset": dataset,
+            "validation_data": validation_data,
+            "tenant_id": tenant_id,
+            "epochs": request.epochs,
+            "batch_size": request.batch_size,
+            "learning_rate": request.learning_rate,
+            "max_seq_length": request.max_seq_length,
+            "lora_rank": request.lora_rank,
+            "lora_alpha": request.lora_alpha,
+            "lora_dropout": request.lora_dropout,
+            "target_modules": request.target_modules,
+            "use_gpu": request.use_gpu,
+            "mixed_precision": request.mixed_precision,
+            "output_dir": output_dir,
+            "threads": self.threads,
+            "memory_mb": self.memory_mb,
+            "checkpoint_steps": self.checkpoint_steps,
+            "prefetch": self.prefetch,
+            "allow_download": self.allow_download,
+            "seed": 0
+        }
+
+    async def submit(self, request: ModelTrainingConfig, tenant_id: Optional[str] = None) -> ModelTrainingStatus:
+        existing = self.jobs.get(request.training_id)
+        if existing is not None and existing.status not in _TERMINAL:
+            return existing
+        spec = self._spec(request, tenant_id)
+        if not self._claim(request.training_id, spec["output_dir"]):
+            raise TrainingError(f"Training {request.training_id} is already running", status_code=409)
+        now = datetime.datetime.utcnow().isoformat()
+        job = ModelTrainingStatus(training_id=request.training_id, model_name=request.model_name, status="queued",
+                                  created_at=now, updated_at=now)
+        await asyncio.get_running_loop().run_in_executor(None, self._persist, spec, job)
+        self._start(spec, job)
+        return job
+
+    def _claim(self, training_id: str, output_dir: str) -> bool:
+        """Own a job across uvicorn workers: a non-blocking flock on its job.lock, held until the job ends"""
+        if training_id in self._job_locks:
+            return True
+        os.makedirs(output_dir, exist_ok=True)
+        handle = open(os.path.join(output_dir, "job.lock"), "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return False
+        self._job_locks[training_id] = handle
+        return True
+
+    def _release(self, training_id: str) -> None:
+        handle = self._job_locks.pop(training_id, None)
+        if handle is not None:
+            handle.close()  # closing drops the flock
+
+    def _runner_slot(self, job: ModelTrainingStatus):
+        """Wait for the machine-wide runner lock, so one job trains at a time across all workers; None if cancelled"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        handle = open(os.path.join(self.output_dir, ".runner.lock"), "a")
+        while job.status != "cancelled":
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return handle
+            except BlockingIOError:
+                time.sleep(1.0)
+        handle.close()
+        return None
+
+    def _start(self, spec: Dict[str, Any], job: ModelTrainingStatus) -> None:
+        self.jobs[job.training_id] = job
+        self._specs[job.training_id] = spec
+        self._changed[job.training_id] = asyncio.Event()
+        task = asyncio.ensure_future(self._run(spec, job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _persist(self, spec: Dict[str, Any], job: ModelTrainingStatus) -> None:
+        os.makedirs(spec["output_dir"], exist_ok=True)
+        path = os.path.join(spec["output_dir"], "job.json")
+        saved = {"spec": spec, "status": job.model_dump(mode="json")}
+        if job.training_id in self.results:
+            saved["result"] = self.results[job.training_id].model_dump(mode="json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(path + ".tmp", path)
+
+    def _touch(self, job: ModelTrainingStatus) -> None:
+        job.updated_at = datetime.datetime.utcnow().isoformat()
+        # Wake every SSE subscriber, then hand later ones a fresh event
+        event = self._changed.get(job.training_id)
+        if event is not None:
+            event.set()
+            self._changed[job.training_id] = asyncio.Event()
+
+    def _apply(self, job: ModelTrainingStatus, event: Dict[str, Any]) -> None:
+        kind = event["type"]
+        if kind == "start":
+            job.total_steps = event["total_steps"]
+            job.metrics.update({key: float(event[key]) for key in ("examples", "micro_batch", "accumulation", "trainable_parameters")})
+            job.logs.append(
+                f"Training on {event['device']} ({'bf16' if event['bf16'] else 'fp32'}): {event['examples']} examples, "
+                f"micro-batch {event['micro_batch']} x {event['accumulation']} accumulation steps, "
+                f"{event['adapted_modules']} adapted modules"
+            )
+        elif kind == "progress":
+            job.current_step = event["step"]
+            job.total_steps = event["total_steps"]
+            job.loss = round(event["loss"], 5)
+            job.progress = round(100 * event["step"] / max(1, event["total_steps"]), 2)
+            job.metrics.update(epoch=float(event["epoch"]), learning_rate=event["learning_rate"],
+                               grad_norm=round(event["grad_norm"], 4), tokens_per_second=round(event["tokens_per_second"], 1))
+        elif kind == "epoch":
+            job.current_step = event["step"]
+            if "val_loss" in event:
+                job.metrics["val_loss"] = round(event["val_loss"], 5)
+            job.logs.append(f"Epoch {event['epoch']} finished at step {event['step']}")
+        elif kind == "checkpoint":
+            job.metrics["checkpoint_step"] = float(event["step"])
+        elif kind == "log":
+            job.logs.append(event["message"])
+        elif kind == "error":
+            job.error = event["message"]
+            job.logs.append(event["message"])
+        elif kind == "done":
+            job.current_step = event["step"]
+            job.progress = 100.0
+            job.metrics["train_seconds"] = round(event["train_seconds"], 1)
+        self._touch(job)
+
+    async def _run(self, spec: Dict[str, Any], job: ModelTrainingStatus) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._lock:
+                if job.status == "cancelled":
+                    return
+                slot = await loop.run_in_executor(None, self._runner_slot, job)
+                if slot is None:
+                    return
+                try:
+                    await self._supervise(spec, job, loop)
+                finally:
+                    slot.close()
+        finally:
+            self._release(job.training_id)
+
+    async def _supervise(self, spec: Dict[str, Any], job: ModelTrainingStatus, loop: asyncio.AbstractEventLoop) -> None:
+        """Run the training process, restarting it from the last checkpoint when it dies"""
+        context = multiprocessing.get_context("spawn")
+        artifacts = None
+        for attempt in range(self.max_restarts + 1):
+            events = context.Queue()
+            process = context.Process(target=_train_worker, args=(spec, events), name=f"train-{job.training_id[:8]}")
+            process.start()
+            self._processes[job.training_id] = process
+            job.status = "running"
+            job.error = None
+            self._touch(job)
+            fatal = False
+            while True:
+                try:
+                    event = await loop.run_in_executor(None, events.get, True, 0.5)
+                except queue.Empty:
+                    if not process.is_alive():
+                        break
+                    continue
+                self._apply(job, event)
+                if event["type"] == "done":
+                    artifacts = event["artifacts"]
+                elif event["type"] == "error":
+                    fatal = event["fatal"]
+                elif event["type"] == "checkpoint":
+                    await loop.run_in_executor(None, self._persist, spec, job)
+            await loop.run_in_executor(None, process.join)
+            self._processes.pop(job.training_id, None)
+            if job.status == "cancelled" or artifacts is not None or fatal:
+                break
+            job.logs.append(f"Training process exited with code {process.exitcode}; resuming from the last checkpoint")
+            logger.warning("Training %s process exited with %s (attempt %d)", job.training_id, process.exitcode, attempt + 1)
+        if job.status != "cancelled":
+            job.status = "complete" if artifacts is not None else "failed"
+            if job.status == "failed" and job.error is None:
+                job.error = "Training process kept crashing"
+        if artifacts is not None:
+            self.results[job.training_id] = TrainingResult(
+                model_name=job.model_name, provider=ModelProvider.HUGGINGFACE,
+                training_id=job.training_id, status=job.status, metrics=dict(job.metrics, loss=job.loss),
+                hyperparameters={key: spec[key] for key in ("epochs", "batch_size", "learning_rate", "max_seq_length",
+                                                             "lora_rank", "lora_alpha", "lora_dropout")},
+                logs=list(job.logs), artifacts=artifacts, created_at=job.created_at, updated_at=job.updated_at
+            )
+        self._touch(job)
+        await loop.run_in_executor(None, self._persist, spec, job)
+        logger.info("Training %s %s after %d steps", job.training_id, job.status, job.current_step)
+
+    def _saved(self, training_id: str) -> Optional[Dict[str, Any]]:
+        """job.json of a job owned by another worker (default output directory only)"""
+        try:
+            with open(os.path.join(self.output_dir, training_id, "job.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _lookup(self, training_id: str, tenant_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Spec, status and result of a job, only for the tenant that submitted it"""
+        if training_id in self._specs:
+            saved = {"spec": self._specs[training_id], "status": self.jobs[training_id],
+                     "result": self.results.get(training_id)}
+        else:
+            saved = self._saved(training_id)
+            if saved is None:
+                return None
+            saved["status"] = ModelTrainingStatus(**saved["status"])
+            saved["result"] = TrainingResult(**saved["result"]) if saved.get("result") else None
+        return saved if saved["spec"]["tenant_id"] == tenant_id else None
+
+    def status(self, training_id: str, tenant_id: Optional[str] = None) -> Optional[ModelTrainingStatus]:
+        saved = self._lookup(training_id, tenant_id)
+        return saved["status"] if saved is not None else None
+
+    def result(self, training_id: str, tenant_id: Optional[str] = None) -> Optional[TrainingResult]:
+        saved = self._lookup(training_id, tenant_id)
+        return saved["result"] if saved is not None else None
+
+    async def watch(self, training_id: str, tenant_id: Optional[str] = None,
+                    keepalive: float = 15.0) -> AsyncIterator[Optional[ModelTrainingStatus]]:
+        """Yield the status after every change until the job ends; None marks a keepalive tick"""
+        job = self.status(training_id, tenant_id)
+        yield job
+        if training_id not in self._changed:
+            # Owned by another worker: follow its job.json, which is rewritten at every checkpoint
+            last = job.updated_at
+            while job is not None and job.status not in _TERMINAL:
+                await asyncio.sleep(min(keepalive, 5.0))
+                job = await asyncio.get_running_loop().run_in_executor(None, self.status, training_id, tenant_id)
+                if job is not None and job.updated_at != last:
+                    last = job.updated_at
+                    yield job
+                else:
+                    yield None
+            return
+        while job.status not in _TERMINAL:
+            event = self._changed[training_id]
+            try:
+                await asyncio.wait_for(event.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            yield job
+
+    async def cancel(self, training_id: str, tenant_id: Optional[str] = None) -> Optional[ModelTrainingStatus]:
+        job = self.status(training_id, tenant_id)
+        if job is None or job.status in _TERMINAL:
+            return job
+        if training_id not in self._changed:
+            raise TrainingError(f"Training {training_id} is running in another worker; retry the request", status_code=409)
+        job.status = "cancelled"
+        process = self._processes.get(training_id)
+        if process is not None and process.is_alive():
+            process.terminate()
+        self._touch(job)
+        # Persisted now, or a job cancelled while queued would be resumed after a restart
+        await asyncio.get_running_loop().run_in_executor(None, self._persist, self._specs[training_id], job)
+        return job
+
+    def start(self) -> None:
+        """Resume jobs that were queued or running when the server stopped.
+
+        Every uvicorn worker runs this; the per-job flock makes exactly one of
+        them resume each job, and the others leave it alone.
+        """
+        for path in glob.glob(os.path.join(self.output_dir, "*", "job.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    saved = json.load(f)
+                job = ModelTrainingStatus(**saved["status"])
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping unreadable training job %s: %s", path, e)
+                continue
+            if job.status in _TERMINAL:
+                self.jobs.setdefault(job.training_id, job)
+                self._specs.setdefault(job.training_id, saved["spec"])
+                if "result" in saved:
+                    self.results.setdefault(job.training_id, TrainingResult(**saved["result"]))
+                continue
+            if not self._claim(job.training_id, saved["spec"]["output_dir"]):
+                continue
+            job.status = "queued"
+            job.logs.append("Server restarted; resuming from the last checkpoint")
+            logger.info("Resuming training %s", job.training_id)
+            self._start(saved["spec"], job)
+
+    async def close(self) -> None:
+        for process in list(self._processes.values()):
+            # The checkpoint on disk lets start() pick the job up again
+            process.terminate()
+        for task in list(self._tasks):
+            task.cancel()
+        for training_id in list(self._job_locks):
+            self._release(training_id)
+
+
+# Per-worker executor; file locks under TRAINING_DIR make one training run use the box at a time across workers
+training_executor = TrainingExecutor(
+    output_dir=config.TRAINING_DIR,
+    threads=config.TRAINING_THREADS,
+    memory_mb=config.TRAINING_ACTIVATION_MEMORY_MB,
+    checkpoint_steps=config.TRAINING_CHECKPOINT_STEPS,
+    max_restarts=config.TRAINING_MAX_RESTARTS,
+    prefetch=config.TRAINING_PREFETCH_BATCHES,
+    allow_download=config.TRAINING_DOWNLOAD,
+    dataset_dir=config.TRAINING_DATASET_DIR
+)
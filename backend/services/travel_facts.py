@@ -0,0 +1,466 @@
+import csv
+import io
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import config
+from utils.countries import COUNTRY_ALIASES, COUNTRY_NAMES, alias_tokens, country_name
+from utils.response_policy import QuestionClass, classify_question
+
+logger = logging.getLogger(__name__)
+
+ANY = "*"
+PURPOSES = ("any", "tourism", "business", "transit", "study", "work")
+
+MAGIC = b"PTF1"
+HEADER = struct.Struct("<4sHHIIII")  # magic, version, flags, count, keys, records, strings offsets
+# visa, max_stay_days, passport_validity_months, blank_pages, vaccinations, documents, notes, source, updated
+RECORD = struct.Struct("<IHBBIIIII")
+STRING_LENGTH = struct.Struct("<H")
+
+_PURPOSE_CUES = {
+    "tourism": {"tourist", "tourism", "holiday", "holidays", "vacation", "sightseeing", "leisure", "honeymoon"},
+    "business": {"business", "conference", "meeting", "meetings", "trade"},
+    "transit": {"transit", "layover", "stopover", "connecting"},
+    "study": {"study", "studying", "student", "students", "university", "school", "course"},
+    "work": {"work", "working", "job", "employment", "employed"},
+}
+_TOPIC_CUES = {
+    "visa": {"visa", "visas", "evisa", "eta", "entry", "permit", "visafree"},
+    "passport": {"valid", "validity", "expire", "expires", "expiry", "pages", "blank"},
+    "vaccinations": {"vaccine", "vaccines", "vaccination", "vaccinations", "vaccinated", "yellow", "shots", "immunization", "jab", "jabs"},
+    "documents": {"documents", "document", "papers", "bring", "carry"},
+}
+_GENERAL_CUES = {"need", "needed", "require", "required", "requirements", "requirement"}
+_ORIGIN_BEFORE = {"from"}
+_ORIGIN_AFTER = {"citizen", "citizens", "passport", "passports", "national", "nationals", "holder", "holders", "nationality"}
+_ORIGIN_OF = {"citizen", "citizens", "national", "nationals", "resident", "residents"}
+_DESTINATION_BEFORE = {"to", "visit", "visiting", "into", "enter", "entering", "in", "for", "travel", "travelling",
+                       "traveling", "fly", "flying", "going", "trip", "visa"}
+# "<word> in <country>" says where someone is, which is neither origin nor destination ("I live in Kenya", "I'm in Japan")
+_RESIDENCE_BEFORE_IN = {"live", "lives", "living", "reside", "resides", "residing", "resident", "based", "staying",
+                        "stay", "am", "m", "currently", "located", "work", "working"}
+_WORD_RE = re.compile(r"\w+")
+
+# Country aliases as word tuples; the scan tries the longest alias first
+_ALIAS_TOKENS: Dict[Tuple[str, ...], Tuple[str, bool]] = {tuple(alias_tokens(a)): v for a, v in COUNTRY_ALIASES.items()}
+_ALIAS_FIRST_WORDS = {tokens[0] for tokens in _ALIAS_TOKENS}
+_ALIAS_MAX_WORDS = max(len(tokens) for tokens in _ALIAS_TOKENS)
+
+
+def _country_index(code: str) -> int:
+    """0 for any origin, 1..676 for AA..ZZ"""
+    if code == ANY:
+        return 0
+    return (ord(code[0]) - 65) * 26 + (ord(code[1]) - 65) + 1
+
+
+def _key(origin: str, destination: str, purpose: str) -> int:
+    return ((_country_index(origin) * 677 + _country_index(destination)) << 3) | PURPOSES.index(purpose)
+
+
+def resolve_country(value: str) -> Optional[str]:
+    """ISO code for a code, name, alias or demonym ("ke", "Kenya", "Kenyan"); "*" stays a wildcard"""
+    value = value.strip()
+    if value == ANY:
+        return ANY
+    # Aliases first: "UK" is a common name for GB, not the ISO code UK (which is unassigned)
+    match = _ALIAS_TOKENS.get(tuple(alias_tokens(value.lower())))
+    if match:
+        return match[0]
+    if len(value) == 2 and value.upper() in COUNTRY_NAMES:
+        return value.upper()
+    return None
+
+
+class TravelFact:
+    """Entry requirements for one (origin, destination, purpose)"""
+
+    __slots__ = ("origin", "destination", "purpose", "visa", "max_stay_days", "passport_validity_months",
+                 "blank_pages", "vaccinations", "documents", "notes", "source", "updated")
+
+    def __init__(self, origin: str, destination: str, purpose: str = "any", visa: str = "", max_stay_days: int = 0,
+                 passport_validity_months: int = 0, blank_pages: int = 0, vaccinations: Iterable[str] = (),
+                 documents: Iterable[str] = (), notes: str = "", source: str = "", updated: str = ""):
+        self.origin = origin
+        self.destination = destination
+        self.purpose = purpose
+        self.visa = visa
+        self.max_stay_days = max_stay_days
+        self.passport_validity_months = passport_validity_months
+        self.blank_pages = blank_pages
+        self.vaccinations = list(vaccinations)
+        self.documents = list(documents)
+        self.notes = notes
+        self.source = source
+        self.updated = updated
+
+    @classmethod
+    def from_row(cls, row: Dict[str, object]) -> "TravelFact":
+        """Build from a CSV row or JSON object; list fields may be lists or ';'-separated strings"""
+        def text(name):
+            value = row.get(name)
+            return "" if value is None else str(value).strip()
+
+        def number(name):
+            value = text(name)
+            return int(float(value)) if value else 0
+
+        def items(name):
+            value = row.get(name) or []
+            if isinstance(value, str):
+                value = value.split(";")
+            return [str(v).strip() for v in value if str(v).strip()]
+
+        origin, destination = resolve_country(text("origin")), resolve_country(text("destination"))
+        if origin is None or destination is None or destination == ANY:
+            raise ValueError(f"Unknown country in {text('origin')!r} -> {text('destination')!r}")
+        purpose = text("purpose").lower() or "any"
+        if purpose not in PURPOSES:
+            raise ValueError(f"Unknown purpose {purpose!r}")
+        return cls(origin, destination, purpose, text("visa"), number("max_stay_days"),
+                   number("passport_validity_months"), number("blank_pages"), items("vaccinations"),
+                   items("documents"), text("notes"), text("source"), text("updated"))
+
+    def to_dict(self) -> Dict[str, object]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class TravelQuery:
+    """What the entity extractor found in a question.
+
+    `ambiguous` is set when the countries cannot be assigned with confidence
+    (two destinations, or a country someone lives in); such questions are
+    left to the LLM.
+    """
+
+    __slots__ = ("origin", "destination", "purpose", "topics", "general", "ambiguous")
+
+    def __init__(self, origin: Optional[str], destination: Optional[str], purpose: Optional[str], topics: List[str], general: bool,
+                 ambiguous: bool = False):
+        self.origin = origin
+        self.destination = destination
+        self.purpose = purpose
+        self.topics = topics
+        self.general = general
+        self.ambiguous = ambiguous
+
+
+def extract(question: str) -> TravelQuery:
+    """Countries, travel purpose and requirement topics mentioned in a question (dictionary lookups only)"""
+    words = _WORD_RE.findall(question.lower().replace(".", "").replace("'", " ").replace("’", " ").replace("-", " "))
+    origin = destination = None
+    ambiguous = False
+    unassigned: List[str] = []
+    i = 0
+    while i < len(words):
+        if words[i] not in _ALIAS_FIRST_WORDS:
+            i += 1
+            continue
+        for length in range(min(_ALIAS_MAX_WORDS, len(words) - i), 0, -1):
+            match = _ALIAS_TOKENS.get(tuple(words[i:i + length]))
+            if match is not None:
+                break
+        else:
+            i += 1
+            continue
+        code, demonym = match
+        before = words[i - 1] if i > 0 else ""
+        after = words[i + length] if i + length < len(words) else ""
+        if demonym or before in _ORIGIN_BEFORE or after in _ORIGIN_AFTER or (
+                before == "of" and i > 1 and words[i - 2] in _ORIGIN_OF):
+            origin = origin or code
+        elif before == "in" and i > 1 and words[i - 2] in _RESIDENCE_BEFORE_IN:
+            ambiguous = True
+        elif before in _DESTINATION_BEFORE:
+            if destination is not None and destination != code:
+                ambiguous = True
+            destination = destination or code
+        else:
+            unassigned.append(code)
+        i += length
+    for code in unassigned:
+        # "Kenya to UK": an unmarked country is the origin if the destination is already known
+        if destination is None and origin is not None and code != origin:
+            destination = code
+        elif origin is None and destination is not None and code != destination:
+            origin = code
+        elif destination is None:
+            destination = code
+        elif origin is None and code != destination:
+            origin = code
+    vocabulary = set(words)
+    purpose = next((p for p, cues in _PURPOSE_CUES.items() if vocabulary & cues), None)
+    topics = [t for t, cues in _TOPIC_CUES.items() if vocabulary & cues]
+    if "passport" in vocabulary and "passport" not in topics and ("how" in vocabulary or "long" in vocabulary):
+        topics.append("passport")
+    return TravelQuery(origin, destination, purpose, topics, bool(vocabulary & _GENERAL_CUES), ambiguous)
+
+
+class TravelFactStore:
+    """Visa, passport and vaccination requirements indexed by (origin, destination, purpose).
+
+    Facts are compiled into one compact binary file: a sorted array of
+    32-bit keys, fixed-size records and a deduplicated string table. The
+    file is memory-mapped, so every worker shares the same pages and a
+    lookup is a binary search plus one struct unpack. Common questions are
+    answered from a template without calling an LLM; other questions about
+    a known route get the facts as grounding. `reload` rebuilds the file
+    from CSV or JSON; other workers remap it when its mtime changes.
+    """
+
+    def __init__(self, path: str, source: Optional[str] = None, check_interval: float = 30.0):
+        self.path = path
+        self.source = source
+        self.check_interval = check_interval
+        self.loaded_at: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        # (mapping, keys, records offset, strings offset), swapped as one reference so
+        # a reload on another thread never exposes a half-updated index
+        self._index: Optional[tuple] = None
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+
+    @staticmethod
+    def build(facts: Iterable[TravelFact], path: str) -> int:
+        """Write facts to the binary format (atomically replacing `path`); returns the number of records"""
+        by_key = {_key(f.origin, f.destination, f.purpose): f for f in facts}
+        keys = sorted(by_key)
+        strings = bytearray(STRING_LENGTH.pack(0))  # offset 0 is the empty string
+        offsets: Dict[str, int] = {"": 0}
+
+        def intern(value: str) -> int:
+            offset = offsets.get(value)
+            if offset is None:
+                encoded = value.encode("utf-8")[:65535]
+                offset = offsets[value] = len(strings)
+                strings.extend(STRING_LENGTH.pack(len(encoded)))
+                strings.extend(encoded)
+            return offset
+
+        records = bytearray()
+        for key in keys:
+            f = by_key[key]
+            records.extend(RECORD.pack(
+                intern(f.visa), min(f.max_stay_days, 65535), min(f.passport_validity_months, 255),
+                min(f.blank_pages, 255), intern("; ".join(f.vaccinations)), intern("; ".join(f.documents)),
+                intern(f.notes), intern(f.source), intern(f.updated)
+            ))
+        keys_offset = HEADER.size
+        records_offset = keys_offset + 4 * len(keys)
+        strings_offset = records_offset + len(records)
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, 1, 0, len(keys), keys_offset, records_offset, strings_offset))
+            f.write(struct.pack(f"<{len(keys)}I", *keys))
+            f.write(records)
+            f.write(strings)
+        os.replace(temp, path)
+        return len(keys)
+
+    @staticmethod
+    def parse(data: bytes, fmt: str) -> List[TravelFact]:
+        """Facts from CSV (one row per route) or JSON (a list, or {"facts": [...]})"""
+        if fmt == "json":
+            rows = json.loads(data)
+            if isinstance(rows, dict):
+                rows = rows.get("facts", [])
+        else:
+            rows = list(csv.DictReader(io.StringIO(data.decode("utf-8-sig"))))
+        facts, errors = [], 0
+        for number, row in enumerate(rows, 1):
+            try:
+                facts.append(TravelFact.from_row(row))
+            except (ValueError, TypeError, AttributeError) as e:
+                errors += 1
+                if errors <= 10:
+                    logger.warning("Skipping travel fact %d: %s", number, e)
+        if errors:
+            logger.warning("Skipped %d of %d travel facts", errors, len(rows))
+        return facts
+
+    def load(self) -> bool:
+        """Map the compiled file; the previous mapping is released once nothing references it"""
+        try:
+            with open(self.path, "rb") as f:
+                mtime = os.fstat(f.fileno()).st_mtime
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        magic, version, _, count, keys_offset, records_offset, strings_offset = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != 1:
+            logger.error("%s is not a travel fact file", self.path)
+            return False
+        keys = memoryview(mapped)[keys_offset:keys_offset + 4 * count].cast("I")
+        if sys.byteorder != "little":
+            keys = array("I", keys)
+            keys.byteswap()
+        self._index = (mapped, keys, records_offset, strings_offset)
+        self._mtime, self.loaded_at = mtime, time.time()
+        logger.info("Loaded %d travel facts from %s", count, self.path)
+        return True
+
+    def open(self) -> None:
+        """Map the compiled file, compiling it from `source` first if the source is newer (blocking)"""
+        try:
+            stale = self.source and (not os.path.exists(self.path) or os.path.getmtime(self.source) > os.path.getmtime(self.path))
+        except OSError as e:
+            logger.error("Travel fact source unavailable: %s", e)
+            stale = False
+        if stale:
+            self.reload()
+        else:
+            self.load()
+
+    def reload(self, data: Optional[bytes] = None, fmt: Optional[str] = None) -> int:
+        """Rebuild from `data` (or the configured source file) and remap; returns the number of facts"""
+        if data is None:
+            if not self.source:
+                raise ValueError("No travel fact source configured")
+            with open(self.source, "rb") as f:
+                data = f.read()
+            fmt = fmt or ("json" if self.source.lower().endswith(".json") else "csv")
+        facts = self.parse(data, fmt or "csv")
+        if not facts:
+            # Never replace a working store with an empty one because of a bad upload
+            raise ValueError("No valid travel facts in input")
+        count = self.build(facts, self.path)
+        self.load()
+        return count
+
+    @property
+    def count(self) -> int:
+        return len(self._index[1]) if self._index is not None else 0
+
+    @staticmethod
+    def _string(mapped: mmap.mmap, strings_offset: int, offset: int) -> str:
+        (length,) = STRING_LENGTH.unpack_from(mapped, strings_offset + offset)
+        start = strings_offset + offset + STRING_LENGTH.size
+        return mapped[start:start + length].decode("utf-8")
+
+    def _maybe_remap(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        try:
+            if os.path.getmtime(self.path) != self._mtime:
+                self.load()
+        except OSError:
+            pass
+
+    def _get(self, index: tuple, origin: str, destination: str, purpose: str) -> Optional[TravelFact]:
+        mapped, keys, records_offset, strings_offset = index
+        key = _key(origin, destination, purpose)
+        position = bisect_left(keys, key)
+        if position == len(keys) or keys[position] != key:
+            return None
+        visa, stay, validity, pages, *strings = RECORD.unpack_from(mapped, records_offset + position * RECORD.size)
+        vaccinations, documents, notes, source, updated = (self._string(mapped, strings_offset, o) for o in strings)
+        return TravelFact(
+            origin, destination, purpose, self._string(mapped, strings_offset, visa), stay, validity, pages,
+            vaccinations.split("; ") if vaccinations else [], documents.split("; ") if documents else [],
+            notes, source, updated
+        )
+
+    def lookup(self, origin: Optional[str], destination: str, purpose: Optional[str] = None) -> Optional[TravelFact]:
+        """Most specific fact for a route: exact purpose, then any purpose, then rules for any origin"""
+        index = self._index
+        if index is None or destination in (None, ANY) or len(destination) != 2:
+            return None
+        origins = [origin, ANY] if origin and origin != ANY else [ANY]
+        purposes = [purpose or "tourism", "any"] if purpose != "any" else ["any"]
+        for candidate_origin in origins:
+            if candidate_origin != ANY and len(candidate_origin) != 2:
+                continue
+            for candidate_purpose in purposes:
+                fact = self._get(index, candidate_origin, destination, candidate_purpose)
+                if fact is not None:
+                    self.hits += 1
+                    return fact
+        self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "facts": self.count,
+            "path": self.path,
+            "source": self.source,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.loaded_at)) if self.loaded_at else None,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    @staticmethod
+    def render(fact: TravelFact, topics: Iterable[str] = ()) -> str:
+        """Markdown answer for the requested topics (all of them when none were asked for)"""
+        topics = set(topics) or {"visa", "passport", "vaccinations", "documents"}
+        who = f"Citizens of {country_name(fact.origin)} travelling to" if fact.origin != ANY else "All travellers to"
+        purpose = "" if fact.purpose == "any" else f" for {fact.purpose}"
+        lines = [f"**{who} {country_name(fact.destination)}{purpose}**"]
+        if "visa" in topics and fact.visa:
+            stay = f" (stays of up to {fact.max_stay_days} days)" if fact.max_stay_days else ""
+            lines.append(f"- Visa: {fact.visa}{stay}")
+        if "passport" in topics and (fact.passport_validity_months or fact.blank_pages):
+            rules = []
+            if fact.passport_validity_months:
+                rules.append(f"valid for at least {fact.passport_validity_months} months beyond your stay")
+            if fact.blank_pages:
+                rules.append(f"{fact.blank_pages} blank page{'s' if fact.blank_pages != 1 else ''}")
+            lines.append(f"- Passport: {', with '.join(rules)}")
+        if "vaccinations" in topics and fact.vaccinations:
+            lines.append(f"- Vaccinations: {', '.join(fact.vaccinations)}")
+        if "documents" in topics and fact.documents:
+            lines.append(f"- Documents: {', '.join(fact.documents)}")
+        if len(lines) == 1:
+            return ""
+        if fact.notes:
+            lines.append(f"\n{fact.notes}")
+        provenance = f"Source: {fact.source}" if fact.source else "Source: internal travel fact store"
+        if fact.updated:
+            provenance += f" (updated {fact.updated})"
+        lines.append(f"\n_{provenance}. Requirements change; confirm with the embassy or official portal before you travel._")
+        return "\n".join(lines)
+
+    def answer(self, question: str) -> Optional[str]:
+        """Template answer for a plain requirements lookup, or None when the question needs an LLM"""
+        self._maybe_remap()
+        if not self.count:
+            return None
+        query = extract(question)
+        if query.destination is None or query.ambiguous or not (query.topics or query.general):
+            return None
+        if classify_question(question) == QuestionClass.LONG_FORM:
+            return None
+        fact = self.lookup(query.origin, query.destination, query.purpose)
+        if fact is None or (fact.origin == ANY and query.origin is not None and "visa" in query.topics):
+            # Rules for any nationality cannot answer a nationality-specific visa question
+            return None
+        return self.render(fact, query.topics) or None
+
+    def grounding(self, question: str) -> Optional[str]:
+        """Known facts for the route in a question, as reference material for the LLM"""
+        self._maybe_remap()
+        if not self.count:
+            return None
+        query = extract(question)
+        if query.destination is None or query.ambiguous:
+            return None
+        fact = self.lookup(query.origin, query.destination, query.purpose)
+        if fact is None:
+            return None
+        return f"[Travel requirements from the fact store]\n{self.render(fact)}"
+
+
+# Per-worker view of the shared compiled fact file
+travel_facts = TravelFactStore(config.TRAVEL_FACTS_PATH, config.TRAVEL_FACTS_SOURCE, config.TRAVEL_FACTS_CHECK_INTERVAL)
@@ -0,0 +1,10 @@
+from services.attachments import AttachmentStore, _Document
+from utils.token_accounting import token_counter
+
+
+def test_excerpt_truncates_when_no_chunk_fits():
+    document = _Document("a", "notes.txt", "text/plain", 0, text=" ".join(f"word{i}" for i in range(3000)))
+    excerpt, used = AttachmentStore._excerpt(document, {"word7"}, 20, None)
+    assert excerpt.startswith("word0 word1")
+    assert 0 < used <= 20
+    assert token_counter.count(excerpt) == used
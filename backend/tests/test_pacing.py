@@ -0,0 +1,35 @@
+import asyncio
+
+from models import ModelProvider
+from services.pacing import PacerRegistry, ProviderPacer, retry_after
+
+
+def test_registry_never_evicts_the_requested_pacer():
+    async def scenario():
+        registry = PacerRegistry(max_pacers=2)
+        busy = [await registry.get(ModelProvider.OPENAI, model).acquire() for model in ("a", "b")]
+        pacer = registry.get(ModelProvider.OPENAI, "c")
+        assert registry.get(ModelProvider.OPENAI, "c") is pacer
+        assert len(registry) == 3  # busy pacers are kept over the bound
+        for slot in busy:
+            slot.release()
+        registry.get(ModelProvider.OPENAI, "d")
+        assert len(registry) == 2
+
+    asyncio.run(scenario())
+
+
+def test_malformed_retry_after_is_ignored():
+    assert retry_after({"retry-after": "soon"}) is None
+    assert retry_after({"retry-after": "2"}) == 2.0
+
+
+def test_slot_release_is_idempotent():
+    async def scenario():
+        pacer = ProviderPacer("test", initial_concurrency=1)
+        slot = await pacer.acquire()
+        slot.release({"retry-after": "soon"}, 429, success=False)
+        slot.release(success=False)
+        assert pacer.in_flight == 0
+
+    asyncio.run(scenario())
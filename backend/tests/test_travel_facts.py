@@ -0,0 +1,20 @@
+from services.travel_facts import extract, resolve_country
+
+
+def test_residence_is_not_a_destination():
+    query = extract("I live in Kenya, do I need a visa for Japan?")
+    assert query.ambiguous
+
+
+def test_two_destinations_are_ambiguous():
+    assert extract("Do I need a visa to visit Japan and to enter Kenya?").ambiguous
+
+
+def test_plain_route():
+    query = extract("Do Kenyans need a visa to visit Japan?")
+    assert (query.origin, query.destination, query.ambiguous) == ("KE", "JP", False)
+
+
+def test_alias_before_iso_code():
+    assert resolve_country("UK") == "GB"
+    assert resolve_country("ZZ") is None
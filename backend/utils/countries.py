@@ -0,0 +1,240 @@
+"""Country names, aliases and demonyms keyed by ISO 3166-1 alpha-2 code.
+
+One line per country: `CODE|Name|aliases;...|demonyms;...`. Demonyms
+("Kenyan", "British") mark a country as the traveller's nationality when
+they appear in a question. Aliases that are also common English words
+("US", "CAR") are deliberately left out.
+"""
+from typing import Dict, List, Tuple
+
+_TABLE = """
+AF|Afghanistan||Afghan
+AL|Albania||Albanian
+DZ|Algeria||Algerian
+AD|Andorra||Andorran
+AO|Angola||Angolan
+AG|Antigua and Barbuda|Antigua|Antiguan
+AR|Argentina||Argentine;Argentinian
+AM|Armenia||Armenian
+AU|Australia||Australian
+AT|Austria||Austrian
+AZ|Azerbaijan||Azerbaijani
+BS|Bahamas|The Bahamas|Bahamian
+BH|Bahrain||Bahraini
+BD|Bangladesh||Bangladeshi
+BB|Barbados||Barbadian
+BY|Belarus||Belarusian
+BE|Belgium||Belgian
+BZ|Belize||Belizean
+BJ|Benin||Beninese
+BT|Bhutan||Bhutanese
+BO|Bolivia||Bolivian
+BA|Bosnia and Herzegovina|Bosnia|Bosnian
+BW|Botswana||Motswana;Batswana
+BR|Brazil||Brazilian
+BN|Brunei|Brunei Darussalam|Bruneian
+BG|Bulgaria||Bulgarian
+BF|Burkina Faso||Burkinabe
+BI|Burundi||Burundian
+CV|Cabo Verde|Cape Verde|Cape Verdean
+KH|Cambodia||Cambodian
+CM|Cameroon||Cameroonian
+CA|Canada||Canadian
+CF|Central African Republic||
+TD|Chad||Chadian
+CL|Chile||Chilean
+CN|China|PRC;People's Republic of China;Mainland China|Chinese
+CO|Colombia||Colombian
+KM|Comoros||Comorian
+CG|Republic of the Congo|Congo-Brazzaville;Congo Brazzaville|
+CD|Democratic Republic of the Congo|DRC;DR Congo;Congo-Kinshasa;Congo Kinshasa;Congo|Congolese
+CR|Costa Rica||Costa Rican
+CI|Cote d'Ivoire|Ivory Coast;Côte d'Ivoire|Ivorian
+HR|Croatia||Croatian
+CU|Cuba||Cuban
+CY|Cyprus||Cypriot
+CZ|Czechia|Czech Republic|Czech
+DK|Denmark||Danish;Dane
+DJ|Djibouti||Djiboutian
+DM|Dominica||Dominican
+DO|Dominican Republic||
+EC|Ecuador||Ecuadorian
+EG|Egypt||Egyptian
+SV|El Salvador||Salvadoran
+GQ|Equatorial Guinea||Equatoguinean
+ER|Eritrea||Eritrean
+EE|Estonia||Estonian
+SZ|Eswatini|Swaziland|Swazi
+ET|Ethiopia||Ethiopian
+FJ|Fiji||Fijian
+FI|Finland||Finnish;Finn
+FR|France||French
+GA|Gabon||Gabonese
+GM|Gambia|The Gambia|Gambian
+GE|Georgia||Georgian
+DE|Germany|Deutschland|German
+GH|Ghana||Ghanaian
+GR|Greece||Greek
+GD|Grenada||Grenadian
+GT|Guatemala||Guatemalan
+GN|Guinea||Guinean
+GW|Guinea-Bissau|Guinea Bissau|Bissau-Guinean
+GY|Guyana||Guyanese
+HT|Haiti||Haitian
+HN|Honduras||Honduran
+HK|Hong Kong|Hong Kong SAR|Hongkonger
+HU|Hungary||Hungarian
+IS|Iceland||Icelandic;Icelander
+IN|India||Indian
+ID|Indonesia||Indonesian
+IR|Iran||Iranian
+IQ|Iraq||Iraqi
+IE|Ireland|Republic of Ireland;Eire|Irish
+IL|Israel||Israeli
+IT|Italy||Italian
+JM|Jamaica||Jamaican
+JP|Japan||Japanese
+JO|Jordan||Jordanian
+KZ|Kazakhstan||Kazakh;Kazakhstani
+KE|Kenya||Kenyan
+KI|Kiribati||I-Kiribati
+KP|North Korea|DPRK|North Korean
+KR|South Korea|Korea;Republic of Korea|South Korean;Korean
+XK|Kosovo||Kosovar
+KW|Kuwait||Kuwaiti
+KG|Kyrgyzstan||Kyrgyz
+LA|Laos|Lao PDR|Lao;Laotian
+LV|Latvia||Latvian
+LB|Lebanon||Lebanese
+LS|Lesotho||Basotho;Mosotho
+LR|Liberia||Liberian
+LY|Libya||Libyan
+LI|Liechtenstein||Liechtensteiner
+LT|Lithuania||Lithuanian
+LU|Luxembourg||Luxembourger
+MO|Macau|Macao|Macanese
+MG|Madagascar||Malagasy
+MW|Malawi||Malawian
+MY|Malaysia||Malaysian
+MV|Maldives||Maldivian
+ML|Mali||Malian
+MT|Malta||Maltese
+MH|Marshall Islands||Marshallese
+MR|Mauritania||Mauritanian
+MU|Mauritius||Mauritian
+MX|Mexico||Mexican
+FM|Micronesia||Micronesian
+MD|Moldova||Moldovan
+MC|Monaco||Monegasque
+MN|Mongolia||Mongolian
+ME|Montenegro||Montenegrin
+MA|Morocco||Moroccan
+MZ|Mozambique||Mozambican
+MM|Myanmar|Burma|Burmese
+NA|Namibia||Namibian
+NR|Nauru||Nauruan
+NP|Nepal||Nepali;Nepalese
+NL|Netherlands|Holland;The Netherlands|Dutch
+NZ|New Zealand|Aotearoa|New Zealander;Kiwi
+NI|Nicaragua||Nicaraguan
+NE|Niger||Nigerien
+NG|Nigeria||Nigerian
+MK|North Macedonia|Macedonia|Macedonian
+NO|Norway||Norwegian
+OM|Oman||Omani
+PK|Pakistan||Pakistani
+PW|Palau||Palauan
+PS|Palestine|State of Palestine|Palestinian
+PA|Panama||Panamanian
+PG|Papua New Guinea|PNG|Papua New Guinean
+PY|Paraguay||Paraguayan
+PE|Peru||Peruvian
+PH|Philippines|The Philippines|Filipino;Filipina
+PL|Poland||Polish
+PT|Portugal||Portuguese
+PR|Puerto Rico||Puerto Rican
+QA|Qatar||Qatari
+RO|Romania||Romanian
+RU|Russia|Russian Federation|Russian
+RW|Rwanda||Rwandan
+KN|Saint Kitts and Nevis|St Kitts and Nevis;St. Kitts|Kittitian
+LC|Saint Lucia|St Lucia;St. Lucia|Saint Lucian
+VC|Saint Vincent and the Grenadines|St Vincent|Vincentian
+WS|Samoa||Samoan
+SM|San Marino||Sammarinese
+ST|Sao Tome and Principe|São Tomé and Príncipe|
+SA|Saudi Arabia|KSA;Saudi|Saudi Arabian
+SN|Senegal||Senegalese
+RS|Serbia||Serbian
+SC|Seychelles||Seychellois
+SL|Sierra Leone||Sierra Leonean
+SG|Singapore||Singaporean
+SK|Slovakia|Slovak Republic|Slovak
+SI|Slovenia||Slovenian;Slovene
+SB|Solomon Islands||Solomon Islander
+SO|Somalia||Somali
+ZA|South Africa|RSA|South African
+SS|South Sudan||South Sudanese
+ES|Spain||Spanish
+LK|Sri Lanka||Sri Lankan
+SD|Sudan||Sudanese
+SR|Suriname||Surinamese
+SE|Sweden||Swedish;Swede
+CH|Switzerland||Swiss
+SY|Syria||Syrian
+TW|Taiwan||Taiwanese
+TJ|Tajikistan||Tajik
+TZ|Tanzania|Zanzibar|Tanzanian
+TH|Thailand||Thai
+TL|Timor-Leste|East Timor|Timorese
+TG|Togo||Togolese
+TO|Tonga||Tongan
+TT|Trinidad and Tobago|Trinidad|Trinidadian
+TN|Tunisia||Tunisian
+TR|Turkey|Turkiye;Türkiye|Turkish
+TM|Turkmenistan||Turkmen
+TV|Tuvalu||Tuvaluan
+UG|Uganda||Ugandan
+UA|Ukraine||Ukrainian
+AE|United Arab Emirates|UAE;Emirates;Dubai;Abu Dhabi|Emirati
+GB|United Kingdom|UK;U.K.;Britain;Great Britain;England;Scotland;Wales;Northern Ireland|British;English;Scottish;Welsh
+US|United States|USA;U.S.A.;America;United States of America|American
+UY|Uruguay||Uruguayan
+UZ|Uzbekistan||Uzbek
+VU|Vanuatu||Ni-Vanuatu
+VA|Vatican City|Holy See;Vatican|
+VE|Venezuela||Venezuelan
+VN|Vietnam|Viet Nam|Vietnamese
+YE|Yemen||Yemeni
+ZM|Zambia||Zambian
+ZW|Zimbabwe||Zimbabwean
+"""
+
+
+def _parse() -> Tuple[Dict[str, str], Dict[str, Tuple[str, bool]]]:
+    names: Dict[str, str] = {}
+    aliases: Dict[str, Tuple[str, bool]] = {}
+    for line in _TABLE.strip().splitlines():
+        if "|" not in line:
+            continue
+        code, name, other_names, demonyms = line.split("|")
+        names[code] = name
+        for alias in [name] + [a for a in other_names.split(";") if a]:
+            aliases.setdefault(alias.lower(), (code, False))
+        for demonym in (d for d in demonyms.split(";") if d):
+            aliases.setdefault(demonym.lower(), (code, True))
+            aliases.setdefault(demonym.lower() + "s", (code, True))
+    return names, aliases
+
+
+# ISO code -> display name, and lowercase alias -> (ISO code, is_demonym)
+COUNTRY_NAMES, COUNTRY_ALIASES = _parse()
+
+
+def country_name(code: str) -> str:
+    return COUNTRY_NAMES.get(code, code)
+
+
+def alias_tokens(alias: str) -> List[str]:
+    """How an alias is split into words by the entity extractor"""
+    return alias.replace("-", " ").replace(".", "").replace("'", " ").split()
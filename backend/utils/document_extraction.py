@@ -0,0 +1,116 @@
+"""Text extraction for uploaded attachments.
+
+These functions run inside the attachment process pool, so this module
+imports nothing from the application and loads each parser lazily: a
+spawned worker only pays for the libraries of the formats it is asked to
+read.
+"""
+import os
+from typing import Dict, Tuple
+
+PDF_TYPES = {"application/pdf"}
+DOCX_TYPES = {"application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
+TEXT_TYPES = {"text/plain", "text/csv", "text/markdown", "application/json"}
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/tiff", "image/webp"}
+
+_EXTENSION_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": "text/plain",
+    ".csv": "text/csv",
+    ".md": "text/markdown",
+    ".json": "application/json",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".webp": "image/webp",
+}
+
+SUPPORTED_TYPES = PDF_TYPES | DOCX_TYPES | TEXT_TYPES | IMAGE_TYPES
+
+
+def sniff_content_type(head: bytes, filename: str, declared: str = "") -> str:
+    """Content type from the file's magic bytes, then its extension, then what the client declared"""
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    by_extension = _EXTENSION_TYPES.get(os.path.splitext(filename or "")[1].lower())
+    if head.startswith(b"PK\x03\x04"):
+        # DOCX is a zip archive; only trust the extension for zip containers
+        return by_extension if by_extension in DOCX_TYPES else "application/zip"
+    return by_extension or (declared or "application/octet-stream").split(";")[0].strip().lower()
+
+
+def _pdf(path: str, max_chars: int) -> Tuple[str, Dict[str, object]]:
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    if reader.is_encrypted:
+        reader.decrypt("")
+    pages, total = [], 0
+    for page in reader.pages:
+        text = page.extract_text() or ""
+        pages.append(text)
+        total += len(text)
+        if total >= max_chars:
+            break
+    return "\n\n".join(pages), {"pages": len(reader.pages)}
+
+
+def _docx(path: str, max_chars: int) -> Tuple[str, Dict[str, object]]:
+    import docx
+
+    document = docx.Document(path)
+    blocks = [p.text for p in document.paragraphs if p.text.strip()]
+    for table in document.tables:
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells]
+            if any(cells):
+                blocks.append(" | ".join(cells))
+    return "\n\n".join(blocks)[:max_chars], {"paragraphs": len(document.paragraphs), "tables": len(document.tables)}
+
+
+def _text(path: str, max_chars: int) -> Tuple[str, Dict[str, object]]:
+    with open(path, "rb") as f:
+        raw = f.read(max_chars * 4)
+    return raw.decode("utf-8", errors="replace")[:max_chars], {}
+
+
+def _image(path: str, max_chars: int) -> Tuple[str, Dict[str, object]]:
+    from PIL import Image
+
+    with Image.open(path) as image:
+        meta: Dict[str, object] = {"width": image.width, "height": image.height}
+        try:
+            import pytesseract
+        except ImportError:  # no OCR engine installed: only image metadata is available
+            meta["ocr"] = False
+            return "", meta
+        meta["ocr"] = True
+        return pytesseract.image_to_string(image.convert("L"))[:max_chars], meta
+
+
+_EXTRACTORS = (
+    (PDF_TYPES, _pdf),
+    (DOCX_TYPES, _docx),
+    (TEXT_TYPES, _text),
+    (IMAGE_TYPES, _image),
+)
+
+
+def extract_text(path: str, content_type: str, max_chars: int) -> Tuple[str, Dict[str, object]]:
+    """Plain text of a document and format-specific metadata (page count, image size)"""
+    for types, extractor in _EXTRACTORS:
+        if content_type in types:
+            text, meta = extractor(path, max_chars)
+            return text[:max_chars], meta
+    raise ValueError(f"Unsupported attachment type: {content_type}")
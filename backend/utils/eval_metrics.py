@@ -0,0 +1,115 @@
+"""Answer scoring for the evaluation harness.
+
+Runs in worker processes, so this module imports nothing from the app.
+Every scorer takes a batch of predictions and references and returns one
+score in [0, 1] per pair, computed on hashed count matrices with NumPy
+instead of per-pair Python loops. Multiple-choice rows are scored on the
+option letter instead, and failed generations score 0 on every scorer.
+"""
+import re
+import string
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+SCORERS = ("exact_match", "overlap_f1", "similarity")
+
+_ARTICLES = re.compile(r"\b(a|an|the)\b")
+_PUNCTUATION = str.maketrans("", "", string.punctuation)
+# "B", "B.", "(B)", "B) Paris" at the start, or "the answer is B" anywhere; uppercase only, so the article "a" never matches
+_LEADING_CHOICE = re.compile(r"\s*\(?([A-J])(?:[).:]|\s*$)")
+_STATED_CHOICE = re.compile(r"(?i:answer|option|choice)(?:\s+is)?\s*[:\-]?\s*\(?([A-J])\b")
+# Buckets for hashed features; collisions only ever add spurious overlap, and are rare at this size
+_TOKEN_BUCKETS = 1 << 15
+_NGRAM_BUCKETS = 1 << 14
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop punctuation and articles, collapse whitespace (SQuAD-style)"""
+    text = _ARTICLES.sub(" ", text.lower().translate(_PUNCTUATION))
+    return " ".join(text.split())
+
+
+def _bucket(feature: str, buckets: int) -> int:
+    # crc32 rather than hash(): stable across the spawned worker processes
+    return zlib.crc32(feature.encode("utf-8")) % buckets
+
+
+def _count_matrix(features: List[List[str]], buckets: int) -> np.ndarray:
+    """Rows of hashed feature counts, one row per text"""
+    rows = np.repeat(np.arange(len(features)), [len(f) for f in features])
+    cols = np.fromiter((_bucket(f, buckets) for fs in features for f in fs), dtype=np.int64, count=len(rows))
+    matrix = np.zeros((len(features), buckets), dtype=np.float32)
+    np.add.at(matrix, (rows, cols), 1.0)
+    return matrix
+
+
+def exact_match(predictions: List[str], references: List[str]) -> np.ndarray:
+    return np.array([p == r for p, r in zip(predictions, references)], dtype=np.float32)
+
+
+def overlap_f1(predictions: List[str], references: List[str]) -> np.ndarray:
+    """Unigram overlap F1 (ROUGE-1 style) on normalized tokens"""
+    pred = _count_matrix([p.split() for p in predictions], _TOKEN_BUCKETS)
+    ref = _count_matrix([r.split() for r in references], _TOKEN_BUCKETS)
+    overlap = np.minimum(pred, ref).sum(axis=1)
+    pred_len = pred.sum(axis=1)
+    ref_len = ref.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(pred_len > 0, overlap / pred_len, 0.0)
+        recall = np.where(ref_len > 0, overlap / ref_len, 0.0)
+        f1 = np.where(overlap > 0, 2 * precision * recall / (precision + recall), 0.0)
+    # Two empty answers agree
+    f1[(pred_len == 0) & (ref_len == 0)] = 1.0
+    return f1.astype(np.float32)
+
+
+def _char_ngrams(text: str, n: int = 3) -> List[str]:
+    padded = f" {text} "
+    return [padded[i:i + n] for i in range(max(1, len(padded) - n + 1))]
+
+
+def similarity(predictions: List[str], references: List[str]) -> np.ndarray:
+    """Cosine similarity of hashed character-trigram vectors.
+
+    A dependency-free stand-in for sentence embeddings: robust to inflection
+    and small wording changes, blind to paraphrases that share no characters.
+    """
+    pred = _count_matrix([_char_ngrams(p) for p in predictions], _NGRAM_BUCKETS)
+    ref = _count_matrix([_char_ngrams(r) for r in references], _NGRAM_BUCKETS)
+    dot = np.einsum("ij,ij->i", pred, ref)
+    norms = np.linalg.norm(pred, axis=1) * np.linalg.norm(ref, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(norms > 0, dot / norms, 0.0).astype(np.float32)
+
+
+def extract_choice(text: str) -> Optional[str]:
+    """The option letter a multiple-choice answer picked, if it states one"""
+    match = _LEADING_CHOICE.match(text) or _STATED_CHOICE.search(text)
+    return match.group(1) if match else None
+
+
+def score_batch(predictions: Sequence[Optional[str]], references: Sequence[str],
+                scorers: Sequence[str] = SCORERS, choices: Optional[Sequence[bool]] = None) -> Dict[str, List[float]]:
+    """Score a batch with each requested scorer; returns rounded per-item scores.
+
+    A None prediction is a failed generation and scores 0. Rows flagged in
+    `choices` compare the extracted option letter with the reference letter
+    (1 or 0 on every scorer): normalizing would strip "A" as an article.
+    """
+    texts = [normalize(p or "") for p in predictions]
+    normalized = [normalize(r) for r in references]
+    functions = {"exact_match": exact_match, "overlap_f1": overlap_f1, "similarity": similarity}
+    overrides = np.full(len(texts), np.nan)
+    for i, prediction in enumerate(predictions):
+        if prediction is None:
+            overrides[i] = 0.0
+        elif choices is not None and choices[i]:
+            overrides[i] = float(extract_choice(prediction) == references[i].strip().upper())
+    scored = {}
+    for name in scorers:
+        values = functions[name](texts, normalized).astype(np.float64)
+        values = np.where(np.isnan(overrides), values, overrides)
+        scored[name] = np.round(values, 4).tolist()
+    return scored
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+Hook = Callable[[], Awaitable[None]]
+
+
+class ServiceLifecycle:
+    """Readiness, warmup and graceful draining for one worker process"""
+
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self.started_at = time.time()
+        self.in_flight = 0
+        self.warmup_errors: List[str] = []
+        self._warmup_hooks: List[Tuple[str, Hook, bool]] = []
+        self._shutdown_hooks: List[Tuple[str, Hook]] = []
+
+    def on_warmup(self, name: str, hook: Hook, required: bool = False) -> None:
+        """Run `hook` before the worker reports ready; required hooks fail startup.
+
+        Registering a name again replaces its hook, so a lifespan that runs
+        more than once in a process (tests, reloads) does not stack duplicates.
+        """
+        self._warmup_hooks = [h for h in self._warmup_hooks if h[0] != name] + [(name, hook, required)]
+
+    def on_shutdown(self, name: str, hook: Hook) -> None:
+        """Run `hook` after in-flight requests have drained (a repeated name replaces its hook)"""
+        self._shutdown_hooks = [h for h in self._shutdown_hooks if h[0] != name] + [(name, hook)]
+
+    async def startup(self, timeout: float = 60.0) -> None:
+        """Run warmup hooks concurrently, then mark the worker ready"""
+        async def run(name: str, hook: Hook, required: bool):
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(hook(), timeout)
+                logger.info("Warmup %s finished in %.2fs", name, time.perf_counter() - started)
+            except Exception as e:
+                if required:
+                    raise
+                self.warmup_errors.append(f"{name}: {e}")
+                logger.warning("Warmup %s failed: %s", name, e)
+
+        await asyncio.gather(*(run(name, hook, required) for name, hook, required in self._warmup_hooks))
+        self.started_at = time.time()
+        self.ready = True
+
+    def begin_drain(self) -> None:
+        """Stop reporting ready so load balancers take this worker out of rotation"""
+        if not self.draining:
+            logger.info("Draining worker with %d request(s) in flight", self.in_flight)
+        self.draining = True
+        self.ready = False
+
+    async def shutdown(self, drain_timeout: float = 30.0) -> None:
+        """Wait for in-flight requests and streams, then run shutdown hooks in reverse order.
+
+        Under uvicorn this runs after the server has stopped accepting
+        connections and waited for open ones (up to timeout_graceful_shutdown,
+        which serve.py sets from SHUTDOWN_DRAIN_TIMEOUT), so the wait here
+        usually returns at once. It still covers requests uvicorn gave up
+        on and servers or test clients that do not drain before lifespan
+        shutdown.
+        """
+        self.begin_drain()
+        deadline = time.monotonic() + drain_timeout
+        while self.in_flight > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.in_flight > 0:
+            logger.warning("Drain timeout reached with %d request(s) still in flight", self.in_flight)
+        for name, hook in reversed(self._shutdown_hooks):
+            try:
+                await hook()
+            except Exception as e:
+                logger.warning("Shutdown %s failed: %s", name, e)
+
+    def request_started(self) -> None:
+        self.in_flight += 1
+
+    def request_finished(self) -> None:
+        self.in_flight -= 1
+
+
+lifecycle = ServiceLifecycle()
+
+# Probe paths stay answerable while draining
+_PROBE_PATHS = {"/health", "/ready"}
+
+
+class InFlightMiddleware:
+    """Count in-flight HTTP requests and refuse new work while draining (pure ASGI)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in _PROBE_PATHS:
+            await self.app(scope, receive, send)
+            return
+        if lifecycle.draining:
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [(b"content-type", b"application/json"), (b"connection", b"close"), (b"retry-after", b"1")],
+            })
+            await send({"type": "http.response.body", "body": b'{"detail":"Server is shutting down"}'})
+            return
+        lifecycle.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lifecycle.request_finished()
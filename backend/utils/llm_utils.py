@@ -1,41 +1,37 @@
-import os
-import openai
-from anthropic import AsyncAnthropic
 from typing import Dict, Any, Optional
+from models import ModelProvider
+from services.provider_health import provider_health
+from services.providers import ChatResult, ProviderError, get_adapter
 
 class LLMProvider:
-    def __init__(self):
-        self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
-        
-        # Initialize clients
-        if self.openai_api_key:
-            openai.api_key = self.openai_api_key
-            
-        if self.anthropic_api_key:
-            self.anthropic_client = AsyncAnthropic(api_key=self.anthropic_api_key)
-    
-    def check_openai_connection(self) -> bool:
-        """Check if OpenAI API key is valid"""
-        if not self.openai_api_key:
-            return False
-            
-        try:
-            openai.Model.list()
-            return True
-        except:
-            return False
-            
-    def check_anthropic_connection(self) -> bool:
-        """Check if Anthropic API key is valid"""
-        if not self.anthropic_api_key:
-            return False
-            
-        try:
-            # Make a simple API call
-            return True
-        except:
-            return False
+    """Thin wrapper over the shared provider adapters, kept for existing callers"""
+
+    @staticmethod
+    def _as_dict(result: ChatResult) -> Dict[str, Any]:
+        return {
+            "model": result.model,
+            "response": result.text,
+            "usage": {
+                "input_tokens": result.prompt_tokens,
+                "output_tokens": result.completion_tokens
+            }
+        }
+
+    async def check_openai_connection(self) -> bool:
+        """Check if OpenAI is reachable (cached result from the background prober)"""
+        return await self._cached_health(ModelProvider.OPENAI)
+
+    async def check_anthropic_connection(self) -> bool:
+        """Check if Anthropic is reachable (cached result from the background prober)"""
+        return await self._cached_health(ModelProvider.ANTHROPIC)
+
+    @staticmethod
+    async def _cached_health(provider: ModelProvider) -> bool:
+        entry = provider_health.health.get(provider)
+        if entry is not None and entry.healthy is not None:
+            return entry.healthy
+        # Not probed by this worker (e.g. no key configured): ask once
+        return await get_adapter(provider).health()
 
     async def generate_openai_response(
         self,
@@ -45,23 +41,12 @@ class LLMProvider:
         max_tokens: Optional[int] = None
     ) -> Dict[str, Any]:
         """Generate response using OpenAI model"""
-        if not self.openai_api_key:
-            raise Exception("OpenAI API key not configured")
-            
         try:
-            response = await openai.ChatCompletion.acreate(
-                model=model_name,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=temperature,
-                max_tokens=max_tokens
+            result = await get_adapter(ModelProvider.OPENAI).chat(
+                [{"role": "user", "content": prompt}], model_name, temperature, max_tokens
             )
-            
-            return {
-                "model": model_name,
-                "response": response.choices[0].message.content,
-                "usage": response.usage
-            }
-        except Exception as e:
+            return self._as_dict(result)
+        except ProviderError as e:
             raise Exception(f"OpenAI API error: {str(e)}")
 
     async def generate_anthropic_response(
@@ -72,24 +57,10 @@ class LLMProvider:
         max_tokens: Optional[int] = 300
     ) -> Dict[str, Any]:
         """Generate response using Anthropic model"""
-        if not self.anthropic_api_key:
-            raise Exception("Anthropic API key not configured")
-            
         try:
-            response = await self.anthropic_client.completion(
-                prompt=f"\n\nHuman: {prompt}\n\nAssistant:",
-                model=model_name,
-                temperature=temperature,
-                max_tokens_to_sample=max_tokens
+            result = await get_adapter(ModelProvider.ANTHROPIC).chat(
+                [{"role": "user", "content": prompt}], model_name, temperature, max_tokens
             )
-            
-            return {
-                "model": model_name,
-                "response": response.content,
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens
-                }
-            }
-        except Exception as e:
-            raise Exception(f"Anthropic API error: {str(e)}")
\ No newline at end of file
+            return self._as_dict(result)
+        except ProviderError as e:
+            raise Exception(f"Anthropic API error: {str(e)}")
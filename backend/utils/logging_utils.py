@@ -0,0 +1,180 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+from typing import Optional
+
+from utils.request_context import request_id_var, tenant_id_var
+
+# Patterns scrubbed from log output when sensitive data masking is enabled
+SENSITIVE_PATTERNS = [
+    (re.compile(r"sk-(?:ant-)?[A-Za-z0-9_\-]{16,}"), "sk-***"),
+    (re.compile(r"(?i)bearer\s+[A-Za-z0-9_\-\.=]+"), "Bearer ***"),
+    (re.compile(r"eyJ[A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]+"), "***jwt***"),
+    (re.compile(r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}"), "***@***"),
+    (re.compile(r"\b(?:\d[ \-]?){13,16}\b"), "***card***"),
+    (re.compile(r"\b[A-Z]{1,2}\d{6,8}\b"), "***passport***"),
+]
+
+# Attributes present on every LogRecord; anything else came in through `extra`
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "tenant_id", "sample"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Probe endpoints whose uvicorn access lines are sampled at the health rate
+_PROBE_PATHS = {"/health", "/ready"}
+
+
+def mask_sensitive(text: str) -> str:
+    """Replace API keys, tokens and personal identifiers in text"""
+    for pattern, replacement in SENSITIVE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _is_probe(record: logging.LogRecord) -> bool:
+    if getattr(record, "sample", None) == "health":
+        return True
+    # uvicorn.access args: (client_addr, method, full_path, http_version, status_code)
+    if record.name == "uvicorn.access" and isinstance(record.args, tuple) and len(record.args) >= 3:
+        return str(record.args[2]).split("?", 1)[0] in _PROBE_PATHS
+    return False
+
+
+class SamplingFilter(logging.Filter):
+    """Drop a fraction of health-check and debug records before they are queued.
+
+    Health records are uvicorn access lines for the probe paths and anything
+    logged with `extra={"sample": "health"}`.
+    """
+
+    def __init__(self, health_rate: float = 1.0, debug_rate: float = 1.0):
+        super().__init__()
+        self.health_rate = health_rate
+        self.debug_rate = debug_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if _is_probe(record):
+            rate = self.health_rate
+        elif record.levelno <= logging.DEBUG:
+            rate = self.debug_rate
+        else:
+            return True
+        return rate >= 1.0 or random.random() < rate
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the request and tenant bound to the emitting context"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.tenant_id = tenant_id_var.get()
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread.
+
+    The stock handler renders `msg % args` (and any traceback) on the calling
+    thread; here the record is enqueued untouched so the request path only
+    pays for building the LogRecord.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Render records as one JSON object per line, masking sensitive values"""
+
+    def __init__(self, mask: bool = True):
+        super().__init__()
+        self.mask = mask
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        payload = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                  .isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": message,
+            "request_id": getattr(record, "request_id", None),
+            "tenant_id": getattr(record, "tenant_id", None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        line = json.dumps(payload, default=str, ensure_ascii=False)
+        return mask_sensitive(line) if self.mask else line
+
+
+class MaskingFormatter(logging.Formatter):
+    """Plain-text formatter for local development, with optional masking"""
+
+    def __init__(self, mask: bool = True):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+        self.mask = mask
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "request_id"):
+            record.request_id = None
+        line = super().format(record)
+        return mask_sensitive(line) if self.mask else line
+
+
+def setup_logging(
+    level: str = "INFO",
+    fmt: str = "json",
+    mask: bool = True,
+    health_sample_rate: float = 1.0,
+    debug_sample_rate: float = 1.0,
+) -> logging.handlers.QueueListener:
+    """Route all application logging through a background queue writer.
+
+    Callers only create a LogRecord and put it on an in-memory queue; JSON
+    rendering, masking and stream I/O happen on the listener thread.
+    Calling this more than once returns the already running listener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter(mask) if fmt == "json" else MaskingFormatter(mask))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(health_sample_rate, debug_sample_rate))
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level.upper())
+
+    # uvicorn installs its own synchronous stream handlers; send them through the queue too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
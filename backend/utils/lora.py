@@ -0,0 +1,105 @@
+"""Low-rank adapters (LoRA) for PyTorch causal language models.
+
+Only the small A/B matrices train; the base weights stay frozen, so the
+optimizer state and gradients fit comfortably in CPU memory. Adapters are
+saved with PEFT's key names and adapter_config.json, so
+`peft.PeftModel.from_pretrained(base, path)` can load them.
+
+Imports nothing from the app: it runs inside training worker processes.
+"""
+import json
+import math
+import os
+from typing import Dict, List, Optional, Sequence
+
+import torch
+from torch import nn
+
+# Attention projections of common architectures (Llama/Mistral/Qwen, GPT-2, GPT-NeoX, BERT-style)
+DEFAULT_TARGETS = ("q_proj", "v_proj", "c_attn", "query_key_value", "query", "value")
+
+
+class LoRALinear(nn.Module):
+    """Wrap a Linear (or GPT-2 Conv1D) as `base(x) + dropout(x) @ A^T @ B^T * alpha / r`"""
+
+    def __init__(self, base: nn.Module, rank: int, alpha: float, dropout: float = 0.0):
+        super().__init__()
+        self.base = base
+        # transformers' Conv1D stores the weight as (in, out)
+        self.transposed = type(base).__name__ == "Conv1D"
+        out_features, in_features = base.weight.shape[::-1] if self.transposed else base.weight.shape
+        self.lora_A = nn.Linear(in_features, rank, bias=False)
+        self.lora_B = nn.Linear(rank, out_features, bias=False)
+        nn.init.kaiming_uniform_(self.lora_A.weight, a=math.sqrt(5))
+        # B starts at zero, so the wrapped model initially matches the base model exactly
+        nn.init.zeros_(self.lora_B.weight)
+        self.dropout = nn.Dropout(dropout) if dropout > 0 else nn.Identity()
+        self.scaling = alpha / rank
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.base(x) + self.lora_B(self.lora_A(self.dropout(x))) * self.scaling
+
+
+def inject(model: nn.Module, rank: int = 8, alpha: float = 16.0, dropout: float = 0.05,
+           targets: Optional[Sequence[str]] = None) -> List[str]:
+    """Freeze the model and wrap matching projections with adapters; returns the wrapped module names"""
+    targets = tuple(targets or DEFAULT_TARGETS)
+    for parameter in model.parameters():
+        parameter.requires_grad_(False)
+    wrapped = []
+    for name, module in list(model.named_modules()):
+        leaf = name.rsplit(".", 1)[-1]
+        if leaf not in targets or not (isinstance(module, nn.Linear) or type(module).__name__ == "Conv1D"):
+            continue
+        parent = model.get_submodule(name.rsplit(".", 1)[0]) if "." in name else model
+        adapter = LoRALinear(module, rank, alpha, dropout).to(module.weight.device)
+        setattr(parent, leaf, adapter)
+        wrapped.append(name)
+    if not wrapped:
+        raise ValueError(f"No modules named {list(targets)} to adapt")
+    return wrapped
+
+
+def adapter_state(model: nn.Module) -> Dict[str, torch.Tensor]:
+    """Adapter weights only, keyed like PEFT (`base_model.model.<module>.lora_A.weight`)"""
+    return {
+        f"base_model.model.{name}": tensor.detach().cpu().contiguous()
+        for name, tensor in model.state_dict().items()
+        if ".lora_A." in name or ".lora_B." in name
+    }
+
+
+def load_adapter_state(model: nn.Module, state: Dict[str, torch.Tensor]) -> None:
+    prefix = "base_model.model."
+    own = model.state_dict()
+    for key, tensor in state.items():
+        name = key[len(prefix):] if key.startswith(prefix) else key
+        if name not in own:
+            raise KeyError(f"Adapter weight {key} does not match the model")
+        own[name].copy_(tensor)
+
+
+def save_adapter(model: nn.Module, directory: str, base_model: str, wrapped: List[str], rank: int, alpha: float,
+                 dropout: float) -> List[str]:
+    """Write adapter_model.safetensors and adapter_config.json; returns the written paths"""
+    from safetensors.torch import save_file
+
+    os.makedirs(directory, exist_ok=True)
+    weights = os.path.join(directory, "adapter_model.safetensors")
+    # PEFT drops the adapter name ("default") when saving, which leaves exactly these keys
+    save_file(adapter_state(model), weights)
+    config_path = os.path.join(directory, "adapter_config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "peft_type": "LORA",
+            "task_type": "CAUSAL_LM",
+            "base_model_name_or_path": base_model,
+            "r": rank,
+            "lora_alpha": alpha,
+            "lora_dropout": dropout,
+            "target_modules": sorted({name.rsplit(".", 1)[-1] for name in wrapped}),
+            "fan_in_fan_out": any(type(model.get_submodule(name).base).__name__ == "Conv1D" for name in wrapped),
+            "bias": "none",
+            "inference_mode": True
+        }, f, indent=2)
+    return [weights, config_path]
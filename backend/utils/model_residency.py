@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import httpx
+
+from config import config
+from models import ModelArchitecture, ModelInfo, ModelProvider, ModelType
+
+logger = logging.getLogger(__name__)
+
+_DURATION_RE = re.compile(r"^(-?\d+(?:\.\d+)?)([smh]?)$")
+
+
+def parse_keep_alive(value: str) -> float:
+    """Convert an Ollama keep_alive value ("30m", "1h", "300", "-1") to seconds; negative means forever"""
+    match = _DURATION_RE.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid keep_alive value: {value}")
+    amount, unit = float(match.group(1)), match.group(2)
+    return amount * {"": 1, "s": 1, "m": 60, "h": 3600}[unit]
+
+
+def default_memory_budget() -> int:
+    """Three quarters of physical RAM, leaving room for the OS and the API workers"""
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * 0.75)
+    except (ValueError, OSError, AttributeError):
+        return 8 * 1024 ** 3
+
+
+class ModelUnavailable(RuntimeError):
+    """A model was unloaded (by eviction or another worker) before the request could hold it"""
+
+
+class ResidentModel:
+    """A model currently loaded into the Ollama server's memory"""
+
+    __slots__ = ("name", "size_bytes", "loaded_at", "last_used", "in_use", "hot")
+
+    def __init__(self, name: str, size_bytes: int, hot: bool = False):
+        self.name = name
+        self.size_bytes = size_bytes
+        self.loaded_at = time.monotonic()
+        self.last_used = self.loaded_at
+        self.in_use = 0
+        self.hot = hot
+
+
+class ModelResidencyManager:
+    """Keeps frequently used Ollama models loaded within a RAM budget.
+
+    Models are loaded with an explicit keep_alive and tracked in LRU order.
+    Loading a model that does not fit first unloads the least recently used
+    models that are neither hot nor serving a request. The view is per
+    worker; it is re-synchronised from `/api/ps` before each eviction so
+    models loaded by other workers are accounted for.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        memory_budget_bytes: Optional[int] = None,
+        hot_models: Optional[List[str]] = None,
+        keep_alive: str = "30m",
+        default_model: str = "llama3.1"
+    ):
+        self.host = host.rstrip("/")
+        self.memory_budget_bytes = memory_budget_bytes or default_memory_budget()
+        self.hot_models = [m for m in (hot_models or []) if m]
+        self.keep_alive = keep_alive
+        self.keep_alive_seconds = parse_keep_alive(keep_alive)
+        self.default_model = default_model
+        self.catalog: Dict[str, ModelInfo] = {}
+        self.resident: "OrderedDict[str, ResidentModel]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # Model loads can take minutes on CPU hosts
+            self._client = httpx.AsyncClient(base_url=self.host, timeout=httpx.Timeout(600.0, connect=5.0))
+        return self._client
+
+    @staticmethod
+    def _canonical(name: str) -> str:
+        return name if ":" in name else f"{name}:latest"
+
+    def keep_alive_for(self, name: str) -> str:
+        """Hot models stay loaded indefinitely; others expire after the configured idle time"""
+        return "-1" if self._canonical(name) in {self._canonical(m) for m in self.hot_models} else self.keep_alive
+
+    def used_bytes(self) -> int:
+        return sum(m.size_bytes for m in self.resident.values())
+
+    def is_resident(self, name: str) -> bool:
+        model = self.resident.get(self._canonical(name))
+        if model is None:
+            return False
+        if self.keep_alive_seconds >= 0 and not model.hot and model.in_use == 0:
+            # Ollama will have unloaded it on its own after the keep_alive window
+            if time.monotonic() - model.last_used > self.keep_alive_seconds:
+                del self.resident[model.name]
+                return False
+        return True
+
+    def resolve(self, requested: Optional[str], pinned: bool = False) -> str:
+        """Pick the model to serve a request, preferring ones that are already loaded"""
+        if requested and pinned:
+            return requested
+        if requested and self.is_resident(requested):
+            return requested
+        if self.is_resident(self.default_model):
+            return self.default_model
+        # Another resident model may be an embedding or vision model; never substitute it for a chat request
+        return requested or self.default_model
+
+    async def refresh_catalog(self) -> Dict[str, ModelInfo]:
+        """Read installed models and their on-disk size from `/api/tags`"""
+        response = await self.client.get("/api/tags")
+        response.raise_for_status()
+        catalog = {}
+        for entry in response.json().get("models", []):
+            name = self._canonical(entry["name"])
+            details = entry.get("details") or {}
+            catalog[name] = ModelInfo(
+                name=name,
+                version=name.split(":", 1)[1],
+                provider=ModelProvider.OLLAMA,
+                type=ModelType.TEXT,
+                architecture=ModelArchitecture.TRANSFORMER,
+                size_bytes=entry.get("size"),
+                modified=entry.get("modified_at"),
+                quantization=details.get("quantization_level")
+            )
+        self.catalog = catalog
+        return catalog
+
+    async def sync_loaded(self) -> None:
+        """Reconcile the resident set with what the Ollama server reports as loaded"""
+        response = await self.client.get("/api/ps")
+        response.raise_for_status()
+        loaded = {self._canonical(m["name"]): m.get("size") or 0 for m in response.json().get("models", [])}
+        for name in list(self.resident):
+            if name not in loaded and self.resident[name].in_use == 0:
+                del self.resident[name]
+        for name, size in loaded.items():
+            if name in self.resident:
+                self.resident[name].size_bytes = size or self.resident[name].size_bytes
+            else:
+                self.resident[name] = ResidentModel(name, size, hot=self.keep_alive_for(name) == "-1")
+                self.resident.move_to_end(name, last=False)
+
+    def _footprint(self, name: str) -> int:
+        info = self.catalog.get(name)
+        return info.size_bytes if info is not None and info.size_bytes else 0
+
+    async def _evict_for(self, needed: int) -> None:
+        for name in list(self.resident):
+            if self.used_bytes() + needed <= self.memory_budget_bytes:
+                return
+            model = self.resident[name]
+            if model.hot or model.in_use > 0:
+                continue
+            await self.unload(name)
+        if self.used_bytes() + needed > self.memory_budget_bytes:
+            logger.warning("Loading %.1f GB exceeds the residency budget; all resident models are hot or busy", needed / 1024 ** 3)
+
+    async def _load(self, name: str) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if name not in self.catalog:
+                await self.refresh_catalog()
+            await self.sync_loaded()
+            if name in self.resident:
+                return
+            await self._evict_for(self._footprint(name))
+            started = time.perf_counter()
+            # An empty prompt loads the model without generating anything
+            response = await self.client.post("/api/generate", json={"model": name, "keep_alive": self.keep_alive_for(name)})
+            response.raise_for_status()
+            self.resident[name] = ResidentModel(name, self._footprint(name), hot=self.keep_alive_for(name) == "-1")
+            logger.info("Loaded %s in %.1fs (%.1f/%.1f GB resident)", name, time.perf_counter() - started,
+                        self.used_bytes() / 1024 ** 3, self.memory_budget_bytes / 1024 ** 3)
+
+    async def ensure_loaded(self, name: str) -> None:
+        """Load `name` if needed; concurrent callers share a single load"""
+        name = self._canonical(name)
+        if self.is_resident(name):
+            self.resident.move_to_end(name)
+            self.resident[name].last_used = time.monotonic()
+            return
+        future = self._loading.get(name)
+        if future is None:
+            future = asyncio.ensure_future(self._load(name))
+            self._loading[name] = future
+            future.add_done_callback(lambda _: self._loading.pop(name, None))
+        await asyncio.shield(future)
+
+    async def unload(self, name: str) -> None:
+        """Ask Ollama to release a model's memory"""
+        name = self._canonical(name)
+        response = await self.client.post("/api/generate", json={"model": name, "keep_alive": 0})
+        response.raise_for_status()
+        self.resident.pop(name, None)
+        logger.info("Unloaded %s", name)
+
+    @asynccontextmanager
+    async def use(self, name: str):
+        """Hold a model resident (not evictable) for the duration of a request"""
+        model = None
+        for _ in range(2):
+            await self.ensure_loaded(name)
+            # A concurrent eviction or sync_loaded can drop it between the load and this lookup; load it again once
+            model = self.resident.get(self._canonical(name))
+            if model is not None:
+                break
+        if model is None:
+            raise ModelUnavailable(f"Model {name} was unloaded before it could be used")
+        model.in_use += 1
+        try:
+            yield model
+        finally:
+            model.in_use -= 1
+            model.last_used = time.monotonic()
+            if model.name in self.resident:
+                self.resident.move_to_end(model.name)
+
+    async def preload(self) -> None:
+        """Load configured hot models, e.g. during worker warmup"""
+        await self.refresh_catalog()
+        await self.sync_loaded()
+        for name in self.hot_models:
+            await self.ensure_loaded(name)
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        """Resident models in LRU order (least recent first)"""
+        now = time.monotonic()
+        return [
+            {
+                "name": m.name,
+                "size_bytes": m.size_bytes,
+                "hot": m.hot,
+                "in_use": m.in_use,
+                "idle_seconds": round(now - m.last_used, 1),
+            }
+            for m in self.resident.values()
+        ]
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Per-worker residency view of the shared Ollama host
+residency = ModelResidencyManager(
+    config.OLLAMA_HOST,
+    memory_budget_bytes=int(config.OLLAMA_MEMORY_BUDGET_GB * 1024 ** 3) or None,
+    hot_models=config.OLLAMA_HOT_MODELS,
+    keep_alive=config.OLLAMA_KEEP_ALIVE,
+    default_model=config.DEFAULT_MODEL
+)
@@ -3,6 +3,11 @@ import subprocess
 import os
 import json
 from typing import List, Dict, Any, Optional
+import httpx
+from models import ModelProvider
+from services.provider_health import provider_health
+from services.providers import get_adapter
+from utils.model_residency import residency
 
 class OllamaModelInfo:
     def __init__(self, name: str, size: str, modified: str):
@@ -15,17 +20,11 @@ class OllamaManager:
         self.ollama_host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
         
     async def check_connection(self) -> bool:
-        """Check if Ollama service is running"""
-        try:
-            process = await asyncio.create_subprocess_exec(
-                'ollama', 'list',
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-            return process.returncode == 0
-        except:
-            return False
+        """Check if Ollama service is running (cached result from the background prober)"""
+        entry = provider_health.health.get(ModelProvider.OLLAMA)
+        if entry is not None and entry.healthy is not None:
+            return entry.healthy
+        return await get_adapter(ModelProvider.OLLAMA).health()
 
     async def list_models(self) -> List[OllamaModelInfo]:
         """List all installed Ollama models"""
@@ -101,37 +100,39 @@ class OllamaManager:
         model_name: str, 
         prompt: str,
         temperature: float = 0.7,
-        stream: bool = False
+        stream: bool = False,
+        pinned: bool = True
     ) -> Dict[str, Any]:
-        """Generate response from Ollama model"""
-        if not await self.check_connection():
-            raise Exception("Ollama service not available")
-            
+        """Generate response from Ollama model
+
+        When `pinned` is False the request may be routed to a model that is
+        already resident instead of loading `model_name`.
+        """
+        model_name = residency.resolve(model_name, pinned=pinned)
         try:
             # Create request payload
             payload = {
                 "model": model_name,
                 "prompt": prompt,
-                "temperature": temperature,
-                "stream": stream
+                "options": {"temperature": temperature},
+                "stream": False,
+                "keep_alive": residency.keep_alive_for(model_name)
             }
             
-            # Use Ollama API directly for streaming support
-            process = await asyncio.create_subprocess_exec(
-                'ollama', 'run', model_name, prompt,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
+            # Use Ollama API directly so the model stays resident between requests
+            async with residency.use(model_name):
+                response = await residency.client.post("/api/generate", json=payload)
             
-            stdout, stderr = await process.communicate()
+            if response.status_code != 200:
+                raise Exception(f"Model error: {response.text}")
             
-            if process.returncode != 0:
-                raise Exception(f"Model error: {stderr.decode()}")
-                
+            result = response.json()
             return {
                 "model": model_name,
-                "response": stdout.decode(),
+                "response": result.get("response", ""),
                 "status": "success"
             }
+        except httpx.HTTPError as e:
+            raise Exception(f"Ollama service not available: {str(e)}")
         except Exception as e:
-            raise Exception(f"Error generating response: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error generating response: {str(e)}")
@@ -0,0 +1,267 @@
+import asyncio
+import collections
+import linecache
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profile of the same kind is already running in this worker"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_names() -> Dict[int, str]:
+    return {thread.ident: thread.name for thread in threading.enumerate()}
+
+
+def format_stack(frame, limit: int = 30) -> List[str]:
+    """Innermost-last "file:line in function" lines for a live frame"""
+    lines = []
+    while frame is not None and len(lines) < limit:
+        code = frame.f_code
+        source = linecache.getline(code.co_filename, frame.f_lineno).strip()
+        lines.append(f"{code.co_filename}:{frame.f_lineno} in {code.co_name}" + (f": {source}" if source else ""))
+        frame = frame.f_back
+    return lines[::-1]
+
+
+class StackSampler:
+    """Statistical CPU profiler: samples every thread's stack at a fixed interval.
+
+    Nothing is installed while idle; a profile starts a sampling thread that
+    reads `sys._current_frames()` until the duration elapses, so the running
+    code is not instrumented. Samples are wall-clock: a thread stuck in a
+    blocking call counts against its caller. Threads parked in a wait (idle
+    executor workers, the loop's selector) are dropped unless `include_idle`.
+    Output is in collapsed-stack format
+    ("root;caller;callee count"), which flamegraph.pl and speedscope read.
+    """
+
+    # Innermost frames that mean a thread is blocked rather than running Python code
+    IDLE_FRAMES = {"wait", "select", "poll", "_worker", "accept"}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = 0.005, include_idle: bool = False,
+                loop_thread_id: Optional[int] = None) -> Dict[str, Any]:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A CPU profile is already running")
+        try:
+            return self._sample(seconds, interval, include_idle, loop_thread_id)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float, include_idle: bool, loop_thread_id: Optional[int]) -> Dict[str, Any]:
+        own_thread = threading.get_ident()
+        stacks: Dict[str, int] = collections.Counter()
+        names = _thread_names()
+        samples = idle = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                samples += 1
+                if not include_idle and frame.f_code.co_name in self.IDLE_FRAMES:
+                    idle += 1
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = _thread_names()
+                thread = "event-loop" if thread_id == loop_thread_id else names.get(thread_id, str(thread_id))
+                labels.append(thread)
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(max(0.0, interval - (time.perf_counter() - now)))
+        elapsed = time.perf_counter() - started
+        return {"stacks": stacks, "samples": samples, "idle_samples": idle, "duration": round(elapsed, 3),
+                "interval": interval}
+
+    @staticmethod
+    def collapsed(result: Dict[str, Any]) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(result["stacks"].items()))
+
+    @staticmethod
+    def top_functions(result: Dict[str, Any], limit: int = 30) -> List[Dict[str, Any]]:
+        """Functions ranked by self samples (innermost frame), with inclusive counts"""
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in result["stacks"].items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        busy = sum(result["stacks"].values()) or 1
+        return [
+            {"function": name, "self": count, "self_percent": round(100 * count / busy, 2),
+             "total": total[name], "total_percent": round(100 * total[name] / busy, 2)}
+            for name, count in own.most_common(limit)
+        ]
+
+
+class AllocationProfiler:
+    """tracemalloc snapshot diff over a time window.
+
+    Tracing is switched on only for the window (it slows allocation-heavy
+    code by roughly 2x while active) and switched off again unless something
+    else had already started it.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+
+    async def diff(self, seconds: float, top: int = 25, group_by: str = "lineno", frames: int = 10) -> Dict[str, Any]:
+        if self._lock.locked():
+            raise ProfilerBusy("A memory profile is already running")
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            started_here = not tracemalloc.is_tracing()
+            if started_here:
+                tracemalloc.start(frames if group_by == "traceback" else 1)
+            try:
+                before = await loop.run_in_executor(None, tracemalloc.take_snapshot)
+                await asyncio.sleep(seconds)
+                after = await loop.run_in_executor(None, tracemalloc.take_snapshot)
+                traced, peak = tracemalloc.get_traced_memory()
+            finally:
+                if started_here:
+                    tracemalloc.stop()
+            return await loop.run_in_executor(None, self._compare, before, after, top, group_by, traced, peak, seconds)
+
+    @staticmethod
+    def _compare(before, after, top: int, group_by: str, traced: int, peak: int, seconds: float) -> Dict[str, Any]:
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), group_by)
+        return {
+            "window_seconds": seconds,
+            "traced_bytes": traced,
+            "peak_bytes": peak,
+            "net_bytes": sum(stat.size_diff for stat in stats),
+            "top": [
+                {
+                    "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                    "size_diff": stat.size_diff,
+                    "size": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count
+                }
+                for stat in stats[:top]
+            ]
+        }
+
+
+class LoopLagMonitor:
+    """Detect event-loop stalls and log the stack of the code causing them.
+
+    A heartbeat callback runs on the loop every `interval`; its scheduling
+    delay is the loop lag. A watchdog thread checks the heartbeat and, when
+    it is older than `threshold`, captures the loop thread's stack while the
+    blocking callback is still running, so the log names the culprit rather
+    than whatever ran next. Nothing runs unless started.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, keep: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: "collections.deque[Dict[str, Any]]" = collections.deque(maxlen=keep)
+        self.lags: "collections.deque[float]" = collections.deque(maxlen=2048)
+        self._beat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.stall_count = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def _heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+            self._beat = time.monotonic()
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopping.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or beat == reported:
+                continue
+            # Report each stall once, with the stack as it is right now
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = format_stack(frame) if frame is not None else []
+            self.stall_count += 1
+            self.stalls.append({"ts": time.time(), "blocked_ms": round(blocked * 1000, 1), "stack": stack})
+            logger.warning("Event loop blocked for %.0fms at:\n%s", blocked * 1000, "\n".join(stack[-15:]))
+
+    def start(self, threshold: Optional[float] = None) -> None:
+        if threshold is not None:
+            self.threshold = threshold
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info("Loop lag monitor started (threshold %.0fms)", self.threshold * 1000)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._watchdog = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        lags = sorted(self.lags)
+
+        def pick(q: float) -> Optional[float]:
+            return round(lags[min(len(lags) - 1, int(q * len(lags)))] * 1000, 2) if lags else None
+
+        return {
+            "running": self.running,
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "lag_ms": {"p50": pick(0.5), "p99": pick(0.99), "max": round(lags[-1] * 1000, 2) if lags else None},
+            "stalls": self.stall_count,
+            "recent_stalls": list(self.stalls)[-10:]
+        }
+
+
+# Per-worker profilers; idle unless a request or LOOP_LAG_MONITOR starts them
+stack_sampler = StackSampler()
+allocation_profiler = AllocationProfiler()
+loop_monitor = LoopLagMonitor(threshold=config.LOOP_LAG_THRESHOLD_MS / 1000)
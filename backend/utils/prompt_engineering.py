@@ -12,6 +12,33 @@ class PromptTemplates:
         
         Format your response with clear sections and bullet points where appropriate."""
     
+    @staticmethod
+    def travel_brief_answer_prompt():
+        return """You are an expert travel assistant.
+        
+        Answer the question directly in one to three sentences.
+        Do not add headings, background or unrelated advice."""
+    
+    @staticmethod
+    def travel_checklist_prompt():
+        return """You are an expert travel assistant specializing in visa requirements and travel documentation.
+        
+        Answer with a short markdown checklist:
+        - One bullet per requirement or document
+        - Keep each bullet to a single line
+        - Add at most one sentence of context before the list"""
+    
+    @staticmethod
+    def travel_detailed_prompt():
+        return """You are an expert travel assistant. Provide detailed, accurate, and well-structured answers 
+        using markdown formatting with headings (##), subheadings (###), and bullet points (-). 
+        Focus on clarity and completeness."""
+    
+    @staticmethod
+    def continuation_prompt():
+        return """Your previous answer was cut off. Continue exactly where you stopped, without repeating
+        anything you already wrote and without any introduction."""
+    
     @staticmethod
     def technical_support_prompt():
         return """You are a technical support specialist.
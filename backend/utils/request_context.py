@@ -0,0 +1,65 @@
+import contextvars
+import uuid
+from typing import Optional
+
+# Identifiers bound to the request currently being served. They are read by
+# the logging pipeline and anything else that needs per-request attribution.
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+tenant_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("tenant_id", default=None)
+# Set by the auth dependency once a bearer token has been verified
+user_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("user_id", default=None)
+
+REQUEST_ID_HEADER = b"x-request-id"
+TENANT_ID_HEADER = b"x-tenant-id"
+
+
+def get_request_id() -> Optional[str]:
+    """Return the request ID bound to the current context"""
+    return request_id_var.get()
+
+
+def get_tenant_id() -> Optional[str]:
+    """Return the tenant ID bound to the current context"""
+    return tenant_id_var.get()
+
+
+def get_user_id() -> Optional[str]:
+    """Return the authenticated user ID bound to the current context"""
+    return user_id_var.get()
+
+
+class RequestContextMiddleware:
+    """Bind request/tenant IDs from headers to context variables (pure ASGI)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        tenant_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")[:128]
+            elif name == TENANT_ID_HEADER:
+                tenant_id = value.decode("latin-1")[:128]
+        if not request_id:
+            request_id = uuid.uuid4().hex
+
+        request_token = request_id_var.set(request_id)
+        tenant_token = tenant_id_var.set(tenant_id)
+        header_value = request_id.encode("latin-1")
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER, header_value)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(request_token)
+            tenant_id_var.reset(tenant_token)
@@ -0,0 +1,168 @@
+import logging
+import math
+import re
+import threading
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from utils.prompt_engineering import PromptTemplates
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionClass(str, Enum):
+    SIMPLE_FACT = "simple_fact"
+    CHECKLIST = "checklist"
+    LONG_FORM = "long_form"
+
+
+_LONG_FORM_CUES = re.compile(
+    r"\b(explain|compare|comparison|plan|itinerary|detailed|in detail|pros and cons|step[- ]by[- ]step|"
+    r"guide|overview|everything|differences?|vs\.?|versus|why)\b",
+    re.IGNORECASE
+)
+_CHECKLIST_CUES = re.compile(
+    r"\b(what (documents|papers|items|vaccinations|vaccines)|documents?|checklist|list|requirements?|"
+    r"required|need to (bring|prepare|pack)|steps|process|how (do|can) i apply|apply for)\b",
+    re.IGNORECASE
+)
+_SIMPLE_CUES = re.compile(
+    r"^\s*(is|are|do|does|can|should|will|how (long|much|many|far)|when|which|what is the|"
+    r"what's the|who)\b",
+    re.IGNORECASE
+)
+
+
+def classify_question(text: str) -> QuestionClass:
+    """Cheap lexical classification of the answer shape a question calls for"""
+    words = len(text.split())
+    if _LONG_FORM_CUES.search(text) or words > 40 or text.count("?") > 1:
+        return QuestionClass.LONG_FORM
+    if _CHECKLIST_CUES.search(text):
+        return QuestionClass.CHECKLIST
+    if _SIMPLE_CUES.search(text) and words <= 20:
+        return QuestionClass.SIMPLE_FACT
+    return QuestionClass.CHECKLIST
+
+
+class LengthDecision:
+    """Generation parameters chosen for one question"""
+
+    __slots__ = ("question_class", "max_tokens", "system_prompt", "stop")
+
+    def __init__(self, question_class: QuestionClass, max_tokens: int, system_prompt: str, stop: Optional[List[str]]):
+        self.question_class = question_class
+        self.max_tokens = max_tokens
+        self.system_prompt = system_prompt
+        self.stop = stop
+
+
+class _ClassStats:
+    """Recent completion lengths for one question class"""
+
+    def __init__(self, window: int):
+        self.lengths: Deque[int] = deque(maxlen=window)
+        self.truncated: Deque[bool] = deque(maxlen=window)
+
+    def percentile(self, q: float) -> int:
+        ordered = sorted(self.lengths)
+        return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+    def truncation_rate(self) -> float:
+        return sum(self.truncated) / len(self.truncated) if self.truncated else 0.0
+
+
+class ResponseLengthPolicy:
+    """Chooses max_tokens, prompt variant and stop sequences per question class.
+
+    Each class starts from a static budget. Once enough answers have been
+    observed, the budget follows the class's p95 completion length with
+    headroom, widening while answers keep getting cut off.
+    """
+
+    DEFAULTS: Dict[QuestionClass, Tuple[int, int, int]] = {
+        # (initial max_tokens, floor, ceiling)
+        QuestionClass.SIMPLE_FACT: (250, 96, 500),
+        QuestionClass.CHECKLIST: (700, 256, 1200),
+        QuestionClass.LONG_FORM: (1500, 800, 2500),
+    }
+    STOP_SEQUENCES: Dict[QuestionClass, Optional[List[str]]] = {
+        # A short answer that starts a new markdown section is drifting into long form
+        QuestionClass.SIMPLE_FACT: ["\n## "],
+        QuestionClass.CHECKLIST: None,
+        QuestionClass.LONG_FORM: None,
+    }
+    PROMPTS = {
+        QuestionClass.SIMPLE_FACT: PromptTemplates.travel_brief_answer_prompt,
+        QuestionClass.CHECKLIST: PromptTemplates.travel_checklist_prompt,
+        QuestionClass.LONG_FORM: PromptTemplates.travel_detailed_prompt,
+    }
+
+    def __init__(self, window: int = 500, min_samples: int = 30, headroom: float = 1.25, max_truncation_rate: float = 0.02):
+        self.window = window
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.max_truncation_rate = max_truncation_rate
+        self._stats = {cls: _ClassStats(window) for cls in QuestionClass}
+        self._budgets = {cls: defaults[0] for cls, defaults in self.DEFAULTS.items()}
+        self._lock = threading.Lock()
+
+    def decide(self, question: str) -> LengthDecision:
+        """Classify a question and return the generation parameters to use"""
+        question_class = classify_question(question)
+        return LengthDecision(
+            question_class,
+            self._budgets[question_class],
+            self.PROMPTS[question_class](),
+            self.STOP_SEQUENCES[question_class]
+        )
+
+    def continuation_budget(self) -> int:
+        """Token budget for finishing an answer that hit its class limit"""
+        return self._budgets[QuestionClass.LONG_FORM]
+
+    def observe(self, question_class: QuestionClass, completion_tokens: int, truncated: bool = False) -> None:
+        """Record an answer's length and recompute the class budget"""
+        with self._lock:
+            stats = self._stats[question_class]
+            stats.lengths.append(completion_tokens)
+            stats.truncated.append(truncated)
+            if len(stats.lengths) < self.min_samples:
+                return
+            _, floor, ceiling = self.DEFAULTS[question_class]
+            headroom = self.headroom
+            if stats.truncation_rate() > self.max_truncation_rate:
+                headroom *= 1.5
+            budget = int(stats.percentile(0.95) * headroom)
+            self._budgets[question_class] = max(floor, min(ceiling, budget))
+
+    def seed(self, samples: Iterable[Tuple[str, int]]) -> None:
+        """Learn from past (question, completion tokens) pairs, e.g. chat history"""
+        count = 0
+        for question, completion_tokens in samples:
+            if completion_tokens > 0:
+                self.observe(classify_question(question), completion_tokens)
+                count += 1
+        logger.info("Seeded response length policy with %d historical answers", count)
+
+    def budgets(self) -> Dict[str, int]:
+        return {cls.value: budget for cls, budget in self._budgets.items()}
+
+
+async def seed_policy_from_history(policy: ResponseLengthPolicy, database, limit: int = 5000) -> None:
+    """Seed the policy from recent `chat_history` records (output_length is in characters)"""
+    cursor = database.chat_history.find(
+        {"status": "success"},
+        {"query": 1, "tokens_used": 1, "output_length": 1, "_id": 0}
+    ).sort("timestamp", -1).limit(limit)
+    samples = []
+    async for record in cursor:
+        # Completion tokens are not stored separately; ~4 characters per token is close enough for budgeting
+        tokens = int(record.get("output_length", 0) / 4) or 0
+        samples.append((record.get("query", ""), tokens))
+    policy.seed(samples)
+
+
+# Per-worker policy; each worker learns from the answers it serves
+response_policy = ResponseLengthPolicy()
@@ -0,0 +1,165 @@
+"""Mergeable approximate summaries for live statistics.
+
+Both sketches have a fixed size regardless of how many values they have
+seen, and two sketches built on different workers can be merged into one
+that summarizes the union of their inputs.
+"""
+import hashlib
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class HyperLogLog:
+    """Approximate distinct count in 2**precision bytes (standard error ~1.04/sqrt(2**precision))"""
+
+    def __init__(self, precision: int = 10, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+    def add(self, value: str) -> None:
+        h = self._hash(value)
+        index = h >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rest = h & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Fold `other` into this sketch in place"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Linear counting is more accurate while most registers are still empty
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        return cls(int(math.log2(len(data))), data)
+
+    @classmethod
+    def union(cls, sketches: Iterable["HyperLogLog"], precision: int = 10) -> "HyperLogLog":
+        result = cls(precision)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
+
+
+class TDigest:
+    """Merging t-digest for streaming quantiles.
+
+    Values are buffered and periodically merged into at most ~`compression`
+    centroids, sized by the arcsine scale function so the tails keep small
+    centroids and p99 stays accurate while the median is summarized coarsely.
+    """
+
+    def __init__(self, compression: float = 100.0):
+        self.compression = compression
+        self.means: List[float] = []
+        self.weights: List[float] = []
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer: List[Tuple[float, float]] = []
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        self._buffer.append((value, weight))
+        self.total += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q(self, k: float) -> float:
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self) -> None:
+        if not self._buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        total = sum(w for _, w in points)
+        means, weights = [], []
+        cumulative = 0.0
+        mean, weight = points[0]
+        q_limit = self._q(self._k(0) + 1) * total
+        for value, w in points[1:]:
+            if cumulative + weight + w <= q_limit:
+                weight += w
+                mean += (value - mean) * w / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                cumulative += weight
+                q_limit = self._q(self._k(min(cumulative / total, 1.0)) + 1) * total
+                mean, weight = value, w
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        """Fold `other` into this digest in place"""
+        other._compress()
+        self._buffer.extend(zip(other.means, other.weights))
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        self._compress()
+        if not self.means:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+        target = q * self.total
+        cumulative = 0.0
+        previous_mid, previous_mean = 0.0, self.min
+        for mean, weight in zip(self.means, self.weights):
+            mid = cumulative + weight / 2
+            if target <= mid:
+                span = mid - previous_mid
+                fraction = (target - previous_mid) / span if span > 0 else 0.0
+                return previous_mean + fraction * (mean - previous_mean)
+            cumulative += weight
+            previous_mid, previous_mean = mid, mean
+        span = self.total - previous_mid
+        fraction = (target - previous_mid) / span if span > 0 else 1.0
+        return previous_mean + fraction * (self.max - previous_mean)
+
+    def percentiles(self, qs: Iterable[float] = (0.5, 0.95, 0.99)) -> Dict[str, float]:
+        return {f"p{int(q * 100)}": round(value, 3) for q in qs if (value := self.quantile(q)) is not None}
+
+    def to_dict(self) -> Dict[str, object]:
+        self._compress()
+        return {"c": self.compression, "m": self.means, "w": self.weights, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> "TDigest":
+        digest = cls(data["c"])
+        digest.means, digest.weights = list(data["m"]), list(data["w"])
+        digest.total = sum(digest.weights)
+        digest.min, digest.max = data["min"], data["max"]
+        return digest
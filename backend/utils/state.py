@@ -0,0 +1,204 @@
+"""Shared state backends.
+
+State in this service falls into two groups:
+
+* Per-worker state lives in each process and is rebuilt on startup: provider
+  HTTP clients and connection pools, the logging/tracing writer threads,
+  the Ollama residency view and any in-process memoization.
+* Shared state must agree across worker processes, such as the usage-stat
+  shards each worker publishes. It is reached only through a `StateBackend`
+  namespace on `shared_state`, so a single worker
+  can use the in-memory backend while a multi-worker deployment points every
+  worker at the same MongoDB collection.
+"""
+import asyncio
+import datetime
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+
+class StateBackend(ABC):
+    """Async key/value store with optional per-key expiry"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Atomically add to a counter, setting its expiry when it is created"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def scan(self, prefix: str) -> Dict[str, Any]:
+        """All live keys starting with `prefix` and their values"""
+
+    async def ping(self) -> bool:
+        return True
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """Process-local backend; only correct when running a single worker"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lock = asyncio.Lock()
+
+    def _live(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._live(key)
+        return entry[0] if entry is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        async with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                value, expires = amount, (time.monotonic() + ttl if ttl else None)
+            else:
+                value, expires = entry[0] + amount, entry[1]
+            self._data[key] = (value, expires)
+            return value
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def scan(self, prefix: str) -> Dict[str, Any]:
+        return {key: entry[0] for key in list(self._data) if key.startswith(prefix) and (entry := self._live(key)) is not None}
+
+
+class MongoStateBackend(StateBackend):
+    """Backend shared by all workers, stored in a MongoDB collection with a TTL index"""
+
+    def __init__(self, database, collection: str = "shared_state"):
+        self.collection = database[collection]
+        self._indexed = False
+
+    async def _ensure_index(self) -> None:
+        if not self._indexed:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+
+    @staticmethod
+    def _expiry(ttl: Optional[float]) -> Optional[datetime.datetime]:
+        if not ttl:
+            return None
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl)
+
+    async def get(self, key: str) -> Optional[Any]:
+        doc = await self.collection.find_one({"_id": key})
+        if doc is None:
+            return None
+        # The TTL monitor only runs once a minute, so check expiry ourselves as well
+        if doc.get("expires_at") is not None and doc["expires_at"] <= datetime.datetime.utcnow():
+            return None
+        return doc.get("value")
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self._ensure_index()
+        await self.collection.replace_one(
+            {"_id": key},
+            {"_id": key, "value": value, "expires_at": self._expiry(ttl)},
+            upsert=True
+        )
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        await self._ensure_index()
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"value": amount}, "$setOnInsert": {"expires_at": self._expiry(ttl)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return doc["value"]
+
+    async def delete(self, key: str) -> None:
+        await self.collection.delete_one({"_id": key})
+
+    async def scan(self, prefix: str) -> Dict[str, Any]:
+        now = datetime.datetime.utcnow()
+        cursor = self.collection.find({
+            "_id": {"$regex": f"^{re.escape(prefix)}"},
+            "$or": [{"expires_at": None}, {"expires_at": {"$gt": now}}]
+        })
+        return {doc["_id"]: doc.get("value") async for doc in cursor}
+
+    async def ping(self) -> bool:
+        await self.collection.database.command("ping")
+        return True
+
+
+class NamespacedState:
+    """View of a backend that prefixes every key"""
+
+    def __init__(self, backend: StateBackend, namespace: str):
+        self.backend = backend
+        self.prefix = f"{namespace}:"
+
+    async def get(self, key: str) -> Optional[Any]:
+        return await self.backend.get(self.prefix + key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self.backend.set(self.prefix + key, value, ttl)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        return await self.backend.incr(self.prefix + key, amount, ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.backend.delete(self.prefix + key)
+
+    async def scan(self, prefix: str = "") -> Dict[str, Any]:
+        found = await self.backend.scan(self.prefix + prefix)
+        return {key[len(self.prefix):]: value for key, value in found.items()}
+
+
+class SharedState:
+    _instance = None
+    backend: Optional[StateBackend] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SharedState, cls).__new__(cls)
+        return cls._instance
+
+    def initialize(self, kind: str = "memory", database=None):
+        """Select the backend shared by every namespace"""
+        if kind == "mongo":
+            if database is None:
+                raise ValueError("The mongo state backend requires a database")
+            self.backend = MongoStateBackend(database)
+        elif kind == "memory":
+            self.backend = MemoryStateBackend()
+        else:
+            raise ValueError(f"Unknown state backend: {kind}")
+        self.usage = NamespacedState(self.backend, "usage")
+
+    async def close(self):
+        if self.backend is not None:
+            await self.backend.close()
+
+
+# Create shared state instance
+shared_state = SharedState()
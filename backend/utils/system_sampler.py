@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import config
+from models import ModelProvider, SystemResources
+from services.provider_health import provider_health
+from utils.lifecycle import lifecycle
+from utils.model_residency import residency
+
+logger = logging.getLogger(__name__)
+
+# Columns of the history ring, in sample order
+COLUMNS = (
+    "ts",
+    "cpu_percent",
+    "process_cpu_percent",
+    "ram_used_gb",
+    "process_rss_gb",
+    "disk_used_gb",
+    "load_1m",
+    "temperature_c",
+    "active_connections",
+    "in_flight",
+)
+
+GB = 1024 ** 3
+_TCP_ESTABLISHED = "01"
+_PROCESS_STARTED = time.time()
+
+
+class RingBuffer:
+    """Fixed-capacity columnar history of samples.
+
+    Every column is a preallocated `array('d')` and a sample overwrites the
+    oldest slot in place, so recording allocates nothing and the memory used
+    does not grow with uptime. Missing readings are stored as NaN.
+    """
+
+    def __init__(self, columns: Sequence[str], capacity: int):
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self._data = [array("d", [math.nan]) * capacity for _ in self.columns]
+        self._head = 0  # next slot to write
+        self.size = 0
+
+    def append(self, values: Sequence[float]) -> None:
+        head = self._head
+        for column, value in zip(self._data, values):
+            column[head] = value
+        self._head = (head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        if not self.size:
+            return None
+        slot = (self._head - 1) % self.capacity
+        return {name: column[slot] for name, column in zip(self.columns, self._data)}
+
+    def window(self, since: float = 0.0) -> Dict[str, List[Optional[float]]]:
+        """Samples with ts >= `since`, oldest first, one list per column (NaN becomes None)"""
+        start = (self._head - self.size) % self.capacity
+        slots = [(start + i) % self.capacity for i in range(self.size)]
+        timestamps = self._data[0]
+        slots = [slot for slot in slots if timestamps[slot] >= since]
+        return {
+            name: [None if math.isnan(column[slot]) else round(column[slot], 3) for slot in slots]
+            for name, column in zip(self.columns, self._data)
+        }
+
+
+def _read_first_line(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.readline()
+    except OSError:
+        return None
+
+
+def format_uptime(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    return f"{minutes // 1440}d {minutes // 60 % 24}h {minutes % 60}m"
+
+
+class SystemSampler:
+    """Samples host and process resources in the background for /diagnostics.
+
+    A loop reads `/proc` and `statvfs` on a thread every `interval` seconds,
+    appends the readings to a ring buffer and rebuilds the cached
+    SystemResources, so the diagnostics endpoint only returns objects that
+    already exist and never makes a syscall itself. Readings that are not
+    available on the host (non-Linux, no thermal zone) are left empty.
+    """
+
+    def __init__(self, interval: float = 5.0, history: int = 720, disk_path: str = "/", port: Optional[int] = None):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.port_hex = f"{port:04X}" if port else None
+        self.ring = RingBuffer(COLUMNS, history)
+        self.resources = SystemResources()
+        self.sampled_at: Optional[float] = None
+        self._cpu: Optional[Tuple[int, int]] = None
+        self._process_cpu: Optional[Tuple[float, float]] = None
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self._task: Optional[asyncio.Task] = None
+
+    def _cpu_percent(self) -> float:
+        line = _read_first_line("/proc/stat")
+        if not line:
+            return math.nan
+        fields = [int(v) for v in line.split()[1:]]
+        idle, total = fields[3] + (fields[4] if len(fields) > 4 else 0), sum(fields[:8])
+        previous, self._cpu = self._cpu, (idle, total)
+        if previous is None or total == previous[1]:
+            return math.nan
+        return 100.0 * (1 - (idle - previous[0]) / (total - previous[1]))
+
+    def _process_cpu_percent(self, now: float) -> float:
+        """CPU used by this worker, in percent of one core"""
+        line = _read_first_line("/proc/self/stat")
+        if not line:
+            return math.nan
+        # The command name may contain spaces; fields after it are fixed
+        fields = line.rsplit(")", 1)[1].split()
+        seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+        previous, self._process_cpu = self._process_cpu, (now, seconds)
+        if previous is None or now == previous[0]:
+            return math.nan
+        return 100.0 * (seconds - previous[1]) / (now - previous[0])
+
+    @staticmethod
+    def _memory_used_gb() -> float:
+        values = {}
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    key, _, rest = line.partition(":")
+                    if key in ("MemTotal", "MemAvailable"):
+                        values[key] = int(rest.split()[0]) * 1024
+                        if len(values) == 2:
+                            break
+        except OSError:
+            return math.nan
+        if len(values) < 2:
+            return math.nan
+        return (values["MemTotal"] - values["MemAvailable"]) / GB
+
+    def _process_rss_gb(self) -> float:
+        line = _read_first_line("/proc/self/statm")
+        return int(line.split()[1]) * self._page_size / GB if line else math.nan
+
+    def _disk_used_gb(self) -> float:
+        try:
+            stats = os.statvfs(self.disk_path)
+        except (OSError, AttributeError):
+            return math.nan
+        return (stats.f_blocks - stats.f_bfree) * stats.f_frsize / GB
+
+    @staticmethod
+    def _load_1m() -> float:
+        try:
+            return os.getloadavg()[0]
+        except (OSError, AttributeError):
+            return math.nan
+
+    @staticmethod
+    def _temperature() -> float:
+        line = _read_first_line("/sys/class/thermal/thermal_zone0/temp")
+        return int(line) / 1000 if line and line.strip() else math.nan
+
+    def _established_connections(self) -> float:
+        """ESTABLISHED TCP connections to this server's port (all workers share it)"""
+        if self.port_hex is None:
+            return math.nan
+        suffix = ":" + self.port_hex
+        count, found = 0, False
+        for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+            try:
+                with open(path) as f:
+                    next(f, None)
+                    for line in f:
+                        fields = line.split(None, 4)
+                        if fields[3] == _TCP_ESTABLISHED and fields[1].endswith(suffix):
+                            count += 1
+                found = True
+            except OSError:
+                continue
+        return float(count) if found else math.nan
+
+    def _read(self, in_flight: int) -> Tuple[float, ...]:
+        """One sample; runs on a thread"""
+        now = time.time()
+        return (
+            now,
+            self._cpu_percent(),
+            self._process_cpu_percent(now),
+            self._memory_used_gb(),
+            self._process_rss_gb(),
+            self._disk_used_gb(),
+            self._load_1m(),
+            self._temperature(),
+            self._established_connections(),
+            float(in_flight),
+        )
+
+    async def sample(self) -> None:
+        values = await asyncio.get_running_loop().run_in_executor(None, self._read, lifecycle.in_flight)
+        self.ring.append(values)
+        sample = dict(zip(COLUMNS, values))
+        connections = sample["active_connections"]
+        resources = {
+            "cpu_usage": round(sample["cpu_percent"], 1),
+            "ram_usage": round(sample["ram_used_gb"], 2),
+            "disk_usage": round(sample["disk_used_gb"], 2),
+            "active_models": list(residency.resident),
+            "active_connections": int(lifecycle.in_flight if math.isnan(connections) else connections),
+            "uptime": format_uptime(sample["ts"] - _PROCESS_STARTED),
+            "temperature": round(sample["temperature_c"], 1),
+        }
+        # Unreadable metrics keep the model defaults; for temperature that is None rather than a made-up value
+        self.resources = SystemResources(**{k: v for k, v in resources.items() if not (isinstance(v, float) and math.isnan(v))})
+        self.sampled_at = sample["ts"]
+
+    async def _sync_residency(self) -> None:
+        """Pick up models loaded by other workers, but only while Ollama is known to be up"""
+        if ModelProvider.OLLAMA in provider_health.health and provider_health.is_healthy(ModelProvider.OLLAMA):
+            try:
+                await residency.sync_loaded()
+            except Exception as e:
+                logger.debug("Residency sync for diagnostics failed: %s", e)
+
+    async def _sample_periodically(self) -> None:
+        rounds = 0
+        while True:
+            try:
+                if rounds % 6 == 0:
+                    await self._sync_residency()
+                await self.sample()
+            except Exception as e:
+                logger.warning("System sample failed: %s", e)
+            rounds += 1
+            await asyncio.sleep(self.interval)
+
+    def history(self, seconds: Optional[float] = None) -> Dict[str, List[Optional[float]]]:
+        since = time.time() - seconds if seconds else 0.0
+        return self.ring.window(since)
+
+    def performance(self) -> Dict[str, float]:
+        """Latest process-level readings for SystemDiagnostics.performance"""
+        latest = self.ring.latest() or {}
+        keys = ("process_cpu_percent", "process_rss_gb", "load_1m", "in_flight")
+        return {key: round(latest[key], 3) for key in keys if key in latest and not math.isnan(latest[key])}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._sample_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Per-worker sampler; connection counts cover every worker listening on PORT
+system_sampler = SystemSampler(
+    interval=config.DIAGNOSTICS_SAMPLE_INTERVAL,
+    history=config.DIAGNOSTICS_HISTORY,
+    disk_path=config.DIAGNOSTICS_DISK_PATH,
+    port=config.PORT
+)
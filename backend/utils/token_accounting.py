@@ -0,0 +1,332 @@
+import asyncio
+import datetime
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # counting falls back to the estimator
+    Tokenizer = None
+
+
+# Hub repositories with a tokenizer.json matching each model family (longest prefix wins)
+TOKENIZER_SOURCES = {
+    "gpt-4o": "Xenova/gpt-4o",
+    "gpt-4.1": "Xenova/gpt-4o",
+    "o1": "Xenova/gpt-4o",
+    "o3": "Xenova/gpt-4o",
+    "o4": "Xenova/gpt-4o",
+    "gpt-4": "Xenova/gpt-4",
+    "gpt-3.5": "Xenova/gpt-3.5-turbo",
+    "claude": "Xenova/claude-tokenizer",
+}
+
+# USD per 1k (input, output) tokens; local providers cost nothing per token
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4.1-mini": (0.0004, 0.0016),
+    "gpt-4.1": (0.002, 0.008),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06),
+    "claude-3-haiku": (0.00025, 0.00125),
+    "claude-3-5-haiku": (0.0008, 0.004),
+    "claude-3-5-sonnet": (0.003, 0.015),
+    "claude-3-7-sonnet": (0.003, 0.015),
+    "claude-sonnet-4": (0.003, 0.015),
+    "claude-3-opus": (0.015, 0.075),
+    "claude-opus-4": (0.015, 0.075),
+}
+
+LOCAL_PROVIDERS = ("ollama", "huggingface")
+
+
+def _longest_prefix(table: Dict[str, object], model: str):
+    for prefix in sorted(table, key=len, reverse=True):
+        if model.startswith(prefix):
+            return table[prefix]
+    return None
+
+
+class TokenEstimator:
+    """Fast length-based estimate for models without a tokenizer.
+
+    ASCII text is divided by a characters-per-token ratio; other characters
+    (CJK, emoji, accented text) count one token each. The ratio starts at 4.0
+    and is calibrated per model from exact counts as they become available.
+    """
+
+    DEFAULT_RATIO = 4.0
+
+    def __init__(self, smoothing: float = 0.05):
+        self.smoothing = smoothing
+        self.ratios: Dict[str, float] = {}
+
+    @staticmethod
+    def _split(text: str) -> Tuple[int, int]:
+        ascii_chars = len(text.encode("ascii", "ignore"))
+        return ascii_chars, len(text) - ascii_chars
+
+    def estimate(self, text: str, model: Optional[str] = None) -> int:
+        if not text:
+            return 0
+        ascii_chars, other_chars = self._split(text)
+        ratio = self.ratios.get(model or "", self.DEFAULT_RATIO)
+        return max(1, int(math.ceil(ascii_chars / ratio)) + other_chars)
+
+    def calibrate(self, model: str, text: str, actual_tokens: int) -> None:
+        """Move this model's ratio toward what an exact count observed"""
+        ascii_chars, other_chars = self._split(text)
+        ascii_tokens = actual_tokens - other_chars
+        if ascii_chars < 200 or ascii_tokens <= 0:
+            return
+        observed = ascii_chars / ascii_tokens
+        current = self.ratios.get(model, self.DEFAULT_RATIO)
+        self.ratios[model] = current + self.smoothing * (observed - current)
+
+
+class TokenCounter:
+    """Per-model token counting with tokenizers cached for the life of the worker.
+
+    A model's tokenizer is resolved from TOKENIZER_DIR (`<model>.json` or
+    `<model>/tokenizer.json`), then the Hugging Face hub: the fixed family
+    repositories in TOKENIZER_SOURCES, or the model's own repo when it is one
+    of `hub_models`. Any other name uses the estimator, so a request cannot
+    trigger arbitrary downloads. Loading happens on a background thread the
+    first time a source is seen; until it finishes, counts come from the
+    estimator. Tokenizers are cached per source, and the model-to-source
+    mapping is an LRU of `max_models` names.
+    """
+
+    def __init__(self, tokenizer_dir: Optional[str] = None, allow_download: bool = True,
+                 estimator: Optional[TokenEstimator] = None, hub_models: Iterable[str] = (), max_models: int = 1024):
+        self.tokenizer_dir = tokenizer_dir
+        self.allow_download = allow_download and Tokenizer is not None
+        self.estimator = estimator or TokenEstimator()
+        self.hub_models = set(hub_models)
+        self.max_models = max_models
+        self._sources: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._tokenizers: Dict[str, Optional["Tokenizer"]] = {}
+        self._loading: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+    def register(self, model: str, tokenizer) -> None:
+        """Use an already-loaded tokenizers.Tokenizer for `model`"""
+        self.hub_models.add(model)
+        self._tokenizers[f"registered:{model}"] = tokenizer
+        with self._lock:
+            self._sources[model] = f"registered:{model}"
+
+    def _local_path(self, model: str) -> Optional[str]:
+        if not self.tokenizer_dir:
+            return None
+        name = model.replace("/", "--").replace(":", "--")
+        for candidate in (os.path.join(self.tokenizer_dir, f"{name}.json"),
+                          os.path.join(self.tokenizer_dir, name, "tokenizer.json")):
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def _source(self, model: str) -> Optional[str]:
+        """Where `model`'s tokenizer comes from: "file:<path>", a hub repo id, or None"""
+        with self._lock:
+            if model in self._sources:
+                self._sources.move_to_end(model)
+                return self._sources[model]
+        path = self._local_path(model)
+        if path is not None:
+            source = f"file:{path}"
+        elif not self.allow_download:
+            source = None
+        else:
+            source = _longest_prefix(TOKENIZER_SOURCES, model)
+            if source is None and model in self.hub_models:
+                source = model  # configured Hugging Face repo id (HF_MODEL, HF_ALLOWED_MODELS)
+        with self._lock:
+            self._sources[model] = source
+            while len(self._sources) > self.max_models:
+                self._sources.popitem(last=False)
+        return source
+
+    def _load(self, source: str) -> None:
+        tokenizer = None
+        try:
+            if source.startswith("file:"):
+                tokenizer = Tokenizer.from_file(source[len("file:"):])
+            else:
+                tokenizer = Tokenizer.from_pretrained(source)
+        except Exception as e:
+            logger.warning("No tokenizer from %s, using estimates: %s", source, e)
+        # A failed load is cached as None so it is not retried on every call
+        self._tokenizers[source] = tokenizer
+        with self._lock:
+            self._loading.pop(source, None)
+
+    def tokenizer_for(self, model: Optional[str], wait: bool = False):
+        """Cached tokenizer for `model`, starting a background load on first use"""
+        if not model or Tokenizer is None:
+            return None
+        source = self._source(model)
+        if source is None:
+            return None
+        if source in self._tokenizers:
+            return self._tokenizers[source]
+        with self._lock:
+            thread = self._loading.get(source)
+            if thread is None and source not in self._tokenizers:
+                thread = threading.Thread(target=self._load, args=(source,), name=f"tokenizer-{model}", daemon=True)
+                self._loading[source] = thread
+                thread.start()
+        if wait and thread is not None:
+            thread.join()
+        return self._tokenizers.get(source)
+
+    def preload(self, models: Iterable[str]) -> None:
+        """Load tokenizers for `models` (blocking; call from a thread during warmup)"""
+        for model in models:
+            self.tokenizer_for(model, wait=True)
+
+    def count(self, text: str, model: Optional[str] = None) -> int:
+        tokenizer = self.tokenizer_for(model)
+        if tokenizer is None:
+            return self.estimator.estimate(text, model)
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_batch(self, texts: Sequence[str], model: Optional[str] = None) -> List[int]:
+        """Counts for many strings at once; tokenizers encodes the batch in parallel"""
+        tokenizer = self.tokenizer_for(model)
+        if tokenizer is None:
+            return [self.estimator.estimate(text, model) for text in texts]
+        return [len(encoding.ids) for encoding in tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+
+    def count_messages(self, messages: Sequence[Dict[str, str]], model: Optional[str] = None) -> int:
+        """Prompt tokens for a chat request, including ~4 tokens of framing per message"""
+        return sum(self.count_batch([m.get("content", "") for m in messages], model)) + 4 * len(messages)
+
+    def calibrate(self, model: str, text: str, actual_tokens: int) -> None:
+        """Feed a provider-reported count back into the estimator for models we cannot tokenize"""
+        if self._tokenizers.get(self._source(model) or "") is None:
+            self.estimator.calibrate(model, text, actual_tokens)
+
+
+def price_for(provider: str, model: str) -> Tuple[float, float]:
+    """USD per 1k (input, output) tokens for a model"""
+    if provider in LOCAL_PROVIDERS:
+        return 0.0, 0.0
+    return _longest_prefix(MODEL_PRICES, model) or (0.0, 0.0)
+
+
+def load_price_overrides(path: Optional[str]) -> None:
+    """Merge `{"model-prefix": [input_per_1k, output_per_1k]}` from a JSON file into MODEL_PRICES"""
+    if not path:
+        return
+    try:
+        with open(path) as f:
+            for prefix, (input_price, output_price) in json.load(f).items():
+                MODEL_PRICES[prefix] = (float(input_price), float(output_price))
+    except (OSError, ValueError) as e:
+        logger.error("Could not load model prices from %s: %s", path, e)
+
+
+class CostLedger:
+    """Per-tenant, per-model token and cost totals, flushed to MongoDB in batches.
+
+    Recording only updates an in-memory dict, so it is cheap on the request
+    path. `flush` swaps the pending deltas out and `$inc`s them into the
+    `usage_costs` collection (one document per tenant, model and UTC day);
+    deltas that fail to write are merged back and retried on the next flush.
+    """
+
+    FIELDS = ("requests", "prompt_tokens", "completion_tokens", "cost")
+
+    def __init__(self, flush_interval: float = 30.0):
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[str, str, str, str], Dict[str, float]] = {}
+        self.totals: Dict[Tuple[str, str, str], Dict[str, float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._database = None
+
+    def record(self, tenant_id: Optional[str], provider: str, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """Add one request's usage and return its cost in USD"""
+        input_price, output_price = price_for(provider, model)
+        cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1000
+        tenant = tenant_id or "default"
+        day = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+        delta = (1, prompt_tokens, completion_tokens, cost)
+        for table, key in ((self._pending, (tenant, provider, model, day)), (self.totals, (tenant, provider, model))):
+            entry = table.get(key)
+            if entry is None:
+                entry = table[key] = dict.fromkeys(self.FIELDS, 0)
+            for field, value in zip(self.FIELDS, delta):
+                entry[field] += value
+        return cost
+
+    def snapshot(self, tenant_id: Optional[str] = None) -> List[Dict[str, object]]:
+        """Totals recorded by this worker since it started"""
+        return [
+            {"tenant_id": tenant, "provider": provider, "model": model, **{k: round(v, 6) for k, v in entry.items()}}
+            for (tenant, provider, model), entry in self.totals.items()
+            if tenant_id is None or tenant == tenant_id
+        ]
+
+    async def flush(self) -> int:
+        """Write pending deltas to MongoDB; returns the number of documents updated"""
+        if not self._pending or self._database is None:
+            return 0
+        pending, self._pending = self._pending, {}
+        try:
+            from pymongo import UpdateOne
+            operations = [
+                UpdateOne(
+                    {"tenant_id": tenant, "provider": provider, "model": model, "day": day},
+                    {"$inc": entry, "$set": {"updated_at": datetime.datetime.utcnow()}},
+                    upsert=True
+                )
+                for (tenant, provider, model, day), entry in pending.items()
+            ]
+            await self._database.usage_costs.bulk_write(operations, ordered=False)
+            return len(operations)
+        except Exception as e:
+            logger.warning("Cost ledger flush failed, keeping %d entries for the next attempt: %s", len(pending), e)
+            for key, entry in pending.items():
+                current = self._pending.setdefault(key, dict.fromkeys(self.FIELDS, 0))
+                for field, value in entry.items():
+                    current[field] += value
+            return 0
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self, database) -> None:
+        self._database = database
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# Per-worker counter and ledger
+load_price_overrides(config.MODEL_PRICES_FILE)
+token_counter = TokenCounter(config.TOKENIZER_DIR, allow_download=config.TOKENIZER_DOWNLOAD,
+                             hub_models=[config.HF_MODEL, *config.HF_ALLOWED_MODELS])
+cost_ledger = CostLedger(config.COST_FLUSH_INTERVAL)
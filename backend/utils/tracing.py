@@ -0,0 +1,342 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from utils.request_context import request_id_var
+
+logger = logging.getLogger(__name__)
+
+# perf_counter_ns() is monotonic but has no epoch; this converts it to unix time for export
+_EPOCH_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+current_trace_var: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("current_trace", default=None)
+_current_span_var: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed stage of a request"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str] = None, start_ns: Optional[int] = None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = start_ns if start_ns is not None else time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = {}
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        self.end_ns = end_ns if end_ns is not None else time.perf_counter_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """All spans recorded while serving one request"""
+
+    def __init__(self, request_id: str, trace_id: Optional[str] = None, parent_span_id: Optional[str] = None):
+        self.request_id = request_id
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.root = Span("http.request", parent_id=parent_span_id)
+        self.spans: List[Span] = [self.root]
+        self.marks: Dict[str, int] = {}
+
+    def mark(self, name: str) -> None:
+        """Record a point in time used to derive stages outside the handler"""
+        self.marks[name] = time.perf_counter_ns()
+
+    def add_span(self, name: str, start_ns: int, end_ns: Optional[int] = None, **attributes) -> Span:
+        """Record a span whose boundaries were measured elsewhere"""
+        parent = _current_span_var.get() or self.root
+        span = Span(name, parent_id=parent.span_id, start_ns=start_ns)
+        span.attributes.update(attributes)
+        span.end(end_ns)
+        self.spans.append(span)
+        return span
+
+    def stage_timings(self) -> Dict[str, float]:
+        """Milliseconds spent in each completed stage, summed by stage name"""
+        timings: Dict[str, float] = {}
+        for span in self.spans[1:]:
+            if span.end_ns is not None:
+                timings[span.name] = round(timings.get(span.name, 0.0) + span.duration_ms, 3)
+        return timings
+
+    def diagnostics(self) -> Dict[str, Any]:
+        """Per-stage breakdown suitable for a response `diagnostics` block"""
+        return {
+            "request_id": self.request_id,
+            "trace_id": self.trace_id,
+            "stages_ms": self.stage_timings(),
+            "elapsed_ms": round(self.root.duration_ms, 3),
+        }
+
+
+def get_current_trace() -> Optional[Trace]:
+    """Return the trace bound to the current context, if any"""
+    return current_trace_var.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span; a no-op outside a traced request"""
+    trace = current_trace_var.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span_var.get() or trace.root
+    current = Span(name, parent_id=parent.span_id)
+    current.attributes.update(attributes)
+    token = _current_span_var.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.end()
+        _current_span_var.reset(token)
+        trace.spans.append(current)
+
+
+class SpanExporter(ABC):
+    """Base class for span sinks; `export` runs on the background export thread"""
+
+    @abstractmethod
+    def export(self, traces: List[Trace]) -> None:
+        ...
+
+    def shutdown(self) -> None:
+        pass
+
+
+class JsonlSpanExporter(SpanExporter):
+    """Append one JSON object per span to a local file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, traces: List[Trace]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for trace in traces:
+                for s in trace.spans:
+                    f.write(json.dumps({
+                        "trace_id": trace.trace_id,
+                        "request_id": trace.request_id,
+                        "span_id": s.span_id,
+                        "parent_span_id": s.parent_id,
+                        "name": s.name,
+                        "start_unix_ns": s.start_ns + _EPOCH_OFFSET_NS,
+                        "duration_ms": round(s.duration_ms, 3),
+                        "attributes": s.attributes,
+                    }, default=str) + "\n")
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """Post spans to an OTLP/HTTP collector using the JSON encoding"""
+
+    def __init__(self, endpoint: str, service_name: str = "pawa-qa-backend", timeout: float = 5.0):
+        self.endpoint = endpoint.rstrip("/")
+        if not self.endpoint.endswith("/v1/traces"):
+            self.endpoint += "/v1/traces"
+        self.service_name = service_name
+        self.client = httpx.Client(timeout=timeout)
+
+    @staticmethod
+    def _attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+        encoded = []
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                encoded.append({"key": key, "value": {"boolValue": value}})
+            elif isinstance(value, int):
+                encoded.append({"key": key, "value": {"intValue": str(value)}})
+            elif isinstance(value, float):
+                encoded.append({"key": key, "value": {"doubleValue": value}})
+            else:
+                encoded.append({"key": key, "value": {"stringValue": str(value)}})
+        return encoded
+
+    def export(self, traces: List[Trace]) -> None:
+        spans = []
+        for trace in traces:
+            for s in trace.spans:
+                attributes = dict(s.attributes)
+                if s is trace.root:
+                    attributes["request.id"] = trace.request_id
+                otlp_span = {
+                    "traceId": trace.trace_id,
+                    "spanId": s.span_id,
+                    "name": s.name,
+                    "kind": 2 if s is trace.root else 1,  # SERVER / INTERNAL
+                    "startTimeUnixNano": str(s.start_ns + _EPOCH_OFFSET_NS),
+                    "endTimeUnixNano": str((s.end_ns or s.start_ns) + _EPOCH_OFFSET_NS),
+                    "attributes": self._attributes(attributes),
+                    "status": {"code": 2 if "error" in attributes else 1},
+                }
+                if s.parent_id:
+                    otlp_span["parentSpanId"] = s.parent_id
+                spans.append(otlp_span)
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": self._attributes({"service.name": self.service_name})},
+                "scopeSpans": [{"scope": {"name": "pawa.tracing"}, "spans": spans}],
+            }]
+        }
+        response = self.client.post(self.endpoint, json=payload)
+        response.raise_for_status()
+
+    def shutdown(self) -> None:
+        self.client.close()
+
+
+class Tracer:
+    """Starts request traces and ships finished ones to an exporter off the event loop"""
+
+    def __init__(self):
+        self.exporter: Optional[SpanExporter] = None
+        self.sample_rate = 1.0
+        self.batch_size = 64
+        self.flush_interval = 2.0
+        self._queue: "queue.Queue[Optional[Trace]]" = queue.Queue(maxsize=10000)
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, exporter: Optional[SpanExporter], sample_rate: float = 1.0, flush_interval: float = 2.0) -> None:
+        """Install an exporter and start the background export thread"""
+        self.shutdown()
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        if exporter is not None:
+            self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+            self._thread.start()
+
+    def start_trace(self, request_id: str, traceparent: Optional[str] = None) -> Trace:
+        """Begin a trace, continuing a W3C `traceparent` when one is supplied"""
+        match = _TRACEPARENT_RE.match(traceparent) if traceparent else None
+        if match:
+            return Trace(request_id, trace_id=match.group(1), parent_span_id=match.group(2))
+        return Trace(request_id)
+
+    def finish(self, trace: Trace) -> None:
+        """Close the root span and queue the trace for export if sampled"""
+        trace.root.end()
+        if self.exporter is None or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            logger.debug("Span export queue full, dropping trace %s", trace.trace_id)
+
+    def _run(self) -> None:
+        batch: List[Trace] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            else:
+                if item is None:
+                    self._flush(batch)
+                    return
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch: List[Trace]) -> None:
+        if not batch or self.exporter is None:
+            return
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            logger.warning("Span export failed: %s", e)
+
+    def shutdown(self) -> None:
+        """Flush pending traces and stop the export thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+
+tracer = Tracer()
+
+
+def setup_tracing(exporter: str = "none", jsonl_path: str = "traces.jsonl", otlp_endpoint: str = "", sample_rate: float = 1.0) -> Tracer:
+    """Configure the global tracer from settings"""
+    if exporter == "jsonl":
+        tracer.configure(JsonlSpanExporter(jsonl_path), sample_rate)
+    elif exporter == "otlp":
+        tracer.configure(OtlpHttpSpanExporter(otlp_endpoint or "http://localhost:4318"), sample_rate)
+    else:
+        tracer.configure(None, sample_rate)
+    atexit.register(tracer.shutdown)
+    return tracer
+
+
+class TracingMiddleware:
+    """Open a trace per HTTP request and report stage timings in response headers (pure ASGI)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        trace = tracer.start_trace(request_id_var.get() or uuid.uuid4().hex, traceparent)
+        trace.root.attributes["http.method"] = scope["method"]
+        trace.root.attributes["http.route"] = scope["path"]
+        token = current_trace_var.set(trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                handler_end = trace.marks.get("handler_end")
+                if handler_end is not None:
+                    trace.add_span("serialization", handler_end)
+                trace.root.attributes["http.status_code"] = message["status"]
+                server_timing = ", ".join(f"{name};dur={ms}" for name, ms in trace.stage_timings().items())
+                headers = list(message.get("headers", []))
+                headers.append((b"x-process-time", f"{trace.root.duration_ms / 1000:.4f}".encode()))
+                if server_timing:
+                    headers.append((b"server-timing", server_timing.encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_trace_var.reset(token)
+            tracer.finish(trace)
@@ -0,0 +1,244 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+import socket
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from config import config
+from models import ModelProvider, ModelUsageStats
+from utils.sketches import HyperLogLog, TDigest
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 24 * HOUR
+HOURS_KEPT = 24
+DAYS_KEPT = 7
+HLL_PRECISION = 10  # 1 KiB per sketch, ~3% error
+
+# (model, provider, tenant)
+Scope = Tuple[str, str, str]
+
+
+class _Shard:
+    """One worker's statistics for one model/provider/tenant since the worker started"""
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.tokens = 0
+        self.errors: Counter = Counter()
+        self.last_used = 0.0
+        self.hours: Dict[int, Tuple[HyperLogLog, TDigest]] = {}
+        self.days: Dict[int, HyperLogLog] = {}
+
+    def record(self, now: float, user_id: Optional[str], latency_ms: float, tokens: int, error: Optional[str]) -> None:
+        self.requests += 1
+        self.last_used = now
+        if error is None:
+            self.successes += 1
+            self.tokens += tokens
+        else:
+            self.errors[error] += 1
+        hour, day = int(now // HOUR), int(now // DAY)
+        bucket = self.hours.get(hour)
+        if bucket is None:
+            bucket = self.hours[hour] = (HyperLogLog(HLL_PRECISION), TDigest())
+            for old in [h for h in self.hours if h <= hour - HOURS_KEPT]:
+                del self.hours[old]
+        bucket[1].add(latency_ms)
+        if user_id:
+            bucket[0].add(user_id)
+            daily = self.days.get(day)
+            if daily is None:
+                daily = self.days[day] = HyperLogLog(HLL_PRECISION)
+                for old in [d for d in self.days if d <= day - DAYS_KEPT]:
+                    del self.days[old]
+            daily.add(user_id)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "tokens": self.tokens,
+            "errors": dict(self.errors),
+            "last_used": self.last_used,
+            "hours": {str(h): {"users": hll.to_bytes(), "latency": digest.to_dict()} for h, (hll, digest) in self.hours.items()},
+            "days": {str(d): hll.to_bytes() for d, hll in self.days.items()},
+        }
+
+
+class _Aggregate:
+    """Shards from every worker (and optionally every tenant) folded together"""
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.tokens = 0
+        self.errors: Counter = Counter()
+        self.last_used = 0.0
+        self.hours: Dict[int, Tuple[HyperLogLog, TDigest]] = {}
+        self.days: Dict[int, HyperLogLog] = {}
+
+    def add(self, shard: Dict[str, object], now: float) -> None:
+        self.requests += shard["requests"]
+        self.successes += shard["successes"]
+        self.tokens += shard["tokens"]
+        self.errors.update(shard["errors"])
+        self.last_used = max(self.last_used, shard["last_used"])
+        current_hour, current_day = int(now // HOUR), int(now // DAY)
+        for key, bucket in shard["hours"].items():
+            hour = int(key)
+            if hour <= current_hour - HOURS_KEPT:
+                continue
+            users, latency = HyperLogLog.from_bytes(bucket["users"]), TDigest.from_dict(bucket["latency"])
+            if hour in self.hours:
+                self.hours[hour][0].merge(users)
+                self.hours[hour][1].merge(latency)
+            else:
+                self.hours[hour] = (users, latency)
+        for key, registers in shard["days"].items():
+            day = int(key)
+            if day <= current_day - DAYS_KEPT:
+                continue
+            users = HyperLogLog.from_bytes(registers)
+            if day in self.days:
+                self.days[day].merge(users)
+            else:
+                self.days[day] = users
+
+    def stats(self, model: str, provider: str, now: float) -> ModelUsageStats:
+        current_hour = int(now // HOUR)
+        recent = [self.hours[h] for h in (current_hour, current_hour - 1) if h in self.hours]
+        latency = TDigest()
+        for _, digest in recent:
+            latency.merge(digest)
+        hourly_users = HyperLogLog.union((users for users, _ in self.hours.values()), HLL_PRECISION).count()
+        this_hour = self.hours[current_hour][0].count() if current_hour in self.hours else 0
+        return ModelUsageStats(
+            model_name=model,
+            provider=ModelProvider(provider),
+            total_requests=self.requests,
+            total_tokens=self.tokens,
+            average_tokens=self.tokens // self.successes if self.successes else 0,
+            success_rate=round(self.successes / self.requests, 4) if self.requests else 1.0,
+            error_rates={kind: round(count / self.requests, 4) for kind, count in self.errors.items()},
+            last_used=datetime.datetime.fromtimestamp(self.last_used, datetime.timezone.utc).replace(tzinfo=None).isoformat() if self.last_used else None,
+            active_users=hourly_users,
+            active_users_by_window={
+                "1h": this_hour,
+                "24h": hourly_users,
+                "7d": HyperLogLog.union(self.days.values(), HLL_PRECISION).count(),
+            },
+            latency_ms=latency.percentiles()
+        )
+
+
+class UsageStatsEngine:
+    """Live per-model usage statistics.
+
+    Requests are recorded into this worker's shards with plain dict and
+    counter updates on the event loop, so the request path takes no locks
+    and does no I/O. Every `merge_interval` seconds each worker publishes its
+    changed shards to shared state and folds every worker's shards into
+    ready-made ModelUsageStats, so reads are a dict lookup. Active users are
+    HyperLogLog estimates and latency percentiles come from t-digests, both
+    kept in hourly buckets so windows can be unioned without rescanning
+    history. A worker's shards expire `DAYS_KEPT` days after it stops
+    publishing.
+    """
+
+    def __init__(self, merge_interval: float = 10.0, worker_id: Optional[str] = None):
+        self.merge_interval = merge_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self._shards: Dict[Scope, _Shard] = {}
+        self._dirty: set = set()
+        self._by_model: Dict[Tuple[str, str], ModelUsageStats] = {}
+        self._by_tenant: Dict[Scope, ModelUsageStats] = {}
+        self.merged_at: Optional[float] = None
+        self._state = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, model: str, provider: str, tenant_id: Optional[str], user_id: Optional[str],
+               latency_ms: float, tokens: int = 0, error: Optional[str] = None) -> None:
+        scope = (model, provider, tenant_id or "default")
+        shard = self._shards.get(scope)
+        if shard is None:
+            shard = self._shards[scope] = _Shard()
+        shard.record(time.time(), user_id, latency_ms, tokens, error)
+        self._dirty.add(scope)
+
+    def get(self, model: str, provider: str, tenant_id: Optional[str] = None) -> Optional[ModelUsageStats]:
+        """Latest merged stats for a model, across all tenants or for one"""
+        if tenant_id is None:
+            return self._by_model.get((model, provider))
+        return self._by_tenant.get((model, provider, tenant_id))
+
+    def all(self, tenant_id: Optional[str] = None) -> List[ModelUsageStats]:
+        if tenant_id is None:
+            return list(self._by_model.values())
+        return [stats for (_, _, tenant), stats in self._by_tenant.items() if tenant == tenant_id]
+
+    @staticmethod
+    def _key(worker_id: str, scope: Scope) -> str:
+        digest = hashlib.sha1("\0".join(scope).encode()).hexdigest()[:16]
+        return f"{digest}:{worker_id}"
+
+    async def publish(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        try:
+            for scope in list(dirty):
+                value = {"scope": list(scope), **self._shards[scope].to_dict()}
+                await self._state.set(self._key(self.worker_id, scope), value, ttl=DAYS_KEPT * DAY)
+                dirty.discard(scope)
+        finally:
+            self._dirty |= dirty
+
+    async def merge(self) -> None:
+        """Rebuild the served stats from every worker's published shards"""
+        now = time.time()
+        by_model: Dict[Tuple[str, str], _Aggregate] = {}
+        by_tenant: Dict[Scope, _Aggregate] = {}
+        for shard in (await self._state.scan()).values():
+            model, provider, tenant = shard["scope"]
+            by_model.setdefault((model, provider), _Aggregate()).add(shard, now)
+            by_tenant.setdefault((model, provider, tenant), _Aggregate()).add(shard, now)
+        self._by_model = {key: agg.stats(key[0], key[1], now) for key, agg in by_model.items()}
+        self._by_tenant = {key: agg.stats(key[0], key[1], now) for key, agg in by_tenant.items()}
+        self.merged_at = now
+
+    async def _merge_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.merge_interval)
+            try:
+                await self.publish()
+                await self.merge()
+            except Exception as e:
+                logger.warning("Usage stats merge failed: %s", e)
+
+    def start(self, state) -> None:
+        self._state = state
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._merge_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._state is not None:
+            try:
+                await self.publish()
+            except Exception as e:
+                logger.warning("Final usage stats publish failed: %s", e)
+
+
+# Per-worker engine; merged views cover every worker sharing the state backend
+usage_stats = UsageStatsEngine(config.USAGE_MERGE_INTERVAL)
@@ -11,11 +11,11 @@ def validate_question(question: str) -> None:
     
     question_length = len(question.strip())
     if question_length < 10:
-        logger.warning(f"Question too short: {question_length} characters")
+        logger.warning("Question too short: %d characters", question_length)
         raise ValueError(f"Question must be at least 10 characters long, got {question_length}")
     
     if question_length > 500:
-        logger.warning(f"Question too long: {question_length} characters")
+        logger.warning("Question too long: %d characters", question_length)
         raise ValueError(f"Question must not exceed 500 characters, got {question_length}")
     
     # Check for excessive repetition